@@ -32,11 +32,16 @@ setup(
     install_requires=[
         'xbox-smartglass-core==1.3.0',
         'av==8.0.3',
-        'PySDL2==0.9.7'
+        'PySDL2==0.9.7',
+        'bitstruct==8.11.0'
     ],
     setup_requires=['pytest-runner'],
-    tests_require=['pytest', 'pytest-console-scripts', 'pytest-asyncio'],
+    tests_require=['pytest', 'pytest-console-scripts', 'pytest-asyncio', 'hypothesis'],
     extras_require={
+        "export": [
+            "numpy",
+            "pyarrow",
+        ],
         "dev": [
             "pip",
             "bump2version",
@@ -52,13 +57,17 @@ setup(
             "pytest-asyncio",
             "pytest-console-scripts",
             "pytest-runner",
+            "hypothesis",
         ],
     },
     entry_points={
         'console_scripts': [
             'xbox-nano-client=xbox.nano.scripts.client:main',
             'xbox-nano-pcap=xbox.nano.scripts.pcap:main',
-            'xbox-nano-replay=xbox.nano.scripts.replay:main'
+            'xbox-nano-replay=xbox.nano.scripts.replay:main',
+            'xbox-nano-analyze=xbox.nano.scripts.analyze:main',
+            'xbox-nano-play=xbox.nano.scripts.play:main',
+            'xbox-nano-supervise=xbox.nano.scripts.supervise:main'
         ]
     }
 )
@@ -41,3 +41,109 @@ def channels():
         1028: Channel(None, None, 1028, ChannelClass.Input, 0),
         1029: Channel(None, None, 1029, ChannelClass.InputFeedback, 0)
     }
+
+
+def encode_h264(count, size=64, keyint=None):
+    """
+    Encode `count` frames of a synthetic clip into Annex-B access units
+    """
+    av = pytest.importorskip('av')
+    try:
+        encoder = av.CodecContext.create('libx264', 'w')
+    except Exception:
+        pytest.skip('libx264 encoder not available')
+
+    encoder.width = encoder.height = size
+    encoder.pix_fmt = 'yuv420p'
+    options = {'tune': 'zerolatency', 'preset': 'ultrafast'}
+    if keyint:
+        options['g'] = str(keyint)
+    encoder.options = options
+
+    packets = []
+    for i in range(count):
+        frame = av.VideoFrame(size, size, 'yuv420p')
+        for plane in frame.planes:
+            plane.update(bytes([i * 10 % 256]) * plane.buffer_size)
+        frame.pts = i
+        packets.extend(encoder.encode(frame))
+    packets.extend(encoder.encode(None))
+    return [bytes(packet) for packet in packets]
+
+
+SESSION_TCP_PORT = 53401
+SESSION_UDP_PORT = 53402
+SESSION_FRAMES = 5
+
+
+def _session_packets():
+    from xbox.nano import factory, packer
+    from xbox.nano.enum import VideoPayloadType
+
+    channel_map = {1024: Channel(None, None, 1024, ChannelClass.Video, 0)}
+    create = factory.channel.create(
+        name=ChannelClass.Video, flags=0, channel_id=1024
+    )
+    yield 'tcp', False, packer.pack_tcp([create], channel_map)
+    # Client -> console, not replayed
+    yield 'tcp', True, packer.pack_tcp([create], channel_map)
+
+    seq = 0
+    for frame_id in range(SESSION_FRAMES):
+        for offset, data in ((0, b'\x00\x00\x00\x01\x65'), (5, b'\xaa' * 10)):
+            seq += 1
+            msg = factory.streamer_udp(
+                VideoPayloadType.Data, factory.video.data(
+                    flags=4, frame_id=frame_id, timestamp=frame_id * 16666,
+                    total_size=15, packet_count=2, offset=offset, data=data
+                ), connection_id=1, channel_id=1024, sequence_num=seq % 65536
+            )
+            yield 'udp', False, packer.pack(msg, channel_map)
+
+
+def write_session_pcap(path, tcp_port=SESSION_TCP_PORT,
+                       udp_port=SESSION_UDP_PORT, start=1000.0, interval=0.01,
+                       packets=None):
+    """
+    Write a short synthetic session: Video channel create on TCP and
+    `SESSION_FRAMES` two-fragment video frames on UDP
+
+    `packets` replaces the session with (transport, from_client, data)
+    tuples.
+    """
+    import dpkt
+
+    if packets is None:
+        packets = _session_packets()
+
+    console, client = b'\x0a\x00\x00\x02', b'\x0a\x00\x00\x01'
+    with open(path, 'wb') as f:
+        writer = dpkt.pcap.Writer(f)
+        for i, (transport, from_client, data) in enumerate(packets):
+            port = tcp_port if transport == 'tcp' else udp_port
+            src, dst = (client, console) if from_client else (console, client)
+            sport, dport = (40000, port) if from_client else (port, 40000)
+
+            if transport == 'tcp':
+                l4 = dpkt.tcp.TCP(sport=sport, dport=dport, data=data,
+                                  flags=dpkt.tcp.TH_ACK | dpkt.tcp.TH_PUSH)
+                proto = dpkt.ip.IP_PROTO_TCP
+            else:
+                l4 = dpkt.udp.UDP(sport=sport, dport=dport, data=data)
+                l4.ulen = len(l4)
+                proto = dpkt.ip.IP_PROTO_UDP
+
+            ip = dpkt.ip.IP(src=src, dst=dst, p=proto, data=l4)
+            ip.len = len(ip)
+            eth = dpkt.ethernet.Ethernet(
+                src=b'\x00' * 6, dst=b'\x00' * 6,
+                type=dpkt.ethernet.ETH_TYPE_IP, data=ip
+            )
+            writer.writepkt(bytes(eth), ts=start + i * interval)
+
+
+@pytest.fixture(scope='session')
+def session_pcap(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('pcap') / 'session.pcap')
+    write_session_pcap(path)
+    return path
@@ -0,0 +1,86 @@
+import pytest
+
+from xbox.nano import analysis, h264
+from xbox.nano.enum import ChannelClass
+
+from conftest import SESSION_TCP_PORT, SESSION_UDP_PORT, SESSION_FRAMES, \
+    write_session_pcap
+
+
+def test_h264_nal_units():
+    data = b'\x00\x00\x00\x01\x67\x42' + b'\x00\x00\x01\x68\xce' + \
+        b'\x00\x00\x01\x65\x88'
+    assert [t for _, t in h264.nal_units(data)] == [
+        h264.NalUnitType.SPS, h264.NalUnitType.PPS, h264.NalUnitType.IDR
+    ]
+    assert h264.is_keyframe(data)
+    assert not h264.is_keyframe(b'\x00\x00\x01\x41\x9a')
+    # Start code without header
+    assert list(h264.nal_units(b'\xff\x00\x00\x01')) == []
+
+
+def test_analyze_capture(session_pcap):
+    stats = analysis.analyze_capture(
+        session_pcap, SESSION_TCP_PORT, SESSION_UDP_PORT
+    )
+
+    assert stats.packets == 2 * SESSION_FRAMES
+    assert stats.video_frames == SESSION_FRAMES
+    assert stats.video_bytes == 15 * SESSION_FRAMES
+    assert stats.frame_size_min == stats.frame_size_max == 15
+    assert stats.keyframes == SESSION_FRAMES
+    assert stats.keyframe_interval == pytest.approx(0.02)
+    assert stats.duration == pytest.approx(0.09)
+    assert stats.loss(ChannelClass.Video.name) == 0.0
+    assert stats.input_frames == 0
+    assert stats.errors == 0
+
+
+def test_detect_ports(session_pcap):
+    assert analysis.detect_ports(session_pcap) == \
+        (SESSION_TCP_PORT, SESSION_UDP_PORT)
+    stats = analysis.analyze_capture(session_pcap)
+    assert stats.video_frames == SESSION_FRAMES
+
+
+def test_analyze_parallel(session_pcap, tmp_path):
+    other = str(tmp_path / 'other.pcap')
+    write_session_pcap(other, start=2000.0)
+
+    results = analysis.analyze(
+        [session_pcap, other], SESSION_TCP_PORT, SESSION_UDP_PORT,
+        jobs=2
+    )
+
+    assert [r.path for r in results] == [session_pcap, other]
+    assert all(r.video_frames == SESSION_FRAMES for r in results)
+    summary = analysis.total(results)
+    assert summary.video_frames == 2 * SESSION_FRAMES
+    assert summary.keyframe_interval == pytest.approx(0.02)
+    assert summary.duration == pytest.approx(2 * 0.09)
+
+    table = analysis.format_table(results).splitlines()
+    assert len(table) == 4
+    assert table[-1].startswith('total')
+
+
+def test_analyze_failed_capture(session_pcap, tmp_path):
+    corrupt = str(tmp_path / 'corrupt.pcap')
+    with open(corrupt, 'wb') as f:
+        f.write(b'not a capture')
+
+    results = analysis.analyze(
+        [corrupt, session_pcap], SESSION_TCP_PORT, SESSION_UDP_PORT,
+        jobs=2
+    )
+
+    failed, ok = results
+    assert failed.path == corrupt and failed.error
+    assert failed.packets == 0
+    assert ok.error is None
+    assert ok.video_frames == SESSION_FRAMES
+    assert analysis.total(results).video_frames == SESSION_FRAMES
+
+    table = analysis.format_table(results).splitlines()
+    assert table[1].endswith(failed.error)
+    assert table[2].endswith(' 0')
@@ -0,0 +1,143 @@
+import time
+import asyncio
+import logging
+import pytest
+from construct import Container
+
+from xbox.nano import packer, xpacker
+from xbox.nano.backend import PackerBackend, VerifyingPacker, get_packer, \
+    normalize
+from xbox.nano.protocol import StreamerProtocol
+
+
+class BrokenPacker(object):
+    """
+    Fast packer disagreeing with the reference implementation
+    """
+    def __init__(self, raises=False):
+        self.raises = raises
+
+    def unpack(self, buf, channels=None):
+        if self.raises:
+            raise ValueError('Broken')
+        msg = xpacker.unpack(buf, channels)
+        msg.header.sequence_num += 1
+        return msg
+
+    def pack(self, msg, channels=None):
+        if self.raises:
+            raise ValueError('Broken')
+        return b'\x00' + packer.pack(msg, channels)[1:]
+
+
+def test_get_packer():
+    assert get_packer(PackerBackend.Construct) is packer
+    assert get_packer(PackerBackend.Fast) is xpacker
+    assert isinstance(get_packer(PackerBackend.Verify), VerifyingPacker)
+
+    with pytest.raises(ValueError):
+        get_packer('bogus')
+
+
+def test_verify_unpack(packets, channels):
+    verifier = VerifyingPacker(sample_rate=1.0)
+    msg = verifier.unpack(packets['udp_video_data'], channels)
+
+    assert isinstance(msg, xpacker.Message)
+    assert verifier.verified == 1
+    assert verifier.mismatches == 0
+    assert normalize(msg) == normalize(
+        packer.unpack(packets['udp_video_data'], channels)
+    )
+
+
+def test_verify_unpack_tcp(packets, channels):
+    verifier = VerifyingPacker(sample_rate=1.0)
+    data = xpacker.pack_tcp([
+        packer.unpack(packets['tcp_channel_create'], channels),
+        packer.unpack(packets['tcp_video_control'], channels)
+    ], channels)
+
+    msgs = list(verifier.unpack_tcp(data, channels))
+    assert len(msgs) == 2
+    assert verifier.verified == 2
+    assert verifier.mismatches == 0
+
+
+def test_verify_unpack_mismatch(packets, channels, caplog):
+    verifier = VerifyingPacker(fast=BrokenPacker(), sample_rate=1.0)
+    with caplog.at_level(logging.WARNING):
+        msg = verifier.unpack(packets['udp_video_data'], channels)
+
+    assert verifier.mismatches == 1
+    # Reference result is used
+    assert msg.header.sequence_num == packer.unpack(
+        packets['udp_video_data'], channels
+    ).header.sequence_num
+    assert 'msg.header.sequence_num' in caplog.text
+
+
+def test_verify_unpack_error(packets, channels):
+    verifier = VerifyingPacker(fast=BrokenPacker(raises=True), sample_rate=1.0)
+    msg = verifier.unpack(packets['udp_video_data'], channels)
+
+    assert verifier.errors == 1
+    assert normalize(msg) == normalize(
+        packer.unpack(packets['udp_video_data'], channels)
+    )
+
+
+def test_verify_pack_mismatch(packets, channels):
+    verifier = VerifyingPacker(fast=BrokenPacker(), sample_rate=1.0)
+    msg = packer.unpack(packets['tcp_video_control'], channels)
+
+    assert verifier.pack(msg, channels) == packets['tcp_video_control']
+    assert verifier.mismatches == 1
+
+
+def test_verify_not_sampled(packets, channels):
+    verifier = VerifyingPacker(fast=BrokenPacker(), sample_rate=0.0)
+    msg = verifier.unpack(packets['udp_video_data'], channels)
+
+    assert verifier.verified == 0
+    assert isinstance(msg, xpacker.Message)
+
+
+def test_streamer_protocol_fast_backend(packets, channels):
+    nano = Container(packer=get_packer(PackerBackend.Fast), channels=channels)
+    received = []
+
+    async def run():
+        protocol = StreamerProtocol(nano)
+        protocol.on_message += received.append
+        protocol.datagram_received(packets['udp_video_data'], None)
+
+    asyncio.run(run())
+
+    assert len(received) == 1
+    assert received[0]._incoming_ts > 0
+    assert received[0].payload.frame_id == packer.unpack(
+        packets['udp_video_data'], channels
+    ).payload.frame_id
+
+
+def test_streamer_protocol_arrival_before_parsing(packets, channels):
+    fast = get_packer(PackerBackend.Fast)
+    unpacked_at = []
+
+    class TimedPacker(object):
+        def unpack(self, data, channels):
+            unpacked_at.append(time.perf_counter_ns())
+            return fast.unpack(data, channels)
+
+    nano = Container(packer=TimedPacker(), channels=channels)
+    received = []
+
+    async def run():
+        protocol = StreamerProtocol(nano)
+        protocol.on_message += received.append
+        protocol.datagram_received(packets['udp_video_data'], None)
+
+    asyncio.run(run())
+
+    assert received[0]._incoming_ns <= unpacked_at[0]
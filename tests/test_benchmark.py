@@ -0,0 +1,92 @@
+import asyncio
+from construct import Container
+
+from xbox.nano.enum import AudioCodec
+from xbox.nano.replay import ReplayEngine
+from xbox.nano.capture import read_session
+from xbox.nano.render.client import BenchmarkClient
+from xbox.nano.render.client.benchmark import percentile, _MediaBenchmark
+
+from conftest import SESSION_TCP_PORT, SESSION_UDP_PORT, SESSION_FRAMES, \
+    encode_h264
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([5], 95) == 5
+    assert percentile([], 50) is None
+
+
+def test_benchmark_decode():
+    frames = encode_h264(10)
+
+    client = BenchmarkClient()
+    client.open(None)
+    for data in frames:
+        client.render_video(data)
+    client.close()
+
+    stats = client.stats()
+    assert stats.video.frames == len(frames)
+    assert stats.video.decoded == len(frames)
+    assert stats.video.dropped == 0
+    assert stats.video.decode_p50 <= stats.video.decode_p99 <= \
+        stats.video.decode_max
+    assert stats.audio.frames == 0
+    assert stats.wall_time > 0
+    assert 'video' in client.report()
+
+    video, audio = client.totals()
+    assert video.decoded == len(frames)
+    assert video.decode_seconds > 0
+    assert audio.frames == 0
+
+
+def test_benchmark_dropped():
+    class FailingDecoder(object):
+        def decode(self, data):
+            raise ValueError('Invalid data')
+
+    client = BenchmarkClient(decode_audio=False)
+    client.set_audio_format(Container(
+        codec=AudioCodec.AAC, sample_rate=48000, channels=2
+    ))
+    client._video.decoder = FailingDecoder()
+
+    client.render_video(b'\x00')
+    client.render_audio(b'\x00' * 8)
+
+    stats = client.stats()
+    assert stats.video.dropped == 1
+    assert stats.video.decode_p50 is None
+    assert stats.audio.frames == 1
+    assert stats.audio.decoded == 0
+
+
+def test_benchmark_replay(session_pcap):
+    client = BenchmarkClient()
+    engine = ReplayEngine(client, speed=None)
+    asyncio.run(engine.run(
+        read_session(session_pcap, SESSION_TCP_PORT, SESSION_UDP_PORT)
+    ))
+
+    stats = client.stats()
+    assert stats.video.frames == SESSION_FRAMES
+    assert stats.expired == 0
+
+
+def test_benchmark_reservoir():
+    media = _MediaBenchmark(1.0, reservoir_size=100)
+    for i in range(10000):
+        media._sample(i / 10000.0)
+
+    assert len(media.decode_times) == 100
+    assert media.decode_count == 10000
+    stats = media.stats()
+    assert stats.decode_max == 0.9999
+    # Uniform sample of a uniform distribution
+    assert 0.35 < stats.decode_p50 < 0.65
+    assert stats.decode_p99 > 0.85
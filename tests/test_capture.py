@@ -0,0 +1,193 @@
+import struct
+import pytest
+
+from xbox.nano import capture, xpacker
+
+from conftest import SESSION_TCP_PORT, SESSION_UDP_PORT, SESSION_FRAMES
+
+
+def _message(body):
+    return struct.pack('<I', len(body)) + body
+
+
+def _ipv4(proto, l4, src=b'\x0a\x00\x00\x02', dst=b'\x0a\x00\x00\x01'):
+    return struct.pack(
+        '!BBHHHBBH4s4s', 0x45, 0, 20 + len(l4), 0, 0, 64, proto, 0, src, dst
+    ) + l4
+
+
+def _tcp(seq, payload, sport=1000, dport=2000, flags=0x18):
+    return struct.pack(
+        '!HHIIBBHHH', sport, dport, seq, 0, 5 << 4, flags, 0, 0, 0
+    ) + payload
+
+
+def _udp(payload, sport=1000, dport=3000):
+    return struct.pack('!HHHH', sport, dport, 8 + len(payload), 0) + payload
+
+
+def _pcap(frames, linktype, byteorder='<'):
+    data = struct.pack(byteorder + 'IHHiIII', capture.PCAP_MAGIC_US, 2, 4,
+                       0, 0, 65535, linktype)
+    for i, frame in enumerate(frames):
+        data += struct.pack(byteorder + 'IIII', 100 + i, 500000,
+                            len(frame), len(frame)) + frame
+    return data
+
+
+def _pcapng_block(block_type, body):
+    body += b'\x00' * (-len(body) % 4)
+    length = len(body) + 12
+    return struct.pack('<II', block_type, length) + body + \
+        struct.pack('<I', length)
+
+
+def _pcapng(frames, linktype, interface=0):
+    data = _pcapng_block(capture.PCAPNG_SHB, struct.pack(
+        '<IHHq', capture.PCAPNG_BYTE_ORDER, 1, 0, -1
+    ))
+    # if_tsresol = 9 -> nanoseconds
+    options = struct.pack('<HHB3x', capture.PCAPNG_OPT_TSRESOL, 1, 9) + \
+        struct.pack('<HH', 0, 0)
+    data += _pcapng_block(capture.PCAPNG_IDB, struct.pack(
+        '<HHI', linktype, 0, 65535
+    ) + options)
+    for i, frame in enumerate(frames):
+        ts = (100 + i) * 1000000000 + 250000000
+        data += _pcapng_block(capture.PCAPNG_EPB, struct.pack(
+            '<IIIII', interface, ts >> 32, ts & 0xFFFFFFFF, len(frame),
+            len(frame)
+        ) + frame)
+    return data
+
+
+def _session(tmpdir, data, name='capture'):
+    path = str(tmpdir.join(name))
+    with open(path, 'wb') as f:
+        f.write(data)
+    return list(capture.read_session(path, 2000, 3000))
+
+
+def test_read_session(session_pcap):
+    packets = list(capture.read_session(
+        session_pcap, SESSION_TCP_PORT, SESSION_UDP_PORT
+    ))
+
+    assert len(packets) == 2 + 2 * SESSION_FRAMES
+    assert [p.transport for p in packets[:3]] == ['tcp', 'tcp', 'udp']
+    assert [p.from_client for p in packets[:3]] == [False, True, False]
+    assert packets[1].timestamp - packets[0].timestamp == pytest.approx(0.01)
+    # TCP messages keep their length prefix
+    assert list(xpacker.split_tcp(packets[0].data)) == [packets[0].data[4:]]
+
+
+def test_read_messages(session_pcap, channels):
+    messages = list(capture.read_messages(
+        session_pcap, SESSION_TCP_PORT, SESSION_UDP_PORT, xpacker, channels
+    ))
+
+    assert len(messages) == 2 + 2 * SESSION_FRAMES
+    packet, msg = messages[2]
+    assert msg.header.ssrc.channel_id == 1024
+    assert msg.header.sequence_num == 1
+
+
+def test_pcap_big_endian_sll(tmpdir):
+    sll = b'\x00' * 14 + struct.pack('!H', capture.ETH_TYPE_IPV4)
+    frames = [sll + _ipv4(capture.IP_PROTO_UDP, _udp(b'datagram'))]
+    packets = _session(tmpdir, _pcap(frames, capture.LinkType.LinuxSLL, '>'))
+
+    assert packets == [capture.CapturedPacket(
+        100.5, capture.Transport.UDP, True, b'datagram'
+    )]
+
+
+def test_pcapng_raw_ip(tmpdir):
+    frames = [
+        _ipv4(capture.IP_PROTO_UDP, _udp(b'first')),
+        # Other port
+        _ipv4(capture.IP_PROTO_UDP, _udp(b'other', dport=4000)),
+        _ipv4(capture.IP_PROTO_UDP, _udp(b'second', sport=3000, dport=1000)),
+    ]
+    packets = _session(tmpdir, _pcapng(frames, capture.LinkType.RawIP))
+
+    assert [(p.data, p.from_client) for p in packets] == \
+        [(b'first', True), (b'second', False)]
+    assert packets[0].timestamp == pytest.approx(100.25)
+    assert packets[1].timestamp == pytest.approx(102.25)
+
+
+def test_pcapng_unknown_interface(tmpdir):
+    frames = [_ipv4(capture.IP_PROTO_UDP, _udp(b'first'))]
+    with pytest.raises(capture.CaptureError):
+        _session(tmpdir, _pcapng(frames, capture.LinkType.RawIP, interface=1))
+
+
+def test_unknown_format(tmpdir):
+    with pytest.raises(capture.CaptureError):
+        _session(tmpdir, b'\x00' * 32)
+    with pytest.raises(capture.CaptureError):
+        _session(tmpdir, b'', name='empty')
+
+
+def test_tcp_reassembly(tmpdir):
+    first = _message(b'A' * 10)
+    second = _message(b'B' * 3)
+    third = _message(b'C' * 5)
+    stream = first + second + third
+    ethernet = b'\x00' * 12 + struct.pack('!H', capture.ETH_TYPE_IPV4)
+
+    segments = [
+        # SYN
+        _tcp(1000, b'', flags=0x02),
+        # First message split in two
+        _tcp(1001, stream[:6]),
+        # Out of order: third message
+        _tcp(1001 + len(first) + len(second), third),
+        _tcp(1007, stream[6:len(first) + len(second)]),
+        # Retransmission overlapping already received data
+        _tcp(1001, stream[:len(first)]),
+    ]
+    frames = [ethernet + _ipv4(capture.IP_PROTO_TCP, seg) for seg in segments]
+    packets = _session(tmpdir, _pcap(frames, capture.LinkType.Ethernet))
+
+    assert [p.data for p in packets] == [first, second, third]
+    assert all(p.transport == capture.Transport.TCP for p in packets)
+    assert all(p.from_client for p in packets)
+
+
+def test_tcp_sequence_wraparound():
+    stream = capture.TcpStream()
+    msg = _message(b'wrap')
+    start = (1 << 32) - 3
+
+    assert list(stream.feed(start, False, msg[:5])) == []
+    assert list(stream.feed((start + 5) % (1 << 32), False, msg[5:])) == [msg]
+
+
+def test_tcp_missing_segment_resync():
+    stream = capture.TcpStream(max_pending=2)
+    first = _message(b'first')
+    later = [_message(b'x'), _message(b'y'), _message(b'z')]
+
+    list(stream.feed(0, False, first[:3]))
+    # Rest of first message never captured
+    offset = len(first)
+    out = []
+    for msg in later:
+        out.extend(stream.feed(offset, False, msg))
+        offset += len(msg)
+
+    assert stream.gaps == 1
+    assert out == later
+
+
+def test_tcp_implausible_length_skipped():
+    stream = capture.TcpStream(max_message_size=64)
+    msgs = [_message(b'a'), _message(b'b')]
+
+    # Capture starts mid message, tail of it reads as a huge length
+    out = list(stream.feed(0, False, b'\xff\xff\xff' + b''.join(msgs)))
+
+    assert out == msgs
+    assert stream.skipped == 3
@@ -0,0 +1,148 @@
+import wave
+import pytest
+import asyncio
+from datetime import datetime, timedelta
+from construct import Container
+
+from xbox.nano import enum
+from xbox.nano.channel import ChatAudioChannel
+from xbox.nano.render.audio.chat import GeneratorSource, WavFileSource, \
+    ChatAudioUplink
+
+
+class FakeClock(object):
+    """Virtual time, only advanced by sleeping"""
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.now += delay
+        await asyncio.sleep(0)
+
+
+class FakeStreamerProtocol(object):
+    def __init__(self, clock):
+        self.clock = clock
+        self.sent = []
+
+    def send_message(self, msg):
+        self.sent.append((self.clock.time(), msg))
+
+
+class FakeProtocol(object):
+    def __init__(self, clock):
+        self.connection_id = 1234
+        self.streamer_protocol = FakeStreamerProtocol(clock)
+
+
+class FakeClient(object):
+    def __init__(self, chat_audio):
+        self.chat_audio = chat_audio
+
+
+def opus_fmt():
+    return Container(channels=1, sample_rate=24000, codec=enum.AudioCodec.Opus)
+
+
+def make_channel(source, clock):
+    channel = ChatAudioChannel(
+        FakeClient(source), FakeProtocol(clock), 1026,
+        enum.ChannelClass.ChatAudio, 0
+    )
+    channel.reference_timestamp = datetime.utcnow() - timedelta(seconds=1)
+    channel.frame_id = 100
+    return channel
+
+
+def test_generator_source():
+    source = GeneratorSource(duration=0.01)
+    source.open(24000, 1)
+
+    assert len(source.read(120)) == 240
+    assert len(source.read(120)) == 240
+    assert source.read(120) == b''
+
+
+def test_wav_source(tmp_path):
+    filename = str(tmp_path / 'chat.wav')
+    with wave.open(filename, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(24000)
+        wav.writeframes(b'\x01\x00' * 700)
+
+    source = WavFileSource(filename)
+    source.open(24000, 1)
+
+    assert len(source.read(480)) == 960
+    # Tail is padded with silence to a full frame
+    assert source.read(480) == b'\x01\x00' * 220 + b'\x00' * 520
+    assert source.read(480) == b''
+    source.close()
+
+
+def run_uplink(uplink):
+    async def run():
+        uplink.source.open(24000, 1)
+        await uplink.run()
+
+    asyncio.run(run())
+
+
+def test_uplink_frame_ids_and_timestamps():
+    clock = FakeClock()
+    channel = make_channel(GeneratorSource(duration=0.2), clock)
+    uplink = ChatAudioUplink(channel, channel.client.chat_audio, opus_fmt(),
+                             clock=clock.time, sleep=clock.sleep)
+    run_uplink(uplink)
+
+    sent = channel.protocol.streamer_protocol.sent
+    assert len(sent) == 10
+    assert uplink.frames_sent == 10
+
+    frame_ids = [msg.payload.frame_id for _, msg in sent]
+    assert frame_ids == list(range(101, 111))
+
+    timestamps = [msg.payload.timestamp for _, msg in sent]
+    # 20ms frames at 24kHz, relative to reference timestamp (1s ago)
+    assert all(b - a == 20000 for a, b in zip(timestamps, timestamps[1:]))
+    assert 1000000 <= timestamps[0] < 2000000
+
+    for _, msg in sent:
+        assert msg.header.streamer.type == enum.AudioPayloadType.Data
+        assert msg.header.ssrc.channel_id == 1026
+        assert msg.header.ssrc.connection_id == 1234
+
+    # Paced at the frame cadence instead of sent in a burst
+    send_times = [sent_at for sent_at, _ in sent]
+    assert send_times == pytest.approx([i * 0.02 for i in range(10)])
+    assert uplink.late_frames == 0
+
+
+class SlowSource(GeneratorSource):
+    """Capture that takes longer than a frame to deliver one"""
+    def __init__(self, clock, **kwargs):
+        super(SlowSource, self).__init__(**kwargs)
+        self.clock = clock
+
+    def read(self, samples):
+        self.clock.now += 0.05
+        return super(SlowSource, self).read(samples)
+
+
+def test_uplink_falls_behind():
+    clock = FakeClock()
+    channel = make_channel(SlowSource(clock, duration=0.1), clock)
+    uplink = ChatAudioUplink(channel, channel.client.chat_audio, opus_fmt(),
+                             clock=clock.time, sleep=clock.sleep)
+    run_uplink(uplink)
+
+    # Schedule is reset on every frame instead of catching up in a burst
+    sent = channel.protocol.streamer_protocol.sent
+    send_times = [sent_at for sent_at, _ in sent]
+    assert send_times == pytest.approx([0.05 * i for i in range(1, 6)])
+    assert uplink.frames_sent == 5
+    assert uplink.late_frames == 5
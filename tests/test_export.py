@@ -0,0 +1,65 @@
+import pytest
+
+from xbox.nano import export
+from xbox.nano.capture import read_session
+from xbox.nano.enum import ChannelClass, RtpPayloadType
+
+from conftest import SESSION_TCP_PORT, SESSION_UDP_PORT, SESSION_FRAMES
+
+np = pytest.importorskip('numpy')
+
+
+def _packets(path):
+    return read_session(path, SESSION_TCP_PORT, SESSION_UDP_PORT)
+
+
+def test_message_rows(session_pcap):
+    rows = list(export.message_rows(_packets(session_pcap)))
+    fields = [name for name, _ in export.FIELDS]
+
+    assert len(rows) == 2 + 2 * SESSION_FRAMES
+    assert all(len(row) == len(fields) for row in rows)
+
+    create = dict(zip(fields, rows[0]))
+    assert create['tcp'] and not create['from_client']
+    assert create['payload_type'] == RtpPayloadType.ChannelControl.value
+    assert create['frame_id'] == -1
+
+    fragment = dict(zip(fields, rows[3]))
+    assert not fragment['tcp']
+    assert export.CHANNEL_CLASSES[fragment['channel_class']] == \
+        ChannelClass.Video
+    assert fragment['frame_id'] == 0
+    assert fragment['offset'] == 5
+    assert fragment['data_size'] == 10
+    assert fragment['packet_count'] == 2
+    assert fragment['total_size'] == 15
+
+
+def test_export_numpy(session_pcap, tmp_path):
+    path = str(tmp_path / 'session.npy')
+    # Multiple batches
+    rows = export.export_session(_packets(session_pcap), path, batch_size=4)
+    table = np.load(path, mmap_mode='r')
+
+    assert rows == len(table) == 2 + 2 * SESSION_FRAMES
+    assert table.dtype == export.export_dtype()
+    assert list(table['sequence_num'][2:5]) == [1, 2, 3]
+    assert table['data_size'][2:].sum() == 15 * SESSION_FRAMES
+
+
+def test_export_arrow(session_pcap, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = str(tmp_path / 'session.parquet')
+    export.export_session(_packets(session_pcap), path, batch_size=4)
+    table = pq.read_table(path)
+
+    assert table.num_rows == 2 + 2 * SESSION_FRAMES
+    assert table.column('channel')[2].as_py() == ChannelClass.Video.name
+
+
+def test_export_format(tmp_path):
+    assert export.default_format('a.arrow') == export.ExportFormat.Arrow
+    assert export.default_format('a.npy') == export.ExportFormat.Numpy
+    with pytest.raises(export.ExportError):
+        export.SessionExporter(str(tmp_path / 'a'), fmt='csv')
@@ -0,0 +1,139 @@
+import pytest
+from construct import Container
+
+from xbox.nano import h264, factory
+from xbox.nano.channel import VideoChannel
+from xbox.nano.enum import ChannelClass, VideoPayloadType
+
+from conftest import encode_h264
+
+np = pytest.importorskip('numpy')
+
+SPS = b'\x67\x42\xc0\x1e'
+PPS = b'\x68\xce\x3c\x80'
+IDR = b'\x00\x00\x00\x01' + SPS + b'\x00\x00\x00\x01' + PPS + \
+    b'\x00\x00\x00\x01\x65\x88' + b'\xaa' * 20
+P_FRAME = b'\x00\x00\x00\x01\x41\x9a' + b'\xbb' * 20
+
+
+def test_scan_frame():
+    info = h264.scan_frame(IDR)
+    assert info.keyframe
+    assert info.nal_types == (7, 8, 5)
+    assert info.sps == SPS
+    assert info.pps == PPS
+
+    info = h264.scan_frame(P_FRAME)
+    assert not info.keyframe
+    assert info.nal_types == (1,)
+    assert info.sps is None
+
+    # Parameter sets only, no picture
+    assert not h264.scan_frame(IDR[:18]).keyframe
+    assert not h264.is_keyframe(b'')
+    assert h264.is_keyframe(memoryview(IDR))
+    assert h264.parameter_sets(SPS, PPS) + IDR[-26:] == IDR
+
+
+def test_nal_units_vectorized():
+    # Above VECTORIZE_MIN, both searches agree
+    data = (IDR + P_FRAME * 10) * 40
+    assert len(data) >= h264.VECTORIZE_MIN
+    vectorized = h264._vector_offsets(data, 0, len(data)).tolist()
+    offsets = []
+    offset = data.find(h264.START_CODE)
+    while offset != -1:
+        offsets.append(offset + 3)
+        offset = data.find(h264.START_CODE, offset + 3)
+    assert vectorized == offsets
+    assert [t for _, t in h264.nal_units(data)][:5] == [7, 8, 5, 1, 1]
+
+
+def test_vector_offsets_chunk_boundary(monkeypatch):
+    monkeypatch.setattr(h264, 'SCAN_CHUNK', 16)
+    data = b'\xff' * 14 + b'\x00\x00\x01\x65' + b'\xff' * 20 + b'\x00\x00\x01'
+    # Start code across the chunk boundary, none without a header
+    assert h264._vector_offsets(data, 0, len(data)).tolist() == [17]
+
+
+def test_access_units():
+    frames = encode_h264(30, keyint=10)
+    units = h264.access_units(b''.join(frames))
+
+    sizes = [len(f) for f in frames]
+    assert list(units.size) == sizes
+    assert list(units.offset) == list(np.cumsum([0] + sizes[:-1]))
+    assert list(np.flatnonzero(units.keyframe)) == [0, 10, 20]
+    assert list(units.keyframe) == list(units.parameter_sets)
+    assert [h264.is_keyframe(f) for f in frames] == list(units.keyframe)
+
+
+def test_access_units_slices():
+    # Two slices per picture, first_mb_in_slice 0 / non-zero
+    picture = b'\x00\x00\x00\x01\x65\x88\xaa' + b'\x00\x00\x01\x65\x40\xaa'
+    data = b'\x00\x00\x00\x01\x09\xf0' + picture + \
+        b'\x00\x00\x00\x01\x41\x9a\xbb' + b'\x00\x00\x01\x41\x40\xbb'
+    units = h264.access_units(data)
+
+    assert list(units.offset) == [0, 19]
+    assert list(units.size) == [19, 13]
+    assert list(units.keyframe) == [True, False]
+    assert not len(h264.access_units(b'\xff' * 10).offset)
+
+
+def test_scan_file(tmp_path):
+    path = tmp_path / 'video.raw'
+    path.write_bytes(IDR + P_FRAME)
+    units = h264.scan_file(str(path))
+    assert list(units.size) == [len(IDR), len(P_FRAME)]
+
+    path.write_bytes(b'')
+    assert not len(h264.scan_file(str(path)).offset)
+
+
+class FakeClient(object):
+    def render_video(self, data, timestamp=None, frame_id=None):
+        pass
+
+
+def _video_data(frame_id, offset, packet_count, data):
+    return factory.streamer_udp(
+        VideoPayloadType.Data, factory.video.data(
+            flags=4, frame_id=frame_id, timestamp=0, total_size=0,
+            packet_count=packet_count, offset=offset, data=data
+        ), connection_id=1, channel_id=1024
+    )
+
+
+def test_video_channel_keyframes():
+    sent = []
+    protocol = Container(
+        tracer=None, control_protocol=Container(send_message=sent.append)
+    )
+    channel = VideoChannel(FakeClient(), protocol, 1024, ChannelClass.Video, 0)
+    channel.open = True
+
+    for frame_id, data in enumerate([P_FRAME, IDR, P_FRAME, P_FRAME, IDR,
+                                     P_FRAME]):
+        channel.on_data(_video_data(frame_id, 0, 1, data))
+    stats = channel.video_stats()
+    assert stats.frames_completed == 6
+    assert stats.keyframes == 2
+    assert stats.frames_since_keyframe == 1
+    assert stats.keyframe_interval == 3.0
+    assert channel.sps == SPS
+    assert channel.pps == PPS
+
+    # Lost frame before the last keyframe, decoding is intact
+    channel.on_data(_video_data(3, 0, 2, b'ab'))
+    channel._frame_expiry_time = 0
+    channel.on_data(_video_data(8, 0, 2, b'ab'))
+    assert channel.keyframe_requests == 1
+    assert len(sent) == 1
+    assert sent[0].payload.flags.request_keyframe
+
+    # Rate limited
+    assert not channel.request_keyframe()
+    channel._last_keyframe_request -= channel.KEYFRAME_REQUEST_INTERVAL
+    assert channel.request_keyframe()
+    assert channel.video_stats().keyframe_requests == 2
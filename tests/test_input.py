@@ -0,0 +1,82 @@
+import asyncio
+from construct import Container
+
+from xbox.nano.render.input.base import InputHandler, GamepadButton, \
+    GamepadButtonState, GamepadAxis, FRAME_INDEX_BUTTONS, FRAME_INDEX_ANALOG
+
+
+class FakeClient(object):
+    def __init__(self, config=None):
+        self.protocol = Container(config=config or {})
+        self.frames = []
+
+    def send_input(self, frame, timestamp_dt):
+        # State object is reused, take a snapshot
+        self.frames.append(Container(
+            buttons=list(frame.buttons), analog=list(frame.analog)
+        ))
+
+
+def test_input_rate_from_config():
+    async def run():
+        handler = InputHandler()
+        handler.open(FakeClient({'inputReadsPerSecond': '60'}))
+        interval = handler.scheduler.interval
+        handler.close()
+        return interval
+
+    assert asyncio.run(run()) == 1.0 / 60
+
+
+def test_input_axis_coalescing():
+    client = FakeClient()
+
+    async def run():
+        handler = InputHandler(reads_per_second=100)
+        handler.open(client)
+
+        for value in range(1, 51):
+            handler.set_axis(GamepadAxis.LeftThumbstick_X, value)
+        # Same value again is no state change
+        handler.set_axis(GamepadAxis.LeftThumbstick_X, 50)
+        await asyncio.sleep(0.05)
+
+        handler.close()
+        return handler.scheduler
+
+    scheduler = asyncio.run(run())
+
+    assert len(client.frames) == 1
+    assert scheduler.frames_sent == 1
+    assert scheduler.events_coalesced == 49
+    axis = FRAME_INDEX_ANALOG[GamepadAxis.LeftThumbstick_X]
+    assert client.frames[0].analog[axis] == 50
+
+
+def test_input_button_edges_sent_immediately():
+    client = FakeClient()
+
+    async def run():
+        handler = InputHandler(reads_per_second=10)
+        handler.open(client)
+
+        handler.set_axis(GamepadAxis.RightTrigger, 255)
+        handler.set_button(GamepadButton.A, GamepadButtonState.Pressed)
+        sent_after_press = len(client.frames)
+        handler.set_button(GamepadButton.A, GamepadButtonState.Released)
+        sent_after_release = len(client.frames)
+        # Pending analog change was flushed with the button edge
+        await asyncio.sleep(0.15)
+
+        handler.close()
+        return sent_after_press, sent_after_release
+
+    sent_after_press, sent_after_release = asyncio.run(run())
+
+    assert sent_after_press == 1
+    assert sent_after_release == 2
+    assert len(client.frames) == 2
+    trigger = FRAME_INDEX_ANALOG[GamepadAxis.RightTrigger]
+    assert client.frames[0].analog[trigger] == 255
+    assert client.frames[0].buttons[FRAME_INDEX_BUTTONS[GamepadButton.A]] == 1
+    assert client.frames[1].buttons[FRAME_INDEX_BUTTONS[GamepadButton.A]] == 2
@@ -0,0 +1,173 @@
+import urllib.error
+import urllib.request
+from collections import Counter as CollectionsCounter
+import pytest
+from construct import Container
+
+from xbox.nano import metrics, factory
+from xbox.nano.channel import VideoChannel, InputChannel
+from xbox.nano.enum import ChannelClass, VideoPayloadType
+from xbox.nano.render.client.base import Client
+from xbox.nano.render.sink import Sink
+
+
+def test_counter_gauge_render():
+    registry = metrics.Registry()
+    counter = metrics.Counter('test_total', 'A counter', ['channel'], registry)
+    gauge = metrics.Gauge('test_depth', 'A gauge', registry=registry)
+
+    counter.inc(channel='Video')
+    counter.inc(2, channel='Video')
+    counter.inc(channel='Au"dio')
+    gauge.set(5)
+    gauge.dec(2)
+
+    text = registry.render()
+    assert '# TYPE test_total counter' in text
+    assert 'test_total{channel="Video"} 3.0' in text
+    assert 'test_total{channel="Au\\"dio"} 1.0' in text
+    assert 'test_depth 3.0' in text
+
+    with pytest.raises(ValueError):
+        counter.inc(-1, channel='Video')
+    with pytest.raises(ValueError):
+        counter.inc(wrong='label')
+    with pytest.raises(ValueError):
+        metrics.Counter('test_total', 'Duplicate', registry=registry)
+
+
+def test_histogram_render():
+    registry = metrics.Registry()
+    histogram = metrics.Histogram(
+        'test_seconds', 'A histogram', ['media'], registry, buckets=(0.1, 1.0)
+    )
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value, media='video')
+
+    lines = registry.render().splitlines()
+    assert 'test_seconds_bucket{media="video",le="0.1"} 2.0' in lines
+    assert 'test_seconds_bucket{media="video",le="1.0"} 3.0' in lines
+    assert 'test_seconds_bucket{media="video",le="+Inf"} 4.0' in lines
+    assert 'test_seconds_count{media="video"} 4.0' in lines
+    assert 'test_seconds_sum{media="video"} 2.65' in lines
+
+
+def _fake_protocol():
+    video = VideoChannel(None, None, 1024, ChannelClass.Video, 0)
+    video.frames_completed = 10
+    video.frames_expired = 1
+    video.keyframes = 3
+    video.sequence_tracker.update(1, 0.0)
+    video.sequence_tracker.update(3, 0.0)
+    input_channel = InputChannel(None, None, 1028, ChannelClass.Input, 0)
+    input_channel.frames_sent = 7
+
+    return Container(
+        channels={1024: video, 1028: input_channel},
+        streamer_protocol=Container(
+            channel_packets=CollectionsCounter({1024: 2, 4711: 1}),
+            channel_bytes=CollectionsCounter({1024: 2000, 4711: 10}),
+            dropped_packets=1
+        ),
+        control_protocol=Container(write_buffer_size=42)
+    )
+
+
+def test_nano_metrics_collect():
+    registry = metrics.Registry()
+    nano_metrics = metrics.NanoMetrics(_fake_protocol(), registry)
+
+    text = registry.render()
+    assert 'xbox_nano_channel_packets_total{channel="Video"} 2.0' in text
+    assert 'xbox_nano_channel_bytes_total{channel="Video"} 2000.0' in text
+    assert 'xbox_nano_channel_packets_total{channel="4711"} 1.0' in text
+    assert 'xbox_nano_dropped_packets_total 1.0' in text
+    assert 'xbox_nano_channel_lost_packets_total{channel="Video"} 1.0' in text
+    assert 'xbox_nano_video_frames_completed_total 10.0' in text
+    assert 'xbox_nano_video_frames_expired_total 1.0' in text
+    assert 'xbox_nano_video_keyframes_total 3.0' in text
+    assert 'xbox_nano_input_frames_sent_total 7.0' in text
+    assert 'xbox_nano_tcp_write_buffer_bytes 42.0' in text
+
+    nano_metrics.close()
+    assert registry.render() == ''
+
+
+def test_nano_metrics_without_registry():
+    nano_metrics = metrics.NanoMetrics(_fake_protocol())
+    nano_metrics.collect()
+    assert nano_metrics.input_frames.samples()
+    nano_metrics.close()
+
+
+def test_media_metrics_opt_in():
+    client = Client(Sink(), Sink(), Sink())
+    assert metrics.RENDER_SECONDS is None
+    assert metrics.REGISTRY.get('xbox_nano_render_seconds') is None
+    # No-op while disabled
+    client.render_video(b'frame')
+
+    registry = metrics.Registry()
+    metrics.enable_media_metrics(registry)
+    try:
+        with pytest.raises(ValueError):
+            metrics.enable_media_metrics(registry)
+        client.render_video(b'frame')
+        client.render_audio(b'frame')
+        assert metrics.RENDER_SECONDS.totals(media='video')[0] == 1
+        assert 'xbox_nano_decode_seconds' in registry.render()
+    finally:
+        metrics.disable_media_metrics()
+
+    assert metrics.RENDER_SECONDS is None
+    assert registry.render() == ''
+
+
+def test_metrics_server():
+    registry = metrics.Registry()
+    metrics.Gauge('test_up', 'Up', registry=registry).set(1)
+
+    server = metrics.MetricsServer(port=0, registry=registry)
+    server.start()
+    try:
+        url = 'http://127.0.0.1:%d' % server.port
+        with urllib.request.urlopen(url + '/metrics') as response:
+            assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+            assert b'test_up 1.0' in response.read()
+
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + '/other')
+    finally:
+        server.stop()
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.frames = []
+
+    def render_video(self, data, timestamp=None, frame_id=None):
+        self.frames.append(data)
+
+
+def _video_data(frame_id, offset, packet_count, data):
+    return factory.streamer_udp(
+        VideoPayloadType.Data, factory.video.data(
+            flags=4, frame_id=frame_id, timestamp=0, total_size=0,
+            packet_count=packet_count, offset=offset, data=data
+        ), connection_id=1, channel_id=1024
+    )
+
+
+def test_video_frame_counters():
+    channel = VideoChannel(FakeClient(), None, 1024, ChannelClass.Video, 0)
+
+    channel.on_data(_video_data(1, 0, 2, b'ab'))
+    channel.on_data(_video_data(1, 2, 2, b'cd'))
+    assert channel.client.frames == [b'abcd']
+    assert channel.frames_completed == 1
+
+    channel.on_data(_video_data(2, 0, 2, b'ab'))
+    channel._frame_expiry_time = 0
+    channel.on_data(_video_data(3, 0, 2, b'ab'))
+    assert channel.frames_expired == 2
+    assert channel.frames_completed == 1
@@ -0,0 +1,100 @@
+import pytest
+from construct import Container
+
+from xbox.nano import h264
+from xbox.nano.enum import AudioCodec
+from xbox.nano.render.mux import Muxer, MuxerError
+from xbox.nano.render.client import FileClient
+
+from conftest import encode_h264
+
+av = pytest.importorskip('av')
+
+# 60 fps, microseconds
+FRAME_INTERVAL = 16667
+
+
+def _aac_frames(count):
+    encoder = av.CodecContext.create('aac', 'w')
+    encoder.sample_rate = 48000
+    encoder.layout = 'stereo'
+    encoder.format = 'fltp'
+
+    packets = []
+    for i in range(count):
+        frame = av.AudioFrame(format='fltp', layout='stereo', samples=1024)
+        for plane in frame.planes:
+            plane.update(b'\x00' * plane.buffer_size)
+        frame.sample_rate = 48000
+        frame.pts = i * 1024
+        packets.extend(encoder.encode(frame))
+    return [bytes(packet) for packet in packets]
+
+
+def _audio_fmt(codec=AudioCodec.AAC):
+    return Container(codec=codec, sample_rate=48000, channels=2)
+
+
+@pytest.mark.parametrize('container', ['mkv', 'mp4'])
+def test_mux_video_audio(tmp_path, container):
+    video = encode_h264(30, keyint=10)
+    audio = _aac_frames(20)
+    path = str(tmp_path / ('out.' + container))
+
+    client = FileClient(str(tmp_path / 'out'), container=container)
+    client.set_audio_format(_audio_fmt())
+    client.open(None)
+    for i, data in enumerate(video):
+        client.render_video(data, 1000000 + i * FRAME_INTERVAL)
+    for i, data in enumerate(audio):
+        client.render_audio(data, 1000000 + i * 21333)
+    client.close()
+
+    with av.open(path) as f:
+        assert f.streams.video[0].codec_context.name == 'h264'
+        assert f.streams.audio[0].codec_context.name == 'aac'
+        frames = list(f.decode(video=0))
+    assert len(frames) == len(video)
+    assert frames[0].time == 0
+    assert frames[-1].time == pytest.approx(29 * FRAME_INTERVAL / 1e6,
+                                            abs=1e-3)
+
+    # Seeks to the keyframe before 0.3s without re-encoding
+    keyframes = [i for i, data in enumerate(video) if h264.is_keyframe(data)]
+    with av.open(path) as f:
+        stream = f.streams.video[0]
+        f.seek(int(0.3 / stream.time_base), stream=stream)
+        frame = next(f.decode(video=0))
+    expected = max(i for i in keyframes if i * FRAME_INTERVAL <= 300000)
+    assert frame.time == pytest.approx(expected * FRAME_INTERVAL / 1e6,
+                                       abs=1e-3)
+
+
+def test_mux_waits_for_keyframe(tmp_path):
+    video = encode_h264(12, keyint=10)
+    path = str(tmp_path / 'out.mkv')
+
+    muxer = Muxer(path)
+    # Start mid-stream, frames until the next keyframe are dropped
+    for i, data in enumerate(video[1:]):
+        muxer.write_video(data, i * FRAME_INTERVAL)
+    muxer.close()
+
+    assert muxer.dropped == 9
+    assert muxer.video_packets == len(video) - 10
+    with av.open(path) as f:
+        assert not f.streams.audio
+        assert len(list(f.decode(video=0))) == muxer.video_packets
+
+    with pytest.raises(MuxerError):
+        muxer.write_video(video[0], 0)
+
+
+def test_mux_unsupported(tmp_path):
+    with pytest.raises(MuxerError):
+        Muxer(str(tmp_path / 'out.avi'))
+
+    muxer = Muxer(str(tmp_path / 'out.mkv'))
+    muxer.set_audio_format(_audio_fmt(AudioCodec.Opus))
+    muxer.write_audio(b'\x00' * 10, 0)
+    assert muxer.audio_packets == 0 and not muxer.started
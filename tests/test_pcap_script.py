@@ -0,0 +1,97 @@
+import io
+import pytest
+
+from xbox.nano import factory, packer
+from xbox.nano.scripts import pcap
+
+from conftest import SESSION_TCP_PORT, SESSION_UDP_PORT, SESSION_FRAMES, \
+    write_session_pcap
+
+
+def _run(printer, path, **kwargs):
+    out = pcap.Output(io.StringIO())
+    printer(path, SESSION_TCP_PORT, SESSION_UDP_PORT,
+            pcap.PacketFilter(**kwargs), out)
+    out.flush()
+    return out.stream.getvalue().splitlines()
+
+
+def test_compact(session_pcap):
+    lines = _run(pcap.print_compact, session_pcap)
+
+    assert len(lines) == 2 + 2 * SESSION_FRAMES
+    assert '>' in lines[1].split()
+    assert 'Streamer.Data' in lines[2]
+
+
+def test_filters(session_pcap):
+    assert len(_run(pcap.print_compact, session_pcap,
+                    direction='client')) == 1
+    assert len(_run(pcap.print_compact, session_pcap,
+                    payload_types=['Streamer'], streamer_types=['Data'],
+                    channel_classes=['Video'])) == 2 * SESSION_FRAMES
+    assert _run(pcap.print_compact, session_pcap,
+                channel_classes=['Audio']) == []
+    # Second and third fragment
+    assert len(_run(pcap.print_compact, session_pcap,
+                    start=0.03, end=0.05)) == 2
+
+
+def test_summary(session_pcap):
+    lines = _run(pcap.print_summary, session_pcap, direction='console')
+
+    assert lines[-1].split() == ['total', str(1 + 2 * SESSION_FRAMES), '724']
+    assert any('Streamer.Data' in line for line in lines)
+
+
+def test_full(session_pcap):
+    lines = _run(pcap.parse, session_pcap, streamer_types=['Data'])
+
+    assert sum('RtpPayloadType.Streamer Seq' in line for line in lines) == \
+        2 * SESSION_FRAMES
+
+
+def test_export_filtered(session_pcap, tmp_path):
+    np = pytest.importorskip('numpy')
+    path = str(tmp_path / 'session.npy')
+    rows = pcap.export_messages(
+        session_pcap, SESSION_TCP_PORT, SESSION_UDP_PORT,
+        pcap.PacketFilter(direction='console', streamer_types=['Data']), path
+    )
+
+    assert rows == len(np.load(path)) == 2 * SESSION_FRAMES
+
+
+@pytest.fixture
+def handshake_pcap(tmp_path):
+    # Control handshake on channel 0 and a datagram too short to parse
+    handshake = packer.pack_tcp(
+        [factory.channel.control_handshake(connection_id=1)], pcap.channels
+    )
+    path = str(tmp_path / 'handshake.pcap')
+    write_session_pcap(path, packets=[
+        ('tcp', False, handshake), ('udp', False, b'\x80')
+    ])
+    return path
+
+
+def test_malformed_filtered(handshake_pcap):
+    assert len(_run(pcap.print_compact, handshake_pcap)) == 2
+    assert len(_run(pcap.print_compact, handshake_pcap,
+                    direction='console')) == 2
+    assert _run(pcap.print_compact, handshake_pcap, direction='client') == []
+    # Header filters can't match a malformed message
+    assert len(_run(pcap.print_compact, handshake_pcap,
+                    payload_types=['Control'])) == 1
+
+
+def test_export_channel_control(handshake_pcap, tmp_path):
+    np = pytest.importorskip('numpy')
+    path = str(tmp_path / 'handshake.npy')
+    rows = pcap.export_messages(
+        handshake_pcap, SESSION_TCP_PORT, SESSION_UDP_PORT,
+        pcap.PacketFilter(), path
+    )
+
+    # Malformed datagram is skipped by the exporter
+    assert rows == len(np.load(path)) == 1
@@ -0,0 +1,91 @@
+import sys
+import time
+import pytest
+
+from xbox.nano import profiler
+from xbox.nano.stats import SequenceTracker
+
+
+def _busy(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        sum(range(100))
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='Requires setitimer')
+def test_sampling_profiler(tmpdir):
+    prof = profiler.SamplingProfiler(interval=0.001)
+    prof.start()
+    _busy(0.1)
+    prof.stop()
+
+    assert prof.samples > 0
+    assert '_busy' in prof.report()
+
+    path = str(tmpdir.join('session.folded'))
+    prof.write(path)
+    with open(path) as f:
+        stack, count = f.readline().rsplit(' ', 1)
+    assert 'test_profiler:' in stack
+    assert int(count) > 0
+
+
+def test_scoped_profiler(tmpdir):
+    original = SequenceTracker.update
+    prof = profiler.ScopedProfiler(scopes=[
+        'xbox.nano.stats:SequenceTracker.update',
+        'xbox.nano.stats:Missing.function'
+    ])
+    assert prof.report() == 'No calls profiled'
+
+    prof.start()
+    assert SequenceTracker.update is not original
+    tracker = SequenceTracker()
+    for i in range(10):
+        tracker.update(i, 0.0)
+    prof.stop()
+
+    assert SequenceTracker.update is original
+    assert tracker.received == 10
+    assert '(update)' in prof.report()
+
+    prof.write(str(tmpdir.join('session.pstats')))
+
+
+def test_profiled_disabled():
+    with profiler.profiled(None) as prof:
+        assert prof is None
+
+    with pytest.raises(ValueError):
+        profiler.get_profiler('unknown')
+
+
+def test_scoped_profiler_client_override():
+    class BaseClient(object):
+        def render_video(self, data):
+            return 'base'
+
+        def render_audio(self, data):
+            return 'base'
+
+        def pump(self):
+            pass
+
+    class OverridingClient(BaseClient):
+        def render_video(self, data):
+            return sum(range(100))
+
+    client = OverridingClient()
+    original = OverridingClient.render_video
+    prof = profiler.ScopedProfiler(scopes=[], client=client)
+    prof.start()
+    assert OverridingClient.render_video is not original
+    assert 'render_audio' in OverridingClient.__dict__
+    client.render_video(b'')
+    client.render_audio(b'')
+    prof.stop()
+
+    assert OverridingClient.render_video is original
+    # Inherited methods are removed from the subclass again
+    assert 'render_audio' not in OverridingClient.__dict__
+    assert '(render_video)' in prof.report()
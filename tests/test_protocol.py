@@ -0,0 +1,60 @@
+import asyncio
+from construct import Container
+
+from xbox.nano import xpacker
+from xbox.nano.backend import PackerBackend, get_packer
+from xbox.nano.protocol import StreamerProtocol
+
+
+def _receive(channels, datagrams, packet_filter=None):
+    nano = Container(packer=get_packer(PackerBackend.Fast), channels=channels)
+    received = []
+
+    async def run():
+        protocol = StreamerProtocol(nano)
+        protocol.packet_filter = packet_filter
+        protocol.on_message += received.append
+        for data in datagrams:
+            protocol.datagram_received(data, None)
+        return protocol
+
+    return asyncio.run(run()), received
+
+
+def test_streamer_counters(packets, channels):
+    protocol, received = _receive(channels, [
+        packets['udp_video_data'], packets['udp_video_data'],
+        packets['udp_audio_data']
+    ])
+
+    assert len(received) == 3
+    assert protocol.channel_packets[1024] == 2
+    assert protocol.channel_bytes[1024] == 2 * len(packets['udp_video_data'])
+    assert protocol.channel_packets[1025] == 1
+    assert protocol.dropped_packets == 0
+
+
+def test_streamer_drops_unknown_channel(packets, channels):
+    known = {1025: channels[1025]}
+    protocol, received = _receive(known, [
+        packets['udp_video_data'], packets['udp_audio_data'], b'\x80'
+    ])
+
+    assert [msg.header.ssrc.channel_id for msg in received] == [1025]
+    assert protocol.dropped_packets == 2
+
+
+def test_streamer_packet_filter(packets, channels):
+    seen = []
+
+    def only_audio(payload_type, channel_id, sequence_num, streamer_type):
+        seen.append((payload_type, channel_id, sequence_num, streamer_type))
+        return channel_id == 1025
+
+    protocol, received = _receive(channels, [
+        packets['udp_video_data'], packets['udp_audio_data']
+    ], only_audio)
+
+    assert len(received) == 1
+    assert protocol.dropped_packets == 1
+    assert seen[0] == xpacker.peek_header(packets['udp_video_data'])
@@ -0,0 +1,260 @@
+import io
+import pytest
+from construct import Container
+
+from xbox.nano import recording, h264
+from xbox.nano.enum import AudioCodec, VideoCodec
+from xbox.nano.recording import StreamRecorder, StreamKind, IndexFlags, \
+    RecordingError, RecordingReader, INDEX_HEADER, INDEX_MAGIC
+from xbox.nano.render.client import FileClient
+from xbox.nano.render.writer import DiskWriter
+
+from conftest import encode_h264
+
+np = pytest.importorskip('numpy')
+
+KEYFRAME = b'\x00\x00\x00\x01\x65'
+DELTA = b'\x00\x00\x00\x01\x41'
+
+
+def _frame(i, keyint=4):
+    # 100 bytes, keyframe every `keyint` frames, first_mb_in_slice 0
+    nal = KEYFRAME if i % keyint == 0 else DELTA
+    return nal + b'\x88' + bytes([i + 1]) * 94
+
+
+def _record(tmp_path, count=16, **kwargs):
+    prefix = str(tmp_path / 'rec')
+    writer = DiskWriter(registry=None)
+    writer.start()
+    recorder = StreamRecorder(prefix, StreamKind.Video, writer, **kwargs)
+    for i in range(count):
+        recorder.write(_frame(i), i * 10000, i + 1, i % 4 == 0)
+    recorder.close()
+    writer.close()
+    return prefix, recorder
+
+
+def test_index_unsegmented(tmp_path):
+    prefix, recorder = _record(tmp_path)
+    path = recording.index_path(prefix, StreamKind.Video)
+    index = recording.read_index(path)
+
+    assert recorder.segment == 0
+    assert (tmp_path / 'rec.video.raw').stat().st_size == 1600
+    assert index.dtype.itemsize == recording.INDEX_ENTRY.size
+    assert list(index['frame_id']) == list(range(1, 17))
+    assert list(index['offset']) == list(range(0, 1600, 100))
+    assert list(index['flags'] & IndexFlags.Keyframe) == \
+        [int(i % 4 == 0) for i in range(16)]
+    # Plain numpy.fromfile works
+    assert (np.fromfile(path, dtype=recording.INDEX_DTYPE,
+                        offset=INDEX_HEADER.size) == index).all()
+    assert [tuple(e) for e in index.tolist()] == \
+        list(recording.iter_index(path))
+
+
+class FullWriter(DiskWriter):
+    """
+    Queue full for every third frame
+    """
+    def __init__(self):
+        super(FullWriter, self).__init__(registry=None)
+        self.appends = 0
+
+    def append(self, path, *buffers, block=None):
+        if path.endswith('.raw') and not block:
+            self.appends += 1
+            if self.appends % 3 == 0:
+                self.dropped += 1
+                return False
+        return super(FullWriter, self).append(path, *buffers, block=block)
+
+
+def test_dropped_frames_not_indexed(tmp_path):
+    prefix = str(tmp_path / 'rec')
+    writer = FullWriter()
+    writer.start()
+    recorder = StreamRecorder(prefix, StreamKind.Video, writer)
+    frames = [_frame(i) for i in range(12)]
+    for i, frame in enumerate(frames):
+        recorder.write(frame, i * 10000, i + 1, i % 4 == 0)
+    recorder.close()
+    writer.close()
+
+    assert recorder.dropped == writer.dropped == 4
+    index = recording.read_index(recording.index_path(prefix, 'video'))
+    data = (tmp_path / 'rec.video.raw').read_bytes()
+    assert len(index) == 8
+    for entry in index:
+        offset, size = int(entry['offset']), int(entry['size'])
+        assert data[offset:offset + size] == frames[entry['frame_id'] - 1]
+
+
+def test_rotation_by_size(tmp_path):
+    # Rotation waits for the next keyframe
+    prefix, recorder = _record(tmp_path, segment_size=250)
+    index = recording.read_index(recording.index_path(prefix, 'video'))
+
+    assert recorder.segment == 3
+    for segment in range(4):
+        assert (tmp_path / ('rec.video.%04d.raw' % segment)).read_bytes() == \
+            b''.join(_frame(i) for i in range(segment * 4, segment * 4 + 4))
+    assert list(index['segment']) == [i // 4 for i in range(16)]
+    assert list(index['offset'][:5]) == [0, 100, 200, 300, 0]
+
+
+def test_rotation_by_duration(tmp_path):
+    prefix, recorder = _record(tmp_path, segment_duration=0.08)
+    index = recording.read_index(recording.index_path(prefix, 'video'))
+
+    # 80ms reached at frame 8
+    assert recorder.segment == 1
+    assert list(index['segment']) == [0] * 8 + [1] * 8
+
+
+@pytest.mark.parametrize('segment_size', [None, 250])
+def test_seek_and_extract_clip(tmp_path, segment_size):
+    prefix, _ = _record(tmp_path, segment_size=segment_size)
+    index = recording.read_index(recording.index_path(prefix, 'video'))
+
+    assert recording.seek(index, 0) == 0
+    assert recording.seek(index, 65000) == 4
+    assert recording.seek(index, 80000) == 8
+    assert recording.seek(index, 10 ** 9) == 12
+
+    # From the keyframe before 65ms up to 100ms, across a segment boundary
+    expected = b''.join(_frame(i) for i in range(4, 10))
+    assert recording.extract_clip(prefix, 'video', 65000, 100000) == expected
+    output = io.BytesIO()
+    assert recording.extract_clip(
+        prefix, 'video', 65000, 100000, output
+    ) == len(expected)
+    assert output.getvalue() == expected
+
+
+def test_invalid_index(tmp_path):
+    path = tmp_path / 'rec.video.idx'
+    path.write_bytes(b'nope' + b'\x00' * 12)
+    with pytest.raises(RecordingError):
+        recording.read_index(str(path))
+
+    path.write_bytes(INDEX_HEADER.pack(INDEX_MAGIC, 99, 32, 0, 0))
+    with pytest.raises(RecordingError):
+        list(recording.iter_index(str(path)))
+
+
+def test_file_client_segments(tmp_path):
+    fmt = Container(codec=AudioCodec.AAC, sample_rate=48000, channels=2)
+    prefix = str(tmp_path / 'rec')
+    client = FileClient(prefix, writer=DiskWriter(registry=None),
+                        segment_size=250)
+    client.open(None)
+    client.set_audio_format(fmt)
+    for i in range(8):
+        client.render_video(_frame(i), i * 10000, i)
+        client.render_audio(b'\xaa' * 100, i * 10000, i)
+    client.close()
+
+    video = recording.read_index(recording.index_path(prefix, 'video'))
+    audio = recording.read_index(recording.index_path(prefix, 'audio'))
+    assert list(video['segment']) == [0] * 4 + [1] * 4
+    assert (audio['flags'] == IndexFlags.Keyframe).all()
+    # ADTS header + frame
+    assert list(audio['size']) == [107] * 8
+    assert list(audio['segment']) == [0, 0, 0, 1, 1, 1, 2, 2]
+    assert (tmp_path / 'rec.audio.0002.raw').stat().st_size == 214
+
+
+def test_clip_gets_parameter_sets(tmp_path):
+    video = encode_h264(30, keyint=10)
+    prefix = str(tmp_path / 'rec')
+    client = FileClient(prefix, writer=DiskWriter(registry=None))
+    client.open(None)
+    for i, frame in enumerate(video):
+        if i == 10:
+            # Keyframe without SPS / PPS
+            frame = frame[frame.index(b'\x00\x00\x01\x65') - 1:]
+            video[10] = frame
+        client.render_video(frame, i * 10000, i)
+    client.close()
+
+    index = recording.read_index(recording.index_path(prefix, 'video'))
+    assert list(np.flatnonzero(index['flags'] & IndexFlags.ParameterSets)) \
+        == [0, 20]
+
+    clip = recording.extract_clip(prefix, 'video', 105000, 120000)
+    info = h264.scan_frame(clip)
+    assert info.keyframe
+    assert info.sps == h264.scan_frame(video[0]).sps
+    assert clip.endswith(video[10] + video[11])
+
+
+@pytest.mark.parametrize('segment_size', [None, 250])
+def test_rebuild_index(tmp_path, segment_size):
+    prefix, _ = _record(tmp_path, segment_size=segment_size)
+    path = recording.index_path(prefix, 'video')
+    original = recording.read_index(path)
+
+    assert recording.rebuild_index(prefix, frame_rate=100.0) == 16
+    rebuilt = recording.read_index(path)
+    for field in ('segment', 'timestamp', 'offset', 'size', 'flags'):
+        assert (rebuilt[field] == original[field]).all(), field
+    assert list(rebuilt['frame_id']) == list(range(16))
+
+    with pytest.raises(RecordingError):
+        recording.rebuild_index(prefix, StreamKind.Audio)
+    with pytest.raises(RecordingError):
+        recording.rebuild_index(str(tmp_path / 'missing'))
+
+
+def _recording(tmp_path, segment_size=None):
+    video = encode_h264(20, keyint=10)
+    audio_fmt = Container(codec=AudioCodec.AAC, sample_rate=48000, channels=2)
+    prefix = str(tmp_path / 'rec')
+    client = FileClient(prefix, writer=DiskWriter(registry=None),
+                        segment_size=segment_size)
+    client.open(None)
+    client.set_video_format(Container(
+        codec=VideoCodec.H264, fps=60, width=64, height=64
+    ))
+    client.set_audio_format(audio_fmt)
+    for i, frame in enumerate(video):
+        client.render_video(frame, 1000000 + i * 10000, i)
+        client.render_audio(b'\xaa' * 8, 1000000 + i * 10000 + 5000, i)
+    client.close()
+    return prefix, video
+
+
+@pytest.mark.parametrize('segment_size', [None, 1000])
+def test_reader(tmp_path, segment_size):
+    prefix, video = _recording(tmp_path, segment_size)
+
+    with RecordingReader(prefix) as reader:
+        assert reader.video_format.codec == VideoCodec.H264
+        assert reader.video_format.width == 64
+        assert reader.audio_format.sample_rate == 48000
+        assert reader.first_timestamp == 1000000
+
+        frames = list(reader)
+        assert [f.kind for f in frames[:4]] == \
+            ['video', 'audio', 'video', 'audio']
+        assert [f.timestamp for f in frames] == \
+            sorted(f.timestamp for f in frames)
+        video_frames = [f for f in frames if f.kind == 'video']
+        assert [bytes(f.data) for f in video_frames] == video
+        assert isinstance(video_frames[0].data, memoryview)
+        assert [f.keyframe for f in video_frames].count(True) == 2
+        # ADTS header stripped
+        assert all(bytes(f.data) == b'\xaa' * 8
+                   for f in frames if f.kind == 'audio')
+
+        # From the keyframe before 1.15s
+        clip = list(reader.frames('video', 1150000, 1170000))
+        assert [f.frame_id for f in clip] == list(range(10, 17))
+        del frames, video_frames, clip
+
+
+def test_reader_missing(tmp_path):
+    with pytest.raises(RecordingError):
+        RecordingReader(str(tmp_path / 'missing'))
@@ -0,0 +1,158 @@
+import asyncio
+import pytest
+from datetime import datetime
+from construct import Container
+
+from xbox.nano import factory
+from xbox.nano.backend import PackerBackend
+from xbox.nano.channel import InputChannel
+from xbox.nano.enum import ChannelClass, VideoCodec
+from xbox.nano.replay import ReplayEngine, RecordingPlayer
+from xbox.nano.capture import read_session
+from xbox.nano.recording import RecordingReader
+from xbox.nano.render.client import FileClient, BenchmarkClient
+from xbox.nano.render.writer import DiskWriter
+from xbox.nano.render.input.base import InputFrameState
+
+from conftest import SESSION_TCP_PORT, SESSION_UDP_PORT, SESSION_FRAMES, \
+    encode_h264
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.frames = []
+        self.opened = False
+        self.closed = False
+
+    def open(self, protocol):
+        self.opened = True
+
+    def close(self):
+        self.closed = True
+
+    def set_video_format(self, video_fmt):
+        pass
+
+    def render_video(self, data, timestamp=None, frame_id=None):
+        self.frames.append(data)
+
+
+def _replay(path, **kwargs):
+    client = FakeClient()
+    engine = ReplayEngine(client, **kwargs)
+    packets = read_session(path, SESSION_TCP_PORT, SESSION_UDP_PORT)
+    stats = asyncio.run(engine.run(packets))
+    return client, engine, stats
+
+
+def test_replay_max_speed(session_pcap):
+    client, engine, stats = _replay(
+        session_pcap, speed=None, packer_backend=PackerBackend.Fast
+    )
+
+    assert client.opened and client.closed
+    assert engine.protocol.channels[1024].name == ChannelClass.Video
+    assert client.frames == [b'\x00\x00\x00\x01\x65' + b'\xaa' * 10] * \
+        SESSION_FRAMES
+    # Client -> console packet is skipped
+    assert stats.packets == 1 + 2 * SESSION_FRAMES
+    assert stats.stages['control'][0] == 1
+    assert stats.stages['streamer'][0] == 2 * SESSION_FRAMES
+    assert stats.capture_duration == pytest.approx(0.11)
+
+    report = engine.report()
+    assert 'frame Reassembled' in report
+    assert engine.tracer.stage_seconds.totals(stage='Reassembled')[0] == \
+        SESSION_FRAMES
+
+
+def test_replay_send_input(session_pcap):
+    class InputClient(FakeClient):
+        def open(self, protocol):
+            super(InputClient, self).open(protocol)
+            self.protocol = protocol
+
+        def render_video(self, data, timestamp=None, frame_id=None):
+            # As SDLClient does while pumping events, an exception here is
+            # logged by the protocol and the frame is not counted
+            channel = InputChannel(
+                self, self.protocol, 1028, ChannelClass.Input, 0
+            )
+            channel.reference_timestamp = datetime.utcnow()
+            channel.send_frame(InputFrameState(), datetime.utcnow())
+            self.protocol.control_protocol.send_message(
+                factory.channel.close(0, 1028)
+            )
+            super(InputClient, self).render_video(data, timestamp, frame_id)
+
+    client = InputClient()
+    engine = ReplayEngine(client, speed=None)
+    packets = read_session(session_pcap, SESSION_TCP_PORT, SESSION_UDP_PORT)
+    asyncio.run(engine.run(packets))
+
+    assert len(client.frames) == SESSION_FRAMES
+
+
+def test_replay_paced(session_pcap):
+    _, _, stats = _replay(session_pcap, speed=4.0)
+
+    # 110ms of capture at 4x
+    assert stats.duration >= 0.11 / 4
+
+
+def test_replay_inject(session_pcap):
+    client, engine, stats = _replay(
+        session_pcap, speed=None, loss=0.2, reorder=0.3, seed=1
+    )
+
+    assert stats.dropped > 0
+    assert stats.reordered > 0
+    assert stats.packets == 1 + 2 * SESSION_FRAMES - stats.dropped
+    stats_video = engine.protocol.channels[1024].stats()
+    assert stats_video.lost <= stats.dropped
+    assert stats_video.reordered == stats.reordered
+
+    # Deterministic for a given seed
+    _, _, again = _replay(
+        session_pcap, speed=None, loss=0.2, reorder=0.3, seed=1
+    )
+    assert (again.dropped, again.reordered) == (stats.dropped, stats.reordered)
+
+
+def _record(path, frames):
+    prefix = str(path / 'rec')
+    client = FileClient(prefix, writer=DiskWriter(registry=None))
+    client.open(None)
+    client.set_video_format(Container(
+        codec=VideoCodec.H264, fps=60, width=64, height=64
+    ))
+    for i, frame in enumerate(frames):
+        client.render_video(frame, i * 10000, i)
+    client.close()
+    return prefix
+
+
+def test_recording_player_benchmark(tmp_path):
+    frames = encode_h264(10)
+    client = BenchmarkClient()
+    with RecordingReader(_record(tmp_path, frames)) as reader:
+        player = RecordingPlayer(client, speed=None)
+        stats = asyncio.run(player.run(reader))
+
+    assert stats.frames == 10
+    assert stats.media['video'][1] == sum(len(f) for f in frames)
+    # 90ms recorded, no pacing
+    assert stats.recording_duration == pytest.approx(0.09)
+    assert client.stats().video.decoded == 10
+    assert 'Played 10 frames' in player.report()
+
+
+def test_recording_player_paced(tmp_path):
+    client = FakeClient()
+    with RecordingReader(_record(tmp_path, encode_h264(10))) as reader:
+        stats = asyncio.run(RecordingPlayer(client, speed=2.0).run(reader))
+
+    assert client.opened and client.closed
+    assert len(client.frames) == 10
+    assert isinstance(client.frames[0], memoryview)
+    assert stats.duration >= 0.09 / 2
@@ -0,0 +1,158 @@
+import threading
+import multiprocessing
+import pytest
+from construct import Container
+
+from xbox.nano.enum import ChannelClass, VideoCodec, AudioCodec
+from xbox.nano.render.ring import FrameRing, RingError, RECORD_HEADER
+from xbox.nano.render.client import RingClient, BenchmarkClient
+from xbox.nano.render.client.ring import RingRenderer, RingTag
+
+from conftest import encode_h264
+
+pytest.importorskip('multiprocessing.shared_memory')
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing(256)
+    yield ring
+    ring.close()
+
+
+def test_put_get(ring):
+    assert ring.put(b'frame', tag=3, timestamp=1000, frame_id=7)
+    record = ring.get(timeout=0)
+    assert (record.tag, record.timestamp, record.frame_id) == (3, 1000, 7)
+    assert isinstance(record.data, memoryview)
+    assert bytes(record.data) == b'frame'
+    assert ring.pending == 32
+    ring.release(record)
+    assert ring.pending == 0
+    assert ring.get(timeout=0) is None
+
+
+def test_wrap_and_full(ring):
+    # 96 byte records, the third wraps
+    data = [bytes([i]) * 70 for i in range(8)]
+    assert ring.put(data[0]) and ring.put(data[1])
+    first = ring.get(timeout=0)
+    ring.release(first)
+    assert ring.put(data[2])
+    # 256 - 96 (pending) - 64 (skipped) left
+    assert not ring.put(data[3])
+    assert ring.dropped == 1
+
+    for expected in data[1:3]:
+        record = ring.get(timeout=0)
+        assert bytes(record.data) == expected
+        ring.release(record)
+    assert ring.pending == 0
+
+    with pytest.raises(RingError):
+        ring.put(b'x' * (256 - RECORD_HEADER.size + 1))
+
+
+def _produce(ring, frames):
+    client = RingClient(ring)
+    client.open(None)
+    client.set_video_format(Container(
+        codec=VideoCodec.H264, fps=60, width=64, height=64
+    ))
+    client.set_audio_format(Container(
+        codec=AudioCodec.AAC, sample_rate=48000, channels=2
+    ))
+    for i, frame in enumerate(frames):
+        while not ring.put(frame, RingTag.Video, i * 16667, i):
+            pass
+    client.close()
+    ring.close()
+
+
+def test_render_from_process():
+    frames = encode_h264(30)
+    context = multiprocessing.get_context('spawn')
+    ring = FrameRing(4096, context=context)
+    process = context.Process(target=_produce, args=(ring, frames))
+    process.start()
+
+    client = BenchmarkClient(decode_audio=False)
+    renderer = RingRenderer(ring, client)
+    renderer.run()
+    process.join()
+
+    assert process.exitcode == 0
+    assert renderer.frames == 30
+    assert client._audio_fmt.sample_rate == 48000
+    assert client.stats().video.decoded == 30
+    ring.close()
+
+
+def test_dropped_video_requests_keyframe():
+    requests = []
+    channel = Container(request_keyframe=lambda: requests.append(1))
+    protocol = Container(get_channel={ChannelClass.Video: channel}.get)
+
+    ring = FrameRing(64)
+    client = RingClient(ring)
+    client.open(protocol)
+    try:
+        client.render_video(b'x' * 30)
+        client.render_video(b'x' * 30)
+        client.render_audio(b'x' * 30)
+        assert client.dropped == 2
+        assert requests == [1]
+    finally:
+        ring.close()
+
+
+def test_put_wait(ring):
+    # 256 byte record fills the ring
+    assert ring.put(b'x' * 230)
+    assert not ring.put(b'', RingTag.Close, wait=0.01)
+    assert ring.dropped == 1
+
+    def consume():
+        record = ring.get(timeout=1)
+        ring.release(record)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    # Waits for the consumer to free space
+    assert ring.put(b'', RingTag.Close, wait=5)
+    consumer.join()
+    assert ring.dropped == 1
+    assert ring.get(timeout=0).tag == RingTag.Close
+
+
+def test_format_waits_for_space(ring):
+    client = RingClient(ring)
+    assert ring.put(b'x' * 230, RingTag.Video)
+
+    def consume():
+        record = ring.get(timeout=1)
+        ring.release(record)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    client.set_audio_format(Container(
+        codec=AudioCodec.AAC, sample_rate=48000, channels=2
+    ))
+    consumer.join()
+    assert ring.dropped == 0
+    record = ring.get(timeout=0)
+    assert record.tag == RingTag.AudioFormat
+    ring.release(record)
+
+
+def test_renderer_dead_producer(ring):
+    client = BenchmarkClient(decode_audio=False)
+    assert ring.put(b'x' * 230, RingTag.Video)
+    # Close record lost, ring full
+    assert not ring.put(b'', RingTag.Close)
+
+    renderer = RingRenderer(
+        ring, client, producer=Container(is_alive=lambda: False)
+    )
+    renderer.run()
+    assert renderer.frames == 1
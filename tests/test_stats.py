@@ -0,0 +1,116 @@
+import asyncio
+import pytest
+
+from xbox.nano import packer
+from xbox.nano.protocol import NanoProtocol
+from xbox.nano.channel import VideoChannel
+from xbox.nano.enum import ChannelClass
+from xbox.nano.stats import SequenceTracker
+
+
+def _track(sequence_nums, **kwargs):
+    tracker = SequenceTracker(**kwargs)
+    for seq in sequence_nums:
+        tracker.update(seq, 0.0)
+    return tracker.snapshot()
+
+
+def test_sequence_in_order():
+    stats = _track(range(10, 20))
+
+    assert stats.received == 10
+    assert stats.expected == 10
+    assert stats.lost == 0
+    assert stats.duplicates == 0
+    assert stats.reordered == 0
+    assert stats.highest_sequence_num == 19
+
+
+def test_sequence_loss():
+    stats = _track([1, 2, 5, 6, 10])
+
+    assert stats.received == 5
+    assert stats.expected == 10
+    assert stats.lost == 5
+
+
+def test_sequence_wraparound():
+    stats = _track([65533, 65534, 65535, 0, 2])
+
+    assert stats.received == 5
+    assert stats.expected == 6
+    assert stats.lost == 1
+    assert stats.highest_sequence_num == 65536 + 2
+
+
+def test_sequence_duplicates():
+    stats = _track([1, 2, 2, 3, 1])
+
+    assert stats.received == 3
+    assert stats.duplicates == 2
+    assert stats.lost == 0
+
+
+def test_sequence_reorder():
+    stats = _track([1, 3, 2, 4, 2])
+
+    assert stats.received == 4
+    assert stats.reordered == 1
+    assert stats.duplicates == 1
+    assert stats.lost == 0
+
+
+def test_sequence_reorder_across_wrap():
+    stats = _track([65534, 0, 65535, 1])
+
+    assert stats.received == 4
+    assert stats.reordered == 1
+    assert stats.lost == 0
+    assert stats.highest_sequence_num == 65537
+
+
+def test_sequence_late_beyond_window():
+    stats = _track(list(range(0, 20)) + [3], window=8)
+
+    assert stats.reordered == 1
+    assert stats.duplicates == 0
+
+
+def test_jitter():
+    tracker = SequenceTracker()
+    # Constant transit time -> no jitter
+    for i in range(10):
+        tracker.update(i, 1.0 + i * 0.02, i * 0.02)
+    assert tracker.jitter == pytest.approx(0.0)
+
+    # Single 16ms deviation
+    tracker.update(10, 1.0 + 10 * 0.02 + 0.016, 10 * 0.02)
+    assert tracker.jitter == pytest.approx(0.001)
+
+
+def test_channel_track(packets, channels):
+    channel = VideoChannel(None, None, 1024, ChannelClass.Video, 0)
+    msg = packer.unpack(packets['udp_video_data'], channels)
+
+    channel.track(msg, arrival=3365.7)
+    channel.track(msg, arrival=3365.8)
+    stats = channel.stats()
+
+    assert stats.received == 1
+    assert stats.duplicates == 1
+    assert stats.highest_sequence_num == msg.header.sequence_num
+
+
+def test_protocol_stats():
+    async def run():
+        protocol = NanoProtocol(None, '127.0.0.1', None, 0, 0)
+        protocol.channels[1024] = VideoChannel(
+            None, protocol, 1024, ChannelClass.Video, 0
+        )
+        protocol.channels[1024].sequence_tracker.update(1, 0.0)
+        return protocol.stats()
+
+    stats = asyncio.run(run())
+
+    assert list(stats.keys()) == ['Video']
+    assert stats['Video'].received == 1
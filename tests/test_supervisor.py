@@ -0,0 +1,146 @@
+import os
+import pytest
+
+from xbox.nano import metrics
+from xbox.nano.render.client.base import Client
+from xbox.nano.render.sink import Sink
+from xbox.nano.supervisor import (
+    Supervisor, ReplaySession, StatsBlock, WorkerStats, WorkerState,
+    available_cores, _EMPTY_STATS, _SEQUENCE
+)
+
+from conftest import SESSION_TCP_PORT, SESSION_UDP_PORT, SESSION_FRAMES
+
+pytest.importorskip('multiprocessing.shared_memory')
+
+
+class CollectingClient(Client):
+    def __init__(self):
+        self.frames = []
+        self.closed = False
+        super(CollectingClient, self).__init__(Sink(), Sink(), Sink())
+
+    def open(self, protocol):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def loop(self):
+        pass
+
+    def pump(self):
+        pass
+
+    def render_video(self, data, timestamp=None, frame_id=None):
+        self.frames.append(bytes(data))
+
+
+def test_stats_block():
+    block = StatsBlock(2)
+    try:
+        assert block.read(1) == _EMPTY_STATS
+        stats = _EMPTY_STATS._replace(
+            state=WorkerState.Running, pid=42, core=3, started=10.0,
+            updated=12.5, frames_completed=150, decode_seconds=0.25
+        )
+        block.write(1, stats)
+        assert block.read(1) == stats
+        assert block.read(1).fps == 60.0
+        assert block.read(0) == _EMPTY_STATS
+        with pytest.raises(IndexError):
+            block.read(2)
+    finally:
+        block.close()
+
+
+def test_stats_block_dead_writer():
+    block = StatsBlock(1)
+    try:
+        stats = _EMPTY_STATS._replace(state=WorkerState.Running, pid=42)
+        block.write(0, stats)
+        # Writer killed between the sequence bumps
+        sequence = _SEQUENCE.unpack_from(block._buf, 0)[0]
+        _SEQUENCE.pack_into(block._buf, 0, sequence + 1)
+
+        assert block.read(0) == stats
+        failed = stats._replace(state=WorkerState.Failed)
+        block.write(0, failed)
+        assert _SEQUENCE.unpack_from(block._buf, 0)[0] % 2 == 0
+        assert block.read(0) == failed
+    finally:
+        block.close()
+
+
+def test_available_cores():
+    cores = available_cores()
+    assert cores and all(isinstance(core, int) for core in cores)
+
+
+def test_replay_workers(session_pcap):
+    registry = metrics.Registry()
+    sessions = [
+        ReplaySession(session_pcap, SESSION_TCP_PORT, SESSION_UDP_PORT,
+                      name='first'),
+        # Ports detected in the worker
+        ReplaySession(session_pcap, name='second')
+    ]
+    core = available_cores()[0]
+    supervisor = Supervisor(sessions, cores=[core], registry=registry)
+    with supervisor:
+        assert supervisor.wait(timeout=60)
+        all_stats = supervisor.stats()
+        rendered = registry.render()
+        report = supervisor.report()
+
+    assert len(all_stats) == 2
+    for stats in all_stats:
+        assert isinstance(stats, WorkerStats)
+        assert stats.state == WorkerState.Done
+        assert stats.pid not in (0, os.getpid())
+        assert stats.frames_completed == SESSION_FRAMES
+        assert stats.packets == SESSION_FRAMES * 2
+        if hasattr(os, 'sched_setaffinity'):
+            assert stats.core == core
+
+    assert 'xbox_nano_worker_video_frames_total{session="second"} %d' % \
+        SESSION_FRAMES in rendered
+    assert 'Total: %d frames' % (SESSION_FRAMES * 2) in report
+    # Metrics unregistered on close
+    assert registry.get('xbox_nano_worker_up') is None
+
+
+def test_failed_worker(tmp_path):
+    supervisor = Supervisor(
+        [ReplaySession(str(tmp_path / 'missing.pcap'), 1, 2)],
+        cores=[], registry=None
+    )
+    with supervisor:
+        assert supervisor.wait(timeout=60)
+        stats, = supervisor.stats()
+    assert stats.state == WorkerState.Failed
+    assert stats.core == -1
+
+
+def test_render_in_supervisor(session_pcap):
+    clients = {}
+
+    def render_factory(session):
+        clients[session.name] = CollectingClient()
+        return clients[session.name]
+
+    sessions = [
+        ReplaySession(session_pcap, SESSION_TCP_PORT, SESSION_UDP_PORT,
+                      name=name)
+        for name in ('first', 'second')
+    ]
+    supervisor = Supervisor(sessions, render_factory=render_factory,
+                            ring_size=1 << 16, registry=None)
+    with supervisor:
+        assert supervisor.wait(timeout=60)
+        assert all(s.ring_dropped == 0 for s in supervisor.stats())
+
+    for client in clients.values():
+        assert client.closed
+        assert len(client.frames) == SESSION_FRAMES
+        assert client.frames[0].startswith(b'\x00\x00\x00\x01\x65')
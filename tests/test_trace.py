@@ -0,0 +1,102 @@
+import json
+from construct import Container
+
+from xbox.nano import factory, metrics
+from xbox.nano.channel import VideoChannel
+from xbox.nano.enum import ChannelClass, VideoPayloadType
+from xbox.nano.trace import FrameTracer, Stage
+
+
+def test_tracer_latency():
+    registry = metrics.Registry()
+    tracer = FrameTracer(registry, record_events=True)
+
+    tracer.stamp(1, Stage.FirstFragment, 1000000)
+    tracer.stamp(1, Stage.LastFragment, 3000000)
+    tracer.stamp(1, Stage.Reassembled, 3500000)
+    tracer.stamp(1, Stage.Presented, 11000000)
+    tracer.finish(1)
+
+    text = registry.render()
+    stage_sum = 'xbox_nano_frame_stage_seconds_sum{stage="%s"} %s'
+    assert stage_sum % ('LastFragment', '0.002') in text
+    assert stage_sum % ('Presented', '0.0075') in text
+    assert 'stage="Decoded"' not in text
+    assert 'xbox_nano_frame_latency_seconds_sum 0.01' in text
+
+    trace = tracer.chrome_trace()
+    events = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+    assert [e['name'] for e in events] == \
+        ['LastFragment', 'Reassembled', 'Presented']
+    assert events[0]['dur'] == 2000.0
+    assert events[2]['args'] == {'frame_id': 1}
+    json.dumps(trace)
+
+    tracer.close()
+    assert registry.render() == ''
+
+
+def test_tracer_pending_bounds():
+    tracer = FrameTracer(None, max_pending=2)
+
+    for frame_id in range(3):
+        tracer.stamp(frame_id, Stage.FirstFragment)
+    tracer.discard(2)
+    assert list(tracer._pending) == [1]
+
+    # Unknown / evicted frames are ignored
+    tracer.finish(0)
+    assert list(tracer.latency_seconds.samples()) == []
+
+
+class FakeClient(object):
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.frames = []
+
+    def render_video(self, data, timestamp=None, frame_id=None):
+        self.tracer.stamp_current(Stage.Decoded)
+        self.frames.append(data)
+
+
+def _video_data(frame_id, offset, packet_count, data, arrival):
+    msg = factory.streamer_udp(
+        VideoPayloadType.Data, factory.video.data(
+            flags=4, frame_id=frame_id, timestamp=0, total_size=0,
+            packet_count=packet_count, offset=offset, data=data
+        ), connection_id=1, channel_id=1024
+    )
+    msg(_incoming_ns=arrival)
+    return msg
+
+
+def test_video_channel_trace():
+    registry = metrics.Registry()
+    tracer = FrameTracer(registry, record_events=True)
+
+    client = FakeClient(tracer)
+    channel = VideoChannel(
+        client, Container(tracer=tracer), 1024, ChannelClass.Video, 0
+    )
+
+    # Single packet frames are rendered immediately
+    channel.on_data(_video_data(1, 0, 1, b'ab', 1000))
+    channel.on_data(_video_data(2, 0, 2, b'ab', 2000))
+    channel.on_data(_video_data(2, 2, 2, b'cd', 5000))
+
+    assert client.frames == [b'ab', b'abcd']
+    assert channel.frames_completed == 2
+    assert not tracer._pending
+
+    events = [e for e in tracer.chrome_trace()['traceEvents']
+              if e['ph'] == 'X' and e['args']['frame_id'] == 2]
+    assert [e['name'] for e in events] == \
+        ['LastFragment', 'Reassembled', 'Decoded']
+    assert events[0]['dur'] == 3.0
+
+    # Expired frames are no longer tracked
+    channel.on_data(_video_data(3, 0, 2, b'ab', 6000))
+    channel._frame_expiry_time = 0
+    channel.on_data(_video_data(4, 0, 2, b'ab', 7000))
+    assert not tracer._pending
+    assert channel.frames_expired == 2
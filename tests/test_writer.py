@@ -0,0 +1,146 @@
+import threading
+import pytest
+from construct import Container
+
+from xbox.nano import metrics
+from xbox.nano.enum import AudioCodec
+from xbox.nano.render.client import FileClient
+from xbox.nano.render.audio.aac import AACFrame, AACProfile
+from xbox.nano.render.writer import DiskWriter, ALIGNMENT
+
+
+@pytest.mark.parametrize('writev', [False, True])
+def test_append(tmp_path, writev):
+    path = str(tmp_path / 'stream.raw')
+    chunks = [bytes([i]) * (i * 100 + 1) for i in range(64)]
+
+    writer = DiskWriter(buffer_size=ALIGNMENT, writev=writev, registry=None)
+    writer.start()
+    for i in range(0, len(chunks), 2):
+        assert writer.append(path, chunks[i], chunks[i + 1])
+    writer.close()
+
+    with open(path, 'rb') as f:
+        assert f.read() == b''.join(chunks)
+    assert writer.written == sum(len(c) for c in chunks)
+    assert writer.lag_seconds.totals()[0] == len(chunks) // 2
+    assert not writer.running
+
+
+def test_write_file_and_call(tmp_path):
+    writer = DiskWriter(registry=None)
+    writer.start()
+    order = []
+    writer.write_file(str(tmp_path / 'frame'), b'header', b'payload')
+    writer.call(order.append, 'called')
+    writer.flush()
+    assert order == ['called']
+    writer.close()
+
+    assert (tmp_path / 'frame').read_bytes() == b'headerpayload'
+
+
+def test_queue_full_drops(tmp_path):
+    registry = metrics.Registry()
+    writer = DiskWriter(max_queue=2, registry=registry)
+    writer.start()
+    release = threading.Event()
+    started = threading.Event()
+
+    def stall():
+        started.set()
+        release.wait()
+
+    # Slow disk: the writer thread is busy
+    writer.call(stall)
+    started.wait()
+    path = str(tmp_path / 'stream.raw')
+    results = [writer.append(path, b'x') for _ in range(4)]
+    assert registry.get('xbox_nano_writer_lag_seconds') is writer.lag_seconds
+    release.set()
+    writer.close()
+
+    assert results == [True, True, False, False]
+    assert writer.dropped == 2
+    assert 'xbox_nano_writer_dropped_total 2' in \
+        writer.dropped_total.render()
+    assert (tmp_path / 'stream.raw').read_bytes() == b'xx'
+    # Metrics unregistered on close
+    assert registry.get('xbox_nano_writer_lag_seconds') is None
+
+
+@pytest.mark.parametrize('save_frames', [False, True])
+def test_file_client(tmp_path, save_frames):
+    fmt = Container(codec=AudioCodec.AAC, sample_rate=48000, channels=2)
+    prefix = str(tmp_path / 'rec')
+    client = FileClient(prefix, save_frames=save_frames,
+                        writer=DiskWriter(registry=None))
+    client.open(None)
+    client.set_audio_format(fmt)
+    for i in range(3):
+        client.render_video(b'\x00\x00\x00\x01\x65' + bytes([i]), i)
+        client.render_audio(b'\xaa' * 8, i)
+    client.close()
+
+    header = bytes(AACFrame.generate_header(8, AACProfile.Main, 48000, 2))
+    if save_frames:
+        assert (tmp_path / 'rec.video.00000002.frame').read_bytes() == \
+            b'\x00\x00\x00\x01\x65\x02'
+        assert (tmp_path / 'rec.audio.00000000.frame').read_bytes() == \
+            header + b'\xaa' * 8
+    else:
+        assert (tmp_path / 'rec.video.raw').read_bytes() == b''.join(
+            b'\x00\x00\x00\x01\x65' + bytes([i]) for i in range(3)
+        )
+        assert (tmp_path / 'rec.audio.raw').read_bytes() == \
+            (header + b'\xaa' * 8) * 3
+
+
+def test_close_file(tmp_path):
+    path = str(tmp_path / 'segment.raw')
+    writer = DiskWriter(registry=None)
+    writer.start()
+    writer.append(path, b'first')
+    writer.close_file(path)
+    writer.flush()
+    # Buffered data written on close_file
+    assert (tmp_path / 'segment.raw').read_bytes() == b'first'
+    writer.append(path, b'second')
+    writer.close()
+    assert (tmp_path / 'segment.raw').read_bytes() == b'second'
+
+
+def test_blocking_call_not_dropped(tmp_path):
+    writer = DiskWriter(max_queue=1)
+    writer.start()
+    release = threading.Event()
+    started = threading.Event()
+
+    def stall():
+        started.set()
+        release.wait()
+
+    writer.call(stall)
+    started.wait()
+    assert writer.append(str(tmp_path / 'stream.raw'), b'x')
+    order = []
+    # Queue full, e.g. a muxer trailer: waits instead of being dropped
+    caller = threading.Thread(
+        target=writer.call, args=(order.append, 'finalized'),
+        kwargs={'block': True}
+    )
+    caller.start()
+    assert not writer.call(order.append, 'dropped')
+    release.set()
+    caller.join()
+    writer.close()
+
+    assert order == ['finalized']
+
+
+def test_writers_share_default_registry():
+    # Metrics are only registered on request
+    first, second = DiskWriter(), DiskWriter()
+    first.close()
+    second.close()
+    assert metrics.REGISTRY.get('xbox_nano_writer_lag_seconds') is None
@@ -0,0 +1,596 @@
+import struct
+import pytest
+from hypothesis import given, settings, strategies as st
+from datetime import datetime, timedelta
+from construct import Container
+
+from xbox.nano import xpacker, packer, factory, enum
+from xbox.nano.packet import video, audio, input
+from xbox.nano.backend import normalize
+from xbox.nano.channel import InputChannel
+from xbox.nano.render.input.base import InputFrameState
+
+
+class FakeStreamerProtocol(object):
+    def __init__(self):
+        self.sent = []
+
+    def send_data(self, data):
+        self.sent.append(bytes(data))
+
+
+class FakeProtocol(object):
+    def __init__(self):
+        self.connection_id = 56147
+        self.streamer_protocol = FakeStreamerProtocol()
+
+
+def test_input_frame_encoder(packets):
+    encoder = xpacker.InputFrameEncoder()
+    state = InputFrameState()
+    state.buttons[3] = 1  # dpad_right
+    state.analog[2:6] = [1752, 684, 1080, 242]
+
+    packed = encoder.pack(
+        2, 56147, 1028, 672208564, 583706515, 583706495,
+        state.buttons, state.analog, state.extension,
+        rtp_timestamp=2376737668
+    )
+
+    assert len(packed) == xpacker.InputFrameEncoder.SIZE
+    assert packed == packets['udp_input_frame']
+
+
+def test_input_frame_encoder_negative_axis():
+    encoder = xpacker.InputFrameEncoder()
+    state = InputFrameState()
+    state.analog[2:6] = [-32768, 32767, -1, 0]
+
+    packed = encoder.pack(
+        0x10001, 1, 1028, 1, 2, 3,
+        state.buttons, state.analog, state.extension
+    )
+
+    # Sequence number wraps at 16 bits
+    assert packed[2:4] == b'\x00\x01'
+    assert packed[62:70] == b'\x00\x80\xff\x7f\xff\xff\x00\x00'
+
+
+def test_input_channel_send_frame(channels):
+    channel = InputChannel(
+        None, FakeProtocol(), 1028, enum.ChannelClass.Input, 0
+    )
+    channel.reference_timestamp = datetime.utcnow() - timedelta(seconds=2)
+    channel.frame_id = 672208563
+
+    state = InputFrameState()
+    state.buttons[3] = 1
+    channel.send_frame(state, datetime.utcnow())
+
+    data = channel.protocol.streamer_protocol.sent[0]
+    unpacked = xpacker.unpack(data, channels)
+
+    assert unpacked.header.flags.padding is True
+    assert unpacked.header.sequence_num == 1
+    assert unpacked.header.ssrc.connection_id == 56147
+    assert unpacked.header.ssrc.channel_id == 1028
+    assert unpacked.header.streamer.type == enum.InputPayloadType.Frame
+    assert unpacked.payload.frame_id == 672208564
+    assert unpacked.payload.buttons.dpad_right == 1
+    assert unpacked.payload.extension.byte_6 == 1
+    # 10 microsecond units relative to reference timestamp
+    assert 200000 <= unpacked.payload.timestamp < 210000
+    assert unpacked.payload.created_ts <= unpacked.payload.timestamp
+
+
+@pytest.mark.parametrize('name', [
+    'tcp_audio_client_handshake', 'tcp_audio_control',
+    'tcp_audio_server_handshake', 'tcp_channel_close', 'tcp_channel_create',
+    'tcp_channel_open_no_flags', 'tcp_channel_open_with_flags',
+    'tcp_control_handshake', 'tcp_control_msg_with_header',
+    'tcp_input_client_handshake', 'tcp_input_server_handshake',
+    'tcp_video_client_handshake', 'tcp_video_control',
+    'tcp_video_server_handshake', 'udp_audio_data', 'udp_handshake',
+    'udp_input_frame', 'udp_input_frame_ack', 'udp_video_data'
+])
+def test_pack_roundtrip(packets, channels, name):
+    data = packets[name]
+    msg = packer.unpack(data, channels)
+
+    assert xpacker.pack(msg, channels) == data
+    assert xpacker.pack(msg, channels) == packer.pack(msg, channels)
+
+
+def test_pack_tcp_roundtrip(packets, channels):
+    data = packets['tcp_control_msg_with_header_change_video_quality']
+    msgs = list(packer.unpack_tcp(data, channels))
+
+    assert xpacker.pack_tcp(msgs, channels) == data
+    assert xpacker.pack_tcp(msgs + msgs, channels) == data + data
+
+
+def _control_msg(opcode, payload):
+    msg = factory.control.control_header(
+        prev_seq_dup=7, unk1=1, unk2=1406, opcode=opcode,
+        payload=payload.container
+    )
+    return factory.streamer_tcp(
+        8, 7, 0, msg, channel_id=1027, timestamp=123
+    )
+
+
+GUID = bytes(range(16))
+
+
+@pytest.mark.parametrize('opcode,payload', [
+    (enum.ControlPayloadType.SessionInit,
+     factory.control.control.session_init(unk3=b'\x01\x02\x03')),
+    (enum.ControlPayloadType.SessionCreate,
+     factory.control.session_create(guid=GUID, unk3=b'abcde')),
+    (enum.ControlPayloadType.SessionCreateResponse,
+     factory.control.session_create_response(guid=GUID)),
+    (enum.ControlPayloadType.SessionDestroy,
+     factory.control.session_destroy(unk3=1.5, unk5=b'xyz')),
+    (enum.ControlPayloadType.VideoStatistics,
+     factory.control.video_statistics(
+         unk3=1.0, unk4=2.0, unk5=3.5, unk6=0.25, unk7=-1.0, unk8=0.0)),
+    (enum.ControlPayloadType.RealtimeTelemetry,
+     factory.control.realtime_telemetry(data=[
+         Container(key=12, value=0), Container(key=7, value=2 ** 40)])),
+    (enum.ControlPayloadType.ChangeVideoQuality,
+     factory.control.change_video_quality(*enum.VideoQuality.VeryHigh)),
+    (enum.ControlPayloadType.InitiateNetworkTest,
+     factory.control.initiate_network_test(guid=GUID)),
+    (enum.ControlPayloadType.NetworkInformation,
+     factory.control.network_information(
+         guid=GUID, unk4=2 ** 33, unk5=1, unk6=0.5)),
+    (enum.ControlPayloadType.NetworkTestResponse,
+     factory.control.network_test_response(
+         guid=GUID, unk3=1.0, unk4=2.0, unk5=3.0, unk6=4.0, unk7=5.0,
+         unk8=6, unk9=7, unk10=8.0)),
+    (enum.ControlPayloadType.ControllerEvent,
+     factory.control.controller_event(enum.ControllerEvent.Added, 2)),
+])
+def test_pack_control(channels, opcode, payload):
+    msg = _control_msg(opcode, payload)
+    assert xpacker.pack(msg, channels) == packer.pack(msg, channels)
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(request_keyframe=True, start_stream=True),
+    dict(stop_stream=True),
+    dict(queue_depth=True, queue_depth_field=5),
+    dict(lost_frames=True, first_lost_frame=10, last_lost_frame=20),
+    dict(last_displayed_frame=True, last_displayed_frame_id=99,
+         timestamp=-5),
+    dict(request_keyframe=True, queue_depth=True, lost_frames=True,
+         last_displayed_frame=True, queue_depth_field=1,
+         first_lost_frame=2, last_lost_frame=3,
+         last_displayed_frame_id=4, timestamp=5),
+])
+def test_pack_video_control(channels, kwargs):
+    msg = factory.streamer_tcp(
+        2, 1, enum.VideoPayloadType.Control,
+        factory.video.control(**kwargs), channel_id=1024
+    )
+    assert xpacker.pack(msg, channels) == packer.pack(msg, channels)
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(),
+    dict(reinitialize=True),
+    dict(start_stream=True),
+    dict(stop_stream=True),
+])
+def test_pack_audio_control(channels, kwargs):
+    msg = factory.streamer_tcp(
+        2, 1, enum.AudioPayloadType.Control,
+        factory.audio.control(**kwargs), channel_id=1025
+    )
+    assert xpacker.pack(msg, channels) == packer.pack(msg, channels)
+
+
+def test_pack_handshakes_with_extended_formats(channels):
+    ref = datetime(2020, 12, 12, 10, 0, 0, 500000)
+    rgb = video.fmt(
+        fps=60, width=320, height=200, codec=enum.VideoCodec.RGB,
+        rgb=Container(bpp=32, bytes=4, red_mask=0xFF0000,
+                      green_mask=0xFF00, blue_mask=0xFF)
+    ).container
+    pcm = audio.fmt(
+        channels=2, sample_rate=48000, codec=enum.AudioCodec.PCM,
+        pcm=Container(bit_depth=16, type=0)
+    ).container
+
+    msgs = [
+        factory.streamer_tcp(1, 0, enum.VideoPayloadType.ServerHandshake,
+                             factory.video.server_handshake(
+                                 5, 320, 200, 60, ref, [rgb, rgb]),
+                             channel_id=1024),
+        factory.streamer_tcp(1, 0, enum.VideoPayloadType.ClientHandshake,
+                             factory.video.client_handshake(1, rgb),
+                             channel_id=1024),
+        factory.streamer_tcp(1, 0, enum.AudioPayloadType.ServerHandshake,
+                             factory.audio.server_handshake(4, ref, [pcm]),
+                             channel_id=1026),
+        factory.streamer_tcp(1, 0, enum.AudioPayloadType.ClientHandshake,
+                             factory.audio.client_handshake(1, pcm),
+                             channel_id=1026),
+        factory.streamer_tcp(1, 0, enum.InputPayloadType.ClientHandshake,
+                             factory.input.client_handshake(10, ref),
+                             channel_id=1028),
+    ]
+
+    for msg in msgs:
+        assert xpacker.pack(msg, channels) == packer.pack(msg, channels)
+    assert xpacker.pack_tcp(msgs, channels) == packer.pack_tcp(msgs, channels)
+
+
+def test_pack_channel_control(channels):
+    msgs = [
+        factory.channel.control_handshake(40084),
+        factory.channel.create(enum.ChannelClass.Input, 0, 1028),
+        factory.channel.open(b'', 1028),
+        factory.channel.open(b'\x01\x00\x02\x00', 1027),
+        factory.channel.close(0, 1028),
+        factory.udp_handshake(35795),
+    ]
+
+    for msg in msgs:
+        assert xpacker.pack(msg, channels) == packer.pack(msg, channels)
+
+
+def test_pack_udp_data(channels):
+    msgs = [
+        factory.streamer_udp(
+            enum.AudioPayloadType.Data,
+            factory.audio.data(flags=4, frame_id=1, timestamp=2, data=b'abc'),
+            connection_id=1, channel_id=1026, sequence_num=3
+        ),
+        factory.streamer_udp(
+            enum.VideoPayloadType.Data,
+            factory.video.data(flags=4, frame_id=1, timestamp=2,
+                               total_size=4, packet_count=1, offset=0,
+                               data=b'abcd'),
+            connection_id=1, channel_id=1024, sequence_num=0xFFFF
+        ),
+        factory.streamer_udp(
+            enum.InputPayloadType.FrameAck,
+            factory.input.frame_ack(acked_frame=12),
+            connection_id=1, channel_id=1029
+        ),
+    ]
+
+    for msg in msgs:
+        assert xpacker.pack(msg, channels) == packer.pack(msg, channels)
+
+
+def test_pack_errors(channels):
+    msg = factory.streamer_udp(
+        enum.AudioPayloadType.Data,
+        Container(flags=4, frame_id=1, timestamp=2, data=b'abc'),
+        connection_id=1, channel_id=1026
+    )
+
+    with pytest.raises(xpacker.PackerError):
+        xpacker.pack(msg)
+
+    msg.header.ssrc.channel_id = 4711
+    with pytest.raises(xpacker.PackerError):
+        xpacker.pack(msg, channels)
+
+
+"""
+Property based decoding parity with the reference packer
+"""
+
+u8 = st.integers(0, 0xFF)
+u16 = st.integers(0, 0xFFFF)
+u32 = st.integers(0, 0xFFFFFFFF)
+u64 = st.integers(0, 0xFFFFFFFFFFFFFFFF)
+f32 = st.floats(width=32, allow_nan=False)
+blob = st.binary(max_size=64)
+guid = st.binary(min_size=16, max_size=16)
+reference_ts = st.integers(0, 2 ** 42).map(
+    lambda ms: datetime.utcfromtimestamp(ms / 1000)
+)
+video_formats = st.builds(
+    lambda fps, width, height, rgb: video.fmt(
+        fps=fps, width=width, height=height,
+        codec=enum.VideoCodec.RGB if rgb else enum.VideoCodec.H264,
+        rgb=rgb
+    ).container,
+    u32, u32, u32, st.none() | st.builds(
+        Container, bpp=u32, bytes=u32,
+        red_mask=u64, green_mask=u64, blue_mask=u64
+    )
+)
+audio_formats = st.builds(
+    lambda channels, sample_rate, pcm: audio.fmt(
+        channels=channels, sample_rate=sample_rate,
+        codec=enum.AudioCodec.PCM if pcm else enum.AudioCodec.Opus,
+        pcm=pcm
+    ).container,
+    u32, u32, st.none() | st.builds(Container, bit_depth=u32, type=u32)
+)
+control_payloads = st.one_of(
+    st.builds(lambda b: (enum.ControlPayloadType.SessionInit,
+                         factory.control.control.session_init(unk3=b)), blob),
+    st.builds(lambda g, b: (enum.ControlPayloadType.SessionCreate,
+                            factory.control.session_create(guid=g, unk3=b)),
+              guid, blob),
+    st.builds(lambda g: (enum.ControlPayloadType.SessionCreateResponse,
+                         factory.control.session_create_response(guid=g)),
+              guid),
+    st.builds(lambda f, b: (enum.ControlPayloadType.SessionDestroy,
+                            factory.control.session_destroy(unk3=f, unk5=b)),
+              f32, blob),
+    st.builds(lambda v: (enum.ControlPayloadType.VideoStatistics,
+                         factory.control.video_statistics(
+                             unk3=v[0], unk4=v[1], unk5=v[2],
+                             unk6=v[3], unk7=v[4], unk8=v[5])),
+              st.tuples(*[f32] * 6)),
+    st.builds(lambda d: (enum.ControlPayloadType.RealtimeTelemetry,
+                         factory.control.realtime_telemetry(data=d)),
+              st.lists(st.builds(Container, key=u16, value=u64), max_size=8)),
+    st.builds(lambda v: (enum.ControlPayloadType.ChangeVideoQuality,
+                         factory.control.change_video_quality(*v)),
+              st.tuples(*[u32] * 6)),
+    st.builds(lambda g: (enum.ControlPayloadType.InitiateNetworkTest,
+                         factory.control.initiate_network_test(guid=g)),
+              guid),
+    st.builds(lambda g, a, b, c: (enum.ControlPayloadType.NetworkInformation,
+                                  factory.control.network_information(
+                                      guid=g, unk4=a, unk5=b, unk6=c)),
+              guid, u64, u8, f32),
+    st.builds(lambda g, f, a, b, c: (
+        enum.ControlPayloadType.NetworkTestResponse,
+        factory.control.network_test_response(
+            guid=g, unk3=f[0], unk4=f[1], unk5=f[2], unk6=f[3], unk7=f[4],
+            unk8=a, unk9=b, unk10=c)),
+        guid, st.tuples(*[f32] * 5), u64, u64, f32),
+    st.builds(lambda e, n: (enum.ControlPayloadType.ControllerEvent,
+                            factory.control.controller_event(e, n)),
+              st.sampled_from(enum.ControllerEvent), u8),
+)
+
+
+@st.composite
+def streamer_messages(draw):
+    channel_id, payload_type, payload = draw(st.one_of(
+        st.tuples(st.just(1024), st.just(enum.VideoPayloadType.Data),
+                  st.builds(factory.video.data, u32, u32, u64, u32, u32,
+                            u32, blob)),
+        st.tuples(st.just(1024),
+                  st.just(enum.VideoPayloadType.ServerHandshake),
+                  st.builds(factory.video.server_handshake, u32, u32, u32,
+                            u32, reference_ts,
+                            st.lists(video_formats, max_size=4))),
+        st.tuples(st.just(1024),
+                  st.just(enum.VideoPayloadType.ClientHandshake),
+                  st.builds(factory.video.client_handshake, u32,
+                            video_formats)),
+        st.tuples(st.just(1024), st.just(enum.VideoPayloadType.Control),
+                  st.builds(factory.video.control, *[st.booleans()] * 6,
+                            u32, st.integers(-2 ** 63, 2 ** 63 - 1),
+                            u32, u32, u32)),
+        st.tuples(st.sampled_from([1025, 1026]),
+                  st.just(enum.AudioPayloadType.Data),
+                  st.builds(factory.audio.data, u32, u32, u64, blob)),
+        st.tuples(st.sampled_from([1025, 1026]),
+                  st.just(enum.AudioPayloadType.ServerHandshake),
+                  st.builds(factory.audio.server_handshake, u32, reference_ts,
+                            st.lists(audio_formats, max_size=4))),
+        st.tuples(st.sampled_from([1025, 1026]),
+                  st.just(enum.AudioPayloadType.ClientHandshake),
+                  st.builds(factory.audio.client_handshake, u32,
+                            audio_formats)),
+        st.tuples(st.sampled_from([1025, 1026]),
+                  st.just(enum.AudioPayloadType.Control),
+                  st.builds(factory.audio.control, *[st.booleans()] * 3)),
+        st.tuples(st.sampled_from([1028, 1029]),
+                  st.just(enum.InputPayloadType.Frame),
+                  st.builds(_input_frame, u32, u64, u64,
+                            st.lists(u8, min_size=18, max_size=18),
+                            st.lists(st.integers(-2 ** 15, 2 ** 15 - 1),
+                                     min_size=4, max_size=4),
+                            st.lists(u8, min_size=13, max_size=13))),
+        st.tuples(st.sampled_from([1028, 1029]),
+                  st.just(enum.InputPayloadType.ServerHandshake),
+                  st.builds(factory.input.server_handshake, *[u32] * 5)),
+        st.tuples(st.sampled_from([1028, 1029]),
+                  st.just(enum.InputPayloadType.ClientHandshake),
+                  st.builds(factory.input.client_handshake, u32,
+                            reference_ts)),
+        st.tuples(st.sampled_from([1028, 1029]),
+                  st.just(enum.InputPayloadType.FrameAck),
+                  st.builds(factory.input.frame_ack, u32)),
+    ))
+
+    if draw(st.booleans()):
+        return factory.streamer_tcp(
+            draw(u32), draw(u32), payload_type, payload,
+            channel_id=channel_id, timestamp=draw(u32)
+        )
+    return factory.streamer_udp(
+        payload_type, payload, connection_id=draw(st.integers(1, 0xFFFF)),
+        channel_id=channel_id, timestamp=draw(u32), sequence_num=draw(u16)
+    )
+
+
+def _input_frame(frame_id, timestamp, created_ts, bytes_a, axes, bytes_b):
+    return input.frame(
+        frame_id=frame_id, timestamp=timestamp, created_ts=created_ts,
+        buttons=Container(zip(BUTTON_FIELDS, bytes_a[:16])),
+        analog=Container(
+            zip(ANALOG_FIELDS, bytes_a[16:] + axes + bytes_b[:4])
+        ),
+        extension=Container(zip(EXTENSION_FIELDS, bytes_b[4:]))
+    )
+
+
+def _field_names(fields):
+    return [sc.name for sc in fields.subcon.subcons]
+
+
+BUTTON_FIELDS = _field_names(input.input_frame_buttons)
+ANALOG_FIELDS = _field_names(input.input_frame_analog)
+EXTENSION_FIELDS = _field_names(input.input_frame_extension)
+
+
+def _assert_parity(msg, channels):
+    data = packer.pack(msg, channels)
+    assert xpacker.pack(msg, channels) == data
+
+    expected = packer.unpack(data, channels)
+    assert normalize(xpacker.unpack(data, channels)) == normalize(expected)
+
+
+@given(payload=control_payloads, prev_seq_dup=u32, unk1=u16, unk2=u16,
+       sequence_num=u32)
+def test_unpack_control_parity(channels, payload, prev_seq_dup, unk1, unk2,
+                               sequence_num):
+    opcode, payload = payload
+    msg = factory.streamer_tcp(
+        sequence_num, 0, 0, factory.control.control_header(
+            prev_seq_dup=prev_seq_dup, unk1=unk1, unk2=unk2, opcode=opcode,
+            payload=payload.container
+        ), channel_id=1027
+    )
+    _assert_parity(msg, channels)
+
+
+@settings(max_examples=300)
+@given(msg=streamer_messages())
+def test_unpack_streamer_parity(channels, msg):
+    _assert_parity(msg, channels)
+
+
+@given(connection_id=u16, channel_id=st.sampled_from([1024, 1028]),
+       flags=blob, kind=st.integers(0, 4))
+def test_unpack_channel_control_parity(channels, connection_id, channel_id,
+                                       flags, kind):
+    msg = [
+        lambda: factory.channel.control_handshake(connection_id),
+        lambda: factory.channel.create(enum.ChannelClass.Video, len(flags),
+                                       channel_id),
+        lambda: factory.channel.open(flags, channel_id),
+        lambda: factory.channel.close(len(flags), channel_id),
+        lambda: factory.udp_handshake(connection_id),
+    ][kind]()
+    _assert_parity(msg, channels)
+
+
+def test_unpack_video_control_fields(channels):
+    msg = factory.streamer_tcp(
+        2, 1, enum.VideoPayloadType.Control,
+        factory.video.control(queue_depth=True, queue_depth_field=5,
+                              lost_frames=True, first_lost_frame=10,
+                              last_lost_frame=20),
+        channel_id=1024
+    )
+    payload = xpacker.unpack(packer.pack(msg, channels), channels).payload
+
+    assert payload.queue_depth == 5
+    assert payload.lost_frames.first == 10
+    assert payload.lost_frames.last == 20
+    assert payload.last_displayed_frame is None
+
+
+def test_unpack_controller_event(channels):
+    msg = _control_msg(
+        enum.ControlPayloadType.ControllerEvent,
+        factory.control.controller_event(enum.ControllerEvent.Removed, 3)
+    )
+    payload = xpacker.unpack(packer.pack(msg, channels), channels).payload
+
+    assert payload.payload.event == enum.ControllerEvent.Removed
+    assert payload.payload.controller_num == 3
+
+
+def test_unpack_change_video_quality(packets, channels):
+    data = packets['tcp_control_msg_with_header_change_video_quality']
+    msg = list(xpacker.unpack_tcp(data, channels))[0]
+
+    assert msg.payload.opcode == enum.ControlPayloadType.ChangeVideoQuality
+    expected = list(packer.unpack_tcp(data, channels))[0]
+    assert normalize(msg) == normalize(expected)
+
+
+def test_unpack_lazy_payload(packets, channels):
+    msg = xpacker.unpack(packets['udp_video_data'], channels)
+
+    assert isinstance(msg, xpacker.LazyMessage)
+    assert msg.header.ssrc.channel_id == 1024
+    assert not msg.is_decoded('payload')
+    assert 'payload' in msg
+
+    payload = msg.payload
+    assert msg.is_decoded('payload')
+    assert msg.payload is payload
+    assert normalize(msg) == normalize(
+        xpacker.unpack(packets['udp_video_data'], channels, lazy=False)
+    )
+
+
+def test_unpack_lazy_control_opcode(channels):
+    msg = _control_msg(
+        enum.ControlPayloadType.RealtimeTelemetry,
+        factory.control.realtime_telemetry(data=[Container(key=1, value=2)])
+    )
+    msg = xpacker.unpack(packer.pack(msg, channels), channels)
+
+    assert msg.payload.opcode == enum.ControlPayloadType.RealtimeTelemetry
+    assert not msg.payload.is_decoded('payload')
+    assert msg.payload.payload.data == [Container(key=1, value=2)]
+
+
+def test_unpack_lazy_truncated(packets, channels):
+    data = packets['udp_video_data'][:40]
+    msg = xpacker.unpack(data, channels)
+
+    assert msg.header.streamer.type == enum.VideoPayloadType.Data
+    with pytest.raises(struct.error):
+        msg.payload
+
+    with pytest.raises(struct.error):
+        xpacker.unpack(data, channels, lazy=False)
+
+
+@pytest.mark.parametrize('name', [
+    'tcp_audio_client_handshake', 'tcp_channel_create',
+    'tcp_channel_open_with_flags', 'tcp_control_handshake',
+    'tcp_control_msg_with_header', 'tcp_video_control', 'udp_audio_data',
+    'udp_handshake', 'udp_input_frame', 'udp_input_frame_ack',
+    'udp_video_data'
+])
+def test_peek_header(packets, channels, name):
+    data = packets[name]
+    msg = packer.unpack(data, channels)
+
+    payload_type, channel_id, sequence_num, streamer_type = \
+        xpacker.peek_header(data)
+
+    assert payload_type == msg.header.flags.payload_type.value
+    assert channel_id == msg.header.ssrc.channel_id
+    assert sequence_num == msg.header.sequence_num
+    if msg.header.streamer:
+        assert streamer_type == getattr(msg.header.streamer.type, 'value', 0)
+    else:
+        assert streamer_type is None
+
+
+def test_peek_header_too_short(packets):
+    with pytest.raises(xpacker.PackerError):
+        xpacker.peek_header(packets['udp_video_data'][:8])
+    with pytest.raises(xpacker.PackerError):
+        xpacker.peek_header(packets['udp_video_data'][:14])
+
+
+def test_split_tcp(packets):
+    data = packets['tcp_control_msg_with_header_change_video_quality']
+    chunks = list(xpacker.split_tcp(data + data))
+
+    assert len(chunks) == 2
+    assert chunks[0] == chunks[1] == data[4:]
@@ -0,0 +1,429 @@
+"""
+Session analysis
+
+Computes per-session statistics (bitrate, frame sizes, loss, keyframe
+interval, input rate) from captures. Captures are analyzed in parallel
+worker processes, one capture per task. A capture failing to parse is
+reported in the `error` column instead of failing the batch.
+
+Example:
+    >>> results = analyze(['a.pcap', 'b.pcap'], jobs=8)
+    >>> print(format_table(results))
+"""
+import os
+import math
+import logging
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from xbox.nano import xpacker, h264
+from xbox.nano.capture import CaptureReader, TcpStream, transport_packet, \
+    IP_PROTO_UDP, IP_PROTO_TCP
+from xbox.nano.channel import Channel
+from xbox.nano.stats import SequenceTracker
+from xbox.nano.enum import ChannelClass, RtpPayloadType, \
+    ChannelControlPayloadType, VideoPayloadType, AudioPayloadType, \
+    InputPayloadType
+
+log = logging.getLogger(__name__)
+
+STREAMER = RtpPayloadType.Streamer.value
+CHANNEL_CONTROL = RtpPayloadType.ChannelControl.value
+VIDEO_DATA = VideoPayloadType.Data.value
+AUDIO_DATA = AudioPayloadType.Data.value
+INPUT_FRAME = InputPayloadType.Frame.value
+
+
+class SessionStats(object):
+    """
+    Statistics of one capture, combined for totals with :meth:`merge`.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        # Why the capture could not be analyzed
+        self.error = None
+        self.first_ts = None
+        # Seconds from first to last datagram, summed when merged
+        self.duration = 0.0
+        self.packets = 0
+        self.bytes = 0
+        self.errors = 0
+
+        self.video_bytes = 0
+        self.video_frames = 0
+        self.frame_size_min = None
+        self.frame_size_max = 0
+        self.keyframes = 0
+        self.last_keyframe_ts = None
+        # Summed time between consecutive keyframes, and their count
+        self.keyframe_span = 0.0
+        self.keyframe_gaps = 0
+        self.audio_bytes = 0
+        self.input_frames = 0
+
+        # Channel class name -> [received, expected]
+        self.sequence = {}
+
+    @property
+    def video_bitrate(self):
+        """
+        Video bits per second
+        """
+        return self.video_bytes * 8 / self.duration if self.duration else 0.0
+
+    @property
+    def frame_size_mean(self):
+        if not self.video_frames:
+            return 0.0
+        return self.video_bytes / self.video_frames
+
+    @property
+    def keyframe_interval(self):
+        """
+        Mean seconds between keyframes, None with less than two
+        """
+        if not self.keyframe_gaps:
+            return None
+        return self.keyframe_span / self.keyframe_gaps
+
+    @property
+    def input_rate(self):
+        """
+        Input frames per second sent by the client
+        """
+        return self.input_frames / self.duration if self.duration else 0.0
+
+    def loss(self, channel_name):
+        """
+        Returns:
+            float: Fraction of datagrams lost on channel
+        """
+        received, expected = self.sequence.get(channel_name, (0, 0))
+        if not expected:
+            return 0.0
+        return max(0, expected - received) / expected
+
+    def add_frame(self, size, keyframe, timestamp):
+        self.video_frames += 1
+        self.frame_size_max = max(self.frame_size_max, size)
+        if self.frame_size_min is None or size < self.frame_size_min:
+            self.frame_size_min = size
+        if keyframe:
+            self.keyframes += 1
+            if self.last_keyframe_ts is not None:
+                self.keyframe_span += timestamp - self.last_keyframe_ts
+                self.keyframe_gaps += 1
+            self.last_keyframe_ts = timestamp
+
+    def merge(self, other):
+        """
+        Combine with statistics of another capture for totals.
+
+        Returns:
+            :class:`SessionStats`: New instance, without path
+        """
+        merged = SessionStats()
+        for name in ('duration', 'packets', 'bytes', 'errors', 'video_bytes',
+                     'video_frames', 'keyframes', 'audio_bytes',
+                     'input_frames', 'keyframe_span', 'keyframe_gaps'):
+            setattr(merged, name, getattr(self, name) + getattr(other, name))
+
+        def pick(func, a, b):
+            values = [v for v in (a, b) if v is not None]
+            return func(values) if values else None
+
+        merged.frame_size_min = pick(
+            min, self.frame_size_min, other.frame_size_min
+        )
+        merged.frame_size_max = max(self.frame_size_max, other.frame_size_max)
+
+        for stats in (self, other):
+            for name, (received, expected) in stats.sequence.items():
+                total = merged.sequence.setdefault(name, [0, 0])
+                total[0] += received
+                total[1] += expected
+        return merged
+
+    def row(self):
+        """
+        Returns:
+            dict: Summary values, see :data:`COLUMNS`
+        """
+        interval = self.keyframe_interval
+        return {
+            'capture': os.path.basename(self.path) if self.path else 'total',
+            'duration_s': self.duration,
+            'packets': self.packets,
+            'video_kbps': self.video_bitrate / 1000,
+            'frames': self.video_frames,
+            'frame_min': self.frame_size_min or 0,
+            'frame_mean': self.frame_size_mean,
+            'frame_max': self.frame_size_max,
+            'keyframe_s': interval if interval is not None else float('nan'),
+            'video_loss_pct': self.loss(ChannelClass.Video.name) * 100,
+            'audio_loss_pct': self.loss(ChannelClass.Audio.name) * 100,
+            'input_hz': self.input_rate,
+            'errors': self.errors,
+            'error': self.error or ''
+        }
+
+
+# Column name, width, format
+COLUMNS = (
+    ('capture', 24, '%s'),
+    ('duration_s', 10, '%.1f'),
+    ('packets', 9, '%d'),
+    ('video_kbps', 10, '%.0f'),
+    ('frames', 7, '%d'),
+    ('frame_min', 9, '%d'),
+    ('frame_mean', 10, '%.0f'),
+    ('frame_max', 9, '%d'),
+    ('keyframe_s', 10, '%.2f'),
+    ('video_loss_pct', 14, '%.2f'),
+    ('audio_loss_pct', 14, '%.2f'),
+    ('input_hz', 8, '%.1f'),
+    ('errors', 6, '%d'),
+    ('error', 5, '%s'),
+)
+
+
+class _Analyzer(object):
+    def __init__(self, stats, tcp_port, udp_port):
+        self.stats = stats
+        self.tcp_port = tcp_port
+        self.udp_port = udp_port
+
+        self.channels = {}
+        self.streams = {}
+        self.trackers = {}
+        # frame_id -> [received, packet_count, size, keyframe, timestamp]
+        self.frames = {}
+
+    def on_control(self, data):
+        try:
+            for buf in xpacker.split_tcp(data):
+                payload_type, channel_id, _, _ = xpacker.peek_header(buf)
+                if payload_type != CHANNEL_CONTROL:
+                    continue
+                msg = xpacker.unpack(buf, self.channels)
+                if msg.payload.type == ChannelControlPayloadType.ChannelCreate:
+                    self.channels[channel_id] = Channel(
+                        None, None, channel_id, msg.payload.name, 0
+                    )
+        except (xpacker.PackerError, ValueError):
+            self.stats.errors += 1
+
+    def on_datagram(self, ts, data, from_client):
+        stats = self.stats
+        try:
+            payload_type, channel_id, seq, streamer_type = \
+                xpacker.peek_header(data)
+        except xpacker.PackerError:
+            stats.errors += 1
+            return
+        channel = self.channels.get(channel_id)
+        if payload_type != STREAMER or channel is None:
+            return
+        name = channel.name
+
+        if from_client:
+            if name == ChannelClass.Input and streamer_type == INPUT_FRAME:
+                stats.input_frames += 1
+            return
+
+        tracker = self.trackers.get(name.name)
+        if tracker is None:
+            tracker = self.trackers[name.name] = SequenceTracker()
+        tracker.update(seq, ts)
+
+        if name == ChannelClass.Video and streamer_type == VIDEO_DATA:
+            self.on_video(ts, data)
+        elif name == ChannelClass.Audio and streamer_type == AUDIO_DATA:
+            try:
+                payload = xpacker.unpack(data, self.channels).payload
+            except (xpacker.PackerError, ValueError):
+                stats.errors += 1
+                return
+            stats.audio_bytes += len(payload.data)
+
+    def on_video(self, ts, data):
+        try:
+            payload = xpacker.unpack(data, self.channels).payload
+            chunk = payload.data
+        except (xpacker.PackerError, ValueError):
+            self.stats.errors += 1
+            return
+
+        self.stats.video_bytes += len(chunk)
+        frame = self.frames.get(payload.frame_id)
+        if frame is None:
+            frame = self.frames[payload.frame_id] = \
+                [0, payload.packet_count, 0, False, ts]
+        frame[0] += 1
+        frame[2] += len(chunk)
+        if payload.offset == 0:
+            # Parameter sets and slice headers lead the frame
+            frame[3] = h264.is_keyframe(chunk)
+
+        if frame[0] >= frame[1]:
+            del self.frames[payload.frame_id]
+            self.stats.add_frame(frame[2], frame[3], frame[4])
+
+    def feed(self, ts, parsed):
+        proto, src, sport, dst, dport, seq, syn, payload = parsed
+        if proto == IP_PROTO_TCP:
+            if sport == self.tcp_port:
+                key = (src, sport, dst, dport)
+                stream = self.streams.get(key)
+                if stream is None:
+                    stream = self.streams[key] = TcpStream()
+                for msg in stream.feed(seq, syn, payload):
+                    self.on_control(msg)
+            return
+
+        if proto != IP_PROTO_UDP or self.udp_port not in (sport, dport):
+            return
+
+        stats = self.stats
+        stats.packets += 1
+        stats.bytes += len(payload)
+        if stats.first_ts is None:
+            stats.first_ts = ts
+        stats.duration = ts - stats.first_ts
+        self.on_datagram(ts, payload, dport == self.udp_port)
+
+    def finish(self):
+        for name, tracker in self.trackers.items():
+            self.stats.sequence[name] = [tracker.received, tracker.expected]
+
+
+def analyze_capture(path, tcp_port=None, udp_port=None):
+    """
+    Analyze capture
+
+    Args:
+        path (str): Path to pcap / pcapng
+        tcp_port (int): Console TCP port, detected if omitted
+        udp_port (int): Console UDP port, detected if omitted
+
+    Returns:
+        :class:`SessionStats`: Statistics
+    """
+    if tcp_port is None or udp_port is None:
+        detected_tcp, detected_udp = detect_ports(path)
+        tcp_port = tcp_port or detected_tcp
+        udp_port = udp_port or detected_udp
+
+    stats = SessionStats(path)
+    analyzer = _Analyzer(stats, tcp_port, udp_port)
+    with CaptureReader(path) as reader:
+        for ts, linktype, frame in reader.packets():
+            parsed = transport_packet(linktype, frame)
+            if parsed:
+                analyzer.feed(ts, parsed)
+    analyzer.finish()
+    return stats
+
+
+def detect_ports(path, max_packets=20000):
+    """
+    Guess console ports from the start of a capture.
+
+    UDP: Source of most datagrams carrying a streamer message.
+    TCP: Destination port of the first SYN, otherwise the console side of
+    the most active connection carrying length-prefixed RTP messages.
+
+    Returns:
+        tuple: (tcp_port, udp_port), None where undetectable
+    """
+    udp = Counter()
+    tcp = Counter()
+    syn_port = None
+    with CaptureReader(path) as reader:
+        for i, (ts, linktype, frame) in enumerate(reader.packets()):
+            if i >= max_packets:
+                break
+            parsed = transport_packet(linktype, frame)
+            if not parsed:
+                continue
+            proto, src, sport, dst, dport, _, syn, payload = parsed
+
+            if proto == IP_PROTO_UDP:
+                try:
+                    if xpacker.peek_header(payload)[0] == STREAMER:
+                        udp[(src, sport)] += 1
+                except xpacker.PackerError:
+                    pass
+            elif syn and syn_port is None:
+                syn_port = dport
+            elif len(payload) > 5 and payload[4] >> 6 == 2:
+                # RTP version 2 after length prefix
+                tcp[(src, sport, dst, dport)] += 1
+
+    console, udp_port = udp.most_common(1)[0][0] if udp else (None, None)
+    tcp_port = syn_port
+    if tcp_port is None and tcp:
+        src, sport, dst, dport = tcp.most_common(1)[0][0]
+        if console == dst or (console != src and dport < sport):
+            tcp_port = dport
+        else:
+            tcp_port = sport
+    return tcp_port, udp_port
+
+
+def analyze(paths, tcp_port=None, udp_port=None, jobs=None):
+    """
+    Analyze captures in parallel
+
+    Args:
+        paths (list): Capture paths
+        jobs (int): Worker processes, defaults to CPU count
+
+    Returns:
+        list: :class:`SessionStats` per capture, in order of `paths`.
+            Captures that failed have :attr:`SessionStats.error` set
+    """
+    results = [None] * len(paths)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(analyze_capture, path, tcp_port, udp_port): i
+            for i, path in enumerate(paths)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                log.error('Failed to analyze %s: %s', paths[index], e)
+                stats = results[index] = SessionStats(paths[index])
+                stats.error = str(e) or type(e).__name__
+    return results
+
+
+def total(results):
+    """
+    Returns:
+        :class:`SessionStats`: All results merged
+    """
+    merged = SessionStats()
+    for stats in results:
+        merged = merged.merge(stats)
+    return merged
+
+
+def format_table(results, totals=True):
+    rows = [stats.row() for stats in results]
+    if totals and len(results) > 1:
+        rows.append(total(results).row())
+
+    lines = [' '.join(name.rjust(width) if i else name.ljust(width)
+                      for i, (name, width, _) in enumerate(COLUMNS))]
+    for row in rows:
+        cells = []
+        for i, (name, width, fmt) in enumerate(COLUMNS):
+            value = row[name]
+            text = '-' if isinstance(value, float) and math.isnan(value) \
+                else fmt % value
+            cells.append(text.rjust(width) if i else text[:width].ljust(width))
+        lines.append(' '.join(cells).rstrip())
+    return '\n'.join(lines)
@@ -0,0 +1,169 @@
+"""
+Packer backends
+
+`construct` is the reference implementation (:mod:`xbox.nano.packer`),
+`fast` the hand-written one (:mod:`xbox.nano.xpacker`).
+`verify` uses the fast path and cross-checks a sampled fraction of
+messages against the reference implementation.
+"""
+import struct
+import random
+import logging
+from enum import Enum
+from datetime import datetime
+
+from xbox.sg.utils.struct import XStructObj
+from xbox.nano import packer, xpacker
+
+log = logging.getLogger(__name__)
+
+EPOCH = datetime.utcfromtimestamp(0)
+
+
+class PackerBackend(object):
+    Construct = 'construct'
+    Fast = 'fast'
+    Verify = 'verify'
+
+
+class VerifyingPacker(object):
+    """
+    Packer decoding / encoding with `fast`, sampled messages are
+    additionally processed by `reference` and differences get logged.
+
+    If the fast path fails or disagrees on a sampled message,
+    the reference result is returned.
+    """
+    def __init__(self, fast=xpacker, reference=packer, sample_rate=0.01,
+                 seed=None):
+        self.fast = fast
+        self.reference = reference
+        self.sample_rate = sample_rate
+        self._random = random.Random(seed)
+
+        self.verified = 0
+        self.mismatches = 0
+        self.errors = 0
+
+    def _sample(self):
+        return self._random.random() < self.sample_rate
+
+    def unpack_tcp(self, buf, channels=None):
+        for msg in xpacker.split_tcp(buf):
+            yield self.unpack(msg, channels)
+
+    def pack_tcp(self, msgs, channels=None):
+        return b''.join(
+            struct.pack('<I', len(data)) + data
+            for data in (self.pack(msg, channels) for msg in msgs)
+        )
+
+    def unpack(self, buf, channels=None):
+        if not self._sample():
+            return self.fast.unpack(buf, channels)
+
+        expected = self.reference.unpack(buf, channels)
+        try:
+            msg = self.fast.unpack(buf, channels)
+            # Normalizing decodes lazy payloads as well
+            actual = normalize(msg)
+        except Exception:
+            self.errors += 1
+            log.exception('Fast unpack failed, buffer: %s', bytes(buf).hex())
+            return expected
+
+        self.verified += 1
+        differences = list(diff(normalize(expected), actual))
+        if differences:
+            self.mismatches += 1
+            log.warning(
+                'Fast unpack mismatch: %s, buffer: %s',
+                ', '.join(differences), bytes(buf).hex()
+            )
+            return expected
+
+        return msg
+
+    def pack(self, msg, channels=None):
+        if not self._sample():
+            return self.fast.pack(msg, channels)
+
+        expected = self.reference.pack(msg, channels)
+        try:
+            data = self.fast.pack(msg, channels)
+        except Exception:
+            self.errors += 1
+            log.exception('Fast pack failed, expected: %s', expected.hex())
+            return expected
+
+        self.verified += 1
+        if data != expected:
+            self.mismatches += 1
+            log.warning(
+                'Fast pack mismatch: %s != %s', data.hex(), expected.hex()
+            )
+            return expected
+
+        return data
+
+
+def get_packer(backend=PackerBackend.Construct, sample_rate=0.01):
+    """
+    Get packer for backend name
+
+    Args:
+        backend (str): Member of :class:`PackerBackend`
+        sample_rate (float): Fraction of messages to verify in `verify` mode
+
+    Returns:
+        object: Object / module providing `unpack`, `unpack_tcp`,
+            `pack` and `pack_tcp`
+    """
+    if backend == PackerBackend.Construct:
+        return packer
+    elif backend == PackerBackend.Fast:
+        return xpacker
+    elif backend == PackerBackend.Verify:
+        return VerifyingPacker(sample_rate=sample_rate)
+
+    raise ValueError('Unknown packer backend: %s' % backend)
+
+
+def normalize(obj):
+    """
+    Convert parsed message to plain python types for comparison
+
+    Private (`_` prefixed) and unset (None) fields are dropped.
+    """
+    if isinstance(obj, XStructObj):
+        return normalize(obj.container)
+    elif isinstance(obj, dict):
+        return {k: normalize(v) for k, v in obj.items()
+                if not k.startswith('_') and v is not None}
+    elif isinstance(obj, (list, tuple)):
+        return [normalize(v) for v in obj]
+    elif isinstance(obj, Enum):
+        return obj.value
+    elif isinstance(obj, datetime):
+        return int((obj - EPOCH).total_seconds() * 1000.0)
+    return obj
+
+
+def diff(expected, actual, path='msg'):
+    """
+    Yields paths which differ between two normalized messages
+    """
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in expected.keys() | actual.keys():
+            if key not in actual or key not in expected:
+                yield '%s.%s missing' % (path, key)
+            else:
+                yield from diff(
+                    expected[key], actual[key], '%s.%s' % (path, key)
+                )
+    elif isinstance(expected, list) and isinstance(actual, list) and \
+            len(expected) == len(actual):
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            yield from diff(e, a, '%s[%i]' % (path, i))
+    elif expected != actual:
+        yield '%s: %r != %r' % (path, expected, actual)
@@ -0,0 +1,498 @@
+"""
+Capture reading
+
+Reads pcap and pcapng files through :mod:`mmap`, parses link, IP and
+transport headers with precompiled structs and reassembles the TCP byte
+stream per direction, so control messages split across (or sharing)
+segments come out whole.
+
+Example:
+    >>> for packet in read_session('session.pcapng', tcp_port, udp_port):
+    ...     print(packet.timestamp, packet.transport, len(packet.data))
+"""
+import mmap
+import struct
+import logging
+from typing import NamedTuple
+
+log = logging.getLogger(__name__)
+
+
+class CaptureError(Exception):
+    pass
+
+
+class Transport(object):
+    TCP = 'tcp'
+    UDP = 'udp'
+
+
+class RawPacket(NamedTuple):
+    # Capture timestamp in seconds
+    timestamp: float
+    linktype: int
+    data: memoryview
+
+
+class CapturedPacket(NamedTuple):
+    # Capture timestamp in seconds
+    timestamp: float
+    transport: str
+    from_client: bool
+    # UDP: Datagram, TCP: Single length-prefixed message
+    data: bytes
+
+
+class LinkType(object):
+    Null = 0
+    Ethernet = 1
+    RawIP = 101
+    LinuxSLL = 113
+    IPv4 = 228
+    IPv6 = 229
+    LinuxSLL2 = 276
+
+
+PCAP_MAGIC_US = 0xA1B2C3D4
+PCAP_MAGIC_NS = 0xA1B23C4D
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+
+PCAPNG_IDB = 0x00000001
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+PCAPNG_OPT_TSRESOL = 9
+
+ETH_TYPE_IPV4 = 0x0800
+ETH_TYPE_IPV6 = 0x86DD
+ETH_TYPE_VLAN = (0x8100, 0x88A8)
+
+IP_PROTO_TCP = 6
+IP_PROTO_UDP = 17
+
+TCP_SYN = 0x02
+
+# Layer 2
+ETHERNET = struct.Struct('!12xH')
+VLAN = struct.Struct('!2xH')
+SLL = struct.Struct('!14xH')
+SLL2 = struct.Struct('!H')
+# Layer 3 / 4
+IPV4 = struct.Struct('!BxH5xB2x4s4s')
+IPV6 = struct.Struct('!4xHBx16s16s')
+TCP = struct.Struct('!HHI4xB')
+UDP = struct.Struct('!HH')
+U32 = struct.Struct('<I')
+
+SEQ_MOD = 1 << 32
+
+# Larger length prefixes mean the TCP framing is lost
+MAX_MESSAGE_SIZE = 1 << 20
+
+
+def _pcap_packets(buf, byteorder, resolution):
+    header = struct.Struct(byteorder + 'IIII')
+    linktype = struct.unpack_from(byteorder + 'I', buf, 20)[0] & 0xFFFF
+    unpack_from = header.unpack_from
+    size = len(buf)
+    view = memoryview(buf)
+
+    offset = 24
+    while offset + 16 <= size:
+        sec, frac, caplen, _ = unpack_from(buf, offset)
+        offset += 16
+        if offset + caplen > size:
+            log.warning('Truncated pcap record at offset %d', offset - 16)
+            return
+        yield RawPacket(sec + frac * resolution, linktype,
+                        view[offset:offset + caplen])
+        offset += caplen
+
+
+def _pcapng_interface(interfaces, interface, offset):
+    """
+    Returns:
+        tuple: Linktype and timestamp resolution of a described interface
+    """
+    if interface >= len(interfaces):
+        raise CaptureError(
+            'Packet block at offset %d references unknown interface %d' % (
+                offset, interface
+            )
+        )
+    return interfaces[interface]
+
+
+def _pcapng_tsresol(buf, byteorder, offset, end):
+    option = struct.Struct(byteorder + 'HH')
+    while offset + 4 <= end:
+        code, length = option.unpack_from(buf, offset)
+        if code == 0:
+            break
+        if code == PCAPNG_OPT_TSRESOL and length >= 1:
+            value = buf[offset + 4]
+            if value & 0x80:
+                return 2.0 ** -(value & 0x7F)
+            return 10.0 ** -value
+        offset += 4 + ((length + 3) & ~3)
+    return 1e-6
+
+
+def _pcapng_packets(buf):
+    size = len(buf)
+    view = memoryview(buf)
+    interfaces = []
+    byteorder = '<'
+    block = struct.Struct('<II')
+    epb = struct.Struct('<IIII')
+
+    offset = 0
+    while offset + 12 <= size:
+        block_type = struct.unpack_from('<I', buf, offset)[0]
+        if block_type == PCAPNG_SHB:
+            magic = struct.unpack_from('<I', buf, offset + 8)[0]
+            byteorder = '<' if magic == PCAPNG_BYTE_ORDER else '>'
+            block = struct.Struct(byteorder + 'II')
+            epb = struct.Struct(byteorder + 'IIII')
+            # Interface ids are per section
+            interfaces = []
+
+        block_type, length = block.unpack_from(buf, offset)
+        if length < 12 or offset + length > size:
+            log.warning('Truncated pcapng block at offset %d', offset)
+            return
+        body = offset + 8
+
+        if block_type == PCAPNG_EPB:
+            interface, ts_high, ts_low, caplen = epb.unpack_from(buf, body)
+            linktype, resolution = _pcapng_interface(
+                interfaces, interface, offset
+            )
+            data = body + 20
+            yield RawPacket(((ts_high << 32) | ts_low) * resolution, linktype,
+                            view[data:data + caplen])
+        elif block_type == PCAPNG_SPB:
+            linktype, _ = _pcapng_interface(interfaces, 0, offset)
+            caplen = min(struct.unpack_from(byteorder + 'I', buf, body)[0],
+                         length - 16)
+            data = body + 4
+            # No timestamp in simple packet blocks
+            yield RawPacket(0.0, linktype, view[data:data + caplen])
+        elif block_type == PCAPNG_IDB:
+            linktype = struct.unpack_from(byteorder + 'H', buf, body)[0]
+            resolution = _pcapng_tsresol(
+                buf, byteorder, body + 8, offset + length - 4
+            )
+            interfaces.append((linktype, resolution))
+
+        offset += length
+
+
+def read_packets(buf):
+    """
+    Iterate link layer frames of a pcap or pcapng capture
+
+    Args:
+        buf: Buffer of the whole capture, e.g. :class:`mmap.mmap`
+
+    Yields:
+        :class:`RawPacket`: Frames, data is a view into `buf`
+    """
+    if len(buf) < 24:
+        raise CaptureError('Capture too short')
+
+    magic = U32.unpack_from(buf, 0)[0]
+    if magic == PCAPNG_SHB:
+        return _pcapng_packets(buf)
+
+    for byteorder in ('<', '>'):
+        magic = struct.unpack_from(byteorder + 'I', buf, 0)[0]
+        if magic == PCAP_MAGIC_US:
+            return _pcap_packets(buf, byteorder, 1e-6)
+        elif magic == PCAP_MAGIC_NS:
+            return _pcap_packets(buf, byteorder, 1e-9)
+
+    raise CaptureError('Unknown capture format, magic: 0x%08x' % magic)
+
+
+def ip_packet(linktype, frame):
+    """
+    Strip link layer
+
+    Returns:
+        tuple: (ethertype, offset of IP header) or None
+    """
+    if linktype == LinkType.Ethernet:
+        ethertype = ETHERNET.unpack_from(frame)[0]
+        offset = 14
+        while ethertype in ETH_TYPE_VLAN:
+            ethertype = VLAN.unpack_from(frame, offset)[0]
+            offset += 4
+        return ethertype, offset
+    elif linktype in (LinkType.RawIP, LinkType.IPv4, LinkType.IPv6):
+        version = frame[0] >> 4
+        return ETH_TYPE_IPV4 if version == 4 else ETH_TYPE_IPV6, 0
+    elif linktype == LinkType.LinuxSLL:
+        return SLL.unpack_from(frame)[0], 16
+    elif linktype == LinkType.LinuxSLL2:
+        return SLL2.unpack_from(frame)[0], 20
+    elif linktype == LinkType.Null:
+        family = U32.unpack_from(frame)[0]
+        if family > 0xFFFF:
+            # Written on a big endian host
+            family = struct.unpack_from('>I', frame)[0]
+        return ETH_TYPE_IPV4 if family == 2 else ETH_TYPE_IPV6, 4
+    return None
+
+
+def transport_packet(linktype, frame):
+    """
+    Parse link, IP and transport headers
+
+    Returns:
+        tuple: (protocol, src, sport, dst, dport, seq, syn, payload)
+            or None for anything but TCP / UDP over IP. seq and syn are
+            None for UDP.
+    """
+    try:
+        l3 = ip_packet(linktype, frame)
+        if not l3:
+            return None
+        ethertype, offset = l3
+
+        if ethertype == ETH_TYPE_IPV4:
+            ver_ihl, total, proto, src, dst = IPV4.unpack_from(frame, offset)
+            end = offset + total if total else len(frame)
+            offset += (ver_ihl & 0x0F) * 4
+        elif ethertype == ETH_TYPE_IPV6:
+            length, proto, src, dst = IPV6.unpack_from(frame, offset)
+            offset += 40
+            end = offset + length
+        else:
+            return None
+
+        if proto == IP_PROTO_UDP:
+            sport, dport = UDP.unpack_from(frame, offset)
+            return (proto, src, sport, dst, dport, None, None,
+                    frame[offset + 8:end])
+        elif proto == IP_PROTO_TCP:
+            sport, dport, seq, data_offset = TCP.unpack_from(frame, offset)
+            flags = frame[offset + 13]
+            return (proto, src, sport, dst, dport, seq, bool(flags & TCP_SYN),
+                    frame[offset + (data_offset >> 4) * 4:end])
+    except (struct.error, IndexError):
+        # Truncated by snaplen
+        pass
+    return None
+
+
+class TcpStream(object):
+    """
+    Reassembles one direction of a TCP connection and splits it into
+    length-prefixed nano messages.
+
+    After a missing segment, or in a capture starting mid-stream, data
+    is skipped byte by byte until a plausible length prefix (at most
+    `max_message_size`) is found.
+
+    Args:
+        max_pending (int): Out of order segments held back before
+            giving up on a missing segment (not captured) and
+            resynchronizing
+        max_message_size (int): Largest accepted message
+    """
+    def __init__(self, max_pending=256, max_message_size=MAX_MESSAGE_SIZE):
+        self.max_pending = max_pending
+        self.max_message_size = max_message_size
+        self.next_seq = None
+        self.gaps = 0
+        # Bytes skipped looking for a length prefix
+        self.skipped = 0
+        self._skipping = False
+        self._buffer = bytearray()
+        self._pending = {}
+
+    def feed(self, seq, syn, payload):
+        """
+        Add segment
+
+        Yields:
+            bytes: Complete messages, including length prefix
+        """
+        if syn:
+            self.next_seq = (seq + 1) % SEQ_MOD
+            self._pending.clear()
+            self._buffer.clear()
+        if not payload:
+            return
+
+        if self.next_seq is None:
+            self.next_seq = seq
+        if syn:
+            seq = (seq + 1) % SEQ_MOD
+
+        delta = (seq - self.next_seq) % SEQ_MOD
+        if delta >= SEQ_MOD // 2:
+            # Retransmission, possibly overlapping new data
+            overlap = SEQ_MOD - delta
+            if overlap >= len(payload):
+                return
+            payload = payload[overlap:]
+            delta = 0
+
+        if delta:
+            if seq not in self._pending:
+                self._pending[seq] = bytes(payload)
+            if len(self._pending) > self.max_pending:
+                self._resync()
+            else:
+                return
+        else:
+            self._append(payload)
+
+        while self.next_seq in self._pending:
+            self._append(self._pending.pop(self.next_seq))
+
+        yield from self._messages()
+
+    def _append(self, payload):
+        self._buffer += payload
+        self.next_seq = (self.next_seq + len(payload)) % SEQ_MOD
+
+    def _resync(self):
+        self.gaps += 1
+        log.warning('TCP segment missing from capture, resynchronizing')
+        # Framing is lost, drop partial message
+        self._buffer.clear()
+        self.next_seq = min(
+            self._pending, key=lambda s: (s - self.next_seq) % SEQ_MOD
+        )
+
+    def _messages(self):
+        buf = self._buffer
+        offset = 0
+        while len(buf) - offset >= 4:
+            size = U32.unpack_from(buf, offset)[0]
+            if size > self.max_message_size:
+                if not self._skipping:
+                    log.warning('Implausible TCP message size %d, skipping '
+                                'to the next message', size)
+                    self._skipping = True
+                self.skipped += 1
+                offset += 1
+                continue
+
+            end = offset + 4 + size
+            if end > len(buf):
+                break
+            self._skipping = False
+            yield bytes(buf[offset:end])
+            offset = end
+        if offset:
+            del buf[:offset]
+
+
+class CaptureReader(object):
+    """
+    Memory-mapped capture file
+
+    Example:
+        >>> with CaptureReader('session.pcap') as reader:
+        ...     for packet in reader.session(tcp_port, udp_port):
+        ...         ...
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        except ValueError:
+            # Empty file
+            self._file.close()
+            raise CaptureError('Capture is empty: %s' % path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Views still referenced, unmapped once collected
+            pass
+        self._file.close()
+
+    def packets(self):
+        """
+        Yields:
+            :class:`RawPacket`: Link layer frames
+        """
+        return read_packets(self._mmap)
+
+    def session(self, tcp_port, udp_port):
+        """
+        Packets of a nano session, TCP reassembled into messages
+
+        Args:
+            tcp_port (int): Console TCP port
+            udp_port (int): Console UDP port
+
+        Yields:
+            :class:`CapturedPacket`: Packets in capture order
+        """
+        streams = {}
+        for ts, linktype, frame in self.packets():
+            parsed = transport_packet(linktype, frame)
+            if not parsed:
+                continue
+            proto, src, sport, dst, dport, seq, syn, payload = parsed
+
+            if proto == IP_PROTO_UDP:
+                if udp_port not in (sport, dport) or not payload:
+                    continue
+                yield CapturedPacket(
+                    ts, Transport.UDP, dport == udp_port, bytes(payload)
+                )
+            elif tcp_port in (sport, dport):
+                key = (src, sport, dst, dport)
+                stream = streams.get(key)
+                if stream is None:
+                    stream = streams[key] = TcpStream()
+                from_client = dport == tcp_port
+                for msg in stream.feed(seq, syn, payload):
+                    yield CapturedPacket(ts, Transport.TCP, from_client, msg)
+
+
+def read_session(path, tcp_port, udp_port):
+    """
+    Read nano session packets from pcap / pcapng file
+
+    Yields:
+        :class:`CapturedPacket`: See :meth:`CaptureReader.session`
+    """
+    with CaptureReader(path) as reader:
+        yield from reader.session(tcp_port, udp_port)
+
+
+def read_messages(path, tcp_port, udp_port, packer, channels=None):
+    """
+    Read and decode nano session messages
+
+    Args:
+        packer: Packer module or :class:`.VerifyingPacker`
+        channels (dict): Channel map for streamer payloads
+
+    Yields:
+        tuple: (:class:`CapturedPacket`, message)
+    """
+    for packet in read_session(path, tcp_port, udp_port):
+        data = packet.data
+        if packet.transport == Transport.TCP:
+            # Strip length prefix
+            data = data[4:]
+        yield packet, packer.unpack(data, channels)
@@ -1,13 +1,15 @@
 import time
 import random
 import logging
-from collections import deque
 from datetime import datetime
 
-from xbox.nano import factory
+from xbox.nano import factory, xpacker, h264
+from xbox.nano.stats import SequenceTracker, VideoStats
+from xbox.nano.trace import Stage
 from xbox.nano.packet import audio
 from xbox.nano.enum import ChannelClass, VideoPayloadType, AudioPayloadType, \
-    InputPayloadType, ControlPayloadType, ControllerEvent, VideoQuality
+    InputPayloadType, ControlPayloadType, ControllerEvent, VideoQuality, \
+    AudioCodec
 
 log = logging.getLogger(__name__)
 
@@ -26,11 +28,18 @@ class Channel(object):
         self._frame_id = 0
         self._ref_timestamp = None
 
+        # Incoming (UDP) RTP sequence numbers
+        self.sequence_tracker = SequenceTracker()
+
     def __repr__(self):
         return '<{:s} id={:d} class={:s} flags=0x{:08x} opened={:}>'.format(
             self.__class__.__name__, self.id, self.name, self.flags, self.open
         )
 
+    @property
+    def tracer(self):
+        return self.protocol.tracer if self.protocol else None
+
     @property
     def sequence_num(self):
         return self._sequence_num
@@ -89,6 +98,32 @@ class Channel(object):
 
         self.protocol.streamer_protocol.send_message(msg)
 
+    def sender_timestamp(self, msg):
+        """
+        Sender timestamp of message in seconds, used for jitter calculation.
+
+        Returns:
+            float: Timestamp or None if the message carries none
+        """
+        return None
+
+    def track(self, msg, arrival=None):
+        """
+        Account incoming datagram in sequence statistics
+        """
+        if arrival is None:
+            arrival = getattr(msg, '_incoming_ts', None) or time.time()
+        self.sequence_tracker.update(
+            msg.header.sequence_num, arrival, self.sender_timestamp(msg)
+        )
+
+    def stats(self):
+        """
+        Returns:
+            :class:`.SequenceStats`: Incoming sequence statistics
+        """
+        return self.sequence_tracker.snapshot()
+
     def on_message(self, msg):
         raise NotImplementedError()
 
@@ -100,11 +135,27 @@ class Channel(object):
 
 
 class VideoChannel(Channel):
+    # Minimum seconds between keyframe requests
+    KEYFRAME_REQUEST_INTERVAL = 1.0
+
     def __init__(self, *args, **kwargs):
         super(VideoChannel, self).__init__(*args, **kwargs)
         self._frame_buf = {}
         self._frame_expiry_time = 3.0
-        self._render_queue = deque()
+
+        self.frames_completed = 0
+        self.frames_expired = 0
+
+        # Latest parameter sets, without start code
+        self.sps = None
+        self.pps = None
+        self.keyframes = 0
+        self.keyframe_requests = 0
+        self._last_keyframe_id = None
+        self._frames_since_keyframe = None
+        # Frames from first to latest keyframe
+        self._keyframe_span = 0
+        self._last_keyframe_request = None
 
     def on_message(self, msg):
         if VideoPayloadType.Data == msg.header.streamer.type:
@@ -114,6 +165,11 @@ class VideoChannel(Channel):
         else:
             log.warning("Unknown message received on VideoChannel", extra={'_msg': msg})
 
+    def sender_timestamp(self, msg):
+        if VideoPayloadType.Data == msg.header.streamer.type:
+            # Microseconds
+            return msg.payload.timestamp / 1000000.0
+
     def on_open(self, flags):
         self.protocol.channel_open(flags, self.id)
 
@@ -138,20 +194,27 @@ class VideoChannel(Channel):
         self.control()
 
     def on_data(self, msg):
-        flags = msg.payload.flags
         frame_id = msg.payload.frame_id
-        timestamp = msg.payload.timestamp
         packet_count = msg.payload.packet_count
 
+        tracer = self.tracer
+        if tracer:
+            arrival = getattr(msg, '_incoming_ns', None)
+
         if packet_count == 1:
-            self._render_queue.append((
-                frame_id, flags, timestamp, msg.payload.data
-            ))
+            if tracer:
+                tracer.stamp(frame_id, Stage.FirstFragment, arrival)
+                tracer.stamp(frame_id, Stage.LastFragment, arrival)
+            self._render_frame(
+                frame_id, msg.payload.data, msg.payload.timestamp
+            )
         else:
             if frame_id not in self._frame_buf:
                 # msg list, current count, packet count
                 frame_buf = [[msg], 1, packet_count, time.time()]
                 self._frame_buf[frame_id] = frame_buf
+                if tracer:
+                    tracer.stamp(frame_id, Stage.FirstFragment, arrival)
             else:
                 frame_buf = self._frame_buf[frame_id]
                 frame_buf[0].append(msg)
@@ -159,16 +222,101 @@ class VideoChannel(Channel):
 
             # current count == packet count
             if frame_buf[1] == frame_buf[2]:
+                if tracer:
+                    tracer.stamp(frame_id, Stage.LastFragment, arrival)
                 data_buf = frame_buf[0]
                 data_buf.sort(key=lambda x: x.payload.offset)
                 frame = b''.join([packet.payload.data for packet in data_buf])
 
-                self.client.render_video(frame)
                 del self._frame_buf[frame_id]
+                self._render_frame(
+                    frame_id, frame, data_buf[0].payload.timestamp
+                )
 
         # Discard frames older than self._frame_expiry_time
-        self._frame_buf = {k: v for (k, v) in self._frame_buf.items()
-                           if (time.time() - v[3]) < self._frame_expiry_time}
+        now = time.time()
+        expired = [k for (k, v) in self._frame_buf.items()
+                   if (now - v[3]) >= self._frame_expiry_time]
+        for frame_id in expired:
+            del self._frame_buf[frame_id]
+            if tracer:
+                tracer.discard(frame_id)
+        self.frames_expired += len(expired)
+
+        # Decoding is broken until the next IDR frame, unless one already
+        # arrived after the lost frame
+        if expired and (self._last_keyframe_id is None or
+                        max(expired) > self._last_keyframe_id):
+            self.request_keyframe(now)
+
+    def _scan_frame(self, frame_id, data):
+        info = h264.scan_frame(data)
+        if info.sps:
+            self.sps = info.sps
+        if info.pps:
+            self.pps = info.pps
+
+        if self._frames_since_keyframe is not None:
+            self._frames_since_keyframe += 1
+        if info.keyframe:
+            if self.keyframes:
+                self._keyframe_span += self._frames_since_keyframe
+            self.keyframes += 1
+            self._last_keyframe_id = frame_id
+            self._frames_since_keyframe = 0
+
+    def _render_frame(self, frame_id, data, timestamp=None):
+        self.frames_completed += 1
+        self._scan_frame(frame_id, data)
+
+        tracer = self.tracer
+        if not tracer:
+            self.client.render_video(data, timestamp, frame_id)
+            return
+
+        tracer.begin(frame_id)
+        try:
+            self.client.render_video(data, timestamp, frame_id)
+        finally:
+            tracer.finish(frame_id)
+
+    def video_stats(self):
+        """
+        Returns:
+            :class:`.VideoStats`: Frame and keyframe statistics
+        """
+        interval = None
+        if self.keyframes > 1:
+            interval = self._keyframe_span / (self.keyframes - 1)
+        return VideoStats(
+            self.frames_completed, self.frames_expired, self.keyframes,
+            self.keyframe_requests, self._frames_since_keyframe, interval
+        )
+
+    def request_keyframe(self, now=None):
+        """
+        Ask the console for an IDR frame, at most once per
+        :attr:`KEYFRAME_REQUEST_INTERVAL`
+
+        Returns:
+            bool: Whether a request was sent
+        """
+        now = now or time.time()
+        if self._last_keyframe_request is not None and \
+                now - self._last_keyframe_request < \
+                self.KEYFRAME_REQUEST_INTERVAL:
+            return False
+        if not self.open:
+            return False
+
+        self._last_keyframe_request = now
+        self.keyframe_requests += 1
+        log.debug("VideoChannel requesting keyframe")
+        self.send_tcp_streamer(
+            VideoPayloadType.Control,
+            factory.video.control(request_keyframe=True)
+        )
+        return True
 
     def control(self, start_stream=True):
         # TODO
@@ -176,6 +324,7 @@ class VideoChannel(Channel):
             payload = factory.video.control(
                 request_keyframe=True, start_stream=True
             )
+            self._last_keyframe_request = time.time()
         else:
             payload = factory.video.control(stop_stream=True)
 
@@ -191,6 +340,11 @@ class AudioChannel(Channel):
         else:
             log.warning("Unknown message received on AudioChannel", extra={'_msg': msg})
 
+    def sender_timestamp(self, msg):
+        if AudioPayloadType.Data == msg.header.streamer.type:
+            # Microseconds
+            return msg.payload.timestamp / 1000000.0
+
     def on_open(self, flags):
         self.protocol.channel_open(flags, self.id)
 
@@ -214,7 +368,10 @@ class AudioChannel(Channel):
 
     def on_data(self, msg):
         # print('AudioChannel:on_data ', msg)
-        self.client.render_audio(msg.payload.data)
+        payload = msg.payload
+        self.client.render_audio(
+            payload.data, payload.timestamp, payload.frame_id
+        )
 
     def control(self):
         payload = factory.audio.control(
@@ -228,7 +385,13 @@ class ChatAudioChannel(Channel):
     This one is special
     1. Client sends ServerHandshake initially
     2. Host responds with ClientHandshake
+    3. Host sends Control with start_stream, client starts sending frames
     """
+    def __init__(self, *args, **kwargs):
+        super(ChatAudioChannel, self).__init__(*args, **kwargs)
+        self._audio_fmt = None
+        self._uplink = None
+
     def on_message(self, msg):
         if AudioPayloadType.ClientHandshake == msg.header.streamer.type:
             self.on_client_handshake(msg)
@@ -240,17 +403,35 @@ class ChatAudioChannel(Channel):
 
     def on_open(self, flags):
         self.protocol.channel_open(flags, self.id)
+        if self.client.chat_audio:
+            self.server_handshake()
 
     def on_close(self, flags):
+        self.stop_stream()
         self.client.close()
 
+    def get_audio_timestamp_now(self):
+        """
+        Microseconds since reference timestamp
+        """
+        delta = (datetime.utcnow() - self.reference_timestamp)
+        return int(delta.total_seconds() * 1000000)
+
     def on_client_handshake(self, msg):
         log.debug("ChatAudioChannel client handshake", extra={'_msg': msg})
-        raise NotImplementedError("We should configure audio input parameters / encoder here")
+        self.frame_id = msg.payload.initial_frame_id
+        self._audio_fmt = msg.payload.requested_format
+
+        if self._audio_fmt.codec != AudioCodec.Opus:
+            log.error("ChatAudioChannel: Unsupported codec requested: %s",
+                      self._audio_fmt.codec)
+            self._audio_fmt = None
 
     def server_handshake(self):
         # 1 Channel, Samplerate: 24000, Codec: Opus
-        formats = [audio.fmt(1, 24000, 0)]
+        formats = [audio.fmt(
+            channels=1, sample_rate=24000, codec=AudioCodec.Opus
+        ).container]
         payload = factory.audio.server_handshake(
             protocol_version=4,
             reference_timestamp=self.generate_reference_timestamp(),
@@ -259,17 +440,55 @@ class ChatAudioChannel(Channel):
         self.send_tcp_streamer(AudioPayloadType.ServerHandshake, payload)
 
     def on_control(self, msg):
-        raise NotImplementedError("We should start streaming ChatAudio frames here")
+        flags = msg.payload.flags
+        if flags.stop_stream:
+            self.stop_stream()
+        elif flags.start_stream or flags.reinitialize:
+            self.stop_stream()
+            self.start_stream()
+
+    def start_stream(self):
+        if not self._audio_fmt or not self.client.chat_audio:
+            log.warning("ChatAudioChannel: Cannot start stream, "
+                        "no format negotiated or no audio source")
+            return
+
+        # Pulls in the audio encoder, only needed once chat audio streams
+        from xbox.nano.render.audio.chat import ChatAudioUplink
+        self._uplink = ChatAudioUplink(
+            self, self.client.chat_audio, self._audio_fmt
+        )
+        self._uplink.start()
+
+    def stop_stream(self):
+        if self._uplink:
+            self._uplink.stop()
+            self._uplink = None
+
+    def data(self, data, timestamp=None):
+        if timestamp is None:
+            timestamp = self.get_audio_timestamp_now()
 
-    def data(self, data):
-        ts = int(time.time())
         payload = factory.audio.data(
-            flags=4, frame_id=0, timestamp=ts, data=data
+            flags=4, frame_id=self.next_frame_id, timestamp=timestamp,
+            data=data
         )
         self.send_udp_streamer(AudioPayloadType.Data, payload)
 
 
 class InputChannel(Channel):
+    def __init__(self, *args, **kwargs):
+        super(InputChannel, self).__init__(*args, **kwargs)
+        self._frame_encoder = xpacker.InputFrameEncoder()
+        self._ref_time = None
+        self.frames_sent = 0
+
+    @Channel.reference_timestamp.setter
+    def reference_timestamp(self, val):
+        Channel.reference_timestamp.fset(self, val)
+        # Reference as unix time, saves datetime math per input frame
+        self._ref_time = (val - datetime.utcfromtimestamp(0)).total_seconds()
+
     def get_input_timestamp_from_dt(self, datetime_obj):
         """
         Nanoseconds (1/1000000)s
@@ -278,7 +497,7 @@ class InputChannel(Channel):
         return int(delta.total_seconds() * 100000)
 
     def get_input_timestamp_now(self):
-        return self.get_input_timestamp_from_dt(datetime.utcnow())
+        return int((time.time() - self._ref_time) * 100000)
 
     def on_message(self, msg):
         if InputPayloadType.ServerHandshake == msg.header.streamer.type:
@@ -310,13 +529,25 @@ class InputChannel(Channel):
         log.debug("Acked InputFrame: %s", msg.payload.acked_frame)
 
     def send_frame(self, input_frame, created_dt):
-        input_frame = input_frame(
-            frame_id=self.next_frame_id,
-            timestamp=self.get_input_timestamp_now(),
-            created_ts=self.get_input_timestamp_from_dt(created_dt)
+        """
+        Send input frame, packed directly into wire format
+
+        Args:
+            input_frame (:class:`InputFrameState`): Controller state
+            created_dt (datetime): Time the state was created
+
+        Returns:
+            None
+        """
+        data = self._frame_encoder.pack(
+            self.next_sequence_num, self.protocol.connection_id, self.id,
+            self.next_frame_id, self.get_input_timestamp_now(),
+            self.get_input_timestamp_from_dt(created_dt),
+            input_frame.buttons, input_frame.analog, input_frame.extension
         )
-        log.debug("Sending Input Frame msg: %s", input_frame)
-        self.send_udp_streamer(InputPayloadType.Frame, input_frame)
+        log.debug("Sending Input Frame: %s", input_frame)
+        self.frames_sent += 1
+        self.protocol.streamer_protocol.send_data(data)
 
 
 class InputFeedbackChannel(Channel):
@@ -0,0 +1,316 @@
+"""
+Columnar session export
+
+Writes one row per message of a captured session, see :data:`FIELDS`,
+for loading into pandas & co. Rows are collected in NumPy record batches
+and written as Parquet or Arrow IPC (requires pyarrow) or as a NumPy
+structured array (`.npy`, loadable with `numpy.load(mmap_mode='r')`).
+
+Example:
+    >>> packets = read_session('session.pcap', tcp_port, udp_port)
+    >>> export_session(packets, 'session.parquet')
+    >>> df = pandas.read_parquet('session.parquet')
+"""
+import logging
+
+from xbox.nano import xpacker
+from xbox.nano.capture import Transport
+from xbox.nano.channel import Channel
+from xbox.nano.enum import ChannelClass, RtpPayloadType, \
+    ChannelControlPayloadType, VideoPayloadType, AudioPayloadType, \
+    InputPayloadType
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet  # noqa: F401
+except ImportError:
+    pa = None
+
+log = logging.getLogger(__name__)
+
+
+class ExportError(Exception):
+    pass
+
+
+class ExportFormat(object):
+    Parquet = 'parquet'
+    Arrow = 'arrow'
+    Numpy = 'npy'
+
+
+EXTENSIONS = {
+    '.parquet': ExportFormat.Parquet,
+    '.arrow': ExportFormat.Arrow,
+    '.ipc': ExportFormat.Arrow,
+    '.feather': ExportFormat.Arrow,
+    '.npy': ExportFormat.Numpy
+}
+
+# Index stored in column `channel_class`, -1 for unknown channels
+CHANNEL_CLASSES = tuple(ChannelClass)
+
+# Column name, NumPy type. Integer columns use -1 where not applicable.
+FIELDS = (
+    # Capture timestamp in seconds
+    ('timestamp', 'f8'),
+    ('from_client', '?'),
+    ('tcp', '?'),
+    ('channel_id', 'u2'),
+    ('channel_class', 'i1'),
+    ('payload_type', 'u1'),
+    # Streamer payload type, (channel) control payload type
+    ('subtype', 'i2'),
+    # RTP sequence number
+    ('sequence_num', 'u2'),
+    # Message size
+    ('size', 'u4'),
+    # Media / input payloads
+    ('frame_id', 'i8'),
+    ('media_timestamp', 'i8'),
+    ('flags', 'i8'),
+    ('data_size', 'i8'),
+    # Video fragments
+    ('packet_count', 'i8'),
+    ('offset', 'i8'),
+    ('total_size', 'i8'),
+)
+
+STREAMER = RtpPayloadType.Streamer.value
+CONTROL = RtpPayloadType.Control.value
+CHANNEL_CONTROL = RtpPayloadType.ChannelControl.value
+
+# Channel class -> streamer payload types decoded for payload columns
+DECODED = {
+    ChannelClass.Video: (VideoPayloadType.Data.value,),
+    ChannelClass.Audio: (AudioPayloadType.Data.value,),
+    ChannelClass.ChatAudio: (AudioPayloadType.Data.value,),
+    ChannelClass.Input: (InputPayloadType.Frame.value,),
+    ChannelClass.InputFeedback: (InputPayloadType.Frame.value,),
+}
+
+_UNSET = (-1, -1, -1, -1, -1, -1, -1)
+
+
+def _require_numpy():
+    if np is None:
+        raise ExportError('Export requires numpy, install with [export]')
+
+
+def export_dtype():
+    _require_numpy()
+    return np.dtype(list(FIELDS))
+
+
+def message_rows(packets, channels=None):
+    """
+    Convert captured packets into export rows
+
+    Channels are learned from ChannelCreate messages. Only media and input
+    payloads are decoded, everything else is read from the headers.
+
+    Args:
+        packets: Iterable of :class:`CapturedPacket`
+        channels (dict): Initial channel map, optional
+
+    Yields:
+        tuple: Row values in order of :data:`FIELDS`
+    """
+    channels = dict(channels or {})
+    class_index = {name: i for i, name in enumerate(CHANNEL_CLASSES)}
+
+    for packet in packets:
+        tcp = packet.transport == Transport.TCP
+        messages = xpacker.split_tcp(packet.data) if tcp else (packet.data,)
+
+        for buf in messages:
+            try:
+                payload_type, channel_id, seq, subtype = \
+                    xpacker.peek_header(buf)
+            except xpacker.PackerError as e:
+                log.debug('Skipping message: %s', e)
+                continue
+
+            channel = channels.get(channel_id)
+            name = getattr(channel, 'name', None)
+            payload = _UNSET
+            try:
+                if payload_type == STREAMER:
+                    if subtype in DECODED.get(name, ()):
+                        payload = _payload_values(
+                            xpacker.unpack(buf, channels).payload
+                        )
+                elif payload_type in (CONTROL, CHANNEL_CONTROL):
+                    msg = xpacker.unpack(buf, channels)
+                    subtype = msg.payload.type.value
+                    if msg.payload.type == \
+                            ChannelControlPayloadType.ChannelCreate:
+                        channels[channel_id] = Channel(
+                            None, None, channel_id, msg.payload.name, 0
+                        )
+            except (xpacker.PackerError, ValueError, KeyError) as e:
+                log.debug('Failed to decode payload: %s', e)
+
+            yield (
+                packet.timestamp, packet.from_client, tcp, channel_id,
+                class_index.get(name, -1), payload_type,
+                -1 if subtype is None else subtype, seq, len(buf)
+            ) + payload
+
+
+def _payload_values(payload):
+    data = getattr(payload, 'data', None)
+    return (
+        payload.frame_id,
+        payload.timestamp,
+        getattr(payload, 'flags', -1),
+        -1 if data is None else len(data),
+        getattr(payload, 'packet_count', -1),
+        getattr(payload, 'offset', -1),
+        getattr(payload, 'total_size', -1),
+    )
+
+
+class _NumpyFile(object):
+    """
+    Appends record batches to a `.npy` file, the header is rewritten
+    with the final row count on close
+    """
+    def __init__(self, path, dtype):
+        self._file = open(path, 'wb')
+        self._dtype = dtype
+        self._count = 0
+        # Reserve room for the largest count
+        self._header_size = len(self._header(10 ** 19))
+        self._file.write(self._header(0, self._header_size))
+
+    def _header(self, count, size=None):
+        header = repr({
+            'descr': np.lib.format.dtype_to_descr(self._dtype),
+            'fortran_order': False,
+            'shape': (count,),
+        })
+        magic = np.lib.format.magic(1, 0)
+        if size is None:
+            # Keep data 64 byte aligned
+            size = len(magic) + 2 + len(header) + 1
+            size += -size % 64
+        header = header.ljust(size - len(magic) - 2 - 1) + '\n'
+        return magic + len(header).to_bytes(2, 'little') + \
+            header.encode('latin1')
+
+    def write(self, batch):
+        batch.tofile(self._file)
+        self._count += len(batch)
+
+    def close(self):
+        self._file.seek(0)
+        self._file.write(self._header(self._count, self._header_size))
+        self._file.close()
+
+
+class _ArrowFile(object):
+    def __init__(self, path, fmt):
+        self._schema = pa.schema(
+            [(name, pa.from_numpy_dtype(np.dtype(kind)))
+             for name, kind in FIELDS if name != 'channel_class'] +
+            [('channel', pa.dictionary(pa.int8(), pa.string()))]
+        )
+        self._names = pa.array([c.name for c in CHANNEL_CLASSES])
+        if fmt == ExportFormat.Parquet:
+            self._writer = pa.parquet.ParquetWriter(path, self._schema)
+        else:
+            self._writer = pa.ipc.new_file(path, self._schema)
+
+    def write(self, batch):
+        columns = [pa.array(batch[name]) for name, _ in FIELDS
+                   if name != 'channel_class']
+        # Unknown channels (-1) become null
+        codes = batch['channel_class']
+        columns.append(pa.DictionaryArray.from_arrays(
+            pa.array(codes, mask=codes < 0), self._names
+        ))
+        self._writer.write_table(
+            pa.Table.from_arrays(columns, schema=self._schema)
+        )
+
+    def close(self):
+        self._writer.close()
+
+
+class SessionExporter(object):
+    """
+    Batched writer for export rows
+
+    Args:
+        path (str): Output file
+        fmt (str): :class:`ExportFormat`, derived from the file extension
+            if omitted; Parquet if pyarrow is installed, NumPy otherwise
+        batch_size (int): Rows per written batch
+    """
+    def __init__(self, path, fmt=None, batch_size=65536):
+        _require_numpy()
+        fmt = fmt or default_format(path)
+        if fmt in (ExportFormat.Parquet, ExportFormat.Arrow) and pa is None:
+            raise ExportError('%s export requires pyarrow' % fmt)
+
+        self.format = fmt
+        self.rows = 0
+        self._dtype = export_dtype()
+        self._batch = np.empty(batch_size, dtype=self._dtype)
+        self._pending = 0
+
+        if fmt == ExportFormat.Numpy:
+            self._file = _NumpyFile(path, self._dtype)
+        elif fmt in (ExportFormat.Parquet, ExportFormat.Arrow):
+            self._file = _ArrowFile(path, fmt)
+        else:
+            raise ExportError('Unknown export format: %s' % fmt)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, row):
+        self._batch[self._pending] = row
+        self._pending += 1
+        if self._pending == len(self._batch):
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._file.write(self._batch[:self._pending])
+            self.rows += self._pending
+            self._pending = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+
+def default_format(path):
+    for extension, fmt in EXTENSIONS.items():
+        if path.endswith(extension):
+            return fmt
+    return ExportFormat.Parquet if pa is not None else ExportFormat.Numpy
+
+
+def export_session(packets, path, fmt=None, channels=None, batch_size=65536):
+    """
+    Export captured packets, one row per message
+
+    Returns:
+        int: Number of rows written
+    """
+    with SessionExporter(path, fmt, batch_size) as exporter:
+        for row in message_rows(packets, channels):
+            exporter.write(row)
+    return exporter.rows
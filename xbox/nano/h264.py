@@ -0,0 +1,236 @@
+"""
+H.264 Annex-B helpers
+
+Frames are classified by their leading NAL units only (parameter sets,
+SEI, first slice), which is enough as all slices of a picture share the
+IDR / non-IDR type. Whole recorded streams are split into access units
+with a vectorized start code search, see :func:`access_units`.
+"""
+import mmap
+from typing import NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+START_CODE = b'\x00\x00\x01'
+
+# Below this size bytes.find beats the vectorized search
+VECTORIZE_MIN = 8192
+
+# Bytes searched per step of the vectorized search
+SCAN_CHUNK = 1 << 20
+
+
+class NalUnitType(object):
+    Slice = 1
+    IDR = 5
+    SEI = 6
+    SPS = 7
+    PPS = 8
+    AccessUnitDelimiter = 9
+
+
+# Non-VCL units which open a new access unit after a picture
+# (ITU-T H.264 7.4.1.2.3)
+AU_PREFIX_TYPES = (6, 7, 8, 9, 14, 15, 16, 17, 18)
+
+
+class FrameInfo(NamedTuple):
+    keyframe: bool
+    # NAL unit types up to and including the first slice
+    nal_types: Tuple[int, ...]
+    # Without start code
+    sps: Optional[bytes]
+    pps: Optional[bytes]
+
+
+class AccessUnits(NamedTuple):
+    """
+    Access units of a stream, as arrays of equal length
+    """
+    offset: 'np.ndarray'
+    size: 'np.ndarray'
+    keyframe: 'np.ndarray'
+    # Carries SPS and PPS
+    parameter_sets: 'np.ndarray'
+
+
+def _is_vcl(nal_type):
+    return 1 <= nal_type <= 5
+
+
+def _header_offsets(data):
+    """
+    Offsets of all NAL headers (byte following a start code)
+    """
+    if np is not None and len(data) >= VECTORIZE_MIN:
+        return _vector_offsets(data, 0, len(data)).tolist()
+
+    offsets = []
+    find = data.find
+    offset = find(START_CODE)
+    while offset != -1:
+        offset += 3
+        if offset >= len(data):
+            break
+        offsets.append(offset)
+        offset = find(START_CODE, offset)
+    return offsets
+
+
+def _vector_offsets(data, start, end):
+    """
+    Vectorized start code search in `data[start:end]`, in chunks of
+    :data:`SCAN_CHUNK` to stay in cache
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    found = []
+    for chunk_start in range(start, end, SCAN_CHUNK):
+        # Overlap by the start code length
+        chunk = buf[chunk_start:min(chunk_start + SCAN_CHUNK + 2, end)]
+        # 0x01 is rare in slice data, check the preceding zeros only there
+        ones = np.flatnonzero(chunk[2:] == 1)
+        ones = ones[(chunk[ones] == 0) & (chunk[ones + 1] == 0)]
+        found.append(ones + chunk_start + 3)
+    offsets = np.concatenate(found) if found else np.empty(0, np.int64)
+    # NAL header must be inside the data
+    return offsets[offsets < end]
+
+
+def nal_units(data):
+    """
+    Scan Annex-B byte stream for NAL units
+
+    Args:
+        data (bytes): Annex-B stream (or start of it)
+
+    Yields:
+        tuple: (offset of NAL header, nal_unit_type)
+    """
+    for offset in _header_offsets(data):
+        yield offset, data[offset] & 0x1F
+
+
+def _leading_units(data):
+    """
+    NAL units up to the first slice, as (header offset, type, end)
+    """
+    find = data.find
+    offset = find(START_CODE)
+    while offset != -1 and offset + 3 < len(data):
+        header = offset + 3
+        nal_type = data[header] & 0x1F
+        if _is_vcl(nal_type):
+            yield header, nal_type, len(data)
+            return
+        offset = find(START_CODE, header)
+        yield header, nal_type, len(data) if offset == -1 else offset
+
+
+def scan_frame(data):
+    """
+    Classify a reassembled frame and extract its parameter sets
+
+    Args:
+        data (bytes): Annex-B access unit
+
+    Returns:
+        :class:`FrameInfo`: Frame info
+    """
+    if not isinstance(data, (bytes, bytearray)):
+        data = bytes(data)
+
+    types = []
+    sps = pps = None
+    for header, nal_type, end in _leading_units(data):
+        types.append(nal_type)
+        if nal_type == NalUnitType.SPS:
+            # Leading zero of a following 4 byte start code
+            sps = bytes(data[header:end]).rstrip(b'\x00')
+        elif nal_type == NalUnitType.PPS:
+            pps = bytes(data[header:end]).rstrip(b'\x00')
+
+    keyframe = bool(types) and types[-1] == NalUnitType.IDR
+    return FrameInfo(keyframe, tuple(types), sps, pps)
+
+
+def is_keyframe(data):
+    """
+    Whether data starts an IDR picture
+    """
+    return scan_frame(data).keyframe
+
+
+def parameter_sets(sps, pps):
+    """
+    SPS and PPS as Annex-B, to prepend to a frame lacking them
+    """
+    return b'\x00\x00\x00\x01' + sps + b'\x00\x00\x00\x01' + pps
+
+
+def access_units(data):
+    """
+    Split an Annex-B stream into access units
+
+    A new access unit starts with the first AUD / SEI / SPS / PPS after a
+    slice, or with a slice with `first_mb_in_slice` 0 directly following
+    another slice. Redundant pictures and field pairs are not considered.
+
+    Args:
+        data: Buffer (bytes, mmap), requires numpy
+
+    Returns:
+        :class:`AccessUnits`: Byte ranges and flags
+    """
+    if np is None:
+        raise ImportError('access_units requires numpy')
+
+    buf = np.frombuffer(data, dtype=np.uint8)
+    headers = _vector_offsets(data, 0, len(buf))
+    if not len(headers):
+        empty = np.empty(0, np.int64)
+        return AccessUnits(empty, empty, empty.astype(bool),
+                           empty.astype(bool))
+
+    types = buf[headers] & 0x1F
+    vcl = (types >= 1) & (types <= 5)
+    # first_mb_in_slice is ue(v), 0 is coded as a single 1 bit
+    following = buf[np.minimum(headers + 1, len(buf) - 1)]
+    first_mb = (following & 0x80) != 0
+
+    after_vcl = np.concatenate(([True], vcl[:-1]))
+    starts = after_vcl & (
+        np.isin(types, AU_PREFIX_TYPES) | (vcl & first_mb)
+    )
+    starts[0] = True
+    first_unit = np.flatnonzero(starts)
+
+    # Include the start code, 4 bytes if preceded by a zero byte
+    start_code = headers[first_unit] - 3
+    long_code = (start_code > 0) & \
+        (buf[np.maximum(start_code - 1, 0)] == 0)
+    offset = start_code - long_code
+    size = np.diff(np.append(offset, len(buf)))
+
+    keyframe = np.logical_or.reduceat(types == NalUnitType.IDR, first_unit)
+    has_sps = np.logical_or.reduceat(types == NalUnitType.SPS, first_unit)
+    has_pps = np.logical_or.reduceat(types == NalUnitType.PPS, first_unit)
+    return AccessUnits(offset, size, keyframe, has_sps & has_pps)
+
+
+def scan_file(path):
+    """
+    :func:`access_units` of a raw stream file, memory mapped
+    """
+    with open(path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return access_units(b'')
+    try:
+        return access_units(mapped)
+    finally:
+        mapped.close()
@@ -69,6 +69,7 @@ class NanoManager(Manager):
 
         self.client = None
         self._protocol = None
+        self._stream_config = DEFAULT_CONFIG
         self._connected = False
         self._current_state = GameStreamState.Unknown
 
@@ -81,6 +82,7 @@ class NanoManager(Manager):
         self._stream_previewstatus = None
 
     async def start_stream(self, config: dict = DEFAULT_CONFIG):
+        self._stream_config = config
         msg = json.BroadcastStartStream(
             type=BroadcastMessageType.StartGameStream,
             reQueryPreviewStatus=True,
@@ -99,12 +101,14 @@ class NanoManager(Manager):
         )
         await self._send_json(msg.dict())
 
-    async def start_gamestream(self, client):
+    async def start_gamestream(self, client, **kwargs):
         if not self.streaming:
             raise NanoManagerError('start_gamestream: Connection params not ready')
 
         self._protocol = NanoProtocol(
-            client, self.console.address, self.session_id, self.tcp_port, self.udp_port
+            client, self.console.address, self.session_id,
+            self.tcp_port, self.udp_port,
+            config=self._stream_config, **kwargs
         )
         await self._protocol.start()
         await self._protocol.connect()
@@ -150,6 +154,10 @@ class NanoManager(Manager):
     def stream_connected(self):
         return self._connected
 
+    @property
+    def protocol(self):
+        return self._protocol
+
     @property
     def stream_state(self):
         return self._current_state
@@ -0,0 +1,436 @@
+"""
+Prometheus metrics
+
+Minimal, stdlib only implementation of the Prometheus text exposition
+format (version 0.0.4) and an HTTP endpoint to scrape it.
+
+Everything is opt-in. Timings measured in the hot path (decoding,
+rendering) are only recorded once :func:`enable_media_metrics` was called,
+until then the module level metrics are None. Session state (packet
+counters, channel statistics, ...) is collected from a live
+:class:`NanoProtocol` on scrape by :class:`NanoMetrics`.
+
+Example:
+    >>> enable_media_metrics(REGISTRY)
+    >>> metrics = NanoMetrics(protocol, REGISTRY)
+    >>> server = MetricsServer(port=9464)
+    >>> server.start()
+"""
+import math
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, suited for per-frame work
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.002, 0.004, 0.008, 0.016, 0.033, 0.066, 0.1, 0.25, 0.5,
+    1.0
+)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    elif value == -math.inf:
+        return '-Inf'
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in pairs)
+
+
+class Metric(object):
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                'Metric %s expects labels %s' % (self.name, self.labelnames)
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        """
+        Yields:
+            tuple: (suffix, label values, extra label, value)
+        """
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield '', key, None, value
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (
+                self.name, self.documentation.replace('\n', ' ')
+            ),
+            '# TYPE %s %s' % (self.name, self.TYPE)
+        ]
+        for suffix, key, extra, value in self.samples():
+            lines.append('%s%s%s %s' % (
+                self.name, suffix,
+                _format_labels(self.labelnames, key, extra),
+                _format_value(value)
+            ))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError('Counters can only be incremented')
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """
+        Mirror an externally maintained, monotonic counter
+        """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Gauge(Metric):
+    TYPE = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    TYPE = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), registry=None,
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(
+            name, documentation, labelnames, registry
+        )
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Bucket counts (non-cumulative, last is +Inf), sum
+                state = [[0] * (len(self.buckets) + 1), 0.0]
+                self._values[key] = state
+            state[0][index] += 1
+            state[1] += value
+
+    def totals(self, **labels):
+        """
+        Returns:
+            tuple: Observation count and sum
+        """
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                return 0, 0.0
+            return sum(state[0]), state[1]
+
+    def samples(self):
+        with self._lock:
+            values = [(k, list(v[0]), v[1]) for k, v in self._values.items()]
+
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield '_bucket', key, ('le', _format_value(bound)), cumulative
+            yield '_count', key, None, cumulative
+            yield '_sum', key, None, total
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError('Metric already registered: %s' % metric.name)
+            self._metrics[metric.name] = metric
+
+    def unregister(self, metric):
+        with self._lock:
+            self._metrics.pop(metric.name, None)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def add_collector(self, collector):
+        """
+        Add callable, invoked before each scrape to update metrics
+        """
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        self._collectors.remove(collector)
+
+    def render(self):
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception:
+                log.exception('Metrics collector failed')
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return ''.join(metric.render() + '\n' for metric in metrics)
+
+
+REGISTRY = Registry()
+
+# Hot path metrics, None unless enabled by enable_media_metrics()
+DECODE_SECONDS = None
+RENDER_SECONDS = None
+AUDIO_QUEUE_BYTES = None
+_media_registry = None
+
+
+def enable_media_metrics(registry):
+    """
+    Start recording decode and render timings and the audio queue size
+
+    Args:
+        registry (:class:`Registry`): Registry to export the metrics to,
+            e.g. :data:`REGISTRY`
+    """
+    global DECODE_SECONDS, RENDER_SECONDS, AUDIO_QUEUE_BYTES, \
+        _media_registry
+    if _media_registry is not None:
+        raise ValueError('Media metrics already enabled')
+
+    decode_seconds = Histogram(
+        'xbox_nano_decode_seconds', 'Time spent decoding a compressed frame',
+        ['codec'], registry=registry
+    )
+    render_seconds = Histogram(
+        'xbox_nano_render_seconds', 'Time spent in the sink rendering a frame',
+        ['media'], registry=registry
+    )
+    audio_queue_bytes = Gauge(
+        'xbox_nano_audio_queue_bytes', 'Audio queued for playback',
+        registry=registry
+    )
+    _media_registry = registry
+    DECODE_SECONDS, RENDER_SECONDS, AUDIO_QUEUE_BYTES = \
+        decode_seconds, render_seconds, audio_queue_bytes
+
+
+def disable_media_metrics():
+    """
+    Stop recording hot path metrics and unregister them
+    """
+    global DECODE_SECONDS, RENDER_SECONDS, AUDIO_QUEUE_BYTES, \
+        _media_registry
+    if _media_registry is None:
+        return
+
+    for metric in (DECODE_SECONDS, RENDER_SECONDS, AUDIO_QUEUE_BYTES):
+        _media_registry.unregister(metric)
+    DECODE_SECONDS = RENDER_SECONDS = AUDIO_QUEUE_BYTES = None
+    _media_registry = None
+
+
+class NanoMetrics(object):
+    """
+    Collects the state of a live session on scrape
+
+    Args:
+        protocol (:class:`.protocol.NanoProtocol`): Live session
+        registry (:class:`Registry`): Registry to export the session
+            metrics to, e.g. :data:`REGISTRY`. Without one, :meth:`collect`
+            has to be called explicitly
+    """
+    def __init__(self, protocol, registry=None):
+        self.protocol = protocol
+        self.registry = registry
+
+        labels = ['channel']
+        self.packets = Counter(
+            'xbox_nano_channel_packets_total', 'Datagrams received', labels)
+        self.bytes = Counter(
+            'xbox_nano_channel_bytes_total', 'Datagram bytes received', labels)
+        self.dropped = Counter(
+            'xbox_nano_dropped_packets_total',
+            'Datagrams dropped before parsing')
+        self.lost = Counter(
+            'xbox_nano_channel_lost_packets_total',
+            'Datagrams lost according to RTP sequence numbers', labels)
+        self.reordered = Counter(
+            'xbox_nano_channel_reordered_packets_total',
+            'Datagrams received out of order', labels)
+        self.jitter = Gauge(
+            'xbox_nano_channel_jitter_seconds',
+            'RTP interarrival jitter', labels)
+        self.frames_completed = Counter(
+            'xbox_nano_video_frames_completed_total',
+            'Video frames fully reassembled')
+        self.frames_expired = Counter(
+            'xbox_nano_video_frames_expired_total',
+            'Incomplete video frames discarded')
+        self.keyframes = Counter(
+            'xbox_nano_video_keyframes_total', 'IDR frames received')
+        self.keyframe_requests = Counter(
+            'xbox_nano_video_keyframe_requests_total',
+            'Keyframes requested after frame loss')
+        self.input_frames = Counter(
+            'xbox_nano_input_frames_sent_total', 'Input frames sent')
+        self.tcp_queue = Gauge(
+            'xbox_nano_tcp_write_buffer_bytes',
+            'Control connection data not yet sent')
+
+        self._metrics = [
+            self.packets, self.bytes, self.dropped, self.lost, self.reordered,
+            self.jitter, self.frames_completed, self.frames_expired,
+            self.keyframes, self.keyframe_requests, self.input_frames,
+            self.tcp_queue
+        ]
+        if registry is not None:
+            for metric in self._metrics:
+                registry.register(metric)
+            registry.add_collector(self.collect)
+
+    def close(self):
+        if self.registry is None:
+            return
+
+        self.registry.remove_collector(self.collect)
+        for metric in self._metrics:
+            self.registry.unregister(metric)
+
+    def collect(self):
+        protocol = self.protocol
+        names = {
+            channel_id: channel.name.name
+            for channel_id, channel in protocol.channels.items()
+        }
+
+        streamer = protocol.streamer_protocol
+        if streamer:
+            for channel_id, count in list(streamer.channel_packets.items()):
+                name = names.get(channel_id, str(channel_id))
+                self.packets.set_total(count, channel=name)
+                self.bytes.set_total(
+                    streamer.channel_bytes[channel_id], channel=name
+                )
+            self.dropped.set_total(streamer.dropped_packets)
+
+        for channel in list(protocol.channels.values()):
+            name = channel.name.name
+            stats = channel.stats()
+            self.lost.set_total(stats.lost, channel=name)
+            self.reordered.set_total(stats.reordered, channel=name)
+            self.jitter.set(stats.jitter, channel=name)
+
+            if hasattr(channel, 'frames_completed'):
+                self.frames_completed.set_total(channel.frames_completed)
+                self.frames_expired.set_total(channel.frames_expired)
+                self.keyframes.set_total(channel.keyframes)
+                self.keyframe_requests.set_total(channel.keyframe_requests)
+            if hasattr(channel, 'frames_sent'):
+                self.input_frames.set_total(channel.frames_sent)
+
+        self.tcp_queue.set(protocol.control_protocol.write_buffer_size)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        log.debug('%s - %s', self.address_string(), fmt % args)
+
+
+class MetricsServer(object):
+    """
+    Serves a registry on http://host:port/metrics from a background thread
+    """
+    def __init__(self, host='127.0.0.1', port=9464, registry=REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.registry = self.registry
+        # Resolve port 0
+        self.port = self._server.server_address[1]
+
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name='nano-metrics', daemon=True
+        )
+        self._thread.start()
+        log.info(
+            'Serving metrics on http://%s:%d/metrics', self.host, self.port
+        )
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+            self._thread = None
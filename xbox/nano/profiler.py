@@ -0,0 +1,272 @@
+"""
+Session profiling
+
+Two modes are available:
+
+* :class:`SamplingProfiler` - Samples the Python stack of the main thread
+  (which runs the asyncio loop) on a CPU time interval timer and writes
+  folded stacks, usable with flamegraph.pl or https://speedscope.app.
+  Overhead is low enough for live sessions. Unix only.
+* :class:`ScopedProfiler` - Runs :mod:`cProfile` only while inside the
+  receive / decode functions listed in :data:`DEFAULT_SCOPES` and the
+  render client methods in :data:`CLIENT_SCOPES`, and writes
+  :mod:`pstats` data.
+
+Example:
+    >>> with profiled(ProfilerMode.Sampling, 'session.folded'):
+    ...     loop.run_until_complete(session())
+"""
+import io
+import sys
+import signal
+import pstats
+import logging
+import cProfile
+import functools
+import importlib
+from collections import Counter
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class ProfilerError(Exception):
+    pass
+
+
+class ProfilerMode(object):
+    Sampling = 'sample'
+    Scoped = 'cprofile'
+
+
+# module:qualified name of hot path functions
+DEFAULT_SCOPES = (
+    'xbox.nano.protocol:StreamerProtocol.datagram_received',
+    'xbox.nano.protocol:NanoProtocol._on_control_message',
+    'xbox.nano.render.codec:FrameDecoder.decode',
+)
+
+# Render client methods, wrapped on the class of the client in use
+CLIENT_SCOPES = ('render_video', 'render_audio', 'pump')
+DEFAULT_CLIENT = 'xbox.nano.render.client.base:Client'
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '%s:%s:%d' % (
+        frame.f_globals.get('__name__', code.co_filename),
+        getattr(code, 'co_qualname', code.co_name),
+        code.co_firstlineno
+    )
+
+
+class SamplingProfiler(object):
+    """
+    Args:
+        interval (float): Seconds of process CPU time between samples
+        max_depth (int): Stack frames kept per sample
+    """
+    def __init__(self, interval=0.005, max_depth=64):
+        if not hasattr(signal, 'setitimer'):
+            raise ProfilerError('Sampling profiler requires setitimer (Unix)')
+
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()
+        self.samples = 0
+        self._previous_handler = None
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+        stack.reverse()
+
+        self.stacks[';'.join(stack)] += 1
+        self.samples += 1
+
+    def start(self):
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+
+    def write(self, path):
+        """
+        Write samples in folded stack format
+        """
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('%s %d\n' % (stack, count))
+
+    def report(self, limit=25):
+        """
+        Returns:
+            str: Functions with most samples, by self and total samples
+        """
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+
+        samples = max(self.samples, 1)
+        lines = ['%d samples, %.1fms interval' % (
+            self.samples, self.interval * 1000
+        ), '%7s %7s  %s' % ('self%', 'total%', 'function')]
+        for name, count in own.most_common(limit):
+            lines.append('%6.1f%% %6.1f%%  %s' % (
+                100.0 * count / samples, 100.0 * total[name] / samples, name
+            ))
+        return '\n'.join(lines)
+
+
+class ScopedProfiler(object):
+    """
+    Profiles calls into `scopes` (including everything they call) only.
+
+    The functions are wrapped on :meth:`start` and restored on
+    :meth:`stop`, so the profiler has to be started before the session.
+
+    Client methods are wrapped on the client's own class, as most clients
+    override them.
+
+    Args:
+        scopes (list): Functions as 'module:Class.method' or 'module:function'
+        client (:class:`.render.client.base.Client`): Client instance or
+            class to profile :data:`CLIENT_SCOPES` of, defaults to the
+            base class
+    """
+    def __init__(self, scopes=DEFAULT_SCOPES, client=None):
+        self.scopes = scopes
+        self.client = client
+        self.profile = cProfile.Profile()
+        self._depth = 0
+        self._patched = []
+
+    def _wrap(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            self._depth += 1
+            if self._depth == 1:
+                self.profile.enable()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.profile.disable()
+        return wrapper
+
+    @staticmethod
+    def _resolve(module_name, path):
+        owner = importlib.import_module(module_name)
+        for name in path:
+            owner = getattr(owner, name)
+        return owner
+
+    def _patch(self, owner, name):
+        # Inherited methods are wrapped on `owner` and removed again on stop
+        original = owner.__dict__.get(name)
+        func = original if original is not None else getattr(owner, name)
+        self._patched.append((owner, name, original))
+        setattr(owner, name, self._wrap(func))
+
+    def start(self):
+        for scope in self.scopes:
+            module_name, _, path = scope.partition(':')
+            *parents, name = path.split('.')
+            try:
+                owner = self._resolve(module_name, parents)
+                if name not in owner.__dict__:
+                    raise KeyError(name)
+            except (ImportError, AttributeError, KeyError) as e:
+                log.warning('Cannot profile %s: %s', scope, e)
+                continue
+            self._patch(owner, name)
+
+        client = self.client
+        if client is None:
+            module_name, _, path = DEFAULT_CLIENT.partition(':')
+            client = self._resolve(module_name, path.split('.'))
+        elif not isinstance(client, type):
+            client = type(client)
+        for name in CLIENT_SCOPES:
+            self._patch(client, name)
+
+    def stop(self):
+        for owner, name, func in reversed(self._patched):
+            if func is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, func)
+        self._patched = []
+
+    def write(self, path):
+        """
+        Write :mod:`pstats` data, e.g. for snakeviz or gprof2dot
+        """
+        self.profile.dump_stats(path)
+
+    def report(self, limit=25):
+        """
+        Returns:
+            str: Functions with highest cumulative time
+        """
+        stream = io.StringIO()
+        try:
+            stats = pstats.Stats(self.profile, stream=stream)
+        except TypeError:
+            # Nothing was profiled
+            return 'No calls profiled'
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        return stream.getvalue()
+
+
+def get_profiler(mode, **kwargs):
+    """
+    Args:
+        mode (str): Member of :class:`ProfilerMode`
+
+    Returns:
+        :class:`SamplingProfiler` or :class:`ScopedProfiler`
+    """
+    if mode == ProfilerMode.Sampling:
+        return SamplingProfiler(**kwargs)
+    elif mode == ProfilerMode.Scoped:
+        return ScopedProfiler(**kwargs)
+    raise ValueError('Unknown profiler mode: %s' % mode)
+
+
+@contextmanager
+def profiled(mode, output=None, client=None):
+    """
+    Profile the enclosed block, write `output` and print the report
+    to stderr on exit.
+
+    Args:
+        mode (str): Member of :class:`ProfilerMode`, None disables profiling
+        output (str): Path for profile data (folded stacks or pstats)
+        client (:class:`.render.client.base.Client`): Render client (or its
+            class) whose methods are profiled in scoped mode
+    """
+    if not mode:
+        yield None
+        return
+
+    kwargs = {'client': client} if mode == ProfilerMode.Scoped else {}
+    profiler = get_profiler(mode, **kwargs)
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        if output:
+            profiler.write(output)
+            log.info('Wrote profile to %s', output)
+        print(profiler.report(), file=sys.stderr)
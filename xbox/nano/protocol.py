@@ -1,7 +1,8 @@
 import time
 import random
 import logging
-from typing import Optional, Tuple, List
+from collections import Counter
+from typing import Optional, Tuple, Callable
 
 import asyncio
 from asyncio.streams import StreamReader, StreamWriter
@@ -9,7 +10,8 @@ from asyncio.transports import DatagramTransport
 from asyncio.protocols import DatagramProtocol
 
 from xbox.sg.utils.events import Event
-from xbox.nano import factory, packer
+from xbox.nano import factory, xpacker
+from xbox.nano.backend import PackerBackend, get_packer
 from xbox.nano.enum import RtpPayloadType, ChannelControlPayloadType
 from xbox.nano.channel import CHANNEL_CLASS_MAP
 
@@ -30,11 +32,22 @@ class NanoProtocol(object):
     Server sends ChannelCreates and ChannelOpens
     Client responds with ChannelOpens (copying possible flags)
     """
-    def __init__(self, client, address: str, session_id, tcp_port: int, udp_port: int):
+    def __init__(self, client, address: str, session_id,
+                 tcp_port: int, udp_port: int,
+                 config: Optional[dict] = None,
+                 packer_backend: str = PackerBackend.Construct,
+                 verify_sample_rate: float = 0.01,
+                 tracer=None):
         self.loop = asyncio.get_running_loop()
 
         self.client = client
         self.session_id = session_id
+        # Gamestream configuration sent with StartGameStream
+        self.config = config or {}
+        # Message (un)packing, see :mod:`xbox.nano.backend`
+        self.packer = get_packer(packer_backend, verify_sample_rate)
+        # Optional :class:`.trace.FrameTracer`
+        self.tracer = tracer
 
         self.remote_addr = address
         self.tcp_port = tcp_port
@@ -155,7 +168,21 @@ class NanoProtocol(object):
             log.warning(msg)
             return
 
-        self.channels[channel_id].on_message(msg)
+        channel = self.channels[channel_id]
+        channel.track(msg)
+        channel.on_message(msg)
+
+    def stats(self):
+        """
+        Incoming sequence statistics of all channels
+
+        Returns:
+            dict: :class:`.SequenceStats` by channel class name
+        """
+        return {
+            channel.name.name: channel.stats()
+            for channel in self.channels.values()
+        }
 
     def channel_control_handshake(self, connection_id=None):
         if not connection_id:
@@ -217,7 +244,7 @@ class ControlProtocol(object):
 
     async def handle(self, data):
         try:
-            for msg in packer.unpack_tcp(data, self._nano.channels):
+            for msg in self._nano.packer.unpack_tcp(data, self._nano.channels):
                 self.on_message(msg)
         except Exception as e:
             log.exception("Exception in ControlProtocol message handler")
@@ -227,8 +254,17 @@ class ControlProtocol(object):
             data = await self._reader.read(self.BUFFER_SIZE)
             await self.handle(data)
 
+    @property
+    def write_buffer_size(self):
+        """
+        Bytes queued in the transport, not yet sent
+        """
+        if not self._writer:
+            return 0
+        return self._writer.transport.get_write_buffer_size()
+
     def _send(self, msgs):
-        data = packer.pack_tcp(msgs, self._nano.channels)
+        data = self._nano.packer.pack_tcp(msgs, self._nano.channels)
 
         if not data:
             raise ControlProtocolError('No data')
@@ -259,18 +295,52 @@ class StreamerProtocol(object):
         self.connected = asyncio.Future()
         self.transport: Optional[DatagramTransport] = None
 
+        # Called with (payload_type, channel_id, sequence_num, streamer_type)
+        # before parsing, returning False drops the datagram
+        self.packet_filter: Optional[Callable[..., bool]] = None
+
+        self.channel_packets = Counter()
+        self.channel_bytes = Counter()
+        self.dropped_packets = 0
+
         self.on_message = Event()
 
     def connection_made(self, transport):
         self.transport = transport
 
     def datagram_received(self, data, addr):
+        # Arrival, before parsing, which the trace stages measure
+        incoming_ts = time.time()
+        incoming_ns = time.perf_counter_ns()
         if not self.connected.done():
             self.connected.set_result(True)
 
         try:
-            msg = packer.unpack(data, self._nano.channels)
-            msg(_incoming_ts=time.time())
+            header = xpacker.peek_header(data)
+        except xpacker.PackerError:
+            log.warning("Invalid datagram received, size: %d", len(data))
+            self.dropped_packets += 1
+            return
+
+        payload_type, channel_id, _, _ = header
+        self.channel_packets[channel_id] += 1
+        self.channel_bytes[channel_id] += len(data)
+
+        if payload_type == xpacker.STREAMER_PAYLOAD_TYPE and \
+                channel_id not in self._nano.channels:
+            log.debug(
+                "Dropping datagram for unknown channel id: %d", channel_id
+            )
+            self.dropped_packets += 1
+            return
+
+        if self.packet_filter and not self.packet_filter(*header):
+            self.dropped_packets += 1
+            return
+
+        try:
+            msg = self._nano.packer.unpack(data, self._nano.channels)
+            msg(_incoming_ts=incoming_ts, _incoming_ns=incoming_ns)
             self.on_message(msg)
         except Exception as e:
             log.exception("Exception in StreamerProtocol message handler")
@@ -282,9 +352,15 @@ class StreamerProtocol(object):
         print("Connection closed")
 
     def send_message(self, msg):
-        data = packer.pack(msg)
+        data = self._nano.packer.pack(msg)
 
         if not data:
             raise StreamerProtocolError('No data')
 
         self.transport.sendto(data)
+
+    def send_data(self, data):
+        """
+        Send already packed message
+        """
+        self.transport.sendto(data)
@@ -0,0 +1,599 @@
+"""
+Segmented recordings
+
+Raw elementary streams written by :class:`.FileClient` can be split into
+segments by size or duration, with a sidecar index per stream that maps
+each frame to its segment and byte offset.
+
+Index file layout (little endian):
+    header: magic `XNRI`, version (uint16), entry size (uint16),
+        stream kind (uint32), reserved (uint32)
+    entries: frame_id (uint32), segment (uint32), timestamp (uint64,
+        microseconds), offset (uint64), size (uint32), flags (uint32)
+
+Entries can be loaded with NumPy:
+    >>> numpy.fromfile(path, dtype=INDEX_DTYPE, offset=INDEX_HEADER.size)
+
+Stream formats are stored in `<prefix>.json`. :class:`RecordingReader`
+memory maps a recording for playback, see :class:`.replay.RecordingPlayer`.
+
+Example:
+    >>> index = read_index(index_path('session', StreamKind.Video))
+    >>> data = extract_clip('session', StreamKind.Video, start, end)
+"""
+import os
+import json
+import heapq
+import mmap
+import struct
+import logging
+from typing import NamedTuple
+
+from construct import Container
+
+from xbox.nano import h264
+from xbox.nano.enum import VideoCodec, AudioCodec
+from xbox.nano.render.audio.aac import AACFrame
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+log = logging.getLogger(__name__)
+
+INDEX_MAGIC = b'XNRI'
+INDEX_VERSION = 1
+INDEX_HEADER = struct.Struct('<4sHHII')
+INDEX_ENTRY = struct.Struct('<IIQQII')
+
+INDEX_DTYPE = [
+    ('frame_id', '<u4'),
+    ('segment', '<u4'),
+    ('timestamp', '<u8'),
+    ('offset', '<u8'),
+    ('size', '<u4'),
+    ('flags', '<u4'),
+]
+
+
+class RecordingError(Exception):
+    pass
+
+
+class StreamKind(object):
+    Video = 'video'
+    Audio = 'audio'
+
+
+# Stored in the index header
+STREAM_KIND_IDS = {
+    StreamKind.Video: 0,
+    StreamKind.Audio: 1
+}
+
+
+class IndexFlags(object):
+    Keyframe = 0x1
+    # Video frame carries SPS and PPS
+    ParameterSets = 0x2
+
+
+def segment_path(prefix, kind, segment=None):
+    """
+    Path of a raw stream file, `segment` None for unsegmented recordings
+    """
+    if segment is None:
+        return '%s.%s.raw' % (prefix, kind)
+    return '%s.%s.%04d.raw' % (prefix, kind, segment)
+
+
+def index_path(prefix, kind):
+    return '%s.%s.idx' % (prefix, kind)
+
+
+def meta_path(prefix):
+    return '%s.json' % prefix
+
+
+def _is_segmented(prefix, kind):
+    return os.path.exists(segment_path(prefix, kind, 0))
+
+
+def format_meta(video_fmt=None, audio_fmt=None):
+    """
+    Serialize stream formats for `<prefix>.json`
+
+    Returns:
+        bytes: JSON document
+    """
+    meta = {'version': INDEX_VERSION}
+    if video_fmt is not None:
+        meta['video'] = {
+            'codec': VideoCodec(video_fmt.codec).name,
+            'fps': video_fmt.fps,
+            'width': video_fmt.width,
+            'height': video_fmt.height
+        }
+    if audio_fmt is not None:
+        meta['audio'] = {
+            'codec': AudioCodec(audio_fmt.codec).name,
+            'sample_rate': audio_fmt.sample_rate,
+            'channels': audio_fmt.channels
+        }
+    return json.dumps(meta, indent=2).encode('utf-8')
+
+
+def parse_meta(data):
+    """
+    Deserialize stream formats, see :func:`format_meta`
+
+    Returns:
+        tuple: (video format, audio format), None if not set
+    """
+    meta = json.loads(bytes(data).decode('utf-8'))
+    video = audio = None
+    if 'video' in meta:
+        video = Container(**meta['video'])
+        video.codec = VideoCodec[video.codec]
+    if 'audio' in meta:
+        audio = Container(**meta['audio'])
+        audio.codec = AudioCodec[audio.codec]
+    return video, audio
+
+
+def read_meta(prefix):
+    """
+    Returns:
+        tuple: (video format, audio format), None if not recorded
+    """
+    try:
+        with open(meta_path(prefix), 'rb') as f:
+            return parse_meta(f.read())
+    except FileNotFoundError:
+        return None, None
+
+
+class StreamRecorder(object):
+    """
+    Writes one elementary stream, rotating segments and maintaining the
+    index.
+
+    Rotation happens before a keyframe once the segment reached
+    `segment_size` bytes or spans `segment_duration` seconds of payload
+    timestamps, so every segment starts decodable. Audio frames are all
+    keyframes.
+
+    Frames dropped by a full writer queue are left out of the segment
+    and the index, so index offsets stay valid.
+
+    Args:
+        prefix (str): Path prefix of the recording
+        kind (str): :class:`StreamKind`
+        writer (:class:`.writer.DiskWriter`): Performs the writes
+        segment_size (int): Bytes per segment
+        segment_duration (float): Seconds per segment
+        index (bool): Write the sidecar index
+    """
+    def __init__(self, prefix, kind, writer, segment_size=None,
+                 segment_duration=None, index=True):
+        self.prefix = prefix
+        self.kind = kind
+        self.writer = writer
+        self.segment_size = segment_size
+        self.segment_duration = segment_duration
+        self.segmented = bool(segment_size or segment_duration)
+
+        self.segment = 0
+        self.offset = 0
+        self.frames = 0
+        # Frames dropped by the writer
+        self.dropped = 0
+        self._segment_start = None
+
+        self._index_path = index_path(prefix, kind) if index else None
+        if self._index_path:
+            # Without the header the index is unreadable
+            self.writer.append(self._index_path, INDEX_HEADER.pack(
+                INDEX_MAGIC, INDEX_VERSION, INDEX_ENTRY.size,
+                STREAM_KIND_IDS[kind], 0
+            ), block=True)
+
+    @property
+    def path(self):
+        """
+        Current segment
+        """
+        return segment_path(
+            self.prefix, self.kind, self.segment if self.segmented else None
+        )
+
+    def _rotate_due(self, timestamp):
+        if self.offset == 0:
+            return False
+        if self.segment_size and self.offset >= self.segment_size:
+            return True
+        if self.segment_duration and self._segment_start is not None and \
+                timestamp - self._segment_start >= \
+                self.segment_duration * 1000000:
+            return True
+        return False
+
+    def write(self, data, timestamp=0, frame_id=0, keyframe=True, header=b'',
+              parameter_sets=False):
+        """
+        Args:
+            data (bytes): Frame
+            timestamp (int): Payload timestamp in microseconds
+            frame_id (int): Payload frame id
+            keyframe (bool): Frame can start a segment / clip
+            header (bytes): Written in front of data, e.g. ADTS
+            parameter_sets (bool): Video frame carries SPS and PPS
+        """
+        if self.segmented and keyframe and self._rotate_due(timestamp):
+            self.writer.close_file(self.path)
+            self.segment += 1
+            self.offset = 0
+
+        if self.offset == 0:
+            self._segment_start = timestamp
+
+        size = len(header) + len(data)
+        if header:
+            written = self.writer.append(self.path, header, data)
+        else:
+            written = self.writer.append(self.path, data)
+        if not written:
+            self.dropped += 1
+            return
+
+        if self._index_path:
+            flags = IndexFlags.Keyframe if keyframe else 0
+            if parameter_sets:
+                flags |= IndexFlags.ParameterSets
+            self.writer.append(self._index_path, INDEX_ENTRY.pack(
+                frame_id & 0xFFFFFFFF, self.segment, timestamp, self.offset,
+                size, flags
+            ))
+        self.offset += size
+        self.frames += 1
+
+    def close(self):
+        self.writer.close_file(self.path)
+        if self._index_path:
+            self.writer.close_file(self._index_path)
+
+
+def _read_header(f, path):
+    header = f.read(INDEX_HEADER.size)
+    if len(header) < INDEX_HEADER.size:
+        raise RecordingError('Index too short: %s' % path)
+    magic, version, entry_size, kind, _ = INDEX_HEADER.unpack(header)
+    if magic != INDEX_MAGIC:
+        raise RecordingError('Not a recording index: %s' % path)
+    if version != INDEX_VERSION or entry_size != INDEX_ENTRY.size:
+        raise RecordingError(
+            'Unsupported index version %d (entry size %d): %s' % (
+                version, entry_size, path
+            )
+        )
+    return kind
+
+
+def read_index(path):
+    """
+    Load index entries
+
+    Returns:
+        numpy.ndarray: Structured array of :data:`INDEX_DTYPE`
+    """
+    if np is None:
+        raise RecordingError('Reading an index requires numpy')
+    with open(path, 'rb') as f:
+        _read_header(f, path)
+    return np.fromfile(path, dtype=INDEX_DTYPE, offset=INDEX_HEADER.size)
+
+
+def iter_index(path):
+    """
+    Iterate index entries without NumPy
+
+    Yields:
+        tuple: Entry fields in order of :data:`INDEX_DTYPE`
+    """
+    with open(path, 'rb') as f:
+        _read_header(f, path)
+        data = f.read()
+    # Drop a partially written trailing entry
+    end = len(data) - len(data) % INDEX_ENTRY.size
+    yield from INDEX_ENTRY.iter_unpack(data[:end])
+
+
+def seek(index, timestamp):
+    """
+    Position of the last keyframe at or before `timestamp`
+
+    Args:
+        index (numpy.ndarray): See :func:`read_index`
+        timestamp (int): Payload timestamp in microseconds
+
+    Returns:
+        int: Entry position, 0 if `timestamp` precedes all keyframes
+    """
+    keyframes = np.flatnonzero(index['flags'] & IndexFlags.Keyframe)
+    if not len(keyframes):
+        return 0
+    position = np.searchsorted(
+        index['timestamp'][keyframes], timestamp, side='right'
+    ) - 1
+    return int(keyframes[max(position, 0)])
+
+
+def _read_entry(prefix, kind, segmented, entry):
+    path = segment_path(
+        prefix, kind, int(entry['segment']) if segmented else None
+    )
+    with open(path, 'rb') as f:
+        f.seek(int(entry['offset']))
+        return f.read(int(entry['size']))
+
+
+def _parameter_sets(prefix, kind, segmented, index, position):
+    """
+    Annex-B SPS and PPS in effect at `position`, None if unknown
+    """
+    carrying = np.flatnonzero(
+        index['flags'][:position + 1] & IndexFlags.ParameterSets
+    )
+    if not len(carrying):
+        return None
+    info = h264.scan_frame(
+        _read_entry(prefix, kind, segmented, index[carrying[-1]])
+    )
+    if not info.sps or not info.pps:
+        return None
+    return h264.parameter_sets(info.sps, info.pps)
+
+
+def extract_clip(prefix, kind, start, end=None, output=None):
+    """
+    Extract frames from the keyframe before `start` up to `end`
+
+    A video clip starting with a keyframe lacking SPS / PPS gets the ones
+    in effect prepended, so it decodes on its own.
+
+    Args:
+        prefix (str): Path prefix of the recording
+        kind (str): :class:`StreamKind`
+        start (int): Payload timestamp in microseconds
+        end (int): Payload timestamp in microseconds, exclusive
+        output: Writable binary file, clip is returned as bytes if omitted
+
+    Returns:
+        bytes or int: Clip, or number of bytes written to `output`
+    """
+    index = read_index(index_path(prefix, kind))
+    first = seek(index, start)
+    rows = index[first:]
+    if end is not None:
+        rows = rows[rows['timestamp'] < end]
+
+    segmented = _is_segmented(prefix, kind)
+    chunks = []
+    written = 0
+    files = {}
+
+    if kind == StreamKind.Video and len(rows) and \
+            not rows[0]['flags'] & IndexFlags.ParameterSets:
+        header = _parameter_sets(prefix, kind, segmented, index, first)
+        if header:
+            if output is None:
+                chunks.append(header)
+            else:
+                output.write(header)
+            written += len(header)
+
+    try:
+        for segment, offset, size in zip(
+                rows['segment'], rows['offset'], rows['size']):
+            segment = int(segment)
+            f = files.get(segment)
+            if f is None:
+                f = files[segment] = open(segment_path(
+                    prefix, kind, segment if segmented else None
+                ), 'rb')
+            f.seek(int(offset))
+            data = f.read(int(size))
+            if output is None:
+                chunks.append(data)
+            else:
+                output.write(data)
+            written += len(data)
+    finally:
+        for f in files.values():
+            f.close()
+
+    return b''.join(chunks) if output is None else written
+
+
+def rebuild_index(prefix, kind=StreamKind.Video, frame_rate=60.0):
+    """
+    Write the index of a raw H.264 recording lacking one, e.g. recorded
+    before indexes were written, by scanning it for access units.
+
+    Payload timestamps are not stored in the stream, entries are
+    timestamped by `frame_rate` and numbered from 0.
+
+    Args:
+        prefix (str): Path prefix of the recording
+        kind (str): Only :attr:`StreamKind.Video` can be scanned
+        frame_rate (float): Frames per second
+
+    Returns:
+        int: Number of entries
+    """
+    if kind != StreamKind.Video:
+        raise RecordingError('Only video streams can be scanned')
+    if np is None:
+        raise RecordingError('Rebuilding an index requires numpy')
+
+    if os.path.exists(segment_path(prefix, kind)):
+        paths = [(0, segment_path(prefix, kind))]
+    else:
+        paths = []
+        while os.path.exists(segment_path(prefix, kind, len(paths))):
+            paths.append(
+                (len(paths), segment_path(prefix, kind, len(paths)))
+            )
+    if not paths:
+        raise RecordingError('No recording at %s' % prefix)
+
+    count = 0
+    with open(index_path(prefix, kind), 'wb') as f:
+        f.write(INDEX_HEADER.pack(
+            INDEX_MAGIC, INDEX_VERSION, INDEX_ENTRY.size,
+            STREAM_KIND_IDS[kind], 0
+        ))
+        for segment, path in paths:
+            units = h264.scan_file(path)
+            entries = np.zeros(len(units.offset), dtype=INDEX_DTYPE)
+            frames = np.arange(count, count + len(entries))
+            entries['frame_id'] = frames
+            entries['segment'] = segment
+            entries['timestamp'] = frames * 1000000.0 / frame_rate
+            entries['offset'] = units.offset
+            entries['size'] = units.size
+            entries['flags'] = \
+                units.keyframe * IndexFlags.Keyframe | \
+                units.parameter_sets * IndexFlags.ParameterSets
+            entries.tofile(f)
+            count += len(entries)
+    return count
+
+
+class RecordedFrame(NamedTuple):
+    kind: str
+    # Payload timestamp in microseconds
+    timestamp: int
+    frame_id: int
+    keyframe: bool
+    # Raw frame, audio without ADTS header
+    data: memoryview
+
+
+class RecordingReader(object):
+    """
+    Memory maps the raw streams of a recording and yields its frames as
+    zero-copy memoryviews, in recorded order.
+
+    Frames reference the mappings and are only valid until :meth:`close`.
+
+    Args:
+        prefix (str): Path prefix of the recording
+    """
+    def __init__(self, prefix):
+        if np is None:
+            raise RecordingError('Reading a recording requires numpy')
+
+        self.prefix = prefix
+        self.video_format, self.audio_format = read_meta(prefix)
+        self.index = {}
+        for kind in (StreamKind.Video, StreamKind.Audio):
+            path = index_path(prefix, kind)
+            if os.path.exists(path):
+                self.index[kind] = read_index(path)
+        if not self.index:
+            raise RecordingError('No indexed recording at %s' % prefix)
+
+        # (kind, segment) -> (mmap, memoryview)
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def kinds(self):
+        return list(self.index)
+
+    def _segment(self, kind, segment):
+        mapping = self._maps.get((kind, segment))
+        if mapping:
+            return mapping[1]
+
+        path = segment_path(
+            self.prefix, kind, segment if _is_segmented(self.prefix, kind)
+            else None
+        )
+        with open(path, 'rb') as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                mapped = None
+        view = memoryview(mapped if mapped is not None else b'')
+        self._maps[(kind, segment)] = (mapped, view)
+        return view
+
+    def frames(self, kind, start=None, end=None):
+        """
+        Frames of one stream
+
+        Args:
+            kind (str): :class:`StreamKind`
+            start (int): Payload timestamp in microseconds, playback starts
+                at the keyframe before
+            end (int): Payload timestamp in microseconds, exclusive
+
+        Yields:
+            :class:`RecordedFrame`: Frames
+        """
+        index = self.index[kind]
+        first = seek(index, start) if start is not None else 0
+        # ADTS header written by FileClient
+        skip = AACFrame.ADTS_HEADER_LEN if kind == StreamKind.Audio else 0
+
+        segment = view = None
+        for frame_id, entry_segment, timestamp, offset, size, flags in \
+                index[first:].tolist():
+            if end is not None and timestamp >= end:
+                return
+            if entry_segment != segment:
+                segment = entry_segment
+                view = self._segment(kind, segment)
+            yield RecordedFrame(
+                kind, timestamp, frame_id, bool(flags & IndexFlags.Keyframe),
+                view[offset + skip:offset + size]
+            )
+
+    def __iter__(self):
+        return self.interleaved()
+
+    def interleaved(self, start=None, end=None):
+        """
+        Frames of all streams, ordered by timestamp
+        """
+        return heapq.merge(
+            *(self.frames(kind, start, end) for kind in self.index),
+            key=lambda frame: frame.timestamp
+        )
+
+    @property
+    def first_timestamp(self):
+        return min((int(index['timestamp'][0])
+                    for index in self.index.values() if len(index)),
+                   default=None)
+
+    def close(self):
+        for mapped, view in self._maps.values():
+            view.release()
+            if mapped is None:
+                continue
+            try:
+                mapped.close()
+            except BufferError:
+                # Frames still referenced, unmapped once collected
+                log.debug('Recording frames still in use: %s', self.prefix)
+        self._maps = {}
@@ -51,6 +51,18 @@ class AACFrame(object):
 
         return adts_headers
 
+    @staticmethod
+    def generate_config(aac_profile, sampling_freq, channels):
+        """
+        MPEG-4 AudioSpecificConfig, container extradata for raw frames
+        """
+        object_type = aac_profile + 1
+        sampling_index = AACFrame.sampling_freq_index[sampling_freq]
+        return bytes([
+            (object_type << 3) | (sampling_index >> 1),
+            ((sampling_index & 0x1) << 7) | ((channels & 0xF) << 3)
+        ])
+
 
 class AACResampler(object):
     """
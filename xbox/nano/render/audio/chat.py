@@ -0,0 +1,203 @@
+import math
+import wave
+import struct
+import asyncio
+import logging
+from typing import Optional
+
+from xbox.nano.render.codec import FrameEncoder
+
+log = logging.getLogger(__name__)
+
+
+class AudioSourceError(Exception):
+    pass
+
+
+class AudioSource(object):
+    """
+    Capture source for the ChatAudio uplink.
+
+    Delivers interleaved signed 16bit little-endian PCM.
+    """
+    def open(self, sample_rate, channels):
+        pass
+
+    def close(self):
+        pass
+
+    def read(self, samples):
+        """
+        Read PCM data
+
+        Args:
+            samples (int): Samples (per channel) to read
+
+        Returns:
+            bytes: PCM data, empty if the source is exhausted
+        """
+        raise NotImplementedError()
+
+
+class WavFileSource(AudioSource):
+    def __init__(self, filename, loop=False):
+        self.filename = filename
+        self.loop = loop
+        self._wav = None
+        self._frame_bytes = 0
+
+    def open(self, sample_rate, channels):
+        self._wav = wave.open(self.filename, 'rb')
+
+        if self._wav.getsampwidth() != 2:
+            raise AudioSourceError('WAV file is not 16bit PCM')
+        if self._wav.getframerate() != sample_rate or \
+                self._wav.getnchannels() != channels:
+            raise AudioSourceError(
+                'WAV file format (%i Hz, %i ch) does not match '
+                'requested format (%i Hz, %i ch)' % (
+                    self._wav.getframerate(), self._wav.getnchannels(),
+                    sample_rate, channels
+                )
+            )
+
+        self._frame_bytes = 2 * channels
+
+    def close(self):
+        if self._wav:
+            self._wav.close()
+            self._wav = None
+
+    def read(self, samples):
+        data = self._wav.readframes(samples)
+        if len(data) < samples * self._frame_bytes and self.loop:
+            self._wav.rewind()
+            data += self._wav.readframes(
+                samples - len(data) // self._frame_bytes
+            )
+
+        if not data:
+            return b''
+
+        # Encoder consumes full frames only, pad the tail with silence
+        return data.ljust(samples * self._frame_bytes, b'\x00')
+
+
+class GeneratorSource(AudioSource):
+    """
+    Synthesized source, produces a sine tone (or silence with frequency=0).
+
+    Mostly useful for testing.
+    """
+    def __init__(self, frequency=440.0, amplitude=0.3, duration=None):
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.duration = duration
+        self._sample_rate = None
+        self._channels = None
+        self._offset = 0
+
+    def open(self, sample_rate, channels):
+        self._sample_rate = sample_rate
+        self._channels = channels
+        self._offset = 0
+
+    def read(self, samples):
+        if self.duration is not None:
+            remaining = int(self.duration * self._sample_rate) - self._offset
+            if remaining <= 0:
+                return b''
+
+        peak = int(self.amplitude * 32767)
+        step = 2 * math.pi * self.frequency / self._sample_rate
+        values = []
+        for i in range(self._offset, self._offset + samples):
+            values.extend([int(peak * math.sin(step * i))] * self._channels)
+
+        self._offset += samples
+        return struct.pack('<%ih' % len(values), *values)
+
+
+class ChatAudioUplink(object):
+    """
+    Encodes captured audio and sends it paced on the ChatAudio channel.
+
+    One packet is sent per encoder frame, scheduled against an absolute
+    deadline. If the loop falls behind, the schedule is reset instead of
+    sending the backlog in a burst.
+
+    `clock` and `sleep` default to the event loop's time and
+    :func:`asyncio.sleep`.
+    """
+    def __init__(self, channel, source: AudioSource, audio_fmt,
+                 clock=None, sleep=asyncio.sleep):
+        self.channel = channel
+        self.source = source
+        self._clock = clock
+        self._sleep = sleep
+
+        self._encoder = FrameEncoder.audio(
+            audio_fmt.codec, audio_fmt.sample_rate, audio_fmt.channels
+        )
+        self._sample_rate = audio_fmt.sample_rate
+        self._channels = audio_fmt.channels
+        self._task: Optional[asyncio.Task] = None
+
+        self.frames_sent = 0
+        self.late_frames = 0
+
+    @property
+    def frame_duration(self):
+        return self._encoder.frame_size / self._sample_rate
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+
+        self.source.open(self._sample_rate, self._channels)
+        self._task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def run(self):
+        clock = self._clock or asyncio.get_running_loop().time
+        frame_size = self._encoder.frame_size
+        frame_duration = self.frame_duration
+        # Sample position of the stream start relative to reference timestamp
+        start_ts = self.channel.get_audio_timestamp_now()
+        sample_pos = 0
+
+        deadline = clock()
+        try:
+            while True:
+                pcm = self.source.read(frame_size)
+                if not pcm:
+                    log.debug('ChatAudio source exhausted')
+                    break
+
+                timestamp = \
+                    start_ts + sample_pos * 1000000 // self._sample_rate
+                for packet in self._encoder.encode(pcm):
+                    self.channel.data(packet, timestamp)
+                    self.frames_sent += 1
+                sample_pos += frame_size
+
+                deadline += frame_duration
+                delay = deadline - clock()
+                if delay > 0:
+                    await self._sleep(delay)
+                else:
+                    if -delay > frame_duration:
+                        # Too far behind, drop the schedule instead of bursting
+                        self.late_frames += 1
+                        deadline = clock()
+                    await self._sleep(0)
+        finally:
+            self.source.close()
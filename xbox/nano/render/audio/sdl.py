@@ -1,5 +1,6 @@
 import sdl2
 import logging
+from xbox.nano import metrics
 from xbox.nano.enum import AudioCodec
 from xbox.nano.render.sink import Sink
 from xbox.nano.render.codec import FrameDecoder
@@ -92,3 +93,7 @@ class SDLAudioRenderer(Sink):
             sdl2.SDL_QueueAudio(
                 self._dev, audio_data, len(audio_data)
             )
+
+        queue_bytes = metrics.AUDIO_QUEUE_BYTES
+        if queue_bytes is not None:
+            queue_bytes.set(sdl2.SDL_GetQueuedAudioSize(self._dev))
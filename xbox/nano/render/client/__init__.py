@@ -1,6 +1,16 @@
 from xbox.nano.render.client.base import Client
-from xbox.nano.render.client.sdl import SDLClient
 from xbox.nano.render.client.file import FileClient
+from xbox.nano.render.client.benchmark import BenchmarkClient
+from xbox.nano.render.client.ring import RingClient
 
 
-__all__ = ['Client', 'SDLClient', 'FileClient']
+def __getattr__(name):
+    # SDL is only loaded on demand, for headless use
+    if name == 'SDLClient':
+        from xbox.nano.render.client.sdl import SDLClient
+        return SDLClient
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+__all__ = ['Client', 'SDLClient', 'FileClient', 'BenchmarkClient',
+           'RingClient']
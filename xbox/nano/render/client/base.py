@@ -1,6 +1,8 @@
+import time
 import asyncio
 from typing import Optional
 
+from xbox.nano import metrics
 from xbox.nano.enum import ChannelClass
 
 
@@ -9,15 +11,24 @@ class ClientError(Exception):
 
 
 class Client(object):
-    def __init__(self, video, audio, input):
+    def __init__(self, video, audio, input, chat_audio=None):
         self.video = video
         self.audio = audio
         self.input = input
+        # Optional AudioSource for the ChatAudio uplink
+        self.chat_audio = chat_audio
         self.protocol = None
 
         self._running = False
         self._loop_task: Optional[asyncio.Task] = None
 
+    @property
+    def tracer(self):
+        """
+        :class:`.trace.FrameTracer` of the session, if any
+        """
+        return getattr(self.protocol, 'tracer', None)
+
     def open(self, protocol):
         self.protocol = protocol
         self.video.open(self)
@@ -51,11 +62,31 @@ class Client(object):
     def set_audio_format(self, audio_fmt):
         self.audio.setup(audio_fmt)
 
-    def render_video(self, data):
+    def render_video(self, data, timestamp=None, frame_id=None):
+        """
+        Args:
+            data (bytes): Annex-B access unit
+            timestamp (int): Payload timestamp in microseconds
+            frame_id (int): Payload frame id
+        """
+        render_seconds = metrics.RENDER_SECONDS
+        if render_seconds is None:
+            self.video.render(data)
+            return
+
+        started = time.perf_counter()
         self.video.render(data)
+        render_seconds.observe(time.perf_counter() - started, media='video')
+
+    def render_audio(self, data, timestamp=None, frame_id=None):
+        render_seconds = metrics.RENDER_SECONDS
+        if render_seconds is None:
+            self.audio.render(data)
+            return
 
-    def render_audio(self, data):
+        started = time.perf_counter()
         self.audio.render(data)
+        render_seconds.observe(time.perf_counter() - started, media='audio')
 
     def send_input(self, frame, timestamp_dt):
         input_channel = self.protocol.get_channel(ChannelClass.Input)
@@ -0,0 +1,267 @@
+import math
+import time
+import random
+import logging
+from typing import NamedTuple, Optional
+
+from xbox.nano.enum import VideoCodec, AudioCodec
+from xbox.nano.render.client.base import Client
+from xbox.nano.render.codec import FrameDecoder
+from xbox.nano.render.audio.aac import AACFrame, AACProfile
+
+log = logging.getLogger(__name__)
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile of sorted values
+    """
+    if not values:
+        return None
+    rank = math.ceil(pct / 100.0 * len(values))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+# Decode times kept for the percentiles, a uniform sample beyond this
+RESERVOIR_SIZE = 10000
+
+
+class MediaStats(NamedTuple):
+    frames: int
+    # Frames emitted by the decoder
+    decoded: int
+    # Frames failing to decode
+    dropped: int
+    # Frames taking longer to decode than the frame interval
+    late: int
+    fps: float
+    decode_p50: Optional[float]
+    decode_p95: Optional[float]
+    decode_p99: Optional[float]
+    decode_max: Optional[float]
+
+
+class MediaTotals(NamedTuple):
+    frames: int
+    decoded: int
+    dropped: int
+    decode_seconds: float
+
+
+class BenchmarkStats(NamedTuple):
+    video: MediaStats
+    audio: MediaStats
+    # Incomplete video frames discarded by the channel
+    expired: int
+    wall_time: float
+    cpu_time: float
+
+
+class _MediaBenchmark(object):
+    """
+    Decode times are kept in a reservoir sample (Algorithm R) of
+    `reservoir_size`, so memory stays bounded over long sessions; the
+    maximum is tracked exactly.
+    """
+    def __init__(self, interval, reservoir_size=RESERVOIR_SIZE):
+        self.decoder = None
+        # Frame interval in seconds, decode time budget
+        self.interval = interval
+        self.frames = 0
+        self.decoded = 0
+        self.dropped = 0
+        self.late = 0
+        self.decode_times = []
+        self.decode_count = 0
+        self.decode_max = None
+        self.decode_seconds = 0.0
+        self.reservoir_size = reservoir_size
+        self._random = random.Random(0)
+        self.first = None
+        self.last = None
+
+    def decode(self, data):
+        now = time.perf_counter()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.frames += 1
+
+        if not self.decoder:
+            return
+
+        try:
+            frames = self.decoder.decode(data)
+        except Exception as e:
+            log.debug('Failed to decode frame: %s', e)
+            self.dropped += 1
+            return
+
+        elapsed = time.perf_counter() - now
+        self.decoded += len(frames)
+        self._sample(elapsed)
+        self.decode_seconds += elapsed
+        if elapsed > self.interval:
+            self.late += 1
+
+    def _sample(self, elapsed):
+        self.decode_count += 1
+        if self.decode_max is None or elapsed > self.decode_max:
+            self.decode_max = elapsed
+
+        if len(self.decode_times) < self.reservoir_size:
+            self.decode_times.append(elapsed)
+            return
+        slot = self._random.randrange(self.decode_count)
+        if slot < self.reservoir_size:
+            self.decode_times[slot] = elapsed
+
+    def totals(self):
+        return MediaTotals(
+            self.frames, self.decoded, self.dropped, self.decode_seconds
+        )
+
+    def stats(self):
+        times = sorted(self.decode_times)
+        span = (self.last - self.first) if self.frames > 1 else 0
+        return MediaStats(
+            frames=self.frames,
+            decoded=self.decoded,
+            dropped=self.dropped,
+            late=self.late,
+            fps=(self.frames - 1) / span if span else 0.0,
+            decode_p50=percentile(times, 50),
+            decode_p95=percentile(times, 95),
+            decode_p99=percentile(times, 99),
+            decode_max=self.decode_max
+        )
+
+
+class BenchmarkClient(Client):
+    """
+    Headless client, decodes video and audio and discards the frames.
+
+    Video is decoded as H264 until the server handshake sets a format.
+    Audio is only decoded once a format is known, as AAC needs a header
+    built from it.
+
+    Args:
+        fps (int): Expected video frame rate, decode time budget for late
+            frames until the video format is known
+        decode_audio (bool): Decode audio frames as well
+    """
+    def __init__(self, fps=60, decode_audio=True):
+        self.decode_audio = decode_audio
+
+        self._video = _MediaBenchmark(1.0 / fps)
+        self._video.decoder = FrameDecoder.video(VideoCodec.H264)
+        # AAC frames of 1024 samples at 48kHz
+        self._audio = _MediaBenchmark(1024 / 48000.0)
+        self._audio_fmt = None
+
+        self._started = None
+        self._cpu_started = None
+        self._stopped = None
+        self._cpu_stopped = None
+        super(BenchmarkClient, self).__init__(None, None, None)
+
+    def open(self, protocol):
+        self.protocol = protocol
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+
+    def close(self):
+        self._stopped = time.perf_counter()
+        self._cpu_stopped = time.process_time()
+
+    def loop(self):
+        pass
+
+    def pump(self):
+        pass
+
+    def set_video_format(self, video_fmt):
+        self._video.decoder = FrameDecoder.video(video_fmt.codec)
+        if video_fmt.fps:
+            self._video.interval = 1.0 / video_fmt.fps
+
+    def set_audio_format(self, audio_fmt):
+        self._audio_fmt = audio_fmt
+        if self.decode_audio:
+            self._audio.decoder = FrameDecoder.audio(audio_fmt.codec)
+
+    def render_video(self, data, timestamp=None, frame_id=None):
+        self._video.decode(data)
+
+    def render_audio(self, data, timestamp=None, frame_id=None):
+        fmt = self._audio_fmt
+        if fmt and fmt.codec == AudioCodec.AAC:
+            data = AACFrame.generate_header(
+                len(data), AACProfile.Main, fmt.sample_rate, fmt.channels
+            ) + data
+        self._audio.decode(data)
+
+    def send_input(self, frame, timestamp):
+        pass
+
+    def controller_added(self, controller_index):
+        pass
+
+    def controller_removed(self, controller_index):
+        pass
+
+    def stats(self):
+        """
+        Returns:
+            :class:`BenchmarkStats`: Results so far
+        """
+        expired = 0
+        if self.protocol:
+            for channel in self.protocol.channels.values():
+                expired += getattr(channel, 'frames_expired', 0)
+
+        stopped = self._stopped or time.perf_counter()
+        cpu_stopped = self._cpu_stopped or time.process_time()
+        return BenchmarkStats(
+            video=self._video.stats(),
+            audio=self._audio.stats(),
+            expired=expired,
+            wall_time=stopped - (self._started or stopped),
+            cpu_time=cpu_stopped - (self._cpu_started or cpu_stopped)
+        )
+
+    def totals(self):
+        """
+        Counters without the percentile computation of :meth:`stats`,
+        cheap enough to poll during a session
+
+        Returns:
+            tuple: (video, audio) :class:`MediaTotals`
+        """
+        return self._video.totals(), self._audio.totals()
+
+    def report(self):
+        stats = self.stats()
+        lines = [
+            'Wall time: %.3fs, CPU time: %.3fs (%.0f%%), '
+            'expired frames: %d' % (
+                stats.wall_time, stats.cpu_time,
+                100.0 * stats.cpu_time / stats.wall_time
+                if stats.wall_time else 0, stats.expired
+            ),
+            '%-6s %8s %8s %8s %6s %8s %9s %9s %9s %9s' % (
+                'media', 'frames', 'decoded', 'dropped', 'late', 'fps',
+                'p50 ms', 'p95 ms', 'p99 ms', 'max ms'
+            )
+        ]
+        for name, media in (('video', stats.video), ('audio', stats.audio)):
+            times = [
+                '%9.3f' % (t * 1000) if t is not None else '%9s' % '-'
+                for t in (media.decode_p50, media.decode_p95,
+                          media.decode_p99, media.decode_max)
+            ]
+            lines.append('%-6s %8d %8d %8d %6d %8.1f %s' % (
+                name, media.frames, media.decoded, media.dropped,
+                media.late, media.fps, ' '.join(times)
+            ))
+        return '\n'.join(lines)
@@ -1,28 +1,79 @@
+from xbox.nano import h264
+from xbox.nano.recording import StreamRecorder, StreamKind, meta_path, \
+    format_meta
 from xbox.nano.render.client.base import Client
 from xbox.nano.render.audio.aac import AACFrame, AACProfile
+from xbox.nano.render.mux import Muxer
+from xbox.nano.render.writer import DiskWriter
 
 
 class FileClient(Client):
-    def __init__(self, filename, save_frames=False):
+    """
+    Records the session to disk.
+
+    By default video (Annex-B H.264) and audio (ADTS AAC) are written to
+    separate raw files, or one file per frame with `save_frames`. With
+    `container` (`mkv` or `mp4`) both are muxed into
+    `<filename>.<container>`, see :class:`.mux.Muxer`.
+
+    Raw files can be rotated every `segment_size` bytes or
+    `segment_duration` seconds (`<filename>.video.0000.raw`, ...) and get
+    a sidecar index (`<filename>.video.idx`) for seeking and clip
+    extraction, see :mod:`xbox.nano.recording`. Stream formats are
+    written to `<filename>.json` for playback.
+
+    All disk I/O runs on the thread of a :class:`.writer.DiskWriter`, a
+    default one is created on :meth:`open` if `writer` is omitted.
+    """
+    def __init__(self, filename, save_frames=False, container=None,
+                 writer=None, segment_size=None, segment_duration=None,
+                 index=True):
         self.filename = filename
         self.save_frames = save_frames
+        self.container = container
+        self.writer = writer
+        self.segment_size = segment_size
+        self.segment_duration = segment_duration
+        self.index = index
 
+        self._video_fmt = None
         self._audio_fmt = None
-        self._video_file = None
-        self._audio_file = None
+        self._video = None
+        self._audio = None
+        self._muxer = None
         self._video_frame_index = 0
         self._audio_frame_index = 0
         super(FileClient, self).__init__(None, None, None)
 
     def open(self, protocol):
-        if not self.save_frames:
-            self._video_file = open('%s.video.raw' % self.filename, 'wb')
-            self._audio_file = open('%s.audio.raw' % self.filename, 'wb')
+        self.protocol = protocol
+        if self.writer is None:
+            self.writer = DiskWriter()
+        self.writer.start()
+
+        if self.container:
+            self._muxer = Muxer(
+                '%s.%s' % (self.filename, self.container), self.container
+            )
+            if self._audio_fmt:
+                self._muxer.set_audio_format(self._audio_fmt)
+        elif not self.save_frames:
+            self._video = self._recorder(StreamKind.Video)
+            self._audio = self._recorder(StreamKind.Audio)
+            self._write_meta()
+
+    def _recorder(self, kind):
+        return StreamRecorder(
+            self.filename, kind, self.writer,
+            segment_size=self.segment_size,
+            segment_duration=self.segment_duration, index=self.index
+        )
 
     def close(self):
-        if not self.save_frames:
-            self._video_file.close()
-            self._audio_file.close()
+        if self._muxer:
+            # Writes the trailer, must not be dropped
+            self.writer.call(self._muxer.close, block=True)
+        self.writer.close()
 
     def loop(self):
         pass
@@ -30,38 +81,69 @@ class FileClient(Client):
     def pump(self):
         pass
 
+    def _write_meta(self):
+        if self._video and (self._video_fmt or self._audio_fmt):
+            self.writer.write_file(
+                meta_path(self.filename),
+                format_meta(self._video_fmt, self._audio_fmt)
+            )
+
     def set_video_format(self, video_fmt):
-        pass
+        self._video_fmt = video_fmt
+        self._write_meta()
 
     def set_audio_format(self, audio_fmt):
         self._audio_fmt = audio_fmt
+        if self._muxer:
+            self.writer.call(
+                self._muxer.set_audio_format, audio_fmt, block=True
+            )
+        self._write_meta()
 
-    def render_video(self, data):
+    def render_video(self, data, timestamp=None, frame_id=None):
+        if self._muxer:
+            self.writer.call(self._muxer.write_video, data, timestamp or 0)
         # Video frames can be written as-is
-        if not self.save_frames:
-            self._video_file.write(data)
+        elif not self.save_frames:
+            info = h264.scan_frame(data)
+            self._video.write(
+                data, timestamp or 0, frame_id or 0, info.keyframe,
+                parameter_sets=bool(info.sps and info.pps)
+            )
         else:
-            with open('%s.video.%08d.frame' % (self.filename, self._video_frame_index), 'wb') as f:
-                f.write(data)
+            self.writer.write_file(
+                '%s.video.%08d.frame' % (
+                    self.filename, self._video_frame_index
+                ), data
+            )
             self._video_frame_index += 1
 
-    def render_audio(self, data):
+    def render_audio(self, data, timestamp=None, frame_id=None):
         if not self._audio_fmt:
             raise Exception(
                 "No audio format set, cannot create frame header"
             )
+        if self._muxer:
+            self.writer.call(self._muxer.write_audio, data, timestamp or 0)
+            return
+
         # Audio frames need a header prepended
-        data = AACFrame.generate_header(
+        header = AACFrame.generate_header(
             len(data), AACProfile.Main,
             self._audio_fmt.sample_rate,
             self._audio_fmt.channels
-        ) + data
+        )
 
         if not self.save_frames:
-            self._audio_file.write(data)
+            self._audio.write(
+                data, timestamp or 0, frame_id or 0, header=header
+            )
         else:
-            with open('%s.audio.%08d.frame' % (self.filename, self._audio_frame_index), 'wb') as f:
-                f.write(data)
+            self.writer.write_file(
+                '%s.audio.%08d.frame' % (
+                    self.filename, self._audio_frame_index
+                ), header, data
+            )
             self._audio_frame_index += 1
 
     def send_input(self, frame, timestamp):
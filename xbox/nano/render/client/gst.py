@@ -149,10 +149,10 @@ class GstClient(Client):
     def set_audio_format(self, audio_fmt):
         pass
 
-    def render_video(self, data):
+    def render_video(self, data, timestamp=None, frame_id=None):
         self._video_frames.put(data)
 
-    def render_audio(self, data):
+    def render_audio(self, data, timestamp=None, frame_id=None):
         data = AACFrame.generate_header(len(data), AACProfile.Main, 48000, 2) + data
         self._audio_frames.put(data)
 
@@ -0,0 +1,160 @@
+import time
+import logging
+
+from xbox.nano.enum import ChannelClass
+from xbox.nano.recording import format_meta, parse_meta
+from xbox.nano.render.client.base import Client
+from xbox.nano.render.sink import Sink
+
+log = logging.getLogger(__name__)
+
+
+class RingTag(object):
+    Video = 0
+    Audio = 1
+    VideoFormat = 2
+    AudioFormat = 3
+    Close = 4
+
+
+# Seconds the end of stream and format changes wait for a full ring
+# to drain, the renderer can't continue without them
+CLOSE_TIMEOUT = 5.0
+
+
+class RingClient(Client):
+    """
+    Forwards media into a :class:`.ring.FrameRing`, for rendering in
+    another process by :class:`RingRenderer`.
+
+    A video frame dropped because the ring is full breaks decoding until
+    the next IDR frame, so a keyframe is requested.
+    """
+    def __init__(self, ring):
+        self.ring = ring
+        self.dropped = 0
+        super(RingClient, self).__init__(Sink(), Sink(), Sink())
+
+    def open(self, protocol):
+        self.protocol = protocol
+
+    def close(self):
+        self.ring.put(b'', RingTag.Close, wait=CLOSE_TIMEOUT)
+
+    def loop(self):
+        pass
+
+    def pump(self):
+        pass
+
+    def set_video_format(self, video_fmt):
+        self.ring.put(format_meta(video_fmt=video_fmt), RingTag.VideoFormat,
+                      wait=CLOSE_TIMEOUT)
+
+    def set_audio_format(self, audio_fmt):
+        self.ring.put(format_meta(audio_fmt=audio_fmt), RingTag.AudioFormat,
+                      wait=CLOSE_TIMEOUT)
+
+    def render_video(self, data, timestamp=None, frame_id=None):
+        if self.ring.put(data, RingTag.Video, timestamp or 0, frame_id or 0):
+            return
+        self.dropped += 1
+        channel = self.protocol and \
+            self.protocol.get_channel(ChannelClass.Video)
+        if channel:
+            channel.request_keyframe()
+
+    def render_audio(self, data, timestamp=None, frame_id=None):
+        if not self.ring.put(data, RingTag.Audio, timestamp or 0,
+                             frame_id or 0):
+            self.dropped += 1
+
+
+class RingRenderer(object):
+    """
+    Renders the records of a :class:`.ring.FrameRing` with a client, on
+    the calling thread. Frames are passed in place, as memoryviews.
+
+    Args:
+        ring (:class:`.ring.FrameRing`): Ring filled by a
+            :class:`RingClient`
+        client (:class:`.Client`): Client rendering the frames
+        pump_interval (float): Seconds between client pumps (e.g. SDL
+            event handling) while waiting for frames
+        producer: Process filling the ring (anything with `is_alive()`),
+            rendering ends once it died and the ring is drained, even if
+            its close record was lost
+    """
+    def __init__(self, ring, client, pump_interval=0.01, producer=None):
+        self.ring = ring
+        self.client = client
+        self.pump_interval = pump_interval
+        self.producer = producer
+        self.frames = 0
+        self._running = False
+
+    def stop(self):
+        self._running = False
+
+    def run(self):
+        """
+        Render until the producer closes or :meth:`stop` is called
+        """
+        client = self.client
+        ring = self.ring
+        client.open(None)
+
+        self._running = True
+        pumped = time.perf_counter()
+        try:
+            while self._running:
+                record = ring.get(timeout=self.pump_interval)
+                if record is not None:
+                    try:
+                        self._dispatch(record)
+                    finally:
+                        ring.release(record)
+                elif self.producer is not None and \
+                        not self.producer.is_alive():
+                    log.warning('Ring producer exited without closing')
+                    self._drain()
+                    break
+
+                now = time.perf_counter()
+                if now - pumped >= self.pump_interval:
+                    client.pump()
+                    pumped = now
+        finally:
+            client.close()
+
+    def _drain(self):
+        # Records published right before the producer died
+        ring = self.ring
+        record = ring.get(timeout=0)
+        while record is not None and self._running:
+            try:
+                self._dispatch(record)
+            finally:
+                ring.release(record)
+            record = ring.get(timeout=0)
+
+    def _dispatch(self, record):
+        tag = record.tag
+        if tag == RingTag.Video:
+            self.client.render_video(
+                record.data, record.timestamp, record.frame_id
+            )
+            self.frames += 1
+        elif tag == RingTag.Audio:
+            self.client.render_audio(
+                record.data, record.timestamp, record.frame_id
+            )
+            self.frames += 1
+        elif tag == RingTag.VideoFormat:
+            self.client.set_video_format(parse_meta(record.data)[0])
+        elif tag == RingTag.AudioFormat:
+            self.client.set_audio_format(parse_meta(record.data)[1])
+        elif tag == RingTag.Close:
+            self._running = False
+        else:
+            log.warning('Unknown ring record: %d', tag)
@@ -1,10 +1,13 @@
+import time
 import av
+from xbox.nano import metrics
 from xbox.nano.enum import VideoCodec, AudioCodec
 
 
 class FrameDecoder(object):
     def __init__(self, codec_name):
         self._decoder = av.Codec(codec_name, 'r').create()
+        self.codec_name = codec_name
 
     @classmethod
     def video(cls, codec_id):
@@ -30,4 +33,64 @@ class FrameDecoder(object):
 
     def decode(self, data):
         packet = av.packet.Packet(data)
-        return self._decoder.decode(packet)
+        decode_seconds = metrics.DECODE_SECONDS
+        if decode_seconds is None:
+            return self._decoder.decode(packet)
+
+        started = time.perf_counter()
+        frames = self._decoder.decode(packet)
+        decode_seconds.observe(
+            time.perf_counter() - started, codec=self.codec_name
+        )
+        return frames
+
+
+class FrameEncoder(object):
+    """
+    Encodes interleaved signed 16bit PCM into compressed audio packets.
+
+    Input has to be supplied in chunks of `frame_size` samples.
+    """
+    LAYOUTS = {1: 'mono', 2: 'stereo'}
+
+    def __init__(self, codec_name, sample_rate, channels):
+        self._encoder = av.CodecContext.create(codec_name, 'w')
+        self._encoder.sample_rate = sample_rate
+        self._encoder.layout = self.LAYOUTS[channels]
+        self._encoder.format = 's16'
+        self._encoder.open()
+
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._pts = 0
+
+    @classmethod
+    def audio(cls, codec_id, sample_rate, channels):
+        if AudioCodec.Opus == codec_id:
+            return cls('libopus', sample_rate, channels)
+        elif AudioCodec.AAC == codec_id:
+            return cls('aac', sample_rate, channels)
+        else:
+            raise Exception('FrameEncoder was supplied invalid AudioCodec')
+
+    @property
+    def frame_size(self):
+        """
+        Samples (per channel) the encoder consumes per packet
+        """
+        return self._encoder.frame_size
+
+    def encode(self, data):
+        samples = len(data) // (2 * self.channels)
+        frame = av.AudioFrame(
+            format='s16', layout=self.LAYOUTS[self.channels], samples=samples
+        )
+        frame.planes[0].update(data)
+        frame.sample_rate = self.sample_rate
+        frame.pts = self._pts
+        self._pts += samples
+
+        return [bytes(packet) for packet in self._encoder.encode(frame)]
+
+    def flush(self):
+        return [bytes(packet) for packet in self._encoder.encode(None)]
@@ -1,9 +1,9 @@
+import asyncio
 import logging
 from enum import Enum
 from datetime import datetime
 
 from xbox.nano.render.sink import Sink
-from xbox.nano.packet.input import frame, input_frame_buttons, input_frame_analog, input_frame_extension
 
 log = logging.getLogger(__name__)
 
@@ -82,22 +82,122 @@ FRAME_MAPPING_ANALOG = {
 }
 
 
+# Position of each field in the input frame payload
+FRAME_INDEX_BUTTONS = {k: i for i, k in enumerate(FRAME_MAPPING_BUTTONS)}
+FRAME_INDEX_ANALOG = {k: i for i, k in enumerate(FRAME_MAPPING_ANALOG)}
+
+DEFAULT_INPUT_READS_PER_SECOND = 120
+
+
 class InputError(Exception):
     pass
 
 
-class InputHandler(Sink):
+class InputFrameState(object):
+    """
+    Controller state, values are kept in input frame field order
+    so they can be packed without any lookup.
+    """
+    __slots__ = ('buttons', 'analog', 'extension')
+
     def __init__(self):
+        self.buttons = [0] * len(FRAME_MAPPING_BUTTONS)
+        self.analog = [0] * len(FRAME_MAPPING_ANALOG)
+        # byte_6: always 1 for gamepad
+        self.extension = [1, 0, 0, 0, 0, 0, 0, 0, 0]
+
+    def __repr__(self):
+        return '<InputFrameState buttons=%s analog=%s>' % (
+            dict(zip(FRAME_MAPPING_BUTTONS.values(), self.buttons)),
+            dict(zip(FRAME_MAPPING_ANALOG.values(), self.analog))
+        )
+
+
+class InputScheduler(object):
+    """
+    Rate limits input frames.
+
+    State changes marked via :meth:`mark_dirty` are coalesced and the latest
+    state is sent at most `rate` times per second. :meth:`send_now` bypasses
+    the schedule, e.g. for button edges.
+    """
+    def __init__(self, send_func, rate=DEFAULT_INPUT_READS_PER_SECOND):
+        self._send_func = send_func
+        self.interval = 1.0 / rate
+
+        self._loop = None
+        self._task = None
+        self._dirty = None
+        self._last_send = 0.0
+
+        self.frames_sent = 0
+        self.events_coalesced = 0
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._dirty = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def mark_dirty(self):
+        if not self.running:
+            # No scheduler loop, fall back to sending right away
+            self.send_now()
+        elif self._dirty.is_set():
+            self.events_coalesced += 1
+        else:
+            self._dirty.set()
+
+    def send_now(self):
+        if self._dirty:
+            self._dirty.clear()
+        if self._loop:
+            self._last_send = self._loop.time()
+
+        self.frames_sent += 1
+        self._send_func()
+
+    async def run(self):
+        while True:
+            await self._dirty.wait()
+
+            delay = self._last_send + self.interval - self._loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            # A button edge might have flushed the state in the meantime
+            if self._dirty.is_set():
+                self.send_now()
+
+
+class InputHandler(Sink):
+    def __init__(self, reads_per_second=None):
         self.client = None
+        self._reads_per_second = reads_per_second
+        self._scheduler = None
 
-        # Cache for button states
-        self._button_states = {k: 0 for k in FRAME_MAPPING_BUTTONS.values()}
-        self._analog_states = {k: 0 for k in FRAME_MAPPING_ANALOG.values()}
+        # Cache for button and analog states
+        self._state = InputFrameState()
+
+    @property
+    def scheduler(self):
+        return self._scheduler
 
     def open(self, client):
         """
         Initialize the input handler with a NanoClient instance
 
+        Input frames are sent at the rate given by `reads_per_second`,
+        falling back to the negotiated `inputReadsPerSecond` of the stream.
+
         Args:
             client (:class:`xbox.nano.protocol.NanoProtocol`): Instance of :class:`NanoProtocol`
 
@@ -106,13 +206,29 @@ class InputHandler(Sink):
         """
         self.client = client
 
+        rate = self._reads_per_second
+        if not rate:
+            config = getattr(client.protocol, 'config', None) or {}
+            rate = int(config.get(
+                'inputReadsPerSecond', DEFAULT_INPUT_READS_PER_SECOND
+            ))
+
+        self._scheduler = InputScheduler(self.send_frame, rate)
+        try:
+            self._scheduler.start()
+        except RuntimeError:
+            log.warning('No running event loop, sending input unthrottled')
+
+    def close(self):
+        if self._scheduler:
+            self._scheduler.stop()
+
+    @property
+    def state(self):
+        return self._state
+
     def send_frame(self):
-        packet = frame(
-            buttons=input_frame_buttons(**self._button_states).container,
-            analog=input_frame_analog(**self._analog_states).container,
-            extension=input_frame_extension(**dict(byte_6=1)).container
-        )
-        self.client.send_input(packet, datetime.utcnow())
+        self.client.send_input(self._state, datetime.utcnow())
 
     def controller_added(self, controller_index):
         self.client.controller_added(controller_index)
@@ -131,8 +247,8 @@ class InputHandler(Sink):
         Returns:
             None
         """
-        field_name = FRAME_MAPPING_BUTTONS[button]
-        current_val = self._button_states[field_name]
+        index = FRAME_INDEX_BUTTONS[button]
+        current_val = self._state.buttons[index]
 
         if current_val == 0 or (current_val % 2) == 0:
             current_state = GamepadButtonState.Released
@@ -146,9 +262,9 @@ class InputHandler(Sink):
             GamepadButton(button), GamepadButtonState(state)
         ))
 
-        # Cache button state
-        self._button_states[field_name] = current_val + 1
-        self.send_frame()
+        # Cache button state, edges are sent right away
+        self._state.buttons[index] = current_val + 1
+        self._scheduler.send_now()
 
     def set_axis(self, axis, value):
         """
@@ -161,9 +277,12 @@ class InputHandler(Sink):
         Returns:
             None
         """
-        field_name = FRAME_MAPPING_ANALOG[axis]
+        index = FRAME_INDEX_ANALOG[axis]
+
+        log.debug('Axis move: %s - Value: %i', axis, value)
 
-        log.debug('Axis move: %s - Value: %i' % (GamepadAxis(axis), value))
+        if self._state.analog[index] == value:
+            return
 
-        self._analog_states[field_name] = value
-        self.send_frame()
+        self._state.analog[index] = value
+        self._scheduler.mark_dirty()
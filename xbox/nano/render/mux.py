@@ -0,0 +1,240 @@
+"""
+Container muxing
+
+Muxes the received H.264 and AAC elementary streams into Matroska or MP4
+with PyAV, without re-encoding. Payload timestamps (microseconds) are used
+as PTS.
+
+Example:
+    >>> muxer = Muxer('session.mkv')
+    >>> muxer.set_audio_format(audio_fmt)
+    >>> muxer.write_video(annexb_frame, payload.timestamp)
+    >>> muxer.close()
+"""
+import io
+import logging
+from fractions import Fraction
+
+import av
+
+from xbox.nano import h264
+from xbox.nano.enum import AudioCodec
+from xbox.nano.render.audio.aac import AACFrame, AACProfile
+
+log = logging.getLogger(__name__)
+
+# Payload timestamps are microseconds
+TIME_BASE = Fraction(1, 1000000)
+
+
+class ContainerFormat(object):
+    Matroska = 'mkv'
+    MP4 = 'mp4'
+
+
+FORMAT_NAMES = {
+    ContainerFormat.Matroska: 'matroska',
+    ContainerFormat.MP4: 'mp4'
+}
+
+FORMAT_OPTIONS = {
+    # Fragmented, playable while recording and after a crash
+    ContainerFormat.MP4: {
+        'movflags': 'frag_keyframe+empty_moov+default_base_moof'
+    }
+}
+
+
+class MuxerError(Exception):
+    pass
+
+
+def _add_stream(output, template):
+    add = getattr(output, 'add_stream_from_template', None)
+    if add:
+        return add(template)
+    # PyAV < 13
+    return output.add_stream(template=template)
+
+
+def _template(data, fmt, kind):
+    """
+    Probe stream parameters from the first packet
+    """
+    probe = av.open(io.BytesIO(data), format=fmt)
+    streams = getattr(probe.streams, kind)
+    if not streams:
+        raise MuxerError('No %s stream in first packet' % kind)
+    return probe, streams[0]
+
+
+class Muxer(object):
+    """
+    Writes video and audio packets into a container file.
+
+    Stream parameters are taken from the first video keyframe (SPS / PPS)
+    and the first audio frame, so the container header is written once
+    both arrived. Until then up to `max_pending` packets are held back;
+    video before the first keyframe is dropped.
+
+    Video and audio payload timestamps are taken as one clock, rebased
+    to the first written packet.
+
+    Args:
+        path (str): Output file
+        container (str): :class:`ContainerFormat`, derived from the file
+            extension if omitted
+        max_pending (int): Packets held back waiting for the other stream
+    """
+    def __init__(self, path, container=None, max_pending=512):
+        if container is None:
+            container = path.rsplit('.', 1)[-1].lower()
+        if container not in FORMAT_NAMES:
+            raise MuxerError('Unsupported container: %s' % container)
+
+        self.path = path
+        self.container = container
+        self.max_pending = max_pending
+
+        self._output = None
+        self._closed = False
+        self._audio_fmt = None
+        self._video = None
+        self._audio = None
+        self._probes = []
+        self._origin = None
+        self._last_dts = {}
+
+        # (is_video, data, timestamp)
+        self._pending = []
+        self._video_ready = False
+        self._audio_ready = False
+
+        self.video_packets = 0
+        self.audio_packets = 0
+        self.dropped = 0
+
+    @property
+    def started(self):
+        return self._output is not None
+
+    def set_audio_format(self, audio_fmt):
+        """
+        Args:
+            audio_fmt: Negotiated audio format, only AAC can be muxed
+        """
+        if audio_fmt.codec != AudioCodec.AAC:
+            log.warning('Cannot mux %s audio, recording video only',
+                        audio_fmt.codec)
+            return
+        self._audio_fmt = audio_fmt
+
+    def write_video(self, data, timestamp):
+        """
+        Args:
+            data (bytes): Annex-B access unit
+            timestamp (int): Payload timestamp in microseconds
+        """
+        if not self._video_ready and not self.started:
+            if not h264.is_keyframe(data):
+                # Undecodable without preceding keyframe
+                self.dropped += 1
+                return
+            self._video_ready = True
+        self._write(True, data, timestamp)
+
+    def write_audio(self, data, timestamp):
+        """
+        Args:
+            data (bytes): Raw AAC frame
+            timestamp (int): Payload timestamp in microseconds
+        """
+        if not self._audio_fmt:
+            return
+        self._audio_ready = True
+        self._write(False, data, timestamp)
+
+    def _write(self, is_video, data, timestamp):
+        if self._closed:
+            raise MuxerError('Muxer is closed')
+        if self.started:
+            self._mux(is_video, data, timestamp)
+            return
+
+        self._pending.append((is_video, data, timestamp))
+        audio_done = self._audio_ready or self._audio_fmt is None
+        if (self._video_ready and audio_done) or \
+                len(self._pending) >= self.max_pending:
+            self._start()
+
+    def _start(self):
+        first_video = next((d for v, d, _ in self._pending if v), None)
+        first_audio = next((d for v, d, _ in self._pending if not v), None)
+
+        self._output = av.open(
+            self.path, 'w', format=FORMAT_NAMES[self.container],
+            options=FORMAT_OPTIONS.get(self.container, {})
+        )
+        if first_video is not None:
+            probe, template = _template(first_video, 'h264', 'video')
+            self._probes.append(probe)
+            self._video = _add_stream(self._output, template)
+            self._video.time_base = TIME_BASE
+        if first_audio is not None:
+            fmt = self._audio_fmt
+            header = AACFrame.generate_header(
+                len(first_audio), AACProfile.Main, fmt.sample_rate,
+                fmt.channels
+            )
+            probe, template = _template(
+                bytes(header) + first_audio, 'aac', 'audio'
+            )
+            self._probes.append(probe)
+            self._audio = _add_stream(self._output, template)
+            self._audio.time_base = TIME_BASE
+            # Raw frames, fragmented MP4 needs the config up front
+            self._audio.codec_context.extradata = AACFrame.generate_config(
+                AACProfile.Main, fmt.sample_rate, fmt.channels
+            )
+
+        self._origin = min(ts for _, _, ts in self._pending)
+        pending, self._pending = self._pending, []
+        for is_video, data, timestamp in pending:
+            self._mux(is_video, data, timestamp)
+
+    def _mux(self, is_video, data, timestamp):
+        stream = self._video if is_video else self._audio
+        if stream is None:
+            # Stream did not show up before the header was written
+            self.dropped += 1
+            return
+
+        # Timestamps must increase per stream
+        pts = max(
+            timestamp - self._origin, self._last_dts.get(is_video, -1) + 1
+        )
+        self._last_dts[is_video] = pts
+
+        packet = av.Packet(data)
+        packet.pts = packet.dts = pts
+        packet.time_base = TIME_BASE
+        packet.stream = stream
+        if is_video:
+            packet.is_keyframe = h264.is_keyframe(data)
+            self.video_packets += 1
+        else:
+            self.audio_packets += 1
+        self._output.mux(packet)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if not self.started and self._pending:
+            self._start()
+        if self._output:
+            self._output.close()
+            self._output = None
+        for probe in self._probes:
+            probe.close()
+        self._probes = []
@@ -0,0 +1,268 @@
+"""
+Shared memory frame ring
+
+Single producer / single consumer ring buffer in
+`multiprocessing.shared_memory` for handing frames between processes
+without pickling. The producer copies each frame into the ring once, the
+consumer reads it in place as a memoryview. A semaphore posted per record
+wakes the consumer and orders the memory accesses.
+
+Records are `[header][data]`, 8 byte aligned. A record not fitting before
+the end of the ring is preceded by a wrap marker. A full ring drops
+records instead of blocking the producer.
+
+Example:
+    >>> ring = FrameRing(8 << 20)
+    >>> # Pass `ring` to a multiprocessing.Process, in the producer:
+    >>> ring.put(frame, tag=VIDEO, timestamp=timestamp)
+    >>> # In the consumer:
+    >>> record = ring.get(timeout=0.1)
+    >>> sink.render(record.data)
+    >>> ring.release(record)
+"""
+import os
+import time
+import struct
+import logging
+import multiprocessing
+from typing import NamedTuple
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+log = logging.getLogger(__name__)
+
+# Control block, producer and consumer fields on separate cache lines
+_WRITE_POS = struct.Struct('<QQ')  # write position, dropped records
+_WRITE_OFFSET = 0
+_READ_POS = struct.Struct('<Q')
+_READ_OFFSET = 64
+_INFO = struct.Struct('<4sIQ')  # magic, version, capacity
+_INFO_OFFSET = 128
+DATA_OFFSET = 192
+
+RING_MAGIC = b'XNFR'
+RING_VERSION = 1
+
+# size, tag, timestamp, frame_id
+RECORD_HEADER = struct.Struct('<IIQI4x')
+ALIGNMENT = 8
+# Size field of a wrap marker
+_MARKER = struct.Struct('<I')
+_WRAP = 0xFFFFFFFF
+
+DEFAULT_CAPACITY = 16 << 20
+
+# Seconds between retries of a waiting put
+_WAIT_INTERVAL = 0.001
+
+
+class RingError(Exception):
+    pass
+
+
+class RingRecord(NamedTuple):
+    tag: int
+    timestamp: int
+    frame_id: int
+    # In place, valid until released
+    data: memoryview
+    # Read position after this record
+    end: int
+
+
+def _align(size):
+    return (size + ALIGNMENT - 1) & ~(ALIGNMENT - 1)
+
+
+class FrameRing(object):
+    """
+    Shared memory ring buffer of tagged frames.
+
+    The creating process owns the memory and unlinks it on :meth:`close`.
+    Pickling a ring (e.g. passing it as `multiprocessing.Process`
+    argument) attaches the other process to the same memory and
+    semaphore.
+
+    Args:
+        capacity (int): Data bytes, rounded up to :data:`ALIGNMENT`
+        name (str): Shared memory name, random if omitted
+        context: multiprocessing context the consumer / producer process
+            is started with
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY, name=None, context=None):
+        if shared_memory is None:
+            raise RingError('Shared memory requires Python 3.8')
+
+        capacity = _align(capacity)
+        self._shm = shared_memory.SharedMemory(
+            name=name, create=True, size=DATA_OFFSET + capacity
+        )
+        # Forked children inherit the object, only the creator unlinks
+        self._owner = os.getpid()
+        self._semaphore = (context or multiprocessing).Semaphore(0)
+        self._attach(capacity)
+        self._buf[:DATA_OFFSET] = bytes(DATA_OFFSET)
+        _INFO.pack_into(
+            self._buf, _INFO_OFFSET, RING_MAGIC, RING_VERSION, capacity
+        )
+
+    def _attach(self, capacity):
+        self.capacity = capacity
+        self._buf = self._shm.buf
+        # Producer side state
+        self._write = 0
+        self._dropped = 0
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'semaphore': self._semaphore}
+
+    def __setstate__(self, state):
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = None
+        self._semaphore = state['semaphore']
+        magic, version, capacity = _INFO.unpack_from(
+            self._shm.buf, _INFO_OFFSET
+        )
+        if magic != RING_MAGIC or version != RING_VERSION:
+            raise RingError('Not a frame ring: %s' % state['name'])
+        self._attach(capacity)
+        self._write, self._dropped = _WRITE_POS.unpack_from(
+            self._buf, _WRITE_OFFSET
+        )
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def dropped(self):
+        """
+        Records dropped by the producer, ring full
+        """
+        return _WRITE_POS.unpack_from(self._buf, _WRITE_OFFSET)[1]
+
+    @property
+    def pending(self):
+        """
+        Bytes written but not yet released
+        """
+        write, _ = _WRITE_POS.unpack_from(self._buf, _WRITE_OFFSET)
+        return write - _READ_POS.unpack_from(self._buf, _READ_OFFSET)[0]
+
+    def put(self, data, tag=0, timestamp=0, frame_id=0, wait=None):
+        """
+        Append a record, producer side
+
+        Args:
+            data (bytes): Frame, any buffer
+            tag (int): Record type, defined by the caller
+            timestamp (int): Payload timestamp
+            frame_id (int): Payload frame id
+            wait (float): Seconds to wait for the consumer to free space
+                instead of dropping right away, for records which must
+                arrive (e.g. end of stream)
+
+        Returns:
+            bool: False if the record was dropped, ring full
+        """
+        deadline = None if wait is None else time.monotonic() + wait
+        while not self._put(data, tag, timestamp, frame_id):
+            if deadline is None or time.monotonic() >= deadline:
+                self._dropped += 1
+                _WRITE_POS.pack_into(
+                    self._buf, _WRITE_OFFSET, self._write, self._dropped
+                )
+                return False
+            time.sleep(_WAIT_INTERVAL)
+        return True
+
+    def _put(self, data, tag, timestamp, frame_id):
+        size = len(data)
+        record_size = _align(RECORD_HEADER.size + size)
+        if record_size > self.capacity:
+            raise RingError('Record of %d bytes exceeds ring' % size)
+
+        write = self._write
+        offset = write % self.capacity
+        remaining = self.capacity - offset
+        skip = remaining if remaining < record_size else 0
+
+        read = _READ_POS.unpack_from(self._buf, _READ_OFFSET)[0]
+        if write + skip + record_size - read > self.capacity:
+            return False
+
+        buf = self._buf
+        if skip:
+            # Remaining space is at least ALIGNMENT bytes
+            _MARKER.pack_into(buf, DATA_OFFSET + offset, _WRAP)
+            write += skip
+            offset = 0
+
+        start = DATA_OFFSET + offset
+        RECORD_HEADER.pack_into(
+            buf, start, size, tag, timestamp, frame_id & 0xFFFFFFFF
+        )
+        start += RECORD_HEADER.size
+        buf[start:start + size] = data
+
+        self._write = write + record_size
+        _WRITE_POS.pack_into(buf, _WRITE_OFFSET, self._write, self._dropped)
+        # Publishes the record
+        self._semaphore.release()
+        return True
+
+    def get(self, timeout=None):
+        """
+        Next record, consumer side. Has to be passed to :meth:`release`
+        before the next call.
+
+        Args:
+            timeout (float): Seconds to wait, None blocks
+
+        Returns:
+            :class:`RingRecord`: Record or None on timeout
+        """
+        if not self._semaphore.acquire(timeout=timeout):
+            return None
+
+        buf = self._buf
+        read = _READ_POS.unpack_from(buf, _READ_OFFSET)[0]
+        offset = read % self.capacity
+        remaining = self.capacity - offset
+        if remaining < RECORD_HEADER.size or \
+                _MARKER.unpack_from(buf, DATA_OFFSET + offset)[0] == _WRAP:
+            read += remaining
+            offset = 0
+
+        start = DATA_OFFSET + offset
+        size, tag, timestamp, frame_id = \
+            RECORD_HEADER.unpack_from(buf, start)
+        start += RECORD_HEADER.size
+        return RingRecord(
+            tag, timestamp, frame_id, buf[start:start + size],
+            read + _align(RECORD_HEADER.size + size)
+        )
+
+    def release(self, record):
+        """
+        Free the space of a record, its data must no longer be used
+        """
+        record.data.release()
+        _READ_POS.pack_into(self._buf, _READ_OFFSET, record.end)
+
+    def close(self):
+        """
+        Detach, the owner also frees the shared memory
+        """
+        self._buf = None
+        try:
+            self._shm.close()
+        except BufferError:
+            log.warning('Frame ring %s still referenced', self.name)
+            return
+        if self._owner == os.getpid():
+            self._shm.unlink()
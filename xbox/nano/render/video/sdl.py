@@ -6,6 +6,7 @@ import sdl2
 import sdl2.ext
 
 from xbox.nano.enum import VideoCodec
+from xbox.nano.trace import Stage
 from xbox.nano.render.sink import Sink
 from xbox.nano.render.codec import FrameDecoder
 
@@ -27,10 +28,12 @@ class SDLVideoRenderer(Sink):
         self._texture = None
         self._decoder = None
         self._fmt = None
+        self._tracer = None
 
         self._lock = threading.Lock()
 
     def open(self, client):
+        self._tracer = client.tracer
         sdl2.ext.init()
         self._window = sdl2.ext.Window(
             self.TITLE, self._window_dimensions,
@@ -73,6 +76,8 @@ class SDLVideoRenderer(Sink):
         renderer = self._renderer.sdlrenderer
         try:
             for frame in self._decoder.decode(data):
+                if self._tracer:
+                    self._tracer.stamp_current(Stage.Decoded)
                 self._lock.acquire()
                 intp = POINTER(c_ubyte)
                 sdl2.SDL_UpdateYUVTexture(
@@ -85,6 +90,8 @@ class SDLVideoRenderer(Sink):
                 sdl2.SDL_RenderClear(renderer)
                 sdl2.SDL_RenderCopy(renderer, self._texture, None, None)
                 sdl2.SDL_RenderPresent(renderer)
+                if self._tracer:
+                    self._tracer.stamp_current(Stage.Presented)
         except Exception as e:
             log.debug('SDLVideoRenderer.render: {0}'.format(e))
 
@@ -0,0 +1,316 @@
+"""
+Background disk writer
+
+Moves file I/O of recordings off the event loop. Writes are queued and
+performed by a worker thread, either coalesced into large aligned writes
+or gathered with `os.writev`. A full queue drops writes instead of
+stalling the caller.
+
+Example:
+    >>> writer = DiskWriter()
+    >>> writer.start()
+    >>> writer.append('video.raw', frame)
+    >>> writer.write_file('frame.00000001', header, payload)
+    >>> writer.close()
+"""
+import os
+import time
+import queue
+import logging
+import threading
+
+from xbox.nano import metrics
+
+log = logging.getLogger(__name__)
+
+# Buffered writes are issued in multiples of this
+ALIGNMENT = 4096
+
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+LAG_BUCKETS = (
+    0.001, 0.004, 0.016, 0.066, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+_APPEND = 0
+_FILE = 1
+_CALL = 2
+_CLOSE = 3
+_STOP = 4
+
+FILE_FLAGS = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+
+
+def _write_all(fd, buffers):
+    """
+    Write buffers, gathered with writev where available
+    """
+    if not hasattr(os, 'writev'):
+        for buf in buffers:
+            view = memoryview(buf)
+            while view:
+                view = view[os.write(fd, view):]
+        return
+
+    for i in range(0, len(buffers), IOV_MAX):
+        chunk = buffers[i:i + IOV_MAX]
+        total = sum(len(buf) for buf in chunk)
+        written = os.writev(fd, chunk)
+        if written < total:
+            # Short write, finish the remainder
+            rest = memoryview(b''.join(chunk))[written:]
+            while rest:
+                rest = rest[os.write(fd, rest):]
+
+
+class _StreamFile(object):
+    def __init__(self, path, buffer_size):
+        self.fd = os.open(path, FILE_FLAGS | os.O_TRUNC, 0o644)
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+
+    def append(self, buffers):
+        for buf in buffers:
+            self.buffer += buf
+        if len(self.buffer) >= self.buffer_size:
+            size = len(self.buffer) - len(self.buffer) % ALIGNMENT
+            _write_all(self.fd, [memoryview(self.buffer)[:size]])
+            del self.buffer[:size]
+
+    def close(self):
+        if self.buffer:
+            _write_all(self.fd, [self.buffer])
+            self.buffer = bytearray()
+        os.close(self.fd)
+
+
+class DiskWriter(object):
+    """
+    Writes files on a background thread.
+
+    Args:
+        max_queue (int): Pending writes, further writes are dropped
+            (or block with `block`)
+        buffer_size (int): Per file write buffer, flushed in multiples of
+            :data:`ALIGNMENT`
+        writev (bool): Gather queued buffers with `os.writev` instead of
+            copying them into the write buffer
+        block (bool): Wait for room in the queue instead of dropping
+        registry (:class:`.metrics.Registry`): Registry to export the
+            writer metrics to, e.g. :data:`.metrics.REGISTRY`. The names
+            are fixed, so one writer per registry
+    """
+    def __init__(self, max_queue=1024, buffer_size=1 << 20, writev=False,
+                 block=False, registry=None):
+        self.buffer_size = buffer_size
+        self.writev = writev and hasattr(os, 'writev')
+        self.block = block
+        self.registry = registry
+
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+        self._queue = queue.Queue(max_queue)
+        self._files = {}
+        self._thread = None
+
+        self.lag_seconds = metrics.Histogram(
+            'xbox_nano_writer_lag_seconds',
+            'Time writes waited in the queue of the writer thread',
+            buckets=LAG_BUCKETS
+        )
+        self.queue_depth = metrics.Gauge(
+            'xbox_nano_writer_queue_depth', 'Writes waiting for the disk'
+        )
+        self.bytes_total = metrics.Counter(
+            'xbox_nano_writer_bytes_total', 'Bytes written to disk'
+        )
+        self.dropped_total = metrics.Counter(
+            'xbox_nano_writer_dropped_total', 'Writes dropped, queue full'
+        )
+        self._metrics = (
+            self.lag_seconds, self.queue_depth, self.bytes_total,
+            self.dropped_total
+        )
+        if registry is not None:
+            for metric in self._metrics:
+                registry.register(metric)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._thread = threading.Thread(
+            target=self._run, name='DiskWriter', daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, item, block=None):
+        try:
+            self._queue.put(
+                item, block=self.block if block is None else block
+            )
+        except queue.Full:
+            self.dropped += 1
+            self.dropped_total.inc()
+            return False
+        self.queue_depth.set(self._queue.qsize())
+        return True
+
+    def append(self, path, *buffers, block=None):
+        """
+        Append buffers to a file, opened (truncated) on first use
+
+        Args:
+            block (bool): Wait for room in the queue, overrides the
+                writer default
+
+        Returns:
+            bool: False if the write was dropped
+        """
+        return self._put((_APPEND, path, buffers, time.perf_counter()), block)
+
+    def write_file(self, path, *buffers):
+        """
+        Write a complete file
+
+        Returns:
+            bool: False if the write was dropped
+        """
+        return self._put((_FILE, path, buffers, time.perf_counter()))
+
+    def call(self, func, *args, block=None):
+        """
+        Run `func(*args)` on the writer thread, in order with the writes
+
+        Args:
+            block (bool): Wait for room in the queue, overrides the
+                writer default. For calls which must not be dropped,
+                e.g. finalizing a file
+
+        Returns:
+            bool: False if the call was dropped
+        """
+        return self._put((_CALL, func, args, time.perf_counter()), block)
+
+    def close_file(self, path):
+        """
+        Flush and close a file written with :meth:`append`, e.g. a
+        finished segment. Appending again truncates it.
+        """
+        # Never dropped, the descriptor would leak
+        self._put((_CLOSE, path, (), time.perf_counter()), block=True)
+
+    def flush(self):
+        """
+        Wait until all queued writes were performed; buffered data is
+        written out on :meth:`close`
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Perform pending writes, close files and stop the thread
+        """
+        if self.running:
+            self._queue.put((_STOP, None, None, None))
+            self._thread.join()
+        self._thread = None
+        self._close_files()
+
+        if self.registry is not None:
+            for metric in self._metrics:
+                self.registry.unregister(metric)
+
+    def _close_files(self):
+        for path, stream in self._files.items():
+            try:
+                stream.close()
+            except OSError:
+                log.exception('Failed to close %s', path)
+        self._files = {}
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Drain what is queued to gather it into few syscalls
+            while len(batch) < IOV_MAX:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            try:
+                stop = self._process(batch)
+            finally:
+                self.queue_depth.set(self._queue.qsize())
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def _process(self, batch):
+        # path -> buffers, for writev mode
+        gathered = {}
+        for kind, target, args, queued in batch:
+            if kind == _STOP:
+                self._flush_gathered(gathered)
+                return True
+
+            try:
+                if kind == _APPEND:
+                    stream = self._files.get(target)
+                    if stream is None:
+                        stream = self._files[target] = \
+                            _StreamFile(target, self.buffer_size)
+                    if self.writev:
+                        gathered.setdefault(target, []).extend(args)
+                    else:
+                        stream.append(args)
+                elif kind == _FILE:
+                    # Pending appends go first
+                    self._flush_gathered(gathered)
+                    fd = os.open(target, FILE_FLAGS | os.O_TRUNC, 0o644)
+                    try:
+                        _write_all(fd, list(args))
+                    finally:
+                        os.close(fd)
+                elif kind == _CALL:
+                    self._flush_gathered(gathered)
+                    target(*args)
+                    continue
+                elif kind == _CLOSE:
+                    self._flush_gathered(gathered)
+                    stream = self._files.pop(target, None)
+                    if stream:
+                        stream.close()
+                    continue
+            except Exception:
+                self.errors += 1
+                log.exception('Disk write failed: %s', target)
+                continue
+
+            size = sum(len(buf) for buf in args)
+            self.written += size
+            self.bytes_total.inc(size)
+            self.lag_seconds.observe(time.perf_counter() - queued)
+
+        self._flush_gathered(gathered)
+        return False
+
+    def _flush_gathered(self, gathered):
+        for path, buffers in gathered.items():
+            try:
+                _write_all(self._files[path].fd, buffers)
+            except OSError:
+                self.errors += 1
+                log.exception('Disk write failed: %s', path)
+        gathered.clear()
@@ -0,0 +1,353 @@
+"""
+PCAP replay
+
+Feeds the console side of a captured session into a :class:`NanoProtocol`
+without network access, paced by the capture timestamps.
+
+:class:`RecordingPlayer` plays a :class:`.FileClient` recording into a
+client instead, skipping capture parsing and the protocol stack.
+
+Example:
+    >>> engine = ReplayEngine(FileClient('out'), speed=2)
+    >>> packets = read_session('session.pcap', tcp_port, udp_port)
+    >>> stats = await engine.run(packets)
+    >>> print(stats.report())
+
+    >>> with RecordingReader('out') as reader:
+    ...     stats = await RecordingPlayer(BenchmarkClient()).run(reader)
+"""
+import time
+import random
+import asyncio
+import logging
+from collections import defaultdict
+
+from xbox.nano.capture import Transport
+from xbox.nano.recording import StreamKind
+from xbox.nano.backend import PackerBackend
+from xbox.nano.trace import FrameTracer, Stage
+from xbox.nano.protocol import NanoProtocol, StreamerProtocol, ControlProtocol
+
+log = logging.getLogger(__name__)
+
+
+class ReplayControlProtocol(ControlProtocol):
+    def _send(self, msgs):
+        pass
+
+
+class ReplayStreamerProtocol(StreamerProtocol):
+    def send_message(self, msg):
+        pass
+
+    def send_data(self, data):
+        pass
+
+
+class ReplayStats(object):
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.reordered = 0
+        self.late = 0
+        self.max_lag = 0.0
+        self.duration = 0.0
+        self.capture_duration = 0.0
+        # Stage name -> [count, seconds]
+        self.stages = defaultdict(lambda: [0, 0.0])
+
+    def add(self, stage, seconds):
+        entry = self.stages[stage]
+        entry[0] += 1
+        entry[1] += seconds
+
+    def report(self, tracer=None):
+        lines = [
+            'Replayed %d packets (%d bytes) in %.3fs, capture spans %.3fs' % (
+                self.packets, self.bytes, self.duration, self.capture_duration
+            ),
+            'Injected loss: %d, reordered: %d' % (
+                self.dropped, self.reordered
+            ),
+            'Behind schedule: %d packets, max lag %.1fms' % (
+                self.late, self.max_lag * 1000
+            ),
+            '%-16s %10s %12s %12s' % ('stage', 'count', 'total ms', 'mean us')
+        ]
+
+        stages = [(name, count, total)
+                  for name, (count, total) in self.stages.items()]
+        if tracer:
+            for stage in list(Stage)[1:]:
+                count, total = tracer.stage_seconds.totals(stage=stage.name)
+                stages.append(('frame ' + stage.name, count, total))
+
+        for name, count, total in stages:
+            if not count:
+                continue
+            lines.append('%-16s %10d %12.3f %12.1f' % (
+                name, count, total * 1000, total * 1e6 / count
+            ))
+        return '\n'.join(lines)
+
+
+class ReplayEngine(object):
+    """
+    Args:
+        client (:class:`.Client`): Client receiving the replayed session
+        speed (float): Playback speed multiplier, None or 0 replays as
+            fast as possible
+        loss (float): Probability to drop a UDP datagram
+        reorder (float): Probability to swap a UDP datagram with its
+            successor
+        seed (int): Seed for loss and reorder injection
+        packer_backend (str): Member of :class:`.PackerBackend`
+        tracer (:class:`.FrameTracer`): Frame tracer, one without registry
+            is created by default
+    """
+    # Packets between yields to the event loop when not pacing
+    YIELD_INTERVAL = 64
+
+    def __init__(self, client, speed=1.0, loss=0.0, reorder=0.0, seed=None,
+                 packer_backend=PackerBackend.Construct, tracer=None):
+        self.client = client
+        self.speed = speed
+        self.loss = loss
+        self.reorder = reorder
+        self.packer_backend = packer_backend
+        self.tracer = tracer or FrameTracer()
+
+        self.random = random.Random(seed)
+        self.protocol = None
+        self.stats = ReplayStats()
+
+    def _setup(self):
+        proto = NanoProtocol(
+            self.client, None, None, None, None,
+            packer_backend=self.packer_backend, tracer=self.tracer
+        )
+        proto.control_protocol = ReplayControlProtocol('', 0, proto)
+        proto.streamer_protocol = ReplayStreamerProtocol(proto)
+
+        proto.control_protocol.on_message += proto._on_control_message
+        proto.streamer_protocol.on_message += proto._on_streamer_message
+
+        self.client.open(proto)
+        return proto
+
+    def _inject(self, packets):
+        """
+        Apply loss / reorder injection to datagrams from the console
+        """
+        held = None
+        for packet in packets:
+            if packet.transport != Transport.UDP or packet.from_client:
+                yield packet
+                continue
+
+            if self.loss and self.random.random() < self.loss:
+                self.stats.dropped += 1
+                continue
+
+            if held is None and self.reorder and \
+                    self.random.random() < self.reorder:
+                held = packet
+                continue
+
+            yield packet
+            if held is not None:
+                self.stats.reordered += 1
+                yield held._replace(timestamp=packet.timestamp)
+                held = None
+
+        if held is not None:
+            yield held
+
+    async def _deliver(self, packet):
+        started = time.perf_counter()
+        if packet.transport == Transport.TCP:
+            await self.protocol.control_protocol.handle(packet.data)
+            stage = 'control'
+        else:
+            self.protocol.streamer_protocol.datagram_received(
+                packet.data, (self.protocol.remote_addr, 0)
+            )
+            stage = 'streamer'
+        self.stats.add(stage, time.perf_counter() - started)
+
+    async def run(self, packets):
+        """
+        Replay packets, see :func:`.capture.read_session`.
+
+        Only packets sent by the console are delivered.
+
+        Returns:
+            :class:`ReplayStats`: Statistics of the replay
+        """
+        self.protocol = self._setup()
+        stats = self.stats
+
+        first_ts = None
+        started = time.perf_counter()
+        read_started = started
+
+        for packet in self._inject(packets):
+            now = time.perf_counter()
+            stats.add('capture', now - read_started)
+
+            if packet.from_client:
+                read_started = time.perf_counter()
+                continue
+
+            if first_ts is None:
+                first_ts = packet.timestamp
+            offset = packet.timestamp - first_ts
+            stats.capture_duration = max(stats.capture_duration, offset)
+
+            if self.speed:
+                delay = started + offset / self.speed - now
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                elif delay < -0.001:
+                    stats.late += 1
+                    stats.max_lag = max(stats.max_lag, -delay)
+            elif stats.packets % self.YIELD_INTERVAL == 0:
+                await asyncio.sleep(0)
+
+            await self._deliver(packet)
+            stats.packets += 1
+            stats.bytes += len(packet.data)
+            read_started = time.perf_counter()
+
+        stats.duration = time.perf_counter() - started
+        self.client.close()
+        return stats
+
+    def report(self):
+        return self.stats.report(self.tracer)
+
+
+class PlaybackStats(object):
+    def __init__(self):
+        # Kind -> [frames, bytes, render seconds]
+        self.media = defaultdict(lambda: [0, 0, 0.0])
+        self.late = 0
+        self.max_lag = 0.0
+        self.duration = 0.0
+        self.recording_duration = 0.0
+
+    @property
+    def frames(self):
+        return sum(frames for frames, _, _ in self.media.values())
+
+    def report(self):
+        lines = [
+            'Played %d frames in %.3fs, recording spans %.3fs' % (
+                self.frames, self.duration, self.recording_duration
+            ),
+            'Behind schedule: %d frames, max lag %.1fms' % (
+                self.late, self.max_lag * 1000
+            ),
+            '%-6s %10s %12s %12s %12s' % (
+                'media', 'frames', 'bytes', 'total ms', 'mean us'
+            )
+        ]
+        for kind, (frames, size, seconds) in sorted(self.media.items()):
+            lines.append('%-6s %10d %12d %12.3f %12.1f' % (
+                kind, frames, size, seconds * 1000,
+                seconds * 1e6 / frames if frames else 0
+            ))
+        return '\n'.join(lines)
+
+
+class RecordingPlayer(object):
+    """
+    Plays a recording into a client at its original cadence.
+
+    Frames are passed as memoryviews straight from the mapped files, so
+    any client (e.g. a :class:`.Client` with SDL sinks, or
+    :class:`.BenchmarkClient`) sees real content without capture parsing
+    or depacketizing.
+
+    Args:
+        client (:class:`.Client`): Client receiving the frames
+        speed (float): Playback speed multiplier, None or 0 plays as fast
+            as possible
+        kinds (tuple): :class:`.StreamKind` to play, all by default
+    """
+    # Frames between yields to the event loop when not pacing
+    YIELD_INTERVAL = 64
+
+    def __init__(self, client, speed=1.0, kinds=None):
+        self.client = client
+        self.speed = speed
+        self.kinds = kinds
+        self.stats = PlaybackStats()
+
+    async def run(self, reader, start=None, end=None):
+        """
+        Args:
+            reader (:class:`.RecordingReader`): Open recording
+            start (int): Payload timestamp in microseconds
+            end (int): Payload timestamp in microseconds
+
+        Returns:
+            :class:`PlaybackStats`: Statistics of the playback
+        """
+        client = self.client
+        stats = self.stats
+        client.open(None)
+
+        video_fmt, audio_fmt = reader.video_format, reader.audio_format
+        if video_fmt:
+            client.set_video_format(video_fmt)
+        if audio_fmt:
+            client.set_audio_format(audio_fmt)
+        render = {
+            StreamKind.Video: client.render_video,
+            # Audio needs the format for its header
+            StreamKind.Audio: client.render_audio if audio_fmt else None
+        }
+
+        first_ts = None
+        started = time.perf_counter()
+        try:
+            for frame in reader.interleaved(start, end):
+                handler = render.get(frame.kind)
+                if not handler or (self.kinds and
+                                   frame.kind not in self.kinds):
+                    continue
+
+                if first_ts is None:
+                    first_ts = frame.timestamp
+                # Microseconds
+                offset = (frame.timestamp - first_ts) / 1000000.0
+                stats.recording_duration = max(
+                    stats.recording_duration, offset
+                )
+
+                now = time.perf_counter()
+                if self.speed:
+                    delay = started + offset / self.speed - now
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    elif delay < -0.001:
+                        stats.late += 1
+                        stats.max_lag = max(stats.max_lag, -delay)
+                elif stats.frames % self.YIELD_INTERVAL == 0:
+                    await asyncio.sleep(0)
+
+                rendered = time.perf_counter()
+                handler(frame.data, frame.timestamp, frame.frame_id)
+                media = stats.media[frame.kind]
+                media[0] += 1
+                media[1] += len(frame.data)
+                media[2] += time.perf_counter() - rendered
+        finally:
+            stats.duration = time.perf_counter() - started
+            client.close()
+        return stats
+
+    def report(self):
+        return self.stats.report()
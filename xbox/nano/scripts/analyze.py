@@ -0,0 +1,47 @@
+import csv
+import sys
+import logging
+import argparse
+from xbox.nano.analysis import COLUMNS, analyze, format_table, total
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description='Analyze PCAP files of SG sessions in parallel'
+    )
+    parser.add_argument('files', nargs='+', help='Paths to PCAP / PCAPNG')
+    parser.add_argument('--tcp-port', type=int,
+                        help='Server TCP Port (console), detected if omitted')
+    parser.add_argument('--udp-port', type=int,
+                        help='Server UDP Port (console), detected if omitted')
+    parser.add_argument('--jobs', '-j', type=int,
+                        help='Worker processes, defaults to CPU count')
+    parser.add_argument('--csv', metavar='FILE',
+                        help='Write summary as CSV ("-" for stdout)')
+    args = parser.parse_args()
+
+    results = analyze(args.files, tcp_port=args.tcp_port,
+                      udp_port=args.udp_port, jobs=args.jobs)
+
+    if args.csv:
+        rows = [stats.row() for stats in results]
+        if len(results) > 1:
+            rows.append(total(results).row())
+        f = sys.stdout if args.csv == '-' else open(args.csv, 'w', newline='')
+        try:
+            writer = csv.DictWriter(f, [name for name, _, _ in COLUMNS])
+            writer.writeheader()
+            writer.writerows(rows)
+        finally:
+            if f is not sys.stdout:
+                f.close()
+        if args.csv == '-':
+            return
+
+    print(format_table(results))
+
+
+if __name__ == '__main__':
+    main()
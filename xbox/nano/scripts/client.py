@@ -9,6 +9,11 @@ from xbox.sg.console import Console
 from xbox.sg.enum import ConnectionState
 
 from xbox.nano.manager import NanoManager
+from xbox.nano.backend import PackerBackend
+from xbox.nano.metrics import NanoMetrics, MetricsServer, REGISTRY, \
+    enable_media_metrics
+from xbox.nano.trace import FrameTracer
+from xbox.nano.profiler import ProfilerMode, profiled
 from xbox.nano.render.client import SDLClient
 
 
@@ -17,12 +22,7 @@ def on_gamestream_error(error_msg) -> None:
     sys.exit(1)
 
 
-async def async_main():
-    parser = argparse.ArgumentParser(description="Basic smartglass NANO client")
-    parser.add_argument('--address', '-a',
-                        help="IP address of console")
-    args = parser.parse_args()
-
+async def async_main(args):
     logging.basicConfig(level=logging.DEBUG)
 
     discovered = await Console.discover(timeout=1, addr=args.address)
@@ -41,22 +41,65 @@ async def async_main():
         await console.nano.start_stream()
         await console.wait(2)
 
+        if args.metrics_port is not None:
+            enable_media_metrics(REGISTRY)
+
+        tracer = None
+        if args.trace:
+            tracer = FrameTracer(
+                REGISTRY if args.metrics_port is not None else None,
+                record_events=True
+            )
+
         client = SDLClient(1280, 720)
-        await console.nano.start_gamestream(client)
+        await console.nano.start_gamestream(
+            client, packer_backend=args.packer, tracer=tracer
+        )
+
+        if args.metrics_port is not None:
+            NanoMetrics(console.nano.protocol, REGISTRY)
+            MetricsServer(args.metrics_address, args.metrics_port).start()
 
         try:
             while True:
                 await console.wait(5.0)
         except KeyboardInterrupt:
             pass
+        finally:
+            if tracer:
+                tracer.write_chrome_trace(args.trace)
     else:
         print("No consoles discovered")
         sys.exit(1)
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Basic smartglass NANO client"
+    )
+    parser.add_argument('--address', '-a',
+                        help="IP address of console")
+    parser.add_argument('--packer', default=PackerBackend.Construct,
+                        choices=[PackerBackend.Construct, PackerBackend.Fast,
+                                 PackerBackend.Verify],
+                        help="Packer backend")
+    parser.add_argument('--metrics-port', type=int,
+                        help="Serve Prometheus metrics on this port")
+    parser.add_argument('--metrics-address', default='127.0.0.1',
+                        help="Address to serve metrics on")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="Trace video frame latency, write Chrome trace "
+                             "events to FILE on exit")
+    parser.add_argument('--profile',
+                        choices=[ProfilerMode.Sampling, ProfilerMode.Scoped],
+                        help="Profile the session, print a report on exit")
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help="Write profile data (folded stacks or pstats)")
+    args = parser.parse_args()
+
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(async_main())
+    with profiled(args.profile, args.profile_output, SDLClient):
+        loop.run_until_complete(async_main(args))
 
 
 if __name__ == "__main__":
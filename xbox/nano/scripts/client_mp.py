@@ -1,119 +1,98 @@
+"""
+Multi-process client
+
+The protocol runs in a child process and writes reassembled frames into a
+shared memory ring (:class:`.FrameRing`). The main process renders them
+in place with SDL, so reception and decoding run on separate cores.
+"""
 import asyncio
 import logging
-import threading
+import argparse
 import multiprocessing
-from construct import Container
-
-from xbox.nano.render.client import Client
-from xbox.nano.render.sink import Sink
-from xbox.nano.render.video.sdl import SDLVideoRenderer
-from xbox.nano.render.audio.sdl import SDLAudioRenderer
-
-
-class BlockingClient(Client):
-    def start_loop(self):
-        self.loop()
-
-    def loop(self):
-        self._running = True
-        while self._running:
-            self.pump()
-
-
-class PipedSink(Sink):
-    def __init__(self, pipe):
-        self.pipe = pipe
 
-    def open(self, client):
-        # Ignore client for now, only needed for input
-        self.pipe.send('open')
+from xbox.nano.render.ring import FrameRing, DEFAULT_CAPACITY
+from xbox.nano.render.client.ring import RingClient, RingRenderer, RingTag, \
+    CLOSE_TIMEOUT
 
-    def close(self):
-        self.pipe.send('close')
+log = logging.getLogger(__name__)
 
-    def setup(self, fmt):
-        self.pipe.send(fmt)
 
-    def render(self, data):
-        self.pipe.send(data)
-
-
-async def protocol_runner(video_pipe, audio_pipe):
+async def protocol_runner(ring):
     from xbox.sg.console import Console
     from xbox.nano.manager import NanoManager
-    from xbox.nano.render.client import Client
-
-    logging.basicConfig(level=logging.DEBUG)
 
     consoles = await Console.discover(timeout=1)
-    if len(consoles):
-        console = consoles[0]
-
-        console.add_manager(NanoManager)
-        await console.connect()
-        await console.wait(1)
-        print('connected')
-        await console.nano.start_stream()
-        await console.wait(2)
-
-        client = Client(PipedSink(video_pipe), PipedSink(audio_pipe), Sink())
-        await console.nano.start_gamestream(client)
-        print('stream started')
-        try:
-            while True:
-                await asyncio.sleep(5.0)
-        except KeyboardInterrupt:
-            pass
-
-    print('protocol_runner exit')
-
-
-def sink_pump(pipe, sink):
+    if not len(consoles):
+        log.error('No console found')
+        return
+
+    console = consoles[0]
+    console.add_manager(NanoManager)
+    await console.connect()
+    await console.wait(1)
+    log.info('Connected to %s', console)
+    await console.nano.start_stream()
+    await console.wait(2)
+
+    await console.nano.start_gamestream(RingClient(ring))
+    log.info('Stream started')
     while True:
-        data = pipe.recv()
-        if isinstance(data, Container):
-            sink.setup(data)
-        elif data == 'open':
-            # sink.open(None)
-            pass
-        elif data == 'close':
-            sink.close()
-        else:
-            sink.render(data)
+        await asyncio.sleep(5.0)
 
 
-async def async_main():
-    logging.basicConfig(level=logging.DEBUG)
+def protocol_process(ring):
+    """
+    Target of the protocol process, runs the asyncio protocol stack
+    """
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(protocol_runner(ring))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Unblock the renderer, e.g. if no console was found
+        ring.put(b'', RingTag.Close, wait=CLOSE_TIMEOUT)
+        ring.close()
 
-    vparent, vchild = multiprocessing.Pipe()
-    aparent, achild = multiprocessing.Pipe()
-    protocol_proc = multiprocessing.Process(
-        target=protocol_runner, args=(vchild, achild)
-    )
-    protocol_proc.start()
 
-    client = BlockingClient(
-        SDLVideoRenderer(1280, 720),
-        SDLAudioRenderer(),
-        Sink()
-    )
+def main():
+    logging.basicConfig(level=logging.INFO)
 
-    video_pumper = threading.Thread(
-        target=sink_pump, args=(vparent, client.video)
+    parser = argparse.ArgumentParser(
+        description='Stream with protocol and rendering in separate '
+                    'processes'
     )
-    video_pumper.start()
+    parser.add_argument('--ring-size', type=int, default=DEFAULT_CAPACITY,
+                        help='Shared memory frame ring size in bytes')
+    args = parser.parse_args()
 
-    audio_pumper = threading.Thread(
-        target=sink_pump, args=(aparent, client.audio)
-    )
-    audio_pumper.start()
+    from xbox.nano.render.client import SDLClient
 
-    client.open(None)
+    class RenderClient(SDLClient):
+        def start_loop(self):
+            # Pumped by the RingRenderer
+            pass
 
+    context = multiprocessing.get_context('spawn')
+    ring = FrameRing(args.ring_size, context=context)
+    protocol_proc = context.Process(
+        target=protocol_process, args=(ring,), name='NanoProtocol'
+    )
+    protocol_proc.start()
 
-def main():
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(async_main())
+    renderer = RingRenderer(
+        ring, RenderClient(1280, 720), producer=protocol_proc
+    )
+    try:
+        renderer.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        protocol_proc.terminate()
+        protocol_proc.join()
+        log.info('Rendered %d frames, %d dropped', renderer.frames,
+                 ring.dropped)
+        ring.close()
 
 
 if __name__ == '__main__':
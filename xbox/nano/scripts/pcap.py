@@ -1,11 +1,15 @@
-import dpkt
+import os
+import sys
 import shutil
 import textwrap
 import argparse
-from xbox.nano import packer
+from collections import Counter
+from xbox.nano import packer, xpacker, export
+from xbox.nano.capture import Transport, read_session
 from xbox.nano.channel import Channel
 from xbox.nano.enum import RtpPayloadType, ChannelClass, \
-    ChannelControlPayloadType
+    ChannelControlPayloadType, VideoPayloadType, AudioPayloadType, \
+    InputPayloadType
 
 
 channels = {
@@ -18,77 +22,270 @@ channels = {
     1029: Channel(None, None, 1029, ChannelClass.InputFeedback, 0)
 }
 
+STREAMER_TYPES = sorted({
+    t.name for enum in (VideoPayloadType, AudioPayloadType, InputPayloadType)
+    for t in enum
+})
 
-def parse(pcap_file, tcp_port, udp_port):
+# Lines written per flush of the output buffer
+BUFFER_LINES = 512
+
+
+class Output(object):
+    """
+    Buffered line output, flushed every `BUFFER_LINES` lines
+    """
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lines = []
+
+    def write(self, line):
+        self._lines.append(line)
+        if len(self._lines) >= BUFFER_LINES:
+            self.flush()
+
+    def flush(self):
+        if self._lines:
+            self._lines.append('')
+            self.stream.write('\n'.join(self._lines))
+            self._lines = []
+        self.stream.flush()
+
+
+class PacketFilter(object):
+    """
+    Message filter applied on header fields only
+
+    Args:
+        channel_classes (set): :class:`ChannelClass` names
+        payload_types (set): :class:`RtpPayloadType` names
+        streamer_types (set): Streamer payload type names (e.g. `Data`)
+        direction (str): `client` or `console`, sender of the message
+        start (float): Seconds since the first packet
+        end (float): Seconds since the first packet
+    """
+    def __init__(self, channel_classes=None, payload_types=None,
+                 streamer_types=None, direction=None, start=None, end=None):
+        self.channel_classes = set(channel_classes or ())
+        self.payload_types = {
+            RtpPayloadType[name].value for name in payload_types or ()
+        }
+        self.streamer_types = set(streamer_types or ())
+        self.direction = direction
+        self.start = start
+        self.end = end
+
+    def time(self, offset):
+        """
+        Returns:
+            int: -1 before, 0 inside, 1 after the time range
+        """
+        if self.start is not None and offset < self.start:
+            return -1
+        if self.end is not None and offset >= self.end:
+            return 1
+        return 0
+
+    def __call__(self, from_client, header, channel):
+        if self.direction and \
+                (self.direction == 'client') != from_client:
+            return False
+
+        payload_type, _, _, streamer_type = header
+        if self.payload_types and payload_type not in self.payload_types:
+            return False
+
+        name = getattr(channel, 'name', None)
+        if self.channel_classes and \
+                (name is None or name.name not in self.channel_classes):
+            return False
+        if self.streamer_types and \
+                streamer_type_name(name, streamer_type) \
+                not in self.streamer_types:
+            return False
+        return True
+
+
+def streamer_type_name(channel_class, streamer_type):
+    if streamer_type is None:
+        return None
+    enum = xpacker.STREAMER_TYPE_MAP.get(channel_class)
+    try:
+        return enum(streamer_type).name
+    except (TypeError, ValueError, AttributeError):
+        return str(streamer_type)
+
+
+def _learn_channel(data):
+    try:
+        msg = xpacker.unpack(data, channels)
+    except (xpacker.PackerError, ValueError):
+        return
+    if msg.payload.type == ChannelControlPayloadType.ChannelCreate:
+        channel_id = msg.header.ssrc.channel_id
+        channels[channel_id] = Channel(
+            None, None, channel_id, msg.payload.name, msg.payload.flags
+        )
+
+
+def _filtered(pcap_file, tcp_port, udp_port, packet_filter):
+    """
+    Yields:
+        tuple: (packet, seconds since first packet, data, header, channel)
+            of messages passing the filter
+    """
+    first = None
+    for packet in read_session(pcap_file, tcp_port, udp_port):
+        data = packet.data
+        if packet.transport == Transport.TCP:
+            # Strip length prefix
+            data = data[4:]
+
+        if first is None:
+            first = packet.timestamp
+        # Nanosecond resolution at most, drop float noise
+        offset = round(packet.timestamp - first, 9)
+
+        try:
+            header = xpacker.peek_header(data)
+        except xpacker.PackerError:
+            # Let the parser report it
+            header = (None, None, None, None)
+
+        if header[0] == RtpPayloadType.ChannelControl.value:
+            _learn_channel(data)
+
+        position = packet_filter.time(offset)
+        if position > 0:
+            break
+        elif position < 0:
+            continue
+
+        # Malformed messages only pass when no header field is filtered on
+        channel = channels.get(header[1])
+        if packet_filter(packet.from_client, header, channel):
+            yield packet, offset, data, header, channel
+
+
+def messages(pcap_file, tcp_port, udp_port, packet_filter):
+    """
+    Yields:
+        tuple: (seconds since first packet, from_client, data, header,
+            channel) of messages passing the filter
+    """
+    for packet, offset, data, header, channel in \
+            _filtered(pcap_file, tcp_port, udp_port, packet_filter):
+        yield offset, packet.from_client, data, header, channel
+
+
+def export_messages(pcap_file, tcp_port, udp_port, packet_filter, path,
+                    fmt=None):
+    """
+    Export messages passing the filter, see :func:`.export.export_session`
+
+    Returns:
+        int: Number of rows written
+    """
+    packets = (
+        packet for packet, _, _, _, _ in
+        _filtered(pcap_file, tcp_port, udp_port, packet_filter)
+    )
+    return export.export_session(packets, path, fmt, channels=channels)
+
+
+def _type_str(payload_type, streamer_type, channel):
+    try:
+        text = RtpPayloadType(payload_type).name
+    except ValueError:
+        text = str(payload_type)
+    if streamer_type is not None:
+        text += '.%s' % streamer_type_name(
+            getattr(channel, 'name', None), streamer_type
+        )
+    return text
+
+
+def print_compact(pcap_file, tcp_port, udp_port, packet_filter, out):
+    for offset, from_client, data, header, channel in \
+            messages(pcap_file, tcp_port, udp_port, packet_filter):
+        payload_type, channel_id, seq, streamer_type = header
+        if payload_type is None:
+            out.write('%10.6f %s malformed %d bytes' % (
+                offset, '>' if from_client else '<', len(data)
+            ))
+            continue
+        out.write('%10.6f %s %-13s %-26s seq %5d %6d bytes' % (
+            offset, '>' if from_client else '<',
+            getattr(getattr(channel, 'name', None), 'name', channel_id),
+            _type_str(payload_type, streamer_type, channel), seq, len(data)
+        ))
+
+
+def print_summary(pcap_file, tcp_port, udp_port, packet_filter, out):
+    counts = Counter()
+    sizes = Counter()
+    for offset, from_client, data, header, channel in \
+            messages(pcap_file, tcp_port, udp_port, packet_filter):
+        payload_type, channel_id, _, streamer_type = header
+        key = (
+            'client' if from_client else 'console',
+            getattr(getattr(channel, 'name', None), 'name', str(channel_id)),
+            'malformed' if payload_type is None else
+            _type_str(payload_type, streamer_type, channel)
+        )
+        counts[key] += 1
+        sizes[key] += len(data)
+
+    out.write('%-8s %-13s %-26s %9s %12s' % (
+        'sender', 'channel', 'type', 'messages', 'bytes'
+    ))
+    for key in sorted(counts):
+        out.write('%-8s %-13s %-26s %9d %12d' % (key + (counts[key],
+                                                        sizes[key])))
+    out.write('%-49s %9d %12d' % (
+        'total', sum(counts.values()), sum(sizes.values())
+    ))
+
+
+def parse(pcap_file, tcp_port, udp_port, packet_filter=None, out=None):
+    packet_filter = packet_filter or PacketFilter()
+    out = out or Output()
     width = shutil.get_terminal_size().columns
     col_width = width // 2 - 3
     wrapper = textwrap.TextWrapper(col_width, replace_whitespace=False)
 
-    with open(pcap_file, 'rb') as fh:
-        for ts, buf in dpkt.pcap.Reader(fh):
-            eth = dpkt.ethernet.Ethernet(buf)
-
-            # Make sure the Ethernet data contains an IP packet
-            if not isinstance(eth.data, dpkt.ip.IP):
-                continue
-
-            ip = eth.data
-
-            if isinstance(ip.data, dpkt.tcp.TCP):
-                if ip.data.sport != tcp_port and ip.data.dport != tcp_port:
-                    continue
-
-                try:
-                    msgs = packer.unpack_tcp(ip.data.data, channels)
-                    msgs = list(msgs)
-                except Exception as e:
-                    print("Error: {}".format(e))
-                    continue
-                is_client = ip.data.dport == tcp_port
-            elif isinstance(ip.data, dpkt.udp.UDP):
-                if ip.data.sport != udp_port and ip.data.dport != udp_port:
-                    continue
-
-                try:
-                    msgs = [packer.unpack(ip.data.data, channels)]
-                except Exception as e:
-                    print("Error: {}".format(e))
-                    continue
-                is_client = ip.data.dport == udp_port
-            else:
-                continue
-
-            for msg in msgs:
-                payload_type = msg.header.flags.payload_type
-                channel_id = msg.header.ssrc.channel_id
-
-                type_str = '%s Seq %i ' % \
-                    (RtpPayloadType(payload_type), msg.header.sequence_num)
-
-                if payload_type == RtpPayloadType.ChannelControl:
-                    type_str += ' (%s)' % \
-                        ChannelControlPayloadType(msg.payload.type)
-                # elif payload_type == PayloadType.Streamer:
-                #     type_str += ' (Type: %i)' \
-                #         % msg.payload.streamer_header.packet_type
-
-                if channel_id != 0:
-                    type_str += ' | %s' % channels[channel_id]
-
-                direction = '>' if is_client else '<'
-                print(' {} '.format(type_str).center(width, direction))
-
-                lines = str(msg).split('\n')
-                for line in lines:
-                    line = wrapper.wrap(line)
-                    for i in line:
-                        if is_client:
-                            print('{0: <{1}}'.format(i, col_width), '│')
-                        else:
-                            print(
-                                ' ' * col_width, '│',
-                                '{0}'.format(i, col_width)
-                            )
+    for offset, is_client, data, header, channel in \
+            messages(pcap_file, tcp_port, udp_port, packet_filter):
+        try:
+            msg = packer.unpack(data, channels)
+        except Exception as e:
+            out.write("Error: {}".format(e))
+            continue
+
+        payload_type = msg.header.flags.payload_type
+        channel_id = msg.header.ssrc.channel_id
+
+        type_str = '%s Seq %i ' % \
+            (RtpPayloadType(payload_type), msg.header.sequence_num)
+
+        if payload_type == RtpPayloadType.ChannelControl:
+            type_str += ' (%s)' % \
+                ChannelControlPayloadType(msg.payload.type)
+
+        if channel_id != 0:
+            type_str += ' | %s' % channels.get(channel_id)
+
+        direction = '>' if is_client else '<'
+        out.write(' {} '.format(type_str).center(width, direction))
+
+        for line in str(msg).split('\n'):
+            # Wrapping is costly, most lines fit
+            lines = wrapper.wrap(line) if len(line) > col_width else [line]
+            for i in lines:
+                if is_client:
+                    out.write('{0: <{1}} │'.format(i, col_width))
+                else:
+                    out.write('{0} │ {1}'.format(' ' * col_width, i))
 
 
 def main():
@@ -98,9 +295,65 @@ def main():
     parser.add_argument('file', help='Path to PCAP')
     parser.add_argument('tcp_port', type=int, help='Server TCP Port (console)')
     parser.add_argument('udp_port', type=int, help='Server UDP Port (console)')
+    parser.add_argument('--channel', '-c', action='append', default=[],
+                        choices=[c.name for c in ChannelClass],
+                        help='Only show messages of channel (repeatable)')
+    parser.add_argument('--payload-type', '-p', action='append', default=[],
+                        choices=[t.name for t in RtpPayloadType],
+                        help='Only show RTP payload type (repeatable)')
+    parser.add_argument('--streamer-type', '-t', action='append', default=[],
+                        choices=STREAMER_TYPES,
+                        help='Only show streamer payload type (repeatable)')
+    parser.add_argument('--direction', '-d', choices=['client', 'console'],
+                        help='Only show messages sent by client / console')
+    parser.add_argument('--start', type=float,
+                        help='Skip messages before START seconds')
+    parser.add_argument('--end', type=float,
+                        help='Stop at END seconds')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--summary', '-s', action='store_true',
+                      help='Only print message counts per channel and type')
+    mode.add_argument('--compact', action='store_true',
+                      help='Print one line per message')
+    mode.add_argument('--export', '-e', metavar='FILE',
+                      help='Write one row per message to FILE instead')
+    parser.add_argument('--format', '-f',
+                        choices=[export.ExportFormat.Parquet,
+                                 export.ExportFormat.Arrow,
+                                 export.ExportFormat.Numpy],
+                        help='Export format, defaults to file extension')
     args = parser.parse_args()
 
-    parse(args.file, args.tcp_port, args.udp_port)
+    packet_filter = PacketFilter(
+        channel_classes=args.channel, payload_types=args.payload_type,
+        streamer_types=args.streamer_type, direction=args.direction,
+        start=args.start, end=args.end
+    )
+    if args.export:
+        rows = export_messages(
+            args.file, args.tcp_port, args.udp_port, packet_filter,
+            args.export, args.format
+        )
+        print('Exported {} messages to {}'.format(rows, args.export))
+        return
+
+    if args.summary:
+        printer = print_summary
+    elif args.compact:
+        printer = print_compact
+    else:
+        printer = parse
+
+    out = Output()
+    try:
+        printer(args.file, args.tcp_port, args.udp_port, packet_filter, out)
+        out.flush()
+    except BrokenPipeError:
+        # Output piped into head & co., Python flushes stdout again on
+        # exit, point it at devnull
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
 
 
 if __name__ == '__main__':
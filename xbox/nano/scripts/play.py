@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import argparse
+from xbox.nano.recording import RecordingReader, StreamKind
+from xbox.nano.render.client import BenchmarkClient
+from xbox.nano.profiler import ProfilerMode, profiled
+from xbox.nano.replay import RecordingPlayer
+from xbox.nano.scripts.replay import parse_speed
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description='Play raw recordings written by FileClient'
+    )
+    parser.add_argument('prefix', help='Recording path prefix (--output)')
+    parser.add_argument('--benchmark', '-b', action='store_true',
+                        help='Decode headless and report decode throughput')
+    parser.add_argument('--speed', '-s', type=parse_speed, default=1.0,
+                        help='Playback speed multiplier (1x, 2x, ...) '
+                             'or "max"')
+    parser.add_argument('--start', type=float,
+                        help='Start at START seconds, from the keyframe '
+                             'before')
+    parser.add_argument('--end', type=float,
+                        help='Stop at END seconds')
+    parser.add_argument('--video-only', action='store_true',
+                        help='Skip audio')
+    parser.add_argument('--profile',
+                        choices=[ProfilerMode.Sampling, ProfilerMode.Scoped],
+                        help='Profile the playback, print a report on exit')
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help='Write profile data (folded stacks or pstats)')
+    args = parser.parse_args()
+
+    with RecordingReader(args.prefix) as reader:
+        if args.benchmark:
+            client = BenchmarkClient()
+        else:
+            from xbox.nano.render.client import SDLClient
+            fmt = reader.video_format
+            client = SDLClient(fmt.width if fmt else 1280,
+                               fmt.height if fmt else 720)
+
+        first = reader.first_timestamp or 0
+        start = end = None
+        if args.start is not None:
+            start = first + int(args.start * 1000000)
+        if args.end is not None:
+            end = first + int(args.end * 1000000)
+
+        player = RecordingPlayer(
+            client, speed=args.speed,
+            kinds=(StreamKind.Video,) if args.video_only else None
+        )
+        with profiled(args.profile, args.profile_output, client):
+            asyncio.run(player.run(reader, start, end))
+
+    print(player.report())
+    if args.benchmark:
+        print(client.report())
+
+
+if __name__ == '__main__':
+    main()
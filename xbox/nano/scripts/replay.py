@@ -1,66 +1,22 @@
-import dpkt
+import asyncio
 import logging
 import argparse
-from xbox.nano.render.client.sdl import SDLClient
-from xbox.nano.render.client.file import FileClient
-from xbox.nano.protocol import NanoProtocol, StreamerProtocol, ControlProtocol
+from xbox.nano.backend import PackerBackend
+from xbox.nano.render.client import FileClient, BenchmarkClient
+from xbox.nano.render.mux import ContainerFormat
+from xbox.nano.profiler import ProfilerMode, profiled
+from xbox.nano.replay import ReplayEngine
+from xbox.nano.capture import read_session
 
 
-class DummyStreamerProtocol(StreamerProtocol):
-    def send_message(self, msg):
-        pass
-
-
-class DummyControlProtocol(ControlProtocol):
-    def send_message(self, msg):
-        pass
-
-
-def replay(client, pcap_file, tcp_port, udp_port):
-    with open(pcap_file, 'rb') as fh:
-        proto = NanoProtocol(client, None, None, None, None)
-        proto.streamer_protocol = DummyStreamerProtocol('', 0, proto)
-        proto.control_protocol = DummyControlProtocol('', 0, proto)
-
-        proto.control_protocol.on_message += proto._on_control_message
-        proto.streamer_protocol.on_message += proto._on_streamer_message
-
-        client.open(proto)
-
-        for ts, buf in dpkt.pcap.Reader(fh):
-            eth = dpkt.ethernet.Ethernet(buf)
-
-            # Make sure the Ethernet data contains an IP packet
-            if not isinstance(eth.data, dpkt.ip.IP):
-                continue
-
-            ip = eth.data
-
-            if isinstance(ip.data, dpkt.tcp.TCP):
-                if ip.data.sport != tcp_port and ip.data.dport != tcp_port:
-                    continue
-
-                from_client = ip.data.dport == tcp_port
-
-                if not from_client:
-                    proto.control_protocol.handle(ip.data.data)
-
-            elif isinstance(ip.data, dpkt.udp.UDP):
-                if ip.data.sport != udp_port and ip.data.dport != udp_port:
-                    continue
-
-                from_client = ip.data.dport == udp_port
-                if not from_client:
-                    proto.streamer_protocol.handle(ip.data.data, '')
-
-            else:
-                continue
-
-            client.pump()
+def parse_speed(value):
+    if value == 'max':
+        return None
+    return float(value.rstrip('x'))
 
 
 def main():
-    logging.basicConfig(level=logging.DEBUG)
+    logging.basicConfig(level=logging.INFO)
 
     parser = argparse.ArgumentParser(
         description='Parse PCAP files and replay SG sessions'
@@ -71,14 +27,59 @@ def main():
     parser.add_argument('--output', '-o', help='Write stream to file')
     parser.add_argument('--frames', '-f', action='store_true',
                         help='Save single frames')
+    parser.add_argument('--container', '-c',
+                        choices=[ContainerFormat.Matroska,
+                                 ContainerFormat.MP4],
+                        help='Mux video and audio into a container file')
+    parser.add_argument('--segment-size', type=int, metavar='BYTES',
+                        help='Rotate raw files after BYTES per segment')
+    parser.add_argument('--segment-duration', type=float, metavar='SECONDS',
+                        help='Rotate raw files after SECONDS per segment')
+    parser.add_argument('--benchmark', '-b', action='store_true',
+                        help='Decode headless and report decode throughput')
+    parser.add_argument('--speed', '-s', type=parse_speed, default=1.0,
+                        help='Playback speed multiplier (1x, 2x, ...) '
+                             'or "max"')
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help='Probability to drop a datagram')
+    parser.add_argument('--reorder', type=float, default=0.0,
+                        help='Probability to swap a datagram with the next')
+    parser.add_argument('--seed', type=int,
+                        help='Seed for loss / reorder injection')
+    parser.add_argument('--packer', default=PackerBackend.Construct,
+                        choices=[PackerBackend.Construct, PackerBackend.Fast,
+                                 PackerBackend.Verify],
+                        help='Packer backend')
+    parser.add_argument('--profile',
+                        choices=[ProfilerMode.Sampling, ProfilerMode.Scoped],
+                        help='Profile the replay, print a report on exit')
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help='Write profile data (folded stacks or pstats)')
     args = parser.parse_args()
 
-    if args.output:
-        client = FileClient(args.output, save_frames=args.frames)
+    if args.benchmark:
+        client = BenchmarkClient()
+    elif args.output:
+        client = FileClient(args.output, save_frames=args.frames,
+                            container=args.container,
+                            segment_size=args.segment_size,
+                            segment_duration=args.segment_duration)
     else:
+        from xbox.nano.render.client import SDLClient
         client = SDLClient(1280, 720)
 
-    replay(client, args.file, args.tcp_port, args.udp_port)
+    engine = ReplayEngine(
+        client, speed=args.speed, loss=args.loss, reorder=args.reorder,
+        seed=args.seed, packer_backend=args.packer
+    )
+    packets = read_session(args.file, args.tcp_port, args.udp_port)
+
+    with profiled(args.profile, args.profile_output, client):
+        asyncio.run(engine.run(packets))
+
+    print(engine.report())
+    if args.benchmark:
+        print(client.report())
 
 
 if __name__ == '__main__':
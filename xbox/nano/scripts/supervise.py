@@ -0,0 +1,87 @@
+"""
+Run several sessions in pinned worker processes, see
+:mod:`xbox.nano.supervisor`
+"""
+import logging
+import argparse
+
+from xbox.nano.backend import PackerBackend
+from xbox.nano.metrics import MetricsServer, REGISTRY
+from xbox.nano.scripts.replay import parse_speed
+from xbox.nano.supervisor import (
+    Supervisor, ReplaySession, ConsoleSession, available_cores
+)
+
+
+def parse_cores(value):
+    if not value:
+        return []
+    return [int(core) for core in value.split(',')]
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description='Decode several streams, one worker process per stream'
+    )
+    parser.add_argument('--console', '-a', action='append', default=[],
+                        metavar='ADDRESS', help='Stream from console')
+    parser.add_argument('--capture', '-c', action='append', default=[],
+                        metavar='FILE', help='Replay PCAP, ports detected')
+    parser.add_argument('--repeat', '-n', type=int, default=1,
+                        help='Replay each capture in N workers')
+    parser.add_argument('--speed', '-s', type=parse_speed, default=None,
+                        help='Replay speed multiplier (1x, 2x, ...), '
+                             'as fast as possible by default')
+    parser.add_argument('--cores', type=parse_cores, default=None,
+                        help='Comma separated cores to pin workers to, '
+                             'empty disables pinning (default: %s)' %
+                             ','.join(map(str, available_cores())))
+    parser.add_argument('--packer', default=PackerBackend.Construct,
+                        choices=[PackerBackend.Construct, PackerBackend.Fast,
+                                 PackerBackend.Verify],
+                        help='Packer backend')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve Prometheus metrics on this port')
+    parser.add_argument('--metrics-address', default='127.0.0.1',
+                        help='Address to serve metrics on')
+    args = parser.parse_args()
+
+    sessions = [
+        ConsoleSession(address, packer_backend=args.packer)
+        for address in args.console
+    ]
+    for path in args.capture:
+        for i in range(args.repeat):
+            sessions.append(ReplaySession(
+                path, speed=args.speed, packer_backend=args.packer,
+                name='%s#%d' % (path, i) if args.repeat > 1 else None
+            ))
+    if not sessions:
+        parser.error('No --console or --capture given')
+
+    server = None
+    if args.metrics_port is not None:
+        server = MetricsServer(args.metrics_address, args.metrics_port)
+        server.start()
+
+    supervisor = Supervisor(
+        sessions, cores=args.cores,
+        registry=REGISTRY if server else None
+    )
+    supervisor.start()
+    try:
+        supervisor.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+        print(supervisor.report())
+        supervisor.close()
+        if server:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Stream statistics
+"""
+from typing import NamedTuple, Optional
+
+SEQUENCE_MOD = 1 << 16
+
+
+class SequenceStats(NamedTuple):
+    received: int
+    expected: int
+    lost: int
+    duplicates: int
+    reordered: int
+    # Interarrival jitter in seconds, RFC 3550 6.4.1
+    jitter: float
+    highest_sequence_num: Optional[int]
+
+
+class VideoStats(NamedTuple):
+    frames_completed: int
+    frames_expired: int
+    keyframes: int
+    keyframe_requests: int
+    # Frames since the last keyframe, None before the first one
+    frames_since_keyframe: Optional[int]
+    # Mean frames per keyframe interval
+    keyframe_interval: Optional[float]
+
+
+class SequenceTracker(object):
+    """
+    Tracks 16bit RTP sequence numbers of a channel (RFC 3550 A.1 / A.8).
+
+    Sequence numbers are extended with a wraparound cycle count.
+    Late packets within `window` of the highest sequence number are
+    counted as reordered, or as duplicates if they were already seen.
+    """
+    def __init__(self, window=1024):
+        self.window = window
+        self._seen = [None] * window
+        self._base = None
+        self._max = None
+        self._cycles = 0
+
+        self._last_transit = None
+        self.jitter = 0.0
+
+        self.received = 0
+        self.duplicates = 0
+        self.reordered = 0
+
+    @property
+    def extended_max(self):
+        if self._max is None:
+            return None
+        return self._cycles + self._max
+
+    @property
+    def expected(self):
+        if self._base is None:
+            return 0
+        return self.extended_max - self._base + 1
+
+    @property
+    def lost(self):
+        return max(0, self.expected - self.received)
+
+    def update(self, sequence_num, arrival, timestamp=None):
+        """
+        Account received packet
+
+        Args:
+            sequence_num (int): RTP sequence number
+            arrival (float): Arrival time in seconds
+            timestamp (float): Sender timestamp in seconds, for jitter
+        """
+        if self._max is None:
+            self._base = self._max = sequence_num
+            extended = sequence_num
+        else:
+            delta = (sequence_num - self._max) % SEQUENCE_MOD
+            if delta == 0:
+                self.duplicates += 1
+                return
+            elif delta < SEQUENCE_MOD // 2:
+                # In order, possibly with gap
+                if sequence_num < self._max:
+                    self._cycles += SEQUENCE_MOD
+                self._max = sequence_num
+                extended = self.extended_max
+            else:
+                # Late
+                extended = self.extended_max - (SEQUENCE_MOD - delta)
+                if extended < self._base or \
+                        extended <= self.extended_max - self.window:
+                    # Too old to tell, treat as reordered
+                    self.reordered += 1
+                    self.received += 1
+                    return
+                if self._seen[extended % self.window] == extended:
+                    self.duplicates += 1
+                    return
+                self.reordered += 1
+
+        self._seen[extended % self.window] = extended
+        self.received += 1
+
+        if timestamp is not None:
+            transit = arrival - timestamp
+            if self._last_transit is not None:
+                d = abs(transit - self._last_transit)
+                self.jitter += (d - self.jitter) / 16.0
+            self._last_transit = transit
+
+    def snapshot(self):
+        """
+        Returns:
+            :class:`SequenceStats`: Current statistics
+        """
+        return SequenceStats(
+            received=self.received,
+            expected=self.expected,
+            lost=self.lost,
+            duplicates=self.duplicates,
+            reordered=self.reordered,
+            jitter=self.jitter,
+            highest_sequence_num=self.extended_max
+        )
@@ -0,0 +1,657 @@
+"""
+Multi-stream supervisor
+
+Runs several sessions side by side, each in its own worker process with
+its own asyncio loop, so streams do not compete for one interpreter lock.
+Workers are pinned to a core each (round robin over the available cores,
+where the platform supports it).
+
+Workers report their counters through a shared memory
+:class:`StatsBlock`, which the supervisor exports to a metrics registry
+labelled by session. By default every worker decodes its stream headless
+(:class:`.BenchmarkClient`). With a `render_factory` the reassembled
+frames are handed back over a :class:`.FrameRing` per worker instead and
+rendered by a client in the supervisor process.
+
+Example:
+    >>> sessions = [ConsoleSession('10.0.0.10'), ConsoleSession('10.0.0.11')]
+    >>> with Supervisor(sessions, registry=REGISTRY) as supervisor:
+    ...     MetricsServer(port=9464).start()
+    ...     supervisor.wait()
+    >>> print(supervisor.report())
+"""
+import os
+import time
+import struct
+import asyncio
+import logging
+import threading
+import multiprocessing
+from typing import NamedTuple
+
+from xbox.nano import metrics
+from xbox.nano.backend import PackerBackend
+from xbox.nano.enum import ChannelClass
+from xbox.nano.render.ring import FrameRing, DEFAULT_CAPACITY
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+log = logging.getLogger(__name__)
+
+# Seconds between stats updates of a worker
+PUBLISH_INTERVAL = 0.5
+
+
+class SupervisorError(Exception):
+    pass
+
+
+class WorkerState(object):
+    Starting = 0
+    Running = 1
+    Done = 2
+    Failed = 3
+
+
+class WorkerStats(NamedTuple):
+    state: int
+    pid: int
+    # Pinned core, -1 if not pinned
+    core: int
+    # Wall clock (time.time) of start and last update
+    started: float
+    updated: float
+    cpu_seconds: float
+    packets: int
+    bytes: int
+    lost: int
+    frames_completed: int
+    frames_expired: int
+    keyframes: int
+    video_decoded: int
+    video_dropped: int
+    decode_seconds: float
+    ring_dropped: int
+
+    @property
+    def fps(self):
+        """
+        Mean video frames per second over the lifetime of the worker
+        """
+        span = self.updated - self.started
+        return self.frames_completed / span if span > 0 else 0.0
+
+
+_EMPTY_STATS = WorkerStats(WorkerState.Starting, 0, -1, *([0] * 13))
+
+# Sequence counter, odd while the worker writes the slot
+_SEQUENCE = struct.Struct('<Q')
+_VALUES = struct.Struct('<%dd' % len(WorkerStats._fields))
+# Slots on separate cache lines
+_SLOT_SIZE = (_SEQUENCE.size + _VALUES.size + 63) & ~63
+# Seconds a reader waits for a write to finish, a worker killed while
+# writing leaves the sequence odd
+_READ_TIMEOUT = 0.1
+
+
+class StatsBlock(object):
+    """
+    :class:`WorkerStats` slots in shared memory, one per worker.
+
+    Each slot has a single writer, readers retry while a write is in
+    progress (sequence lock). Ownership and pickling work like
+    :class:`.FrameRing`.
+
+    Args:
+        slots (int): Number of workers
+    """
+    def __init__(self, slots):
+        if shared_memory is None:
+            raise SupervisorError('Shared memory requires Python 3.8')
+
+        self.slots = slots
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=max(slots, 1) * _SLOT_SIZE
+        )
+        self._owner = os.getpid()
+        self._buf = self._shm.buf
+        for slot in range(slots):
+            self.write(slot, _EMPTY_STATS)
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'slots': self.slots}
+
+    def __setstate__(self, state):
+        self.slots = state['slots']
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._owner = None
+        self._buf = self._shm.buf
+
+    def _offset(self, slot):
+        if not 0 <= slot < self.slots:
+            raise IndexError('No stats slot %d' % slot)
+        return slot * _SLOT_SIZE
+
+    def write(self, slot, stats):
+        """
+        Replace the stats of a slot, writer side
+        """
+        offset = self._offset(slot)
+        # Rounded up, in case a dead writer left the write unfinished
+        sequence = (_SEQUENCE.unpack_from(self._buf, offset)[0] + 1) & ~1
+        _SEQUENCE.pack_into(self._buf, offset, sequence + 1)
+        _VALUES.pack_into(self._buf, offset + _SEQUENCE.size, *stats)
+        _SEQUENCE.pack_into(self._buf, offset, sequence + 2)
+
+    def read(self, slot):
+        """
+        Returns:
+            :class:`WorkerStats`: Consistent snapshot of a slot, or the
+            last values if the writer does not finish its write in time
+        """
+        offset = self._offset(slot)
+        deadline = time.monotonic() + _READ_TIMEOUT
+        while True:
+            before = _SEQUENCE.unpack_from(self._buf, offset)[0]
+            values = _VALUES.unpack_from(self._buf, offset + _SEQUENCE.size)
+            if not before & 1 and \
+                    _SEQUENCE.unpack_from(self._buf, offset)[0] == before:
+                break
+            if time.monotonic() >= deadline:
+                log.warning('Stats slot %d stuck in a write', slot)
+                break
+            time.sleep(0)
+
+        floats = ('started', 'updated', 'cpu_seconds', 'decode_seconds')
+        return WorkerStats(*(
+            value if field in floats else int(value)
+            for field, value in zip(WorkerStats._fields, values)
+        ))
+
+    def close(self):
+        """
+        Detach, the owner also frees the shared memory
+        """
+        self._buf = None
+        self._shm.close()
+        if self._owner == os.getpid():
+            self._shm.unlink()
+
+
+def available_cores():
+    """
+    Cores the current process may run on
+    """
+    getaffinity = getattr(os, 'sched_getaffinity', None)
+    if getaffinity:
+        return sorted(getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def pin_to_core(core):
+    """
+    Restrict the current process to a single core
+
+    Returns:
+        bool: False if pinning is not supported or failed
+    """
+    setaffinity = getattr(os, 'sched_setaffinity', None)
+    if setaffinity is None:
+        log.debug('Core pinning not supported on this platform')
+        return False
+    try:
+        setaffinity(0, {core})
+    except OSError as e:
+        log.warning('Failed to pin to core %d: %s', core, e)
+        return False
+    return True
+
+
+class ReplaySession(object):
+    """
+    Replays a capture with :class:`.ReplayEngine`, e.g. to benchmark
+    decoding of several streams.
+
+    Args:
+        path (str): Path to PCAP / PCAPNG
+        tcp_port (int): Console TCP port, detected if omitted
+        udp_port (int): Console UDP port, detected if omitted
+        speed (float): Playback speed multiplier, None replays as fast as
+            possible
+        packer_backend (str): Member of :class:`.PackerBackend`
+        name (str): Session label, defaults to the file name
+    """
+    def __init__(self, path, tcp_port=None, udp_port=None, speed=None,
+                 packer_backend=PackerBackend.Construct, name=None):
+        self.path = path
+        self.tcp_port = tcp_port
+        self.udp_port = udp_port
+        self.speed = speed
+        self.packer_backend = packer_backend
+        self.name = name or os.path.basename(path)
+        self._engine = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_engine'] = None
+        return state
+
+    @property
+    def protocol(self):
+        return self._engine.protocol if self._engine else None
+
+    async def run(self, client):
+        from xbox.nano.replay import ReplayEngine
+        from xbox.nano.capture import read_session
+        from xbox.nano.analysis import detect_ports
+
+        tcp_port, udp_port = self.tcp_port, self.udp_port
+        if tcp_port is None or udp_port is None:
+            detected = detect_ports(self.path)
+            tcp_port = tcp_port or detected[0]
+            udp_port = udp_port or detected[1]
+            if tcp_port is None or udp_port is None:
+                raise SupervisorError(
+                    'Failed to detect ports of %s' % self.path
+                )
+
+        self._engine = ReplayEngine(
+            client, speed=self.speed, packer_backend=self.packer_backend
+        )
+        await self._engine.run(read_session(self.path, tcp_port, udp_port))
+
+
+class ConsoleSession(object):
+    """
+    Streams from a console, like the `xbox-nano-client` script.
+
+    Args:
+        address (str): IP address of the console
+        packer_backend (str): Member of :class:`.PackerBackend`
+        name (str): Session label, defaults to the address
+    """
+    def __init__(self, address, packer_backend=PackerBackend.Construct,
+                 name=None):
+        self.address = address
+        self.packer_backend = packer_backend
+        self.name = name or address
+        self._console = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_console'] = None
+        return state
+
+    @property
+    def protocol(self):
+        return self._console.nano.protocol if self._console else None
+
+    async def run(self, client):
+        from xbox.sg.console import Console
+        from xbox.sg.enum import ConnectionState
+        from xbox.nano.manager import NanoManager
+
+        discovered = await Console.discover(timeout=1, addr=self.address)
+        if not len(discovered):
+            raise SupervisorError('No console found at %s' % self.address)
+
+        console = discovered[0]
+        console.add_manager(NanoManager)
+        await console.connect("", "")
+        if console.connection_state != ConnectionState.Connected:
+            raise SupervisorError('Connection to %s failed' % self.address)
+
+        await console.wait(1)
+        await console.nano.start_stream()
+        await console.wait(2)
+        await console.nano.start_gamestream(
+            client, packer_backend=self.packer_backend
+        )
+        self._console = console
+        try:
+            while True:
+                await console.wait(5.0)
+        finally:
+            client.close()
+
+
+def _session_stats(session, client, started, core, state):
+    values = dict.fromkeys(WorkerStats._fields, 0)
+    values.update(
+        state=state, pid=os.getpid(), core=core, started=started,
+        updated=time.time(), cpu_seconds=time.process_time()
+    )
+
+    protocol = session.protocol
+    if protocol:
+        streamer = protocol.streamer_protocol
+        if streamer:
+            values['packets'] = sum(streamer.channel_packets.values())
+            values['bytes'] = sum(streamer.channel_bytes.values())
+        for channel in list(protocol.channels.values()):
+            values['lost'] += channel.stats().lost
+        video = protocol.get_channel(ChannelClass.Video)
+        if video:
+            values['frames_completed'] = video.frames_completed
+            values['frames_expired'] = video.frames_expired
+            values['keyframes'] = video.keyframes
+
+    if hasattr(client, 'totals'):
+        video = client.totals()[0]
+        values['video_decoded'] = video.decoded
+        values['video_dropped'] = video.dropped
+        values['decode_seconds'] = video.decode_seconds
+    values['ring_dropped'] = getattr(client, 'dropped', 0)
+    return WorkerStats(**values)
+
+
+async def _run_worker(session, client, publish, stop):
+    task = asyncio.ensure_future(session.run(client))
+    while not task.done():
+        publish(WorkerState.Running)
+        if stop.is_set():
+            task.cancel()
+        await asyncio.wait([task], timeout=PUBLISH_INTERVAL)
+
+    if not task.cancelled():
+        # Raises the session error
+        task.result()
+
+
+def worker_main(index, session, core, stats, stop, ring=None,
+                client_factory=None):
+    """
+    Target of a worker process, runs one session until it ends or `stop`
+    is set
+    """
+    from xbox.nano.render.client import BenchmarkClient, RingClient
+    from xbox.nano.render.client.ring import RingTag, CLOSE_TIMEOUT
+
+    started = time.time()
+    if core is not None and not pin_to_core(core):
+        core = None
+    core = -1 if core is None else core
+
+    if ring is not None:
+        client = RingClient(ring)
+    else:
+        client = (client_factory or BenchmarkClient)()
+
+    def publish(state):
+        stats.write(index, _session_stats(
+            session, client, started, core, state
+        ))
+
+    state = WorkerState.Failed
+    try:
+        asyncio.run(_run_worker(session, client, publish, stop))
+        state = WorkerState.Done
+    except KeyboardInterrupt:
+        state = WorkerState.Done
+    except Exception:
+        log.exception('Session %s failed', session.name)
+    finally:
+        publish(state)
+        if ring is not None:
+            # Unblock the renderer if the session ended early
+            ring.put(b'', RingTag.Close, wait=CLOSE_TIMEOUT)
+            ring.close()
+        stats.close()
+
+
+class Supervisor(object):
+    """
+    Runs each session in a worker process.
+
+    Args:
+        sessions (list): :class:`ReplaySession` / :class:`ConsoleSession`
+            or any picklable object with `name`, `protocol` and
+            `async run(client)`
+        cores (list): Cores to pin workers to, round robin. Defaults to
+            all available cores, an empty list disables pinning
+        client_factory: Picklable callable creating the client of a
+            worker, :class:`.BenchmarkClient` by default
+        render_factory: Callable `(session) -> Client`, renders the frames
+            of a session in the supervisor process. Workers forward their
+            frames over a :class:`.FrameRing` instead of decoding them
+        ring_size (int): Frame ring size in bytes, with `render_factory`
+        registry (:class:`.metrics.Registry`): Registry to export worker
+            stats to, e.g. :data:`.metrics.REGISTRY`
+    """
+    def __init__(self, sessions, cores=None, client_factory=None,
+                 render_factory=None, ring_size=DEFAULT_CAPACITY,
+                 registry=None):
+        self.sessions = list(sessions)
+        self.cores = available_cores() if cores is None else list(cores)
+        self.client_factory = client_factory
+        self.render_factory = render_factory
+        self.ring_size = ring_size
+        self.registry = registry
+
+        # Fork would copy the parent's event loop and threads
+        self._context = multiprocessing.get_context('spawn')
+        self._stop = self._context.Event()
+        self.stats_block = None
+        self.processes = []
+        self.rings = []
+        self.renderers = []
+        self._threads = []
+        self._metrics = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+        self.close()
+
+    def core(self, index):
+        """
+        Core of the worker at `index`, None if not pinned
+        """
+        if not self.cores:
+            return None
+        return self.cores[index % len(self.cores)]
+
+    def start(self):
+        from xbox.nano.render.client.ring import RingRenderer
+
+        if self.processes:
+            raise SupervisorError('Supervisor already started')
+
+        self.stats_block = StatsBlock(len(self.sessions))
+        for index, session in enumerate(self.sessions):
+            ring = None
+            if self.render_factory:
+                ring = FrameRing(self.ring_size, context=self._context)
+                self.rings.append(ring)
+
+            process = self._context.Process(
+                target=worker_main, name='Nano-%s' % session.name,
+                args=(index, session, self.core(index), self.stats_block,
+                      self._stop, ring, self.client_factory)
+            )
+            process.start()
+            self.processes.append(process)
+
+            if ring is not None:
+                # Ends with the worker, even if its close record is lost
+                renderer = RingRenderer(
+                    ring, self.render_factory(session), producer=process
+                )
+                thread = threading.Thread(
+                    target=renderer.run, name='Render-%s' % session.name,
+                    daemon=True
+                )
+                thread.start()
+                self.renderers.append(renderer)
+                self._threads.append(thread)
+
+        if self.registry is not None:
+            self._register_metrics()
+
+    def _register_metrics(self):
+        labels = ['session']
+        self.up = metrics.Gauge(
+            'xbox_nano_worker_up', 'Worker process running', labels)
+        self.packets = metrics.Counter(
+            'xbox_nano_worker_packets_total', 'Datagrams received', labels)
+        self.lost = metrics.Counter(
+            'xbox_nano_worker_lost_packets_total',
+            'Datagrams lost according to RTP sequence numbers', labels)
+        self.frames = metrics.Counter(
+            'xbox_nano_worker_video_frames_total',
+            'Video frames fully reassembled', labels)
+        self.expired = metrics.Counter(
+            'xbox_nano_worker_video_frames_expired_total',
+            'Incomplete video frames discarded', labels)
+        self.decoded = metrics.Counter(
+            'xbox_nano_worker_video_decoded_total',
+            'Video frames emitted by the decoder', labels)
+        self.decode_seconds = metrics.Counter(
+            'xbox_nano_worker_decode_seconds_total',
+            'Time spent decoding video', labels)
+        self.cpu_seconds = metrics.Counter(
+            'xbox_nano_worker_cpu_seconds_total',
+            'CPU time of the worker process', labels)
+        self.ring_dropped = metrics.Counter(
+            'xbox_nano_worker_ring_dropped_total',
+            'Frames dropped, frame ring full', labels)
+
+        self._metrics = [
+            self.up, self.packets, self.lost, self.frames, self.expired,
+            self.decoded, self.decode_seconds, self.cpu_seconds,
+            self.ring_dropped
+        ]
+        for metric in self._metrics:
+            self.registry.register(metric)
+        self.registry.add_collector(self.collect)
+
+    def collect(self):
+        for session, stats in zip(self.sessions, self.stats()):
+            name = session.name
+            self.up.set(int(stats.state == WorkerState.Running),
+                        session=name)
+            self.packets.set_total(stats.packets, session=name)
+            self.lost.set_total(stats.lost, session=name)
+            self.frames.set_total(stats.frames_completed, session=name)
+            self.expired.set_total(stats.frames_expired, session=name)
+            self.decoded.set_total(stats.video_decoded, session=name)
+            self.decode_seconds.set_total(stats.decode_seconds, session=name)
+            self.cpu_seconds.set_total(stats.cpu_seconds, session=name)
+            self.ring_dropped.set_total(stats.ring_dropped, session=name)
+
+    def stats(self):
+        """
+        Returns:
+            list: :class:`WorkerStats` per session
+        """
+        if self.stats_block is None:
+            return []
+        return [self.stats_block.read(i) for i in range(len(self.sessions))]
+
+    def wait(self, timeout=None):
+        """
+        Wait for all sessions to end
+
+        Returns:
+            bool: False on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        for index, process in enumerate(self.processes):
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0)
+            process.join(remaining)
+            if process.is_alive():
+                return False
+            self._check_exit(index, process)
+
+        for thread in self._threads:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0)
+            thread.join(remaining)
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def _check_exit(self, index, process):
+        # Killed before reporting, the slot has no writer anymore
+        stats = self.stats_block.read(index)
+        if stats.state in (WorkerState.Starting, WorkerState.Running):
+            log.error('Worker %s exited with %s', process.name,
+                      process.exitcode)
+            self.stats_block.write(
+                index, stats._replace(state=WorkerState.Failed)
+            )
+
+    def stop(self, timeout=5.0):
+        """
+        Ask all workers to end their sessions, terminate them after
+        `timeout`
+        """
+        self._stop.set()
+        for index, process in enumerate(self.processes):
+            process.join(timeout)
+            if process.is_alive():
+                log.warning('Terminating worker %s', process.name)
+                process.terminate()
+                process.join()
+            self._check_exit(index, process)
+
+        for renderer in self.renderers:
+            renderer.stop()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def close(self):
+        """
+        Release shared memory and metrics, after :meth:`stop`
+        """
+        if self._metrics:
+            self.registry.remove_collector(self.collect)
+            for metric in self._metrics:
+                self.registry.unregister(metric)
+            self._metrics = []
+        for ring in self.rings:
+            ring.close()
+        self.rings = []
+        if self.stats_block:
+            self.stats_block.close()
+            self.stats_block = None
+
+    def report(self):
+        """
+        Per worker and aggregate throughput, call before :meth:`close`
+        """
+        all_stats = self.stats()
+        lines = ['%-24s %4s %8s %8s %8s %8s %9s %9s %8s' % (
+            'session', 'core', 'state', 'frames', 'decoded', 'expired',
+            'decode s', 'cpu s', 'fps'
+        )]
+        states = {
+            WorkerState.Starting: 'starting', WorkerState.Running: 'running',
+            WorkerState.Done: 'done', WorkerState.Failed: 'failed'
+        }
+        for session, stats in zip(self.sessions, all_stats):
+            lines.append('%-24s %4s %8s %8d %8d %8d %9.3f %9.3f %8.1f' % (
+                session.name[:24],
+                stats.core if stats.core >= 0 else '-',
+                states.get(stats.state, stats.state), stats.frames_completed,
+                stats.video_decoded, stats.frames_expired,
+                stats.decode_seconds, stats.cpu_seconds, stats.fps
+            ))
+
+        running = [s for s in all_stats if s.started]
+        if running:
+            span = max(s.updated for s in running) - \
+                min(s.started for s in running)
+            frames = sum(s.frames_completed for s in running)
+            lines.append('Total: %d frames in %.3fs, %.1f fps' % (
+                frames, span, frames / span if span > 0 else 0.0
+            ))
+        return '\n'.join(lines)
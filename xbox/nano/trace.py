@@ -0,0 +1,174 @@
+"""
+Frame tracing
+
+Stamps video frames with :func:`time.perf_counter_ns` as they travel
+through the pipeline (see :class:`Stage`). Finished frames are recorded
+into latency histograms and, optionally, kept as Chrome trace events
+(load the file via chrome://tracing or https://ui.perfetto.dev).
+
+Example:
+    >>> tracer = FrameTracer(record_events=True)
+    >>> await console.nano.start_gamestream(client, tracer=tracer)
+    ...
+    >>> tracer.write_chrome_trace('session.trace.json')
+"""
+import json
+import time
+import logging
+from enum import IntEnum
+from collections import OrderedDict, deque
+
+from xbox.nano import metrics
+
+log = logging.getLogger(__name__)
+
+
+class Stage(IntEnum):
+    FirstFragment = 0
+    LastFragment = 1
+    Reassembled = 2
+    Decoded = 3
+    Presented = 4
+
+
+# Finer than metrics.DEFAULT_BUCKETS, reassembly is in the microseconds
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.004, 0.008, 0.016,
+    0.033, 0.066, 0.1, 0.25, 0.5, 1.0
+)
+
+
+class FrameTracer(object):
+    """
+    Collects per-stage timestamps of video frames
+
+    Args:
+        registry (:class:`.metrics.Registry`): Registry to export the
+            latency histograms to, e.g. :data:`.metrics.REGISTRY`. The
+            names are fixed, so one tracer per registry
+        record_events (bool): Keep Chrome trace events
+        max_events (int): Number of most recent frames kept as events
+        max_pending (int): Number of unfinished frames tracked at once
+    """
+    def __init__(self, registry=None, record_events=False,
+                 max_events=100000, max_pending=256):
+        self.registry = registry
+        self.record_events = record_events
+        self.max_pending = max_pending
+
+        self._pending = OrderedDict()
+        self._current = None
+        self._events = deque(maxlen=max_events)
+        self._origin = time.perf_counter_ns()
+
+        self.stage_seconds = metrics.Histogram(
+            'xbox_nano_frame_stage_seconds',
+            'Time from the previous pipeline stage of a video frame',
+            ['stage'], buckets=LATENCY_BUCKETS)
+        self.latency_seconds = metrics.Histogram(
+            'xbox_nano_frame_latency_seconds',
+            'Time from first fragment received to last stage of a video frame',
+            buckets=LATENCY_BUCKETS)
+
+        if registry is not None:
+            registry.register(self.stage_seconds)
+            registry.register(self.latency_seconds)
+
+    def close(self):
+        if self.registry is not None:
+            self.registry.unregister(self.stage_seconds)
+            self.registry.unregister(self.latency_seconds)
+
+    def stamp(self, frame_id, stage, ns=None):
+        """
+        Record that frame reached stage
+
+        Args:
+            frame_id (int): Frame id
+            stage (:class:`Stage`): Pipeline stage
+            ns (int): :func:`time.perf_counter_ns` timestamp, defaults to now
+        """
+        stamps = self._pending.get(frame_id)
+        if stamps is None:
+            if len(self._pending) >= self.max_pending:
+                self._pending.popitem(last=False)
+            stamps = self._pending[frame_id] = [None] * len(Stage)
+        stamps[stage] = time.perf_counter_ns() if ns is None else ns
+
+    def begin(self, frame_id):
+        """
+        Mark frame as reassembled and handed to the client.
+
+        Until :meth:`finish`, sinks can stamp it with :meth:`stamp_current`
+        without knowing its id.
+        """
+        self.stamp(frame_id, Stage.Reassembled)
+        self._current = frame_id
+
+    def stamp_current(self, stage):
+        if self._current is not None:
+            self.stamp(self._current, stage)
+
+    def finish(self, frame_id):
+        """
+        Record latencies of frame and stop tracking it
+        """
+        if self._current == frame_id:
+            self._current = None
+
+        stamps = self._pending.pop(frame_id, None)
+        if stamps is None:
+            return
+
+        previous = None
+        for stage, ns in zip(Stage, stamps):
+            if ns is None:
+                continue
+            if previous is not None:
+                self.stage_seconds.observe(
+                    (ns - stamps[previous]) / 1e9, stage=stage.name
+                )
+                if self.record_events:
+                    self._add_event(frame_id, stage, stamps[previous], ns)
+            previous = stage
+
+        first = stamps[Stage.FirstFragment]
+        if first is not None and previous is not None:
+            self.latency_seconds.observe((stamps[previous] - first) / 1e9)
+
+    def discard(self, frame_id):
+        """
+        Stop tracking frame without recording it, e.g. on expiry
+        """
+        self._pending.pop(frame_id, None)
+
+    def _add_event(self, frame_id, stage, start_ns, end_ns):
+        self._events.append({
+            'name': stage.name,
+            'cat': 'video',
+            'ph': 'X',
+            'ts': (start_ns - self._origin) / 1000.0,
+            'dur': (end_ns - start_ns) / 1000.0,
+            'pid': 1,
+            'tid': int(stage),
+            'args': {'frame_id': frame_id}
+        })
+
+    def chrome_trace(self):
+        """
+        Returns:
+            dict: Recorded frames in Chrome trace event format
+        """
+        names = [{
+            'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': int(stage),
+            'args': {'name': stage.name}
+        } for stage in Stage]
+        return {
+            'traceEvents': names + list(self._events),
+            'displayTimeUnit': 'ms'
+        }
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        log.info('Wrote %d trace events to %s', len(self._events), path)
@@ -1,18 +1,19 @@
 import struct
 import bitstruct
+from functools import partial
 from io import BytesIO
+from datetime import datetime
 from construct import Container
 
-from xbox.nano import enum, packer
+from xbox.sg.utils.struct import XStructObj
+from xbox.nano import enum
+from xbox.nano.packet import video, audio, input, control as control_packet
 from xbox.nano.enum import (
     RtpPayloadType, ChannelControlPayloadType, ChannelClass,
     VideoPayloadType, AudioPayloadType, InputPayloadType, ControlPayloadType,
     ControllerEvent
 )
 
-pack = packer.pack
-
-RTP_FLAGS = bitstruct.compile('u2b1b1u4b1u7')
 VIDEO_CONTROL_FLAGS = bitstruct.compile('p2b1b1b1b1b1b1p24')
 AUDIO_CONTROL_FLAGS = bitstruct.compile('p1b1p1b1b1p27')
 
@@ -26,31 +27,210 @@ STREAMER_TYPE_MAP = {
 }
 
 
+INPUT_FRAME_BODY = struct.Struct('<18B4h13B')
+# Field order of the input frame body, as defined by the construct structs
+INPUT_BUTTON_FIELDS = tuple(
+    sc.name for sc in input.input_frame_buttons.subcon.subcons
+)
+INPUT_ANALOG_FIELDS = tuple(
+    sc.name for sc in input.input_frame_analog.subcon.subcons
+)
+INPUT_EXTENSION_FIELDS = tuple(
+    sc.name for sc in input.input_frame_extension.subcon.subcons
+)
+
+
+# RTP flags, payload type, sequence num, channel id
+RTP_PEEK = struct.Struct('>2BH6xH')
+STREAMER_PAYLOAD_TYPE = RtpPayloadType.Streamer.value
+
+
 class PackerError(Exception):
     pass
 
 
-def unpack_tcp(buf, channels=None):
-    while len(buf):
-        size = struct.unpack('<I', buf[:4])[0]
-        msg, buf = buf[4:size + 4], buf[size + 4:]
-        yield unpack(msg, channels)
+class Message(Container):
+    """
+    Parsed message, can be updated by calling it - like :class:`XStructObj`
+    """
+    def __call__(self, **kwargs):
+        self.update(kwargs)
+        return self
+
+
+class LazyContainer(Container):
+    """
+    Container with fields decoded on first access.
+
+    The decoded value is stored in the container, subsequent accesses
+    are plain lookups.
+    """
+    _decoders = None
+
+    def set_lazy(self, key, decoder):
+        """
+        Add field `key`, decoded by calling `decoder` on first access
+        """
+        if self._decoders is None:
+            object.__setattr__(self, '_decoders', {})
+        if key not in self.__keys_order__:
+            self.__keys_order__.append(key)
+        self._decoders[key] = decoder
+
+    def is_decoded(self, key):
+        return dict.__contains__(self, key) or not self._decoders or \
+            key not in self._decoders
+
+    def __missing__(self, key):
+        decoder = self._decoders.pop(key, None) if self._decoders else None
+        if decoder is None:
+            raise KeyError(key)
+
+        value = decoder()
+        dict.__setitem__(self, key, value)
+        return value
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or \
+            bool(self._decoders and key in self._decoders)
+
+
+class LazyMessage(LazyContainer, Message):
+    pass
+
+
+class InputFrameEncoder(object):
+    """
+    Builds complete UDP input frame messages (RTP header, streamer header
+    and input frame payload) into a reused buffer.
+
+    Layout matches `packer.pack` output for an `input.frame` payload,
+    including the single byte of ANSI X.923 padding.
+    """
+    RTP_HEADER = struct.Struct('>2BHI2H')
+    # streamer version, type, payload length, frame_id, timestamp, created_ts,
+    # 16 buttons, 2 triggers, 4 thumbsticks, 4 rumble, 9 extension, padding
+    BODY = struct.Struct('<4I2Q18B4h14B')
+    SIZE = RTP_HEADER.size + BODY.size
+    PAYLOAD_SIZE = 59
+
+    # version 2, padding set
+    RTP_FLAGS = 0x80 | 0x20
+
+    def __init__(self):
+        self._buf = bytearray(self.SIZE)
+
+    def pack(self, sequence_num, connection_id, channel_id, frame_id,
+             timestamp, created_ts, buttons, analog, extension,
+             rtp_timestamp=0):
+        """
+        Pack input frame message
+
+        The returned buffer is reused by the next call.
+
+        Args:
+            sequence_num (int): RTP sequence number (wraps at 16 bits)
+            connection_id (int): UDP connection id
+            channel_id (int): Input channel id
+            frame_id (int): Input frame id
+            timestamp (int): Input timestamp
+            created_ts (int): Creation timestamp
+            buttons (list): 16 button values, in frame field order
+            analog (list): 10 analog values, in frame field order
+            extension (list): 9 extension values, in frame field order
+            rtp_timestamp (int): RTP header timestamp
+
+        Returns:
+            bytearray: Packed message
+        """
+        buf = self._buf
+        self.RTP_HEADER.pack_into(
+            buf, 0, self.RTP_FLAGS, RtpPayloadType.Streamer.value,
+            sequence_num & 0xFFFF, rtp_timestamp, connection_id, channel_id
+        )
+        self.BODY.pack_into(
+            buf, self.RTP_HEADER.size,
+            0, InputPayloadType.Frame.value, self.PAYLOAD_SIZE,
+            frame_id, timestamp, created_ts,
+            *buttons, *analog, *extension, 1
+        )
+        return buf
+
+
+def split_tcp(buf):
+    """
+    Yields the length prefixed messages of TCP data
+    """
+    offset = 0
+    end = len(buf)
+    while offset < end:
+        size = UINT32.unpack_from(buf, offset)[0]
+        offset += UINT32.size
+        yield buf[offset:offset + size]
+        offset += size
+
+
+def unpack_tcp(buf, channels=None, lazy=True):
+    for msg in split_tcp(buf):
+        yield unpack(msg, channels, lazy)
+
+
+def peek_header(buf):
+    """
+    Read the fields needed for routing without parsing the message
+
+    Args:
+        buf (bytes): Message data
+
+    Returns:
+        tuple: Integers `(payload_type, channel_id, sequence_num,
+            streamer_type)`, `streamer_type` is None for non-streamer
+            messages
+    """
+    try:
+        flags, payload_type, sequence_num, channel_id = \
+            RTP_PEEK.unpack_from(buf)
+        payload_type &= 0x7F
+
+        streamer_type = None
+        if payload_type == STREAMER_PAYLOAD_TYPE:
+            offset = RTP_PEEK.size + 4 * (flags & 0x0F)
+            version = UINT32.unpack_from(buf, offset)[0]
+            # Sequenced streamer header has sequence / prev sequence first
+            offset += 12 if version & 1 else 4
+            streamer_type = UINT32.unpack_from(buf, offset)[0]
+    except struct.error as e:
+        raise PackerError('Message too short: %s' % e)
+
+    return payload_type, channel_id, sequence_num, streamer_type
 
 
 def pack_tcp(msgs, channels=None):
-    buf = b''
+    packed = [pack(msg, channels) for msg in msgs]
+    buf = bytearray(sum(len(msg) for msg in packed) + 4 * len(packed))
 
-    for msg in msgs:
-        msg = pack(msg, channels)
-        buf += struct.pack('<I', len(msg)) + msg
+    offset = 0
+    for msg in packed:
+        UINT32.pack_into(buf, offset, len(msg))
+        buf[offset + 4:offset + 4 + len(msg)] = msg
+        offset += 4 + len(msg)
 
-    return buf
+    return bytes(buf)
 
 
-def unpack(buf, channels=None):
-    stream = BytesIO(buf)
-    msg = Container()
+def unpack(buf, channels=None, lazy=True):
+    """
+    Unpack message
 
+    Args:
+        buf (bytes): Message data
+        channels (dict): Channels by channel id, needed for streamer messages
+        lazy (bool): Decode streamer payloads on first access
+
+    Returns:
+        :class:`Message`: Message
+    """
+    stream = BytesIO(buf)
     header = rtp(stream)
     payload = Container()
 
@@ -82,83 +262,116 @@ def unpack(buf, channels=None):
             raise PackerError('Unknown channel ID %d' % channel_id)
 
         channel = channels[channel_id]
-        payload = streamer(header, channel.name, stream)
+        stream = streamer(header, channel.name, stream)
+        decoder = partial(
+            streamer_payload, channel.name, header['streamer']['type'],
+            stream, lazy
+        )
+
+        if lazy:
+            msg = _new(LazyMessage, header=header)
+            msg.set_lazy('payload', decoder)
+            return msg
+
+        payload = decoder()
+
+    return _new(Message, header=header, payload=payload)
+
+
+def _new(cls=Container, **fields):
+    # Container.__init__ / __setitem__ are slow, fill the dict directly
+    obj = dict.__new__(cls)
+    dict.update(obj, fields)
+    object.__setattr__(obj, '__keys_order__', list(fields))
+    return obj
 
-    msg['header'] = header
-    msg['payload'] = payload
-    return msg
+
+def _zip(names, values):
+    obj = dict.__new__(Container)
+    dict.update(obj, zip(names, values))
+    object.__setattr__(obj, '__keys_order__', list(names))
+    return obj
 
 
 def rtp(stream):
-    flags = RTP_FLAGS.unpack(stream.read(2))
-    data = struct.unpack('>HI2H', stream.read(10))
-
-    r = Container()
-    rflags = Container()
-    rssrc = Container()
-
-    rflags['version'] = flags[0]
-    rflags['padding'] = flags[1]
-    rflags['extension'] = flags[2]
-    rflags['csrc_count'] = flags[3]
-    rflags['marker'] = flags[4]
-    rflags['payload_type'] = RtpPayloadType(flags[5])
-    r['flags'] = rflags
-    r['sequence_num'] = data[0]
-    r['timestamp'] = data[1]
-    rssrc['connection_id'] = data[2]
-    rssrc['channel_id'] = data[3]
-    r['ssrc'] = rssrc
-    r['csrc_list'] = struct.unpack('>{}I'.format(flags[3]), stream.read(4 * flags[3]))
-
-    return r
+    data = RTP_HEADER.unpack(stream.read(RTP_HEADER.size))
+    csrc_count = data[0] & 0x0F
+
+    return _new(
+        flags=_new(
+            version=data[0] >> 6,
+            padding=bool(data[0] & 0x20),
+            extension=bool(data[0] & 0x10),
+            csrc_count=csrc_count,
+            marker=bool(data[1] & 0x80),
+            payload_type=RtpPayloadType(data[1] & 0x7F)
+        ),
+        sequence_num=data[2],
+        timestamp=data[3],
+        ssrc=_new(connection_id=data[4], channel_id=data[5]),
+        csrc_list=list(struct.unpack(
+            '>{}I'.format(csrc_count), stream.read(4 * csrc_count)
+        ))
+    )
 
 
 def streamer(header, channel, stream):
-    streamer_header = Container()
-    if header['ssrc']['connection_id'] == 0:
-        # TCP
-        data = struct.unpack('<4I', stream.read(16))
-        streamer_header['streamer_version'] = data[0]
-        streamer_header['sequence_num'] = data[1]
-        streamer_header['prev_sequence_num'] = data[2]
-        streamer_header['type'] = STREAMER_TYPE_MAP[channel](data[3])
+    if channel not in STREAMER_TYPE_MAP:
+        raise PackerError('Unknown channel class %s' % channel)
+
+    streamer_version = struct.unpack('<I', stream.read(4))[0]
+    if streamer_version & 1:
+        # Sequenced (TCP)
+        data = struct.unpack('<3I', stream.read(12))
+        streamer_type = data[2]
+        streamer_header = _new(
+            streamer_version=streamer_version,
+            sequence_num=data[0],
+            prev_sequence_num=data[1],
+            type=STREAMER_TYPE_MAP[channel](streamer_type)
+        )
     else:
-        # UDP
-        data = struct.unpack('<2I', stream.read(8))
-        streamer_header['streamer_version'] = data[0]
-        streamer_header['type'] = STREAMER_TYPE_MAP[channel](data[1])
+        streamer_type = struct.unpack('<I', stream.read(4))[0]
+        streamer_header = _new(
+            streamer_version=streamer_version,
+            type=STREAMER_TYPE_MAP[channel](streamer_type)
+        )
 
-    if header['ssrc']['connection_id'] == 0 and streamer_header['type'] == 0:
-        pass
-    else:
-        stream.read(4)
+    if streamer_type != 0:
+        # Payload is length prefixed, except for ControlStreamer (type: 0)
+        size = struct.unpack('<I', stream.read(4))[0]
+        stream = BytesIO(stream.read(size))
 
     header['streamer'] = streamer_header
+    return stream
+
+
+def streamer_payload(channel, payload_type, stream, lazy=False):
     payload = Container()
-    payload_type = streamer_header['type']
 
     if channel == ChannelClass.Control:
         if payload_type == 0:
-            payload = control(stream)
+            payload = control(stream, lazy)
 
     elif channel == ChannelClass.Video:
         if payload_type == VideoPayloadType.Data:
             data = struct.unpack('<2IQ4I', stream.read(32))
-            payload['flags'] = data[0]
-            payload['frame_id'] = data[1]
-            payload['timestamp'] = data[2]
-            payload['total_size'] = data[3]
-            payload['packet_count'] = data[4]
-            payload['offset'] = data[5]
-            payload['data'] = stream.read(data[6])
+            payload = _new(
+                flags=data[0],
+                frame_id=data[1],
+                timestamp=data[2],
+                total_size=data[3],
+                packet_count=data[4],
+                offset=data[5],
+                data=stream.read(data[6])
+            )
         elif payload_type == VideoPayloadType.ServerHandshake:
             data = struct.unpack('<4IQI', stream.read(28))
             payload['protocol_version'] = data[0]
             payload['width'] = data[1]
             payload['height'] = data[2]
             payload['fps'] = data[3]
-            payload['reference_timestamp'] = data[4]
+            payload['reference_timestamp'] = _timestamp(data[4])
             formats = []
             for _ in range(data[5]):
                 formats.append(video_fmt(stream))
@@ -177,6 +390,9 @@ def streamer(header, channel, stream):
             flags['lost_frames'] = data[4]
             flags['last_displayed_frame'] = data[5]
             payload['flags'] = flags
+            payload['last_displayed_frame'] = None
+            payload['queue_depth'] = None
+            payload['lost_frames'] = None
 
             if flags['last_displayed_frame']:
                 data = struct.unpack('<Iq', stream.read(12))
@@ -185,23 +401,26 @@ def streamer(header, channel, stream):
                 payload['last_displayed_frame']['timestamp'] = data[1]
 
             if flags['queue_depth']:
-                payload['queue_depth'] = struct.unpack('<I', stream.read(4))
+                payload['queue_depth'] = struct.unpack('<I', stream.read(4))[0]
 
             if flags['lost_frames']:
                 data = struct.unpack('<2I', stream.read(8))
+                payload['lost_frames'] = Container()
                 payload['lost_frames']['first'] = data[0]
                 payload['lost_frames']['last'] = data[1]
     elif channel in (ChannelClass.Audio, ChannelClass.ChatAudio):
         if payload_type == AudioPayloadType.Data:
             data = struct.unpack('<2IQI', stream.read(20))
-            payload['flags'] = data[0]
-            payload['frame_id'] = data[1]
-            payload['timestamp'] = data[2]
-            payload['data'] = stream.read(data[3])
+            payload = _new(
+                flags=data[0],
+                frame_id=data[1],
+                timestamp=data[2],
+                data=stream.read(data[3])
+            )
         elif payload_type == AudioPayloadType.ServerHandshake:
             data = struct.unpack('<IQI', stream.read(16))
             payload['protocol_version'] = data[0]
-            payload['reference_timestamp'] = data[1]
+            payload['reference_timestamp'] = _timestamp(data[1])
             formats = []
             for _ in range(data[2]):
                 formats.append(audio_fmt(stream))
@@ -224,50 +443,10 @@ def streamer(header, channel, stream):
             payload['timestamp'] = data[1]
             payload['created_ts'] = data[2]
 
-            buttons = Container()
-            analog = Container()
-            extension = Container()
-            data = struct.unpack('>18B4H13B', stream.read(39))
-
-            buttons['dpad_up'] = data[0]
-            buttons['dpad_down'] = data[1]
-            buttons['dpad_left'] = data[2]
-            buttons['dpad_right'] = data[3]
-            buttons['start'] = data[4]
-            buttons['back'] = data[5]
-            buttons['left_thumbstick'] = data[6]
-            buttons['right_thumbstick'] = data[7]
-            buttons['left_shoulder'] = data[8]
-            buttons['right_shoulder'] = data[9]
-            buttons['guide'] = data[10]
-            buttons['unknown'] = data[11]
-            buttons['a'] = data[12]
-            buttons['b'] = data[13]
-            buttons['x'] = data[14]
-            buttons['y'] = data[15]
-            analog['left_trigger'] = data[16]
-            analog['right_trigger'] = data[17]
-            analog['left_thumb_x'] = data[18]
-            analog['left_thumb_y'] = data[19]
-            analog['right_thumb_x'] = data[20]
-            analog['right_thumb_y'] = data[21]
-            analog['rumble_trigger_l'] = data[22]
-            analog['rumble_trigger_r'] = data[23]
-            analog['rumble_handle_l'] = data[24]
-            analog['rumble_handle_r'] = data[25]
-            extension['byte_6'] = data[26]
-            extension['byte_7'] = data[27]
-            extension['rumble_trigger_l2'] = data[28]
-            extension['rumble_trigger_r2'] = data[29]
-            extension['rumble_handle_l2'] = data[30]
-            extension['rumble_handle_r2'] = data[31]
-            extension['byte_12'] = data[32]
-            extension['byte_13'] = data[33]
-            extension['byte_14'] = data[34]
-
-            payload['buttons'] = buttons
-            payload['analog'] = analog
-            payload['extension'] = extension
+            data = INPUT_FRAME_BODY.unpack(stream.read(INPUT_FRAME_BODY.size))
+            payload['buttons'] = _zip(INPUT_BUTTON_FIELDS, data[:16])
+            payload['analog'] = _zip(INPUT_ANALOG_FIELDS, data[16:26])
+            payload['extension'] = _zip(INPUT_EXTENSION_FIELDS, data[26:])
         elif payload_type == InputPayloadType.ServerHandshake:
             data = struct.unpack('<5I', stream.read(20))
             payload['protocol_version'] = data[0]
@@ -278,16 +457,15 @@ def streamer(header, channel, stream):
         elif payload_type == InputPayloadType.ClientHandshake:
             data = struct.unpack('<IQ', stream.read(12))
             payload['max_touches'] = data[0]
-            payload['reference_timestamp'] = data[1]
+            payload['reference_timestamp'] = _timestamp(data[1])
         elif payload_type == InputPayloadType.FrameAck:
             payload['acked_frame'] = struct.unpack('<I', stream.read(4))[0]
 
     return payload
 
 
-def control(stream):
-    payload = Container()
-    ppayload = Container()
+def control(stream, lazy=False):
+    payload = LazyContainer() if lazy else Container()
 
     data = struct.unpack('<I3H', stream.read(10))
     payload['prev_seq_dup'] = data[0]
@@ -295,17 +473,30 @@ def control(stream):
     payload['unk2'] = data[2]
     payload['opcode'] = ControlPayloadType(data[3])
 
-    if payload.opcode == ControlPayloadType.SessionInit:
+    if lazy:
+        # Opcode is enough to drop telemetry and friends
+        payload.set_lazy(
+            'payload', partial(control_payload, payload.opcode, stream)
+        )
+    else:
+        payload['payload'] = control_payload(payload.opcode, stream)
+    return payload
+
+
+def control_payload(opcode, stream):
+    ppayload = Container()
+
+    if opcode == ControlPayloadType.SessionInit:
         ppayload['unk3'] = stream.read()
-    elif payload.opcode == ControlPayloadType.SessionCreate:
+    elif opcode == ControlPayloadType.SessionCreate:
         ppayload['guid'] = stream.read(16)
         ppayload['unk3'] = stream.read(struct.unpack('<I', stream.read(4))[0])
-    elif payload.opcode == ControlPayloadType.SessionCreateResponse:
+    elif opcode == ControlPayloadType.SessionCreateResponse:
         ppayload['guid'] = stream.read(16)
-    elif payload.opcode == ControlPayloadType.SessionDestroy:
+    elif opcode == ControlPayloadType.SessionDestroy:
         ppayload['unk3'] = struct.unpack('<f', stream.read(4))[0]
         ppayload['unk5'] = stream.read(struct.unpack('<I', stream.read(4))[0])
-    elif payload.opcode == ControlPayloadType.VideoStatistics:
+    elif opcode == ControlPayloadType.VideoStatistics:
         data = struct.unpack('<6f', stream.read(24))
         ppayload['unk3'] = data[0]
         ppayload['unk4'] = data[1]
@@ -313,7 +504,7 @@ def control(stream):
         ppayload['unk6'] = data[3]
         ppayload['unk7'] = data[4]
         ppayload['unk8'] = data[5]
-    elif payload.opcode == ControlPayloadType.RealtimeTelemetry:
+    elif opcode == ControlPayloadType.RealtimeTelemetry:
         data = []
         for i in range(struct.unpack('<H', stream.read(2))[0]):
             p = struct.unpack('<HQ', stream.read(10))
@@ -322,23 +513,23 @@ def control(stream):
                 value=p[1]
             ))
         ppayload['data'] = data
-    elif payload.opcode == ControlPayloadType.ChangeVideoQuality:
-        data = struct.unpack('<I5f', stream.read(24))
+    elif opcode == ControlPayloadType.ChangeVideoQuality:
+        data = struct.unpack('<6I', stream.read(24))
         ppayload['unk3'] = data[0]
         ppayload['unk4'] = data[1]
         ppayload['unk5'] = data[2]
         ppayload['unk6'] = data[3]
         ppayload['unk7'] = data[4]
         ppayload['unk8'] = data[5]
-    elif payload.opcode == ControlPayloadType.InitiateNetworkTest:
+    elif opcode == ControlPayloadType.InitiateNetworkTest:
         ppayload['guid'] = stream.read(16)
-    elif payload.opcode == ControlPayloadType.NetworkInformation:
+    elif opcode == ControlPayloadType.NetworkInformation:
         ppayload['guid'] = stream.read(16)
         data = struct.unpack('<QBf', stream.read(13))
         ppayload['unk4'] = data[0]
         ppayload['unk5'] = data[1]
         ppayload['unk6'] = data[2]
-    elif payload.opcode == ControlPayloadType.NetworkTestResponse:
+    elif opcode == ControlPayloadType.NetworkTestResponse:
         ppayload['guid'] = stream.read(16)
         data = struct.unpack('<5f2Qf', stream.read(40))
         ppayload['unk3'] = data[0]
@@ -349,13 +540,12 @@ def control(stream):
         ppayload['unk8'] = data[5]
         ppayload['unk9'] = data[6]
         ppayload['unk10'] = data[7]
-    elif payload.opcode == ControlPayloadType.ControllerEvent:
-        data = struct.unpack('<2B')
+    elif opcode == ControlPayloadType.ControllerEvent:
+        data = struct.unpack('<2B', stream.read(2))
         ppayload['event'] = ControllerEvent(data[0])
         ppayload['controller_num'] = data[1]
 
-    payload['payload'] = ppayload
-    return payload
+    return ppayload
 
 
 def video_fmt(stream):
@@ -365,9 +555,10 @@ def video_fmt(stream):
     fmt['width'] = data[1]
     fmt['height'] = data[2]
     fmt['codec'] = enum.VideoCodec(data[3])
-    fmt['rgb'] = Container()
+    fmt['rgb'] = None
     if fmt['codec'] == enum.VideoCodec.RGB:
         data = struct.unpack('<2I3Q', stream.read(32))
+        fmt['rgb'] = Container()
         fmt['rgb']['bpp'] = data[0]
         fmt['rgb']['bytes'] = data[1]
         fmt['rgb']['red_mask'] = data[2]
@@ -383,10 +574,443 @@ def audio_fmt(stream):
     fmt['channels'] = data[0]
     fmt['sample_rate'] = data[1]
     fmt['codec'] = enum.AudioCodec(data[2])
-    fmt['pcm'] = Container()
+    fmt['pcm'] = None
     if fmt['codec'] == enum.AudioCodec.PCM:
         data = struct.unpack('<2I', stream.read(8))
+        fmt['pcm'] = Container()
         fmt['pcm']['bit_depth'] = data[0]
         fmt['pcm']['type'] = data[1]
 
     return fmt
+
+
+def _timestamp(value):
+    # Reference timestamp, milliseconds since epoch
+    return datetime.utcfromtimestamp(value / 1000)
+
+
+# Encoding
+
+UINT8 = struct.Struct('<B')
+UINT16 = struct.Struct('<H')
+UINT32 = struct.Struct('<I')
+RTP_HEADER = struct.Struct('>2BHI2H')
+CSRC = struct.Struct('>I')
+STREAMER_TCP = struct.Struct('<4I')
+STREAMER_UDP = struct.Struct('<2I')
+
+CHANNEL_CONTROL_HANDSHAKE = struct.Struct('<BH')
+CHANNEL_CONTROL_CREATE = struct.Struct('<IH')
+
+VIDEO_FMT = struct.Struct('<4I')
+VIDEO_FMT_RGB = struct.Struct('<2I3Q')
+VIDEO_SERVER_HANDSHAKE = struct.Struct('<4IQI')
+VIDEO_LAST_DISPLAYED_FRAME = struct.Struct('<Iq')
+VIDEO_LOST_FRAMES = struct.Struct('<2I')
+VIDEO_DATA = struct.Struct('<2IQ4I')
+
+AUDIO_FMT = struct.Struct('<3I')
+AUDIO_FMT_PCM = struct.Struct('<2I')
+AUDIO_SERVER_HANDSHAKE = struct.Struct('<IQI')
+AUDIO_DATA = struct.Struct('<2IQI')
+
+INPUT_SERVER_HANDSHAKE = struct.Struct('<5I')
+INPUT_CLIENT_HANDSHAKE = struct.Struct('<IQ')
+INPUT_FRAME = struct.Struct('<I2Q18B4h13B')
+
+CONTROL_HEADER = struct.Struct('<I3H')
+CONTROL_GUID_PREFIXED = struct.Struct('<16sI')
+CONTROL_SESSION_DESTROY = struct.Struct('<fI')
+CONTROL_VIDEO_STATISTICS = struct.Struct('<6f')
+CONTROL_TELEMETRY_ENTRY = struct.Struct('<HQ')
+CONTROL_CHANGE_VIDEO_QUALITY = struct.Struct('<6I')
+CONTROL_NETWORK_INFORMATION = struct.Struct('<16sQBf')
+CONTROL_NETWORK_TEST_RESPONSE = struct.Struct('<16s5f2Qf')
+CONTROL_CONTROLLER_EVENT = struct.Struct('<2B')
+
+EPOCH = datetime.utcfromtimestamp(0)
+
+
+def pack(msg, channels=None):
+    """
+    Pack message, output is identical to `packer.pack`
+
+    Accepts messages created via `factory` as well as
+    messages returned by `unpack` / `packer.unpack`.
+
+    Args:
+        msg: Message
+        channels (dict): Channels, only needed for streamer messages
+            whose payload is not a XStructObj
+
+    Returns:
+        bytes: Packed message
+    """
+    header = _container(msg.header)
+    flags = header['flags']
+    payload_type = RtpPayloadType(flags['payload_type'])
+    payload = msg.payload
+
+    streamer_header = b''
+    if payload_type == RtpPayloadType.Streamer:
+        streamer = _container(header['streamer'])
+        streamer_version = streamer['streamer_version']
+        streamer_type = _value(streamer['type'])
+
+        if streamer_version & 1:
+            streamer_header = STREAMER_TCP.pack(
+                streamer_version, streamer['sequence_num'],
+                streamer['prev_sequence_num'], streamer_type
+            )
+        else:
+            streamer_header = STREAMER_UDP.pack(
+                streamer_version, streamer_type
+            )
+
+        data = _pack_streamer_payload(header, payload, channels)
+        if streamer_type != 0:
+            # ControlStreamer (type: 0) -> No payload length prefixed
+            data = UINT32.pack(len(data)) + data
+    elif payload_type == RtpPayloadType.Control:
+        payload = _container(payload)
+        data = CHANNEL_CONTROL_HANDSHAKE.pack(
+            _value(payload['type']), payload['connection_id']
+        )
+    elif payload_type == RtpPayloadType.ChannelControl:
+        data = _pack_channel_control(_container(payload))
+    elif payload_type == RtpPayloadType.UDPHandshake:
+        data = UINT8.pack(_container(payload)['unk'])
+    else:
+        raise PackerError('Unknown payload type %r' % payload_type)
+
+    version = flags.get('version')
+    if version is None:
+        version = 2
+
+    padding = flags.get('padding') or False
+    pad_size = (4 - len(data) % 4) % 4
+    if pad_size:
+        padding = True
+
+    csrc_list = header.get('csrc_list') or []
+    header_size = RTP_HEADER.size + CSRC.size * len(csrc_list)
+    payload_offset = header_size + len(streamer_header)
+    buf = bytearray(payload_offset + len(data) + pad_size)
+
+    RTP_HEADER.pack_into(
+        buf, 0,
+        (version << 6) | (padding << 5) |
+        (bool(flags.get('extension')) << 4) | (flags.get('csrc_count') or 0),
+        (bool(flags.get('marker')) << 7) | payload_type.value,
+        header.get('sequence_num') or 0, header.get('timestamp') or 0,
+        header['ssrc']['connection_id'], header['ssrc']['channel_id']
+    )
+    for i, csrc in enumerate(csrc_list):
+        CSRC.pack_into(buf, RTP_HEADER.size + i * CSRC.size, csrc)
+
+    buf[header_size:payload_offset] = streamer_header
+    buf[payload_offset:payload_offset + len(data)] = data
+    if pad_size:
+        # ANSI X.923: zero bytes, last byte holds padding size
+        buf[-1] = pad_size
+
+    return bytes(buf)
+
+
+def _container(obj):
+    if isinstance(obj, XStructObj):
+        return obj.container
+    return obj
+
+
+def _value(obj):
+    return getattr(obj, 'value', obj)
+
+
+def _prefixed(data):
+    return UINT32.pack(len(data)) + data
+
+
+def _reference_timestamp(obj):
+    if isinstance(obj, datetime):
+        # Timestamp in milliseconds since epoch (uint64 LE)
+        return int((obj - EPOCH).total_seconds() * 1000.0)
+    return obj
+
+
+def _pack_channel_control(payload):
+    payload_type = ChannelControlPayloadType(payload['type'])
+
+    if payload_type == ChannelControlPayloadType.ChannelCreate:
+        name = _value(payload['name']).encode('utf8')
+        return CHANNEL_CONTROL_CREATE.pack(payload_type.value, len(name)) + \
+            name + UINT32.pack(payload['flags'])
+    elif payload_type == ChannelControlPayloadType.ChannelOpen:
+        return UINT32.pack(payload_type.value) + _prefixed(payload['flags'])
+    elif payload_type == ChannelControlPayloadType.ChannelClose:
+        return UINT32.pack(payload_type.value) + UINT32.pack(payload['flags'])
+
+    return UINT32.pack(payload_type.value)
+
+
+def _pack_streamer_payload(header, payload, channels):
+    if isinstance(payload, XStructObj):
+        encoder = PAYLOAD_ENCODER_MAP.get(payload.subcon)
+        if not encoder:
+            raise PackerError('Unknown payload struct %r' % payload.subcon)
+        return encoder(payload.container)
+
+    if not channels:
+        raise PackerError('No channels passed')
+
+    channel_id = header['ssrc']['channel_id']
+    if channel_id not in channels:
+        raise PackerError('Unknown channel ID %d' % channel_id)
+
+    channel_name = channels[channel_id].name
+    if channel_name not in CHANNEL_ENCODER_MAP:
+        raise PackerError('Unknown channel class %s' % channel_name)
+
+    streamer_type = _value(_container(header['streamer'])['type'])
+    encoder = CHANNEL_ENCODER_MAP[channel_name].get(streamer_type)
+    if not encoder:
+        raise PackerError('Unknown streamer type %r' % streamer_type)
+
+    return encoder(payload)
+
+
+def _pack_video_fmt(fmt):
+    codec = enum.VideoCodec(fmt['codec'])
+    data = VIDEO_FMT.pack(fmt['fps'], fmt['width'], fmt['height'], codec.value)
+    if codec == enum.VideoCodec.RGB:
+        rgb = fmt['rgb']
+        data += VIDEO_FMT_RGB.pack(
+            rgb['bpp'], rgb['bytes'],
+            rgb['red_mask'], rgb['green_mask'], rgb['blue_mask']
+        )
+    return data
+
+
+def _pack_audio_fmt(fmt):
+    codec = enum.AudioCodec(fmt['codec'])
+    data = AUDIO_FMT.pack(fmt['channels'], fmt['sample_rate'], codec.value)
+    if codec == enum.AudioCodec.PCM:
+        data += AUDIO_FMT_PCM.pack(fmt['pcm']['bit_depth'], fmt['pcm']['type'])
+    return data
+
+
+def _pack_video_server_handshake(payload):
+    formats = payload['formats']
+    return VIDEO_SERVER_HANDSHAKE.pack(
+        payload['protocol_version'], payload['width'], payload['height'],
+        payload['fps'], _reference_timestamp(payload['reference_timestamp']),
+        len(formats)
+    ) + b''.join(_pack_video_fmt(_container(fmt)) for fmt in formats)
+
+
+def _pack_video_client_handshake(payload):
+    return UINT32.pack(payload['initial_frame_id']) + \
+        _pack_video_fmt(_container(payload['requested_format']))
+
+
+def _pack_video_control(payload):
+    flags = payload['flags']
+    # Bitfield is MSB first, flags live in the first byte
+    data = bytes((
+        (bool(flags['request_keyframe']) << 5) |
+        (bool(flags['start_stream']) << 4) |
+        (bool(flags['stop_stream']) << 3) |
+        (bool(flags['queue_depth']) << 2) |
+        (bool(flags['lost_frames']) << 1) |
+        bool(flags['last_displayed_frame']),
+        0, 0, 0
+    ))
+
+    if flags['last_displayed_frame']:
+        frame = payload['last_displayed_frame']
+        data += VIDEO_LAST_DISPLAYED_FRAME.pack(
+            frame['frame_id'], frame['timestamp']
+        )
+    if flags['queue_depth']:
+        data += UINT32.pack(payload['queue_depth'])
+    if flags['lost_frames']:
+        lost_frames = payload['lost_frames']
+        data += VIDEO_LOST_FRAMES.pack(
+            lost_frames['first'], lost_frames['last']
+        )
+
+    return data
+
+
+def _pack_video_data(payload):
+    return VIDEO_DATA.pack(
+        payload['flags'], payload['frame_id'], payload['timestamp'],
+        payload['total_size'], payload['packet_count'], payload['offset'],
+        len(payload['data'])
+    ) + payload['data']
+
+
+def _pack_audio_server_handshake(payload):
+    formats = payload['formats']
+    return AUDIO_SERVER_HANDSHAKE.pack(
+        payload['protocol_version'],
+        _reference_timestamp(payload['reference_timestamp']),
+        len(formats)
+    ) + b''.join(_pack_audio_fmt(_container(fmt)) for fmt in formats)
+
+
+def _pack_audio_client_handshake(payload):
+    return UINT32.pack(payload['initial_frame_id']) + \
+        _pack_audio_fmt(_container(payload['requested_format']))
+
+
+def _pack_audio_control(payload):
+    flags = payload['flags']
+    return bytes((
+        (bool(flags['reinitialize']) << 6) |
+        (bool(flags['start_stream']) << 4) |
+        (bool(flags['stop_stream']) << 3),
+        0, 0, 0
+    ))
+
+
+def _pack_audio_data(payload):
+    return AUDIO_DATA.pack(
+        payload['flags'], payload['frame_id'], payload['timestamp'],
+        len(payload['data'])
+    ) + payload['data']
+
+
+def _pack_input_server_handshake(payload):
+    return INPUT_SERVER_HANDSHAKE.pack(
+        payload['protocol_version'], payload['desktop_width'],
+        payload['desktop_height'], payload['max_touches'],
+        payload['initial_frame_id']
+    )
+
+
+def _pack_input_client_handshake(payload):
+    return INPUT_CLIENT_HANDSHAKE.pack(
+        payload['max_touches'],
+        _reference_timestamp(payload['reference_timestamp'])
+    )
+
+
+def _pack_input_frame_ack(payload):
+    return UINT32.pack(payload['acked_frame'])
+
+
+def _pack_input_frame(payload):
+    buttons = _container(payload['buttons'])
+    analog = _container(payload['analog'])
+    extension = _container(payload['extension'])
+    return INPUT_FRAME.pack(
+        payload['frame_id'], payload['timestamp'], payload['created_ts'],
+        *[buttons.get(k) or 0 for k in INPUT_BUTTON_FIELDS],
+        *[analog.get(k) or 0 for k in INPUT_ANALOG_FIELDS],
+        *[extension.get(k) or 0 for k in INPUT_EXTENSION_FIELDS]
+    )
+
+
+def _pack_control(payload):
+    opcode = ControlPayloadType(payload['opcode'])
+    data = CONTROL_HEADER.pack(
+        payload['prev_seq_dup'], payload['unk1'], payload['unk2'], opcode.value
+    )
+
+    encoder = CONTROL_ENCODER_MAP.get(opcode)
+    if encoder:
+        data += encoder(_container(payload['payload']))
+    return data
+
+
+def _pack_control_telemetry(payload):
+    entries = payload['data']
+    return UINT16.pack(len(entries)) + b''.join(
+        CONTROL_TELEMETRY_ENTRY.pack(e['key'], e['value']) for e in entries
+    )
+
+
+CONTROL_ENCODER_MAP = {
+    ControlPayloadType.SessionInit: lambda p: p['unk3'],
+    ControlPayloadType.SessionCreate: lambda p: CONTROL_GUID_PREFIXED.pack(
+        p['guid'], len(p['unk3'])
+    ) + p['unk3'],
+    ControlPayloadType.SessionCreateResponse: lambda p: p['guid'],
+    ControlPayloadType.SessionDestroy: lambda p: CONTROL_SESSION_DESTROY.pack(
+        p['unk3'], len(p['unk5'])
+    ) + p['unk5'],
+    ControlPayloadType.VideoStatistics:
+        lambda p: CONTROL_VIDEO_STATISTICS.pack(
+            p['unk3'], p['unk4'], p['unk5'], p['unk6'], p['unk7'], p['unk8']
+        ),
+    ControlPayloadType.RealtimeTelemetry: _pack_control_telemetry,
+    ControlPayloadType.ChangeVideoQuality:
+        lambda p: CONTROL_CHANGE_VIDEO_QUALITY.pack(
+            p['unk3'], p['unk4'], p['unk5'], p['unk6'], p['unk7'], p['unk8']
+        ),
+    ControlPayloadType.InitiateNetworkTest: lambda p: p['guid'],
+    ControlPayloadType.NetworkInformation:
+        lambda p: CONTROL_NETWORK_INFORMATION.pack(
+            p['guid'], p['unk4'], p['unk5'], p['unk6']
+        ),
+    ControlPayloadType.NetworkTestResponse:
+        lambda p: CONTROL_NETWORK_TEST_RESPONSE.pack(
+            p['guid'], p['unk3'], p['unk4'], p['unk5'], p['unk6'],
+            p['unk7'], p['unk8'], p['unk9'], p['unk10']
+        ),
+    ControlPayloadType.ControllerEvent:
+        lambda p: CONTROL_CONTROLLER_EVENT.pack(
+            _value(p['event']), p['controller_num']
+        )
+}
+
+
+VIDEO_ENCODER_MAP = {
+    VideoPayloadType.ServerHandshake.value: _pack_video_server_handshake,
+    VideoPayloadType.ClientHandshake.value: _pack_video_client_handshake,
+    VideoPayloadType.Control.value: _pack_video_control,
+    VideoPayloadType.Data.value: _pack_video_data
+}
+
+AUDIO_ENCODER_MAP = {
+    AudioPayloadType.ServerHandshake.value: _pack_audio_server_handshake,
+    AudioPayloadType.ClientHandshake.value: _pack_audio_client_handshake,
+    AudioPayloadType.Control.value: _pack_audio_control,
+    AudioPayloadType.Data.value: _pack_audio_data
+}
+
+INPUT_ENCODER_MAP = {
+    InputPayloadType.ServerHandshake.value: _pack_input_server_handshake,
+    InputPayloadType.ClientHandshake.value: _pack_input_client_handshake,
+    InputPayloadType.FrameAck.value: _pack_input_frame_ack,
+    InputPayloadType.Frame.value: _pack_input_frame
+}
+
+CHANNEL_ENCODER_MAP = {
+    ChannelClass.Video: VIDEO_ENCODER_MAP,
+    ChannelClass.Audio: AUDIO_ENCODER_MAP,
+    ChannelClass.ChatAudio: AUDIO_ENCODER_MAP,
+    ChannelClass.Input: INPUT_ENCODER_MAP,
+    ChannelClass.InputFeedback: INPUT_ENCODER_MAP,
+    ChannelClass.Control: {
+        0: _pack_control
+    }
+}
+
+# Payloads created via `factory` carry their XStruct
+PAYLOAD_ENCODER_MAP = {
+    video.server_handshake: _pack_video_server_handshake,
+    video.client_handshake: _pack_video_client_handshake,
+    video.control: _pack_video_control,
+    video.data: _pack_video_data,
+    audio.server_handshake: _pack_audio_server_handshake,
+    audio.client_handshake: _pack_audio_client_handshake,
+    audio.control: _pack_audio_control,
+    audio.data: _pack_audio_data,
+    input.server_handshake: _pack_input_server_handshake,
+    input.client_handshake: _pack_input_client_handshake,
+    input.frame_ack: _pack_input_frame_ack,
+    input.frame: _pack_input_frame,
+    control_packet.control_packet: _pack_control
+}